@@ -48,8 +48,10 @@ from twisted.internet.defer import succeed
 
 from zope.interface import Interface, implementer
 
+from otter.constants import ServiceType
 from otter.log import BoundLog, log as default_log
 from otter.util import logging_treq as treq
+from otter.util.cache import LRUCache
 from otter.util.deferredutils import delay, wait
 from otter.util.http import (
     append_segments,
@@ -61,6 +63,10 @@ from otter.util.http import (
 from otter.util.retry import repeating_interval, retry, retry_times
 
 
+# Number of seconds for which impersonated tokens are valid
+IMPERSONATION_EXPIRY = 10800
+
+
 class _DoNothingLogger(BoundLog):
     """This class implements a do-nothing logger for the benefit of
     those wishing to call authenticate_user without a logger.
@@ -160,18 +166,33 @@ class CachingAuthenticator(object):
     An authenticator which cases the result of the provided auth_function
     based on the tenant_id.
 
+    At most `max_size` tenants are cached, evicting the least recently used
+    one when a new tenant is cached. A token used after `refresh_ratio` of
+    `ttl` has passed is returned from the cache and refreshed in the
+    background, so that tenants that keep being used never wait for
+    authentication. Failed refreshes are logged and the cached token is used
+    until it expires.
+
     :param IReactorTime reactor: An IReactorTime provider used for enforcing
         the cache TTL.
     :param IAuthenticator authenticator:
     :param int ttl: An integer indicating the TTL of a cache entry in seconds.
+    :param int max_size: Maximum number of tenants cached
+    :param float refresh_ratio: Fraction of `ttl` after which a used token is
+        refreshed. Tokens are not refreshed if it is None
+
+    :ivar dict stats: Number of cache hits, misses and background refreshes
     """
-    def __init__(self, reactor, authenticator, ttl):
+    def __init__(self, reactor, authenticator, ttl, max_size=10000,
+                 refresh_ratio=0.8):
         self._reactor = reactor
         self._authenticator = authenticator
         self._ttl = ttl
+        self._refresh_ratio = refresh_ratio
 
-        self._waiters = {}
-        self._cache = {}
+        self._refreshing = set()
+        self._cache = LRUCache(max_size, reactor, ttl)
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
         self._log = self._bind_log(default_log)
         self._auth_func = wait(ignore_kwargs=['log'])(self._authenticator.authenticate_tenant)
 
@@ -184,6 +205,31 @@ class CachingAuthenticator(object):
                         cache_ttl=self._ttl,
                         **kwargs)
 
+    def _authenticate(self, tenant_id, log):
+        """
+        Authenticate the tenant and cache the result
+        """
+        def when_authenticated(result):
+            log.msg('otter.auth.cache.populate')
+            self._cache.set(tenant_id, (self._reactor.seconds(), result))
+            return result
+
+        d = self._auth_func(tenant_id, log=log)
+        d.addCallback(when_authenticated)
+        return d
+
+    def _refresh(self, tenant_id, log):
+        """
+        Authenticate the tenant in the background, keeping the cached token if
+        it fails
+        """
+        self.stats['refreshes'] += 1
+        self._refreshing.add(tenant_id)
+        log.msg('otter.auth.cache.refresh')
+        d = self._authenticate(tenant_id, log)
+        d.addErrback(log.err, 'otter.auth.cache.refresh-failed')
+        d.addBoth(lambda _: self._refreshing.discard(tenant_id))
+
     def authenticate_tenant(self, tenant_id, log=None):
         """
         see :meth:`IAuthenticator.authenticate_tenant`
@@ -193,30 +239,31 @@ class CachingAuthenticator(object):
         else:
             log = self._bind_log(log, tenant_id=tenant_id)
 
-        if tenant_id in self._cache:
-            (created, data) = self._cache[tenant_id]
-            now = self._reactor.seconds()
-
-            if now - created <= self._ttl:
-                log.msg('otter.auth.cache.hit', age=now - created)
-                return succeed(data)
-
-            log.msg('otter.auth.cache.expired', age=now - created)
-
-        def when_authenticated(result):
-            log.msg('otter.auth.cache.populate')
-            self._cache[tenant_id] = (self._reactor.seconds(), result)
-            return result
-
+        cached = self._cache.get(tenant_id)
+        if cached is not None:
+            (created, data) = cached
+            age = self._reactor.seconds() - created
+            self.stats['hits'] += 1
+            log.msg('otter.auth.cache.hit', age=age)
+            if (self._refresh_ratio is not None and
+                    age >= self._refresh_ratio * self._ttl and
+                    tenant_id not in self._refreshing):
+                self._refresh(tenant_id, log)
+            return succeed(data)
+
+        self.stats['misses'] += 1
         log.msg('otter.auth.cache.miss')
-        d = self._auth_func(tenant_id, log=log)
-        d.addCallback(when_authenticated)
+        return self._authenticate(tenant_id, log)
 
-        return d
+    def __len__(self):
+        """
+        Number of tenants cached
+        """
+        return len(self._cache)
 
     def invalidate(self, tenant_id):
         """Remove a tenant's token from the cache."""
-        self._cache.pop(tenant_id, None)
+        self._cache.pop(tenant_id)
 
 
 @implementer(IAuthenticator)
@@ -224,14 +271,36 @@ class ImpersonatingAuthenticator(object):
     """
     An authentication handler that first uses a identity admin account to authenticate
     and then impersonates the desired tenant_id.
-    """
-    def __init__(self, identity_admin_user, identity_admin_password, url, admin_url):
+
+    If `reactor` is given, the tenant's username and service catalog are
+    cached for `identity_ttl` seconds so that only impersonation is needed to
+    authenticate a tenant again. They are also kept in `identity_store` if
+    given, so that they are not looked up again after a restart. They are
+    forgotten if authenticating the tenant fails.
+
+    :param IReactorTime reactor: An IReactorTime provider used to expire the
+        cached usernames and catalogs
+    :param int identity_ttl: Number of seconds usernames and catalogs are kept
+    :param identity_store: A :class:`otter.models.cass.CassTenantIdentityStore`
+        or None
+    :param int max_tenants: Maximum number of tenants whose username and
+        catalog are cached in memory
+    """
+    def __init__(self, identity_admin_user, identity_admin_password, url, admin_url,
+                 reactor=None, identity_ttl=86400, identity_store=None,
+                 max_tenants=10000):
         self._identity_admin_user = identity_admin_user
         self._identity_admin_password = identity_admin_password
         self._url = url
         self._admin_url = admin_url
         # cached token to admin identity
         self._token = None
+        self._identity_ttl = identity_ttl
+        self._identity_store = identity_store
+        self._users = self._catalogs = None
+        if reactor is not None:
+            self._users = LRUCache(max_tenants, reactor, identity_ttl)
+            self._catalogs = LRUCache(max_tenants, reactor, identity_ttl)
 
     @wait(ignore_kwargs=['log'])
     def _auth_me(self, log=None):
@@ -245,33 +314,108 @@ class ImpersonatingAuthenticator(object):
         d.addCallback(partial(setattr, self, "_token"))
         return d
 
+    def _cached(self, cache, tenant_id):
+        return None if cache is None else cache.get(tenant_id)
+
+    def _log_err(self, f, log, why, tenant_id):
+        (log or default_log).err(f, why, system='otter.auth.impersonate',
+                                 tenant_id=tenant_id)
+
+    def _load_identity(self, tenant_id, log):
+        """
+        Load the tenant's username and catalog from `identity_store` unless
+        already cached. Failure to load is logged and ignored.
+        """
+        if (self._users is None or self._identity_store is None or
+                tenant_id in self._users):
+            return succeed(None)
+
+        def loaded(identity):
+            if identity is not None:
+                self._users.set(tenant_id, identity[0])
+                self._catalogs.set(tenant_id, identity[1])
+
+        d = self._identity_store.get_identity(tenant_id)
+        d.addCallback(loaded)
+        d.addErrback(self._log_err, log, 'Error loading tenant identity',
+                     tenant_id)
+        return d
+
+    def _store_identity(self, tenant_id, user, catalog, log):
+        """
+        Cache the tenant's username and catalog and put them in
+        `identity_store` without waiting for it
+        """
+        if self._users is None:
+            return
+        self._users.set(tenant_id, user)
+        self._catalogs.set(tenant_id, catalog)
+        if self._identity_store is not None:
+            d = self._identity_store.set_identity(tenant_id, user, catalog,
+                                                  self._identity_ttl)
+            d.addErrback(self._log_err, log, 'Error storing tenant identity',
+                         tenant_id)
+
+    def _forget_identity(self, f, tenant_id, log):
+        """
+        Forget the tenant's username and catalog as they may be why
+        authentication failed
+        """
+        if self._users is not None:
+            self._users.pop(tenant_id)
+            self._catalogs.pop(tenant_id)
+            if self._identity_store is not None:
+                d = self._identity_store.delete_identity(tenant_id)
+                d.addErrback(self._log_err, log,
+                             'Error deleting tenant identity', tenant_id)
+        return f
+
     def authenticate_tenant(self, tenant_id, log=None):
         """
         see :meth:`IAuthenticator.authenticate_tenant`
         """
         auth = partial(self._auth_me, log=log)
 
-        d = user_for_tenant(self._admin_url,
-                            self._identity_admin_user,
-                            self._identity_admin_password,
-                            tenant_id, log=log)
+        def get_user(_):
+            user = self._cached(self._users, tenant_id)
+            if user is not None:
+                return user
+            return user_for_tenant(self._admin_url,
+                                   self._identity_admin_user,
+                                   self._identity_admin_password,
+                                   tenant_id, log=log)
+
+        d = self._load_identity(tenant_id, log)
+        d.addCallback(get_user)
 
         def impersonate(user):
             iud = impersonate_user(self._admin_url,
                                    self._token,
                                    user, log=log)
             iud.addCallback(extract_token)
+            iud.addCallback(lambda token: (user, token))
             return iud
 
         d.addCallback(lambda user: retry_on_unauth(partial(impersonate, user), auth))
 
-        def endpoints(token):
+        def endpoints(user, token):
+            catalog = self._cached(self._catalogs, tenant_id)
+            if catalog is not None:
+                return succeed((token, catalog))
+
+            def got_catalog(catalog):
+                self._store_identity(tenant_id, user, catalog, log)
+                return (token, catalog)
+
             scd = endpoints_for_token(self._admin_url, self._token,
                                       token, log=log)
-            scd.addCallback(lambda endpoints: (token, _endpoints_to_service_catalog(endpoints)))
+            scd.addCallback(_endpoints_to_service_catalog)
+            scd.addCallback(got_catalog)
             return scd
 
-        d.addCallback(lambda token: retry_on_unauth(partial(endpoints, token), auth))
+        d.addCallback(lambda user_token: retry_on_unauth(
+            partial(endpoints, *user_token), auth))
+        d.addErrback(self._forget_identity, tenant_id, log)
 
         return d
 
@@ -308,7 +452,8 @@ def endpoints_for_token(auth_endpoint, identity_admin_token, user_token,
     :return: decoded JSON response as dict.
     """
     d = treq.get(append_segments(auth_endpoint, 'tokens', user_token, 'endpoints'),
-                 headers=headers(identity_admin_token), log=log)
+                 headers=headers(identity_admin_token), log=log,
+                 service_type=ServiceType.IDENTITY)
     d.addCallback(check_success, [200, 203])
     d.addErrback(wrap_upstream_error, 'identity', 'token_endpoints', auth_endpoint)
     d.addCallback(treq.json_content)
@@ -330,7 +475,8 @@ def user_for_tenant(auth_endpoint, username, password, tenant_id, log=None):
         append_segments(auth_endpoint.replace('v2.0', 'v1.1'), 'mosso', str(tenant_id)),
         auth=(username, password),
         allow_redirects=False,
-        log=log)
+        log=log,
+        service_type=ServiceType.IDENTITY)
     d.addCallback(check_success, [301])
     d.addErrback(wrap_upstream_error, 'identity', 'mosso', auth_endpoint)
     d.addCallback(treq.json_content)
@@ -368,7 +514,8 @@ def authenticate_user(auth_endpoint, username, password, log=None, pool=None):
             }),
         headers=headers(),
         log=log,
-        pool=pool)
+        pool=pool,
+        service_type=ServiceType.IDENTITY)
     d.addCallback(check_success, [200, 203])
     d.addErrback(
         wrap_upstream_error, 'identity',
@@ -379,7 +526,7 @@ def authenticate_user(auth_endpoint, username, password, log=None, pool=None):
 
 
 def impersonate_user(auth_endpoint, identity_admin_token, username,
-                     expire_in=10800, log=None):
+                     expire_in=IMPERSONATION_EXPIRY, log=None):
     """
     Acquire an auth-token for a user via impersonation.
 
@@ -400,7 +547,8 @@ def impersonate_user(auth_endpoint, identity_admin_token, username,
             }
         }),
         headers=headers(identity_admin_token),
-        log=log)
+        log=log,
+        service_type=ServiceType.IDENTITY)
     d.addCallback(check_success, [200, 203])
     d.addErrback(wrap_upstream_error, 'identity', 'impersonation', auth_endpoint)
     d.addCallback(treq.json_content)
@@ -500,12 +648,14 @@ def perform_invalidate_token(dispatcher, intent):
     return intent.authenticator.invalidate(intent.tenant_id)
 
 
-def generate_authenticator(reactor, config):
+def generate_authenticator(reactor, config, identity_store=None):
     """
     Generate authenticator based on settings in config
 
     :param reactor: Twisted reactor
     :param dict config: Identity specific config
+    :param identity_store: Where tenants' username and catalog are kept
+        across restarts. See :class:`ImpersonatingAuthenticator`
     """
     # FIXME: Pick an arbitrary cache ttl value based on absolutely no science.
     cache_ttl = config.get('cache_ttl', 300)
@@ -520,8 +670,13 @@ def generate_authenticator(reactor, config):
                     config['username'],
                     config['password'],
                     config['url'],
-                    config['admin_url']),
+                    config['admin_url'],
+                    reactor=reactor,
+                    identity_ttl=config.get('identity_cache_ttl', 86400),
+                    identity_store=identity_store),
                 max_retries=config['max_retries'],
                 retry_interval=config['retry_interval']),
             config.get('wait', 5)),
-        cache_ttl)
+        cache_ttl,
+        max_size=config.get('cache_size', 10000),
+        refresh_ratio=config.get('cache_refresh_ratio', 0.8))
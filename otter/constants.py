@@ -13,6 +13,7 @@ class ServiceType(Names):
     RACKCONNECT_V3 = NamedConstant()
     CLOUD_METRICS_INGEST = NamedConstant()
     CLOUD_FEEDS = NamedConstant()
+    IDENTITY = NamedConstant()
 
 
 def get_service_configs(config):
@@ -3,13 +3,17 @@ import json
 from collections import defaultdict
 from urllib import urlencode
 
-from effect import parallel
+from characteristic import attributes
+
+from effect import Effect, parallel, sync_performer
+from effect.twisted import deferred_performer, perform
 
 from pyrsistent import pmap
 
-from toolz.curried import filter, groupby, map
+from toolz.curried import groupby, map
+from toolz.itertoolz import concat
 from toolz.dicttoolz import get_in
-from toolz.functoolz import compose, identity
+from toolz.functoolz import identity
 
 from otter.constants import ServiceType
 from otter.convergence.model import (
@@ -21,21 +25,39 @@ from otter.convergence.model import (
     ServerState)
 from otter.http import service_request
 from otter.indexer import atom
+from otter.util.config import config_value
 from otter.util.http import append_segments
+from otter.util.pure_http import has_code
 from otter.util.retry import (
     exponential_backoff_interval, retry_effect, retry_times)
 from otter.util.timestamp import timestamp_to_epoch
 
 
-def get_all_server_details(batch_size=100):
+# Number of servers asked for per request. This is the default maximum number
+# of items Nova returns in a page (``osapi_max_limit``). Listing stops at a
+# page shorter than the requested limit, so a deployment that caps it lower
+# must set ``converger.osapi_max_limit`` to that cap.
+SERVER_BATCH_SIZE = 1000
+
+
+def get_all_server_details(batch_size=None, server_predicate=identity):
     """
     Return all servers of a tenant.
 
-    :param batch_size: number of servers to fetch *per batch*.
+    :param batch_size: number of servers to fetch *per batch*. Defaults to
+        ``converger.osapi_max_limit`` config or :obj:`SERVER_BATCH_SIZE`. It
+        must not be more than Nova's ``osapi_max_limit``.
+    :param server_predicate: function of server -> bool that determines
+        whether the server should be included in the result. It is applied
+        on each batch as it is received so that only the required servers
+        are accumulated.
     :return: list of server objects as returned by Nova.
 
     NOTE: This really screams to be a independent fxcloud-type API
     """
+    if batch_size is None:
+        batch_size = (config_value('converger.osapi_max_limit') or
+                      SERVER_BATCH_SIZE)
     url = append_segments('servers', 'detail')
 
     def get_server_details(marker):
@@ -54,11 +76,11 @@ def get_all_server_details(batch_size=100):
     def continue_(result):
         _response, body = result
         servers = body['servers']
+        wanted = [s for s in servers if server_predicate(s)]
         if len(servers) < batch_size:
-            return servers
-        else:
-            more_eff = get_server_details(servers[-1]['id'])
-            return more_eff.on(lambda more_servers: servers + more_servers)
+            return wanted
+        more_eff = get_server_details(servers[-1]['id'])
+        return more_eff.on(lambda more_servers: wanted + more_servers)
 
     return get_server_details(marker=None)
 
@@ -70,6 +92,28 @@ def _discard_response((response, body)):
     return body
 
 
+def _lb_nodes((response, body)):
+    """
+    Return nodes from response of listing a CLB's nodes. CLB responds with
+    404 if the CLB is deleted and 422 if it is being deleted, in which case
+    it has no nodes.
+    """
+    if response.code in (404, 422):
+        return []
+    return body
+
+
+def _group_id(server):
+    """Return scaling group ID of the server"""
+    return server['metadata']['rax:auto_scaling_group_id']
+
+
+def _has_group_id(server):
+    """Does the server belong to any scaling group?"""
+    return ('metadata' in server and
+            'rax:auto_scaling_group_id' in server['metadata'])
+
+
 def get_scaling_group_servers(server_predicate=identity):
     """
     Return tenant's servers that belong to a scaling group as
@@ -79,47 +123,90 @@ def get_scaling_group_servers(server_predicate=identity):
         the server should be included in the result.
     :return: dict mapping group IDs to lists of Nova servers.
     """
+    eff = get_all_server_details(
+        server_predicate=lambda s: _has_group_id(s) and server_predicate(s))
+    return eff.on(groupby(_group_id))
+
+
+@attributes(['lb_id', 'node_id', 'effect'])
+class CachedDrainedAt(object):
+    """
+    An Effect intent to get the time when a CLB node was changed to DRAINING
+    from a process-wide cache. `effect` should result in the time and is
+    performed only if the time is not cached. Since the time does not change
+    once the node is draining, its feed is fetched only once per drain.
+    """
 
-    def has_group_id(s):
-        return 'metadata' in s and 'rax:auto_scaling_group_id' in s['metadata']
 
-    def group_id(s):
-        return s['metadata']['rax:auto_scaling_group_id']
+@attributes(['nodes'])
+class ForgetDrainedAt(object):
+    """
+    An Effect intent to remove cached drained times of given nodes, since
+    they are not draining anymore.
 
-    servers_apply = compose(groupby(group_id),
-                            filter(server_predicate),
-                            filter(has_group_id))
+    :ivar list nodes: ``list`` of (lb_id, node_id) tuples
+    """
 
-    eff = get_all_server_details()
-    return eff.on(servers_apply)
 
+@deferred_performer
+def perform_cached_drained_at(cache, dispatcher, intent):
+    """
+    Perform :obj:`CachedDrainedAt` using :class:`otter.util.cache.LRUCache`
+    """
+    key = (intent.lb_id, intent.node_id)
+    if key in cache:
+        return cache.get(key)
 
-def get_clb_contents():
+    def store(drained_at):
+        cache.set(key, drained_at)
+        return drained_at
+
+    return perform(dispatcher, intent.effect).addCallback(store)
+
+
+@sync_performer
+def perform_forget_drained_at(cache, dispatcher, intent):
+    """
+    Perform :obj:`ForgetDrainedAt` using :class:`otter.util.cache.LRUCache`
+    """
+    for key in intent.nodes:
+        cache.pop(key)
+
+
+def get_clb_contents(lb_ids=None):
     """
     Get Rackspace Cloud Load Balancer contents as list of `CLBNode`.
+
+    :param list lb_ids: IDs of load balancers whose nodes are fetched. If not
+        given, nodes of all the load balancers on the account are fetched.
+        Load balancers that are deleted or being deleted have no nodes.
     """
 
-    def lb_req(method, url, json_response=True):
+    def lb_req(method, url, json_response=True, success_pred=has_code(200)):
         """Make a request to the LB service with retries."""
         return retry_effect(
             service_request(
                 ServiceType.CLOUD_LOAD_BALANCERS,
-                method, url, json_response=json_response),
+                method, url, json_response=json_response,
+                success_pred=success_pred),
             retry_times(5), exponential_backoff_interval(2))
 
     def _lb_path(lb_id):
         """Return the URL path to lb with given id's nodes."""
         return append_segments('loadbalancers', str(lb_id), 'nodes')
 
-    def fetch_nodes(result):
+    def fetch_all_nodes(result):
         _response, body = result
         lbs = body['loadBalancers']
-        lb_ids = [lb['id'] for lb in lbs]
-        lb_reqs = [lb_req('GET', _lb_path(lb_id)).on(_discard_response)
+        return fetch_nodes([lb['id'] for lb in lbs])
+
+    def fetch_nodes(lb_ids):
+        lb_reqs = [lb_req('GET', _lb_path(lb_id),
+                          success_pred=has_code(200, 404, 422)).on(_lb_nodes)
                    for lb_id in lb_ids]
         return parallel(lb_reqs).on(lambda all_nodes: (lb_ids, all_nodes))
 
-    def fetch_drained_feeds((ids, all_lb_nodes)):
+    def fetch_drained_at((ids, all_lb_nodes)):
         nodes = [
             CLBNode(
                 node_id=str(node['id']),
@@ -134,23 +221,37 @@ def get_clb_contents():
         draining = [n for n in nodes
                     if n.description.condition == CLBNodeCondition.DRAINING]
         return parallel(
-            [lb_req(
-                'GET',
-                append_segments(
-                    'loadbalancers',
-                    str(n.description.lb_id),
-                    'nodes',
-                    '{}.atom'.format(n.node_id)),
-                json_response=False).on(_discard_response)
-             for n in draining]).on(lambda feeds: (nodes, draining, feeds))
-
-    def fill_drained_at((nodes, draining, feeds)):
-        for node, feed in zip(draining, feeds):
-            node.drained_at = extract_CLB_drained_at(feed)
-        return nodes
-
-    return lb_req('GET', 'loadbalancers').on(
-        fetch_nodes).on(fetch_drained_feeds).on(fill_drained_at)
+            [Effect(CachedDrainedAt(
+                lb_id=n.description.lb_id,
+                node_id=n.node_id,
+                effect=lb_req(
+                    'GET',
+                    append_segments(
+                        'loadbalancers',
+                        str(n.description.lb_id),
+                        'nodes',
+                        '{}.atom'.format(n.node_id)),
+                    json_response=False).on(
+                        _discard_response).on(extract_CLB_drained_at)))
+             for n in draining]).on(lambda drained: (nodes, draining, drained))
+
+    def fill_drained_at((nodes, draining, drained)):
+        for node, drained_at in zip(draining, drained):
+            node.drained_at = drained_at
+        # Forget when nodes were drained if they are not draining anymore so
+        # that it is fetched again if they get drained again
+        not_draining = [
+            (n.description.lb_id, n.node_id) for n in nodes
+            if n.description.condition != CLBNodeCondition.DRAINING]
+        if not not_draining:
+            return nodes
+        return Effect(ForgetDrainedAt(nodes=not_draining)).on(lambda _: nodes)
+
+    if lb_ids is None:
+        eff = lb_req('GET', 'loadbalancers').on(fetch_all_nodes)
+    else:
+        eff = fetch_nodes(lb_ids)
+    return eff.on(fetch_drained_at).on(fill_drained_at)
 
 
 def extract_CLB_drained_at(feed):
@@ -239,20 +340,89 @@ def to_nova_server(server_json):
                       servicenet_address=_servicenet_address(server_json))
 
 
+@attributes(['tenant_id', 'key', 'effect'])
+class CachedTenantData(object):
+    """
+    An Effect intent to get a piece of tenant's convergence data identified
+    by `key`, i.e. the result of performing `effect`, from a per-tenant
+    cache. Concurrent convergences of the tenant's groups share a single
+    fetch.
+    """
+
+
+@attributes(['tenant_id'])
+class InvalidateTenantData(object):
+    """
+    An Effect intent to remove all of tenant's convergence data from the
+    cache. This should be done after steps that change the tenant's servers
+    or load balancers are executed.
+    """
+
+
+@deferred_performer
+def perform_cached_tenant_data(cache, dispatcher, intent):
+    """
+    Perform :obj:`CachedTenantData` using a :class:`otter.util.cache.TTLCache`
+    """
+    return cache.get((intent.tenant_id, intent.key),
+                     lambda: perform(dispatcher, intent.effect))
+
+
+@sync_performer
+def perform_invalidate_tenant_data(cache, dispatcher, intent):
+    """
+    Perform :obj:`InvalidateTenantData` using a
+    :class:`otter.util.cache.TTLCache`
+    """
+    for key in cache.keys():
+        if key[0] == intent.tenant_id:
+            cache.invalidate(key)
+
+
 def get_all_convergence_data(
         group_id,
+        lb_ids,
+        tenant_id=None,
         get_scaling_group_servers=get_scaling_group_servers,
         get_clb_contents=get_clb_contents):
     """
     Gather all data relevant for convergence, in parallel where
     possible.
 
+    :param str group_id: ID of the group being converged
+    :param lb_ids: IDs of load balancers the group's servers should be on,
+        i.e. the ones in the group's :obj:`DesiredGroupState`. Only nodes of
+        these load balancers and the ones the group's servers' metadata
+        refer to are fetched.
+    :param str tenant_id: If given, the servers of all the groups of the
+        tenant and the nodes of each load balancer are got from the tenant's
+        :obj:`CachedTenantData`, otherwise they are fetched.
+
     Returns an Effect of ([NovaServer], [LBNode]).
     """
-    eff = parallel(
-        [get_scaling_group_servers()
-         .on(lambda servers: servers.get(group_id, []))
-         .on(map(to_nova_server)).on(list),
-         get_clb_contents()]
-    ).on(tuple)
-    return eff
+    def cached(key, eff):
+        if tenant_id is None:
+            return eff
+        return Effect(
+            CachedTenantData(tenant_id=tenant_id, key=key, effect=eff))
+
+    def get_lb_nodes(ids):
+        return parallel(
+            [cached(('clb', lb_id), get_clb_contents(lb_ids=[lb_id]))
+             for lb_id in ids]).on(lambda nodes: list(concat(nodes)))
+
+    servers_eff = cached('servers', get_scaling_group_servers())
+    lb_ids = set(map(str, lb_ids))
+    eff = parallel([servers_eff, get_lb_nodes(sorted(lb_ids))])
+
+    def group_data((servers, lb_nodes)):
+        servers = list(map(to_nova_server, servers.get(group_id, [])))
+        # Servers may still be on load balancers that are no longer desired
+        other_ids = set(concat(s.desired_lbs.keys() for s in servers))
+        other_ids -= lb_ids
+        if not other_ids:
+            return (servers, lb_nodes)
+        return get_lb_nodes(sorted(other_ids)).on(
+            lambda other_nodes: (servers, lb_nodes + other_nodes))
+
+    return eff.on(group_data)
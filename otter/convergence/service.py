@@ -4,7 +4,7 @@ import time
 
 from functools import partial
 
-from effect import Effect
+from effect import ComposedDispatcher, Effect, TypeDispatcher
 from effect.twisted import perform
 
 from toolz.itertoolz import concat
@@ -14,11 +14,22 @@ from twisted.application.service import Service
 from otter.constants import CONVERGENCE_LOCK_PATH
 from otter.convergence.composition import get_desired_group_state
 from otter.convergence.effecting import steps_to_effect
-from otter.convergence.gathering import get_all_convergence_data
+from otter.convergence.gathering import (
+    CachedDrainedAt,
+    CachedTenantData,
+    ForgetDrainedAt,
+    InvalidateTenantData,
+    get_all_convergence_data,
+    perform_cached_drained_at,
+    perform_cached_tenant_data,
+    perform_forget_drained_at,
+    perform_invalidate_tenant_data)
 from otter.convergence.model import ServerState
 from otter.convergence.planning import plan
 from otter.http import TenantScope
 from otter.models.intents import ModifyGroupState
+from otter.models.interface import repeatable_modifier
+from otter.util.cache import LRUCache, TTLCache
 from otter.util.deferredutils import with_lock
 from otter.util.fp import assoc_obj
 
@@ -56,6 +67,11 @@ def determine_active(servers, lb_nodes):
             and all_met(s, [node for node in lb_nodes if node.matches(s)])]
 
 
+def _reraise(exc_info):
+    """Raise the exception of given ``(type, value, traceback)`` tuple"""
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+
 def execute_convergence(
         scaling_group, desired_capacity, launch_config, now, log,
         get_all_convergence_data=get_all_convergence_data):
@@ -73,32 +89,71 @@ def execute_convergence(
 
     :return: An Effect of a list containing the individual step results.
     """
-    all_data_eff = get_all_convergence_data(scaling_group.uuid)
+    desired_group_state = get_desired_group_state(
+        scaling_group.uuid, launch_config, desired_capacity)
+    all_data_eff = get_all_convergence_data(
+        scaling_group.uuid, desired_group_state.desired_lbs.keys(),
+        tenant_id=scaling_group.tenant_id)
 
     def got_all_data((servers, lb_nodes)):
         active = determine_active(servers, lb_nodes)
-        desired_group_state = get_desired_group_state(
-            scaling_group.uuid, launch_config, desired_capacity)
         steps = plan(desired_group_state, servers, lb_nodes, now)
         active = {server.id: server_to_json(server) for server in active}
 
+        @repeatable_modifier
         def update_group_state(group, old_state):
             return assoc_obj(old_state, active=active)
 
+        def execute_steps(_):
+            eff = steps_to_effect(steps)
+            if steps:
+                # steps change servers or LB nodes even if some of them fail;
+                # tenant's cached data is no longer valid either way
+                invalidate = Effect(
+                    InvalidateTenantData(tenant_id=scaling_group.tenant_id))
+                eff = eff.on(
+                    success=lambda r: invalidate.on(lambda _: r),
+                    error=lambda exc_info: invalidate.on(
+                        lambda _: _reraise(exc_info)))
+            return eff
+
         eff = Effect(ModifyGroupState(scaling_group=scaling_group,
                                       modifier=update_group_state))
-        return eff.on(lambda _: steps_to_effect(steps))
+        return eff.on(execute_steps)
 
     return all_data_eff.on(got_all_data)
 
 
 class Converger(Service, object):
-    """Converger service"""
+    """
+    Converger service
+
+    :param reactor: Twisted reactor
+    :param kz_client: Kazoo client used to get convergence locks
+    :param dispatcher: Effect dispatcher used to perform convergence
+    :param float data_ttl: Number of seconds a tenant's convergence data is
+        shared between convergences of its groups
+    :param int max_drained_nodes: Maximum number of draining CLB nodes whose
+        drained time is cached
+    """
 
-    def __init__(self, reactor, kz_client, dispatcher):
+    def __init__(self, reactor, kz_client, dispatcher, data_ttl=10,
+                 max_drained_nodes=10000):
         self._reactor = reactor
         self._kz_client = kz_client
-        self._dispatcher = dispatcher
+        self.data_cache = TTLCache(reactor, data_ttl)
+        self.drained_at_cache = LRUCache(max_drained_nodes)
+        self._dispatcher = ComposedDispatcher([
+            TypeDispatcher({
+                CachedTenantData: partial(perform_cached_tenant_data,
+                                          self.data_cache),
+                InvalidateTenantData: partial(perform_invalidate_tenant_data,
+                                              self.data_cache),
+                CachedDrainedAt: partial(perform_cached_drained_at,
+                                         self.drained_at_cache),
+                ForgetDrainedAt: partial(perform_forget_drained_at,
+                                         self.drained_at_cache)}),
+            dispatcher])
 
     def _get_lock(self, group_id):
         """Get a ZooKeeper-backed lock for converging the group."""
@@ -175,7 +175,9 @@ def concretize_service_request(
             service_request.url,
             headers=service_request.headers,
             data=service_request.data,
-            log=log)
+            log=log,
+            service_type=service_request.service_type,
+            tenant_id=tenant_id)
     return auth_eff.on(got_auth)
 
 
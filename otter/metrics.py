@@ -5,17 +5,15 @@ Script to collect metrics (total desired, actual and pending) from a DC
 from __future__ import print_function
 
 import json
-import operator
 import sys
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
 from functools import partial
 
 from effect import Effect
 from effect.twisted import exc_info_to_failure, perform
 
 from silverberg.client import ConsistencyLevel
-from silverberg.cluster import RoundRobinCassandraCluster
 
 from toolz.curried import filter, get_in, groupby
 from toolz.dicttoolz import merge
@@ -24,7 +22,6 @@ from toolz.functoolz import identity
 from twisted.application.internet import TimerService
 from twisted.application.service import Service
 from twisted.internet import defer, task
-from twisted.internet.endpoints import clientFromString
 from twisted.python import usage
 
 from otter.auth import generate_authenticator
@@ -33,6 +30,8 @@ from otter.convergence.gathering import get_scaling_group_servers
 from otter.effect_dispatcher import get_full_dispatcher
 from otter.http import TenantScope, service_request
 from otter.log import log as otter_log
+from otter.models.cass import PARTITION_KEYS
+from otter.util.cqlcluster import cluster_from_config
 from otter.util.fp import predicate_all
 
 
@@ -40,34 +39,56 @@ from otter.util.fp import predicate_all
 metrics_log = otter_log.bind(system='otter.metrics')
 
 
+# Bounds of the token ring generated by Murmur3Partitioner
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+
+def _groups_query(props):
+    """
+    Return SELECT query on scaling_group with common and given `props` and a
+    `{where}` placeholder
+    """
+    _props = set(['"tenantId"', '"groupId"', 'desired',
+                  'created_at']) | set(props or [])
+    return ('SELECT ' + ','.join(sorted(list(_props))) +
+            ' FROM scaling_group {where} LIMIT :limit;')
+
+
+def _groups_filter(group_pred, include_resurrected=False):
+    """
+    Return function that removes groups not having desired or created_at,
+    unless `include_resurrected` is True, and the ones for which `group_pred`
+    returns False
+    """
+    has_desired = lambda g: g['desired'] is not None
+    has_created_at = lambda g: g['created_at'] is not None
+    group_pred = group_pred or identity
+    if include_resurrected:
+        return filter(group_pred)
+    return filter(predicate_all(has_desired, has_created_at, group_pred))
+
+
 @defer.inlineCallbacks
 def get_scaling_groups(client, props=None, batch_size=100, group_pred=None):
     """
     Return scaling groups from Cassandra as a list of ``dict`` where each
-    dict has 'tenantId', 'groupId', 'desired', 'active', 'pending'
-    and any other properties given in `props`
+    dict has 'tenantId', 'groupId', 'desired', 'created_at' and any other
+    properties given in `props`. Active servers and pending jobs are not
+    read since metrics are computed from servers in Nova
+
+    NOTE: This holds all the groups in memory. Use
+    :func:`scan_scaling_groups` to process them in a streaming manner.
 
     :param :class:`silverber.client.CQLClient` client: A cassandra client
     :param ``list`` props: List of extra properties to extract
     :oaram int batch_size: Number of groups to fetch at a time
     :return: `Deferred` with ``list`` of ``dict``
     """
-    # TODO: Currently returning all groups as one giant list for now.
-    # Will try to use Twisted tubes to do streaming later
-    _props = set(['"tenantId"', '"groupId"', 'desired',
-                  'active', 'pending', 'created_at']) | set(props or [])
-    query = ('SELECT ' + ','.join(sorted(list(_props))) +
-             ' FROM scaling_group {where} LIMIT :limit;')
+    query = _groups_query(props)
     where_key = 'WHERE "tenantId"=:tenantId AND "groupId">:groupId'
     where_token = 'WHERE token("tenantId") > token(:tenantId)'
-
-    # setup function that removes groups not having desired
-    has_desired = lambda g: g['desired'] is not None
-    has_created_at = lambda g: g['created_at'] is not None
-    group_pred = group_pred or identity
-    group_filter = filter(predicate_all(has_desired,
-                                        has_created_at,
-                                        group_pred))
+    group_filter = _groups_filter(group_pred)
 
     # We first start by getting all groups limited on batch size
     # It will return groups sorted first based on hash of tenant id
@@ -102,6 +123,96 @@ def get_scaling_groups(client, props=None, batch_size=100, group_pred=None):
     defer.returnValue(group_filter(groups))
 
 
+def token_ranges(num_ranges, min_token=MIN_TOKEN, max_token=MAX_TOKEN):
+    """
+    Split the Cassandra token ring into `num_ranges` contiguous sub-ranges
+
+    :param int num_ranges: Number of ranges to split the ring into
+    :return: ``list`` of (start, end) tuples. Each range covers tokens that
+        are > start and <= end
+    """
+    step = (max_token - min_token) // num_ranges
+    bounds = [min_token + i * step for i in range(num_ranges)] + [max_token]
+    return zip(bounds, bounds[1:])
+
+
+@defer.inlineCallbacks
+def scan_token_range(client, token_range, visit, props=None, batch_size=100,
+                     group_pred=None, include_resurrected=False):
+    """
+    Scan scaling groups of tenants whose token falls in `token_range` and
+    call `visit` with the groups as they are fetched. `visit` is always
+    called with all the groups of a tenant together and the next batch is
+    fetched only after the `Deferred` returned by `visit` fires. Hence, at
+    most `batch_size` groups plus the groups of one tenant are in memory.
+
+    :param :class:`silverber.client.CQLClient` client: A cassandra client
+    :param tuple token_range: (start, end) tokens as returned by
+        :func:`token_ranges`
+    :param callable visit: Called with ``list`` of group ``dict`` of one or
+        more tenants. Can return a `Deferred`
+    :param ``list`` props: List of extra properties to extract
+    :param int batch_size: Number of groups to fetch at a time
+    :param callable group_pred: Only groups satisfying this are visited
+    :param bool include_resurrected: Visit groups not having desired or
+        created_at too
+
+    :return: `Deferred` with None
+    """
+    start, end = token_range
+    query = _groups_query(props)
+    where_range = ('WHERE token("tenantId") > :start AND '
+                   'token("tenantId") <= :end')
+    where_key = 'WHERE "tenantId"=:tenantId AND "groupId">:groupId'
+    where_token = ('WHERE token("tenantId") > token(:tenantId) AND '
+                   'token("tenantId") <= :end')
+    group_filter = _groups_filter(group_pred, include_resurrected)
+
+    batch = yield client.execute(query.format(where=where_range),
+                                 {'limit': batch_size, 'start': start,
+                                  'end': end},
+                                 ConsistencyLevel.ONE)
+    while batch != []:
+        groups = batch
+        tenant_id = batch[-1]['tenantId']
+        # Get remaining groups of the last tenant in this batch so that
+        # a tenant's groups are always visited together
+        tenant_batch = batch
+        while len(tenant_batch) == batch_size:
+            tenant_batch = yield client.execute(
+                query.format(where=where_key),
+                {'limit': batch_size, 'tenantId': tenant_id,
+                 'groupId': tenant_batch[-1]['groupId']},
+                ConsistencyLevel.ONE)
+            groups.extend(tenant_batch)
+        yield visit(list(group_filter(groups)))
+        if len(batch) < batch_size:
+            break
+        batch = yield client.execute(query.format(where=where_token),
+                                     {'limit': batch_size,
+                                      'tenantId': tenant_id, 'end': end},
+                                     ConsistencyLevel.ONE)
+
+
+def scan_scaling_groups(client, visit, props=None, batch_size=100,
+                        group_pred=None, num_ranges=1, parallel=1,
+                        include_resurrected=False):
+    """
+    Scan all the scaling groups in Cassandra by splitting the token ring
+    into `num_ranges` ranges and scanning up to `parallel` of them
+    concurrently. See :func:`scan_token_range` for other arguments.
+
+    :return: `Deferred` that fires with None after all groups are visited
+    """
+    sem = defer.DeferredSemaphore(parallel)
+    return defer.gatherResults(
+        [sem.run(scan_token_range, client, token_range, visit, props=props,
+                 batch_size=batch_size, group_pred=group_pred,
+                 include_resurrected=include_resurrected)
+         for token_range in token_ranges(num_ranges)],
+        consumeErrors=True).addCallback(lambda _: None)
+
+
 GroupMetrics = namedtuple('GroupMetrics',
                           'tenant_id group_id desired actual pending')
 
@@ -158,34 +269,146 @@ def get_all_metrics_effects(cass_groups, log, _print=False):
     return effs
 
 
-def _perform_limited_effects(dispatcher, effects, limit):
+class MetricsTotals(object):
+    """
+    Running totals of desired, actual and pending servers in a region.
+    Tenants' metrics are folded into it as and when they are available.
+
+    :ivar int desired: Total number of servers desired
+    :ivar int actual: Total number of ACTIVE servers
+    :ivar int pending: Total number of BUILDing servers
+    :ivar list groups: ``list`` of all :obj:`GroupMetrics` folded if
+        `keep_groups` was given. Otherwise None
     """
-    Perform the effects in parallel up to a limit.
+
+    def __init__(self, keep_groups=False):
+        self.desired, self.actual, self.pending = 0, 0, 0
+        self.groups = [] if keep_groups else None
+
+    def add(self, group_metrics):
+        """
+        Fold given metrics into the totals
+
+        :param list group_metrics: ``list`` of :obj:`GroupMetrics`
+        """
+        for group_metric in group_metrics:
+            self.desired += group_metric.desired
+            self.actual += group_metric.actual
+            self.pending += group_metric.pending
+        if self.groups is not None:
+            self.groups.extend(group_metrics)
+
+
+def fold_tenant_metrics(totals, log, tenant_metrics):
+    """
+    Log a tenant's metrics and fold them into `totals`. Does nothing if
+    `tenant_metrics` is None, i.e. when getting the tenant's metrics failed.
+
+    :param :obj:`MetricsTotals` totals: Totals to add to
+    :param log: A bound logger
+    :param list tenant_metrics: ``list`` of :obj:`GroupMetrics` of a tenant
+    """
+    if not tenant_metrics:
+        return
+    totals.add(tenant_metrics)
+    log.msg('tenant metrics', tenant_id=tenant_metrics[0].tenant_id,
+            desired=sum(m.desired for m in tenant_metrics),
+            actual=sum(m.actual for m in tenant_metrics),
+            pending=sum(m.pending for m in tenant_metrics))
+
+
+class EffectWindow(object):
+    """
+    Performs effects with at most `limit` cooperative tasks, each of which
+    performs one effect at a time taken from the batches submitted so far.
+    One window is shared by all the token ranges being scanned so that
+    `limit` is the overall concurrency and a slow effect only holds up its
+    own task.
 
     It'd be nice if effect.parallel had a "limit" parameter.
+
+    :param dispatcher: An Effect dispatcher
+    :param int limit: Maximum number of effects in progress
+    :param log: A bound logger
+    :param callable coiterate: Function like :func:`task.coiterate` that
+        runs the tasks
     """
-    # TODO: Use cooperator instead
-    sem = defer.DeferredSemaphore(limit)
-    defs = [sem.run(perform, dispatcher, eff) for eff in effects]
-    return defer.gatherResults(defs)
 
+    def __init__(self, dispatcher, limit, log, coiterate=task.coiterate):
+        self.dispatcher = dispatcher
+        self.limit = limit
+        self.log = log
+        self._coiterate = coiterate
+        self._batches = deque()
+        self._tasks = 0
+        self._waiting = []
+
+    def submit(self, effects):
+        """
+        Perform the effects as tasks free up
 
-def get_all_metrics(dispatcher, cass_groups, _print=False,
+        :param iterable effects: Effects to perform
+        :return: `Deferred` that fires with None once all the effects are
+            started, which may be before they complete
+        """
+        effects = deque(effects)
+        if not effects:
+            return defer.succeed(None)
+        started = defer.Deferred()
+        self._batches.append((effects, started))
+        while self._tasks < self.limit and self._batches:
+            self._tasks += 1
+            self._coiterate(self._perform_batches()).addBoth(self._task_done)
+        return started
+
+    def _perform_batches(self):
+        while self._batches:
+            effects, started = self._batches[0]
+            eff = effects.popleft()
+            if not effects:
+                self._batches.popleft()
+                started.callback(None)
+            d = perform(self.dispatcher, eff)
+            yield d.addErrback(self.log.err, 'metrics effect failed')
+
+    def _task_done(self, _):
+        self._tasks -= 1
+        if not self._tasks:
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                d.callback(None)
+
+    def wait(self):
+        """
+        :return: `Deferred` that fires with None when all the effects
+            submitted so far complete
+        """
+        if not self._tasks:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._waiting.append(d)
+        return d
+
+
+def get_all_metrics(window, cass_groups, totals, _print=False,
                     get_all_metrics_effects=get_all_metrics_effects):
     """
     Gather server data and produce metrics for all groups across all tenants
-    in a region.
+    in a region. Each tenant's metrics are folded into `totals` as soon as
+    they are produced.
 
-    :param dispatcher: An Effect dispatcher.
+    :param :obj:`EffectWindow` window: Window to perform the effects in
     :param iterable cass_groups: Groups as retrieved from cassandra
+    :param :obj:`MetricsTotals` totals: Totals to fold metrics into
     :param bool _print: Should the function print while processing?
 
-    :return: ``list`` of `GroupMetrics` as `Deferred`
+    :return: `Deferred` with None after all tenants' effects are started.
+        Use :meth:`EffectWindow.wait` to wait for their metrics to be folded
     """
     effs = get_all_metrics_effects(cass_groups, metrics_log, _print=_print)
-    d = _perform_limited_effects(dispatcher, effs, 10)
-    d.addCallback(filter(lambda x: x is not None))
-    return d.addCallback(lambda x: reduce(operator.add, x, []))
+    return window.submit(
+        eff.on(partial(fold_tenant_metrics, totals, metrics_log))
+        for eff in effs)
 
 
 def add_to_cloud_metrics(ttl, region, total_desired,
@@ -225,10 +448,10 @@ def connect_cass_servers(reactor, config):
     """
     Connect to Cassandra servers and return the connection
     """
-    seed_endpoints = [clientFromString(reactor, str(host))
-                      for host in config['seed_hosts']]
-    return RoundRobinCassandraCluster(
-        seed_endpoints, config['keyspace'], disconnect_on_cancel=True)
+    return cluster_from_config(
+        reactor, config, PARTITION_KEYS,
+        otter_log.bind(system='otter.metrics.cassandra'),
+        disconnect_on_cancel=True)
 
 
 @defer.inlineCallbacks
@@ -260,19 +483,24 @@ def collect_metrics(reactor, config, client=None, authenticator=None,
     dispatcher = get_full_dispatcher(reactor, authenticator, metrics_log,
                                      service_configs)
 
-    # calculate metrics
-    cass_groups = yield get_scaling_groups(
-        _client, props=['status'],
-        group_pred=lambda g: g['status'] != 'DISABLED')
-    group_metrics = yield get_all_metrics(
-        dispatcher, cass_groups, _print=_print)
-
-    # Calculate total desired, actual and pending
-    total_desired, total_actual, total_pending = 0, 0, 0
-    for group_metric in group_metrics:
-        total_desired += group_metric.desired
-        total_actual += group_metric.actual
-        total_pending += group_metric.pending
+    # calculate metrics as the groups are streamed from cassandra
+    totals = MetricsTotals(keep_groups=_print)
+    window = EffectWindow(
+        dispatcher, get_in(['metrics', 'concurrency'], config, default=10),
+        metrics_log)
+
+    def visit(cass_groups):
+        return get_all_metrics(window, cass_groups, totals, _print=_print)
+
+    yield scan_scaling_groups(
+        _client, visit, props=['status'],
+        group_pred=lambda g: g['status'] != 'DISABLED',
+        num_ranges=get_in(['metrics', 'scan_ranges'], config, default=16),
+        parallel=get_in(['metrics', 'scan_parallel'], config, default=4))
+    yield window.wait()
+
+    total_desired, total_actual, total_pending = (
+        totals.desired, totals.actual, totals.pending)
     metrics_log.msg(
         'total desired: {td}, total_actual: {ta}, total pending: {tp}',
         td=total_desired, ta=total_actual, tp=total_pending)
@@ -289,6 +517,7 @@ def collect_metrics(reactor, config, client=None, authenticator=None,
     metrics_log.msg('added to cloud metrics')
     if _print:
         print('added to cloud metrics')
+        group_metrics = totals.groups
         group_metrics.sort(key=lambda g: abs(g.desired - g.actual),
                            reverse=True)
         print('groups sorted as per divergence', *group_metrics, sep='\n')
@@ -5,9 +5,12 @@ Cassandra implementation of the store for the front-end scaling groups engine
 import functools
 import itertools
 import json
+import random
 import time
 import uuid
 import weakref
+import zlib
+from collections import MutableMapping
 from datetime import datetime
 
 from characteristic import attributes
@@ -17,13 +20,14 @@ from effect.twisted import deferred_performer
 
 from jsonschema import ValidationError
 
+from kazoo.exceptions import NodeExistsError, NoNodeError
 from kazoo.protocol.states import KazooState
 
 from pyrsistent import freeze
 
 from silverberg.client import ConsistencyLevel
 
-from toolz.dicttoolz import keymap
+from toolz.dicttoolz import dissoc, keymap
 
 from twisted.internet import defer
 
@@ -33,6 +37,7 @@ from otter.log import log as otter_log
 from otter.models.interface import (
     GroupNotEmptyError,
     GroupState,
+    GroupStateCounts,
     IAdmin,
     IScalingGroup,
     IScalingGroupCollection,
@@ -42,18 +47,51 @@ from otter.models.interface import (
     NoSuchWebhookError,
     PoliciesOverLimitError,
     ScalingGroupOverLimitError,
+    StateProjection,
     UnrecognizedCapabilityError,
     WebhooksOverLimitError,
     next_cron_occurrence)
 from otter.util import timestamp
+from otter.util.cache import LRUCache, TTLCache
 from otter.util.config import config_value
 from otter.util.cqlbatch import Batch, batch
-from otter.util.deferredutils import with_lock
+from otter.util.deferredutils import unwrap_first_error, with_lock
 from otter.util.hashkey import generate_capability, generate_key_str
+from otter.util.retry import (
+    compose_retries,
+    random_interval,
+    retry,
+    retry_times,
+    terminal_errors_except)
 
 
 LOCK_PATH = '/locks'
 
+# Number of times a state change is retried when it conflicts with another
+# change in compare-and-set mode and the range of seconds to wait in between
+CAS_RETRIES = 10
+CAS_RETRY_INTERVAL = (0, 0.1)
+
+# Number of capability hashes whose webhook info is cached and seconds for
+# which known and unknown hashes are cached
+WEBHOOK_CACHE_SIZE = 10000
+WEBHOOK_CACHE_TTL = 60
+WEBHOOK_MISS_TTL = 10
+
+# Cached in place of webhook info of an unknown capability hash
+_UNKNOWN_WEBHOOK = object()
+
+
+class StateConflictError(Exception):
+    """
+    Error to be raised when a group's state is changed by someone else
+    between reading and writing it with compare-and-set
+    """
+    def __init__(self, tenant_id, group_id):
+        super(StateConflictError, self).__init__(
+            "State of group {g} for tenant {t} changed while modifying it"
+            .format(t=tenant_id, g=group_id))
+
 
 @attributes(['query', 'params', 'consistency_level'])
 class CQLQueryExecute(object):
@@ -80,6 +118,100 @@ def serialize_json_data(data, ver):
     dataOut["_ver"] = ver
     return json.dumps(dataOut)
 
+
+class LazyJSONMap(MutableMapping):
+    """
+    Mapping over a JSON object stored in cassandra that is decoded only when
+    its items are first needed. Its length is known without decoding if the
+    number of items is stored alongside it. That number is only as good as
+    the last writer, so it is checked against the JSON whenever the JSON is
+    decoded and :meth:`distrust_length` makes it be decoded when the length
+    is used, before it is relied on for changing the state.
+
+    :ivar bytes raw: The JSON as stored
+    :ivar bool changed: Whether the mapping may differ from `raw`. It is set
+        when an item is set or deleted and also when a ``dict`` or ``list``
+        value is handed out since it could be changed in place.
+
+    :param int length: Number of items in `raw` if known
+    """
+
+    def __init__(self, raw, length=None):
+        self.raw = raw
+        self.changed = False
+        self._length = length
+        self._length_trusted = True
+        self._data = None
+
+    def _decoded(self):
+        if self._data is None:
+            self._data = _jsonloads_data(self.raw)
+            if self._length is not None and self._length != len(self._data):
+                self._length = None
+        return self._data
+
+    @property
+    def length_stored(self):
+        """
+        Was the number of items stored alongside the JSON?
+        """
+        return self._length is not None
+
+    def verify_length(self):
+        """
+        Decode the JSON and forget the stored number of items if it is not
+        the number of items in the JSON, so that the actual number is used
+        and written again.
+        """
+        self._decoded()
+
+    def distrust_length(self):
+        """
+        Verify the stored number of items with :meth:`verify_length` when
+        the length is first used instead of returning it without decoding.
+        """
+        self._length_trusted = False
+
+    def __getitem__(self, key):
+        value = self._decoded()[key]
+        if isinstance(value, (dict, list)):
+            self.changed = True
+        return value
+
+    def __setitem__(self, key, value):
+        self._decoded()[key] = value
+        self.changed = True
+
+    def __delitem__(self, key):
+        del self._decoded()[key]
+        self.changed = True
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __contains__(self, key):
+        return key in self._decoded()
+
+    def __len__(self):
+        if (self._data is None and self._length is not None and
+                self._length_trusted):
+            return self._length
+        return len(self._decoded())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyJSONMap):
+            other = other._decoded()
+        return self._decoded() == other
+
+    def copy(self):
+        """
+        Return shallow copy of the mapping as a ``dict``
+        """
+        return dict(self._decoded())
+
+    def __repr__(self):
+        return repr(self._decoded())
+
 # ACHTUNG LOOKENPEEPERS!
 #
 # Batch operations don't let you have semicolons between statements.  Regular
@@ -102,12 +234,12 @@ _cql_view_webhook = (
     '"groupId" = :groupId AND "policyId" = :policyId AND '
     '"webhookId" = :webhookId;')
 _cql_create_group = (
-    'INSERT INTO {cf}("tenantId", "groupId", group_config, '
-    'launch_config, active, pending, "policyTouched", paused, '
-    'desired, created_at) '
-    'VALUES (:tenantId, :groupId, :group_config, '
-    ':launch_config, :active, :pending, :policyTouched, '
-    ':paused, :desired, :created_at) '
+    'INSERT INTO {cf}("tenantId", "groupId", group_config, group_name, '
+    'launch_config, active, pending, active_count, pending_count, '
+    '"policyTouched", paused, desired, created_at) '
+    'VALUES (:tenantId, :groupId, :group_config, :group_name, '
+    ':launch_config, :active, :pending, :active_count, :pending_count, '
+    ':policyTouched, :paused, :desired, :created_at) '
     'USING TIMESTAMP :ts')
 _cql_view_manifest = (
     'SELECT "tenantId", "groupId", group_config, '
@@ -115,18 +247,25 @@ _cql_view_manifest = (
     '"policyTouched", paused, desired, created_at '
     'FROM {cf} '
     'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
+_cql_list_groups = 'SELECT {columns} FROM {{cf}} WHERE "tenantId" = :tenantId'
+_cql_list_in_groups = (
+    'SELECT "groupId", {columns} FROM {cf} '
+    'WHERE "tenantId" = :tenantId AND "groupId" IN ({group_ids});')
 _cql_insert_policy = (
     'INSERT INTO {cf}("tenantId", "groupId", "policyId", data, version) '
     'VALUES (:tenantId, :groupId, :{name}policyId, :{name}data, '
     ':{name}version)')
 _cql_insert_group_state = (
-    'INSERT INTO {cf}("tenantId", "groupId", active, pending, "groupTouched", '
-    '"policyTouched", paused, desired) VALUES(:tenantId, :groupId, :active, '
-    ':pending, :groupTouched, :policyTouched, :paused, :desired) '
-    'USING TIMESTAMP :ts')
+    'INSERT INTO {cf}("tenantId", "groupId", {columns}) '
+    'VALUES(:tenantId, :groupId, {values}) USING TIMESTAMP :ts')
+_cql_cas_group_state = (
+    'UPDATE {cf} SET {assignments}, state_version = :new_version '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF state_version = {version}')
 _cql_view_group_state = (
     'SELECT "tenantId", "groupId", group_config, active, pending, '
-    '"groupTouched", "policyTouched", paused, desired, created_at '
+    'active_count, pending_count, "groupTouched", "policyTouched", paused, '
+    'desired, state_version, created_at '
     'FROM {cf} WHERE "tenantId" = :tenantId AND "groupId" = :groupId;')
 
 # --- Event related queries
@@ -152,6 +291,31 @@ _cql_fetch_batch_of_events = (
 _cql_delete_bucket_event = (
     'DELETE FROM {cf} WHERE bucket = :bucket '
     'AND trigger = :{name}trigger AND "policyId" = :{name}policyId;')
+_cql_fetch_batch_of_events_in_buckets = (
+    'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", cron, '
+    'version '
+    'FROM {cf} '
+    'WHERE bucket IN ({buckets}) AND trigger <= :now LIMIT :size;')
+_cql_fetch_bucket_events = (
+    'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", cron, '
+    'version '
+    'FROM {cf} '
+    'WHERE bucket = :bucket AND trigger <= :now LIMIT :size;')
+_cql_fetch_bucket_events_at_trigger = (
+    'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", cron, '
+    'version '
+    'FROM {cf} '
+    'WHERE bucket = :bucket AND trigger = :trigger '
+    'AND "policyId" > :policyId LIMIT :size;')
+_cql_fetch_bucket_events_after_trigger = (
+    'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", cron, '
+    'version '
+    'FROM {cf} '
+    'WHERE bucket = :bucket AND trigger > :trigger AND trigger <= :now '
+    'LIMIT :size;')
+_cql_delete_event = (
+    'DELETE FROM {cf} WHERE bucket = :{name}bucket '
+    'AND trigger = :{name}trigger AND "policyId" = :{name}policyId;')
 _cql_oldest_event = 'SELECT * from {cf} WHERE bucket=:bucket LIMIT 1;'
 
 _cql_insert_webhook = (
@@ -201,17 +365,24 @@ _cql_find_webhook_token = (
     'WHERE "webhookKey" = :webhookKey;')
 _cql_del_on_key = 'DELETE FROM {cf} WHERE "webhookKey"=:{name}webhookKey'
 
-_cql_count_for_tenant = (
-    'SELECT COUNT(*) FROM {cf} '
-    'WHERE "tenantId" = :tenantId;')
-_cql_count_for_policy = (
-    'SELECT COUNT(*) FROM {cf} '
-    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
-    'AND "policyId" = :policyId;')
-_cql_count_for_group = (
-    'SELECT COUNT(*) FROM {cf} WHERE "tenantId" = :tenantId '
-    'AND "groupId" = :groupId;')
-_cql_count_all = ('SELECT COUNT(*) FROM {cf};')
+# Counts table
+_cql_view_counts = (
+    'SELECT groups, policies, webhooks FROM {cf} WHERE scope = :scope;')
+_cql_view_counts_in = (
+    'SELECT groups, policies, webhooks FROM {cf} WHERE scope IN ({scopes});')
+_cql_update_counts = 'UPDATE {cf} SET {changes} WHERE scope = :{name}'
+_cql_delete_counts = 'DELETE FROM {cf} WHERE scope = :{name}'
+_cql_list_scopes = ('SELECT scope FROM {cf} {where} LIMIT :limit;')
+_cql_list_tenant_ids = (
+    'SELECT "groupId", {columns} FROM {cf} WHERE "tenantId" = :tenantId;')
+
+# Tenant identity table
+_cql_view_tenant_identity = ('SELECT username, catalog FROM {cf} '
+                             'WHERE "tenantId" = :tenantId;')
+_cql_insert_tenant_identity = (
+    'INSERT INTO {cf}("tenantId", username, catalog) '
+    'VALUES(:tenantId, :username, :catalog) USING TTL :ttl;')
+_cql_delete_tenant_identity = 'DELETE FROM {cf} WHERE "tenantId" = :tenantId;'
 
 # seems to be pretty quick no matter the consistency - unfortunately this only
 # checks we can connect to Cassandra, and not whether the otter keyspace is
@@ -282,8 +453,51 @@ def _paginated_list(tenant_id, group_id=None, policy_id=None, limit=100,
     return (''.join(cql_parts), params)
 
 
+def _paginated_groups(columns, tenant_id, limit=100, marker=None):
+    """
+    Return CQL and params to list a page of the tenant's groups with the
+    given columns. Like :func:`_paginated_list`, the column family name still
+    has to be inserted.
+
+    :param str columns: Comma separated columns to select
+    """
+    cql = _cql_list_groups.format(columns=columns)
+    params = {'tenantId': tenant_id, 'limit': limit}
+    if marker is not None:
+        cql += ' AND "groupId" > :marker'
+        params['marker'] = marker
+    return cql + ' LIMIT :limit;', params
+
+
+_state_projection_columns = {
+    StateProjection.FULL: (
+        '"tenantId", "groupId", group_config, active, pending, '
+        '"groupTouched", "policyTouched", paused, desired, created_at'),
+    StateProjection.COUNTS: (
+        '"tenantId", "groupId", group_name, desired, active_count, '
+        'pending_count, paused, created_at')
+}
+"""
+Columns of scaling_group table read to list each projection of states
+"""
+
 DEFAULT_CONSISTENCY = ConsistencyLevel.QUORUM
 
+PARTITION_KEYS = {
+    "scaling_group": "tenantId",
+    "scaling_policies": "tenantId",
+    "policy_webhooks": "tenantId",
+    "webhook_keys": "webhookKey",
+    "scaling_schedule_v2": "bucket",
+    "counts": "scope",
+    "tenant_identity": "tenantId",
+    "locks": "lockId"
+}
+"""
+Partition key column of each table. Used to send queries to replicas of
+their partition.
+"""
+
 
 def _build_policies(policies, policies_table, event_table, queries, data,
                     buckets):
@@ -425,6 +639,29 @@ def _assemble_webhook_from_row(row, include_id=False):
     return webhook_base
 
 
+def _policies_from_rows(rows):
+    """
+    Return policies as per :data:`otter.json_schema.group_schemas.policy`
+    with their IDs from rows of policies table
+    """
+    return [dict(id=row['policyId'], **_jsonloads_data(row['data']))
+            for row in rows]
+
+
+def _manifest_from_rows(group, policies):
+    """
+    Return manifest as per :data:`otter.json_schema.model_schemas.manifest`
+    from group's row and its policies
+    """
+    return {
+        'groupConfiguration': _jsonloads_data(group['group_config']),
+        'launchConfiguration': _jsonloads_data(group['launch_config']),
+        'scalingPolicies': policies,
+        'id': group['groupId'],
+        'state': _unmarshal_state(group)
+    }
+
+
 def _check_empty_and_grab_data(results, exception_if_empty):
     if len(results) == 0:
         raise exception_if_empty
@@ -446,15 +683,99 @@ def _unmarshal_state(state_dict):
     return GroupState(
         state_dict["tenantId"], state_dict["groupId"],
         _jsonloads_data(state_dict["group_config"])["name"],
-        _jsonloads_data(state_dict["active"]),
-        _jsonloads_data(state_dict["pending"]),
+        LazyJSONMap(state_dict["active"], state_dict.get("active_count")),
+        LazyJSONMap(state_dict["pending"], state_dict.get("pending_count")),
         state_dict["groupTouched"],
-        _jsonloads_data(state_dict["policyTouched"]),
+        LazyJSONMap(state_dict["policyTouched"]),
         bool(ord(state_dict["paused"])),
         desired=desired_capacity
     )
 
 
+# Columns of group state in the order they are written and the corresponding
+# query placeholders
+_state_columns = [
+    ('active', 'active'), ('pending', 'pending'),
+    ('active_count', 'active_count'), ('pending_count', 'pending_count'),
+    ('"groupTouched"', 'groupTouched'), ('"policyTouched"', 'policyTouched'),
+    ('paused', 'paused'), ('desired', 'desired')]
+
+
+def _verify_state_counts(state):
+    """
+    Make the stored counts of the state's active servers and pending jobs be
+    checked against the JSON they count when they are used. A count that is
+    missing is already not trusted but one that is out of sync, say because
+    an older node changed the JSON without it, would otherwise be relied on
+    for changing or deleting the group. Counts that are not used are not
+    checked so that their JSON need not be decoded.
+    """
+    if isinstance(state, GroupState):
+        for value in (state.active, state.pending):
+            if isinstance(value, LazyJSONMap):
+                value.distrust_length()
+    return state
+
+
+def _locked_state_version():
+    """
+    Return a ``state_version`` for a state written while holding the group's
+    lock. It is random instead of incremented so that writes that do not
+    read the version can still change it, and negative so that incrementing
+    it does not overflow.
+    """
+    return random.randint(-2 ** 31, -1)
+
+
+def _stored_state_scalars(state):
+    """
+    Return non-JSON columns of the state as it was read from cassandra or
+    None if it is not a :class:`GroupState`
+    """
+    if not isinstance(state, GroupState):
+        return None
+    return {'groupTouched': state.group_touched, 'paused': state.paused,
+            'desired': state.desired}
+
+
+def _changed_state_columns(state, stored):
+    """
+    Return the columns of the state that need to be written. JSON columns
+    that were read lazily and not changed are not re-serialized and the
+    count columns are written along with the JSON they count, or whenever
+    their count is not stored.
+
+    :param GroupState state: The state to write
+    :param dict stored: Non-JSON columns as returned by
+        :func:`_stored_state_scalars` when the state was read. Every column
+        is written if this is None.
+
+    :return: ``dict`` of placeholder name -> value
+    """
+    columns = {}
+    for name, value in [('active', state.active), ('pending', state.pending),
+                        ('policyTouched', state.policy_touched)]:
+        if not isinstance(value, LazyJSONMap) or value.changed:
+            columns[name] = serialize_json_data(value, 1)
+    for name, value in [('active', state.active), ('pending', state.pending)]:
+        if (name in columns or
+                isinstance(value, LazyJSONMap) and not value.length_stored):
+            columns[name + '_count'] = len(value)
+    for name, value in _stored_state_scalars(state).items():
+        if stored is None or stored[name] != value:
+            columns[name] = value
+    return columns
+
+
+def _unmarshal_state_counts(row):
+    return GroupStateCounts(
+        tenant_id=row['tenantId'], group_id=row['groupId'],
+        group_name=row['group_name'],
+        desired=row['desired'] or 0,
+        active_count=row['active_count'], pending_count=row['pending_count'],
+        paused=bool(ord(row['paused'])))
+
+
 def assemble_webhooks_in_policies(policies, webhooks):
     """
     Assemble webhooks inside policies.
@@ -493,12 +814,16 @@ def assemble_webhooks_in_policies(policies, webhooks):
 
 
 def verified_view(connection, view_query, del_query, data, consistency,
-                  exception_if_empty, log):
+                  exception_if_empty, log, reaper=None):
     """
     Ensures the view query does not get resurrected row, i.e. one that does
     not have "created_at" in it.  Any resurrected entry is deleted and
     `exception_if_empty` is raised.
 
+    If `reaper` is given, the resurrected group, identified by "tenantId"
+    and "groupId" in `data`, is queued for deletion in it instead of
+    executing `del_query`.
+
     TODO: Should there be seperate argument for view_consistency and
     del_consistency.
     """
@@ -510,13 +835,166 @@ def verified_view(connection, view_query, del_query, data, consistency,
         else:
             # resurrected row, trigger its deletion and raise empty exception
             log.msg('Resurrected row', row=result[0], row_params=data)
-            connection.execute(del_query, data, consistency)
+            if reaper is not None:
+                reaper.enqueue(data['tenantId'], data['groupId'])
+            else:
+                connection.execute(del_query, data, consistency)
             raise exception_if_empty
 
     d = connection.execute(view_query, data, consistency)
     return d.addCallback(_check_resurrection)
 
 
+ALL_SCOPE_SHARDS = 16
+"""
+Number of rows counts of all the tenants are spread across in counts table.
+Every counter change of every tenant goes to one of them, which would make a
+single row a hot partition
+"""
+
+ALL_SCOPES = ['*:{}'.format(shard) for shard in range(ALL_SCOPE_SHARDS)]
+"""
+Scopes of the rows having counts of all the tenants in counts table
+"""
+
+
+def all_scope(tenant_id):
+    """
+    Return the scope of counts of all the tenants that the given tenant's
+    counts are added to
+    """
+    return ALL_SCOPES[(zlib.crc32(tenant_id) & 0xffffffff) % ALL_SCOPE_SHARDS]
+
+
+def counts_scope(tenant_id, group_id=None, policy_id=None):
+    """
+    Return scope of counts in counts table of a tenant, group or policy
+    """
+    return '/'.join(filter(None, [tenant_id, group_id, policy_id]))
+
+
+def _counts_changes(changes, tenant_id, group_id=None, policy_id=None,
+                    **counts):
+    """
+    Add changes in `counts` to all scopes containing the given tenant, group
+    or policy. Tenant and global scopes get all the changes while group
+    scope gets only policies change and policy scope gets only webhooks
+    change.
+
+    :param dict changes: scope -> ``dict`` of count column -> change. It is
+        updated in place
+    :param counts: count column -> change
+
+    :return: `changes`
+    """
+    scopes = [(all_scope(tenant_id), counts), (tenant_id, counts)]
+    if group_id is not None:
+        scopes.append((counts_scope(tenant_id, group_id),
+                       {'policies': counts.get('policies', 0)}))
+    if policy_id is not None:
+        scopes.append((counts_scope(tenant_id, group_id, policy_id),
+                       {'webhooks': counts.get('webhooks', 0)}))
+    for scope, scope_counts in scopes:
+        scope_changes = changes.setdefault(scope, {})
+        for column, change in scope_counts.items():
+            scope_changes[column] = scope_changes.get(column, 0) + change
+    return changes
+
+
+def _counts_batch(table, changes, deleted=()):
+    """
+    Return counter batch query and its params to change counts
+
+    :param dict changes: scope -> ``dict`` of count column -> change
+    :param deleted: Scopes whose rows are deleted. Their changes are ignored
+
+    :return: (query, params) tuple or None if nothing changes
+    """
+    queries, params = [], {}
+    for scope in sorted(set(deleted)):
+        name = 'scope{}'.format(len(queries))
+        queries.append(_cql_delete_counts.format(cf=table, name=name))
+        params[name] = scope
+    for scope, counts in sorted(changes.items()):
+        if scope in deleted:
+            continue
+        name = 'scope{}'.format(len(queries))
+        columns = [column for column, change in sorted(counts.items())
+                   if change != 0]
+        if columns:
+            queries.append(_cql_update_counts.format(
+                cf=table, name=name,
+                changes=', '.join('{0} = {0} + :{1}{0}'.format(column, name)
+                                  for column in columns)))
+            params[name] = scope
+            params.update({name + column: counts[column]
+                           for column in columns})
+    if not queries:
+        return None
+    return 'BEGIN COUNTER BATCH {} APPLY BATCH;'.format(
+        ' '.join(queries)), params
+
+
+def change_counts(connection, table, changes, log, deleted=()):
+    """
+    Change counts in counts table. Counters cannot be changed in the same
+    batch that creates or deletes the counted rows, so they are changed after
+    it. Failure is logged and not propagated since drift in counts is fixed by
+    reconciling them. It is never retried, not even on timeout, since counter
+    updates are not idempotent and the timed out one may have been applied.
+
+    :param dict changes: scope -> ``dict`` of count column -> change
+    :param deleted: Scopes of deleted groups or policies whose rows are
+        removed instead of changed
+
+    :return: ``Deferred`` that fires with None
+    """
+    batch_query = _counts_batch(table, changes, deleted)
+    if batch_query is None:
+        return defer.succeed(None)
+    query, params = batch_query
+    d = connection.execute(query, params, DEFAULT_CONSISTENCY)
+    d.addErrback(log.err, 'Could not change counts', changes=changes)
+    return d.addCallback(lambda _: None)
+
+
+def read_counts(connection, table, scope, consistency=DEFAULT_CONSISTENCY):
+    """
+    Read counts of given scope from counts table
+
+    :return: ``Deferred`` that fires with ``dict`` with groups, policies and
+        webhooks counts
+    """
+    def extract(rows):
+        row = rows[0] if rows else {}
+        return {column: row.get(column) or 0
+                for column in ('groups', 'policies', 'webhooks')}
+
+    d = connection.execute(_cql_view_counts.format(cf=table),
+                           {'scope': scope}, consistency)
+    return d.addCallback(extract)
+
+
+def read_total_counts(connection, table, consistency=DEFAULT_CONSISTENCY):
+    """
+    Read counts of all the tenants by adding up the rows they are spread
+    across in counts table
+
+    :return: ``Deferred`` that fires with ``dict`` with groups, policies and
+        webhooks counts
+    """
+    def add(rows):
+        return {column: sum(row.get(column) or 0 for row in rows)
+                for column in ('groups', 'policies', 'webhooks')}
+
+    params = {'scope{}'.format(i): scope
+              for i, scope in enumerate(ALL_SCOPES)}
+    query = _cql_view_counts_in.format(
+        cf=table, scopes=', '.join(':' + name for name in sorted(params)))
+    d = connection.execute(query, params, consistency)
+    return d.addCallback(add)
+
+
 def _del_webhook_queries(table, webhooks):
     """
     Return queries and params to delete webhooks from webhook_keys table
@@ -552,6 +1030,131 @@ class WeakLocks(object):
         return lock
 
 
+CONFIG_VERSIONS_PATH = '/config_versions'
+"""
+Parent znode of the znodes that are changed whenever a group's config,
+launch config or policies are changed
+"""
+
+
+class GroupConfigCache(object):
+    """
+    Per-process read-through cache of groups' config, launch config and
+    policies keyed by (tenant, group). A group's cached entries are
+    invalidated when it is changed through this process. Other processes
+    are told about the change through ZooKeeper: changing a group touches
+    its znode under :data:`CONFIG_VERSIONS_PATH` and every process caching
+    the group has a watch on it. Entries also expire after `ttl` seconds,
+    which bounds staleness when ZooKeeper is not available or a watch is
+    lost.
+
+    ZooKeeper watches cannot be removed and stay until they fire, so a group
+    stays watched after its entries expire. Groups beyond `max_watched`
+    watched groups are not cached and are fetched every time.
+
+    :param clock: `IReactorTime` provider
+    :param float ttl: Seconds after which a cached entry expires
+    :param log: Bound log used to log ZooKeeper failures
+    :param int max_watched: Maximum number of groups watched at a time
+    """
+
+    def __init__(self, clock, ttl, log, max_watched=10000):
+        self._cache = TTLCache(clock, ttl)
+        self.log = log
+        self.max_watched = max_watched
+        self._watched = set()
+
+    def get(self, kz_client, tenant_id, group_id, key, fetch):
+        """
+        Return cached value of the group's key, fetching it if required.
+        It is fetched without caching it if the group cannot be watched since
+        `max_watched` groups are already watched.
+
+        :param kz_client: :class:`txkazoo.TxKazooClient` used to watch the
+            group for changes by other processes. Can be None
+        :param str tenant_id: Tenant ID of the group
+        :param str group_id: ID of the group
+        :param tuple key: Key of the value in the group
+        :param callable fetch: No-argument function returning ``Deferred``
+            that fires with the value
+
+        :return: ``Deferred`` that fires with the value
+        """
+        cache_key = (tenant_id, group_id) + key
+        if cache_key in self._cache:
+            return self._cache.get(cache_key, fetch)
+        if (kz_client is not None and group_id not in self._watched and
+                len(self._watched) >= self.max_watched):
+            return defer.maybeDeferred(fetch)
+        d = self._watch(kz_client, tenant_id, group_id)
+        return d.addCallback(lambda _: self._cache.get(cache_key, fetch))
+
+    def _watch(self, kz_client, tenant_id, group_id):
+        """
+        Watch the group's znode if not already watching it
+        """
+        if kz_client is None or group_id in self._watched:
+            return defer.succeed(None)
+        self._watched.add(group_id)
+
+        def changed(event):
+            self._watched.discard(group_id)
+            self.invalidate(tenant_id, group_id)
+
+        def failed(f):
+            self._watched.discard(group_id)
+            self.log.err(f, 'Could not watch group config version',
+                         tenant_id=tenant_id, scaling_group_id=group_id)
+
+        d = kz_client.exists(self._path(group_id), watch=changed)
+        return d.addCallbacks(lambda _: None, failed)
+
+    def _path(self, group_id):
+        return '{}/{}'.format(CONFIG_VERSIONS_PATH, group_id)
+
+    def invalidate(self, tenant_id, group_id):
+        """
+        Remove the group's cached entries from this process
+        """
+        for key in self._cache.keys():
+            if key[:2] == (tenant_id, group_id):
+                self._cache.invalidate(key)
+
+    def changed(self, kz_client, tenant_id, group_id, deleted=False):
+        """
+        Invalidate the group's cached entries in this and other processes.
+        Failures to tell other processes are logged and not propagated.
+
+        :param kz_client: :class:`txkazoo.TxKazooClient` or None
+        :param str tenant_id: Tenant ID of the group
+        :param str group_id: ID of the group
+        :param bool deleted: Was the group deleted? The group's znode is
+            removed instead of being touched if it was
+
+        :return: ``Deferred`` that fires with None when done
+        """
+        self.invalidate(tenant_id, group_id)
+        if kz_client is None:
+            return defer.succeed(None)
+        path = self._path(group_id)
+
+        def create(f):
+            f.trap(NoNodeError)
+            d = kz_client.create(path, makepath=True)
+            return d.addErrback(lambda f: f.trap(NodeExistsError))
+
+        if deleted:
+            d = kz_client.delete(path)
+            d.addErrback(lambda f: f.trap(NoNodeError))
+        else:
+            d = kz_client.set(path, '')
+            d.addErrback(create)
+        d.addCallback(lambda _: None)
+        d.addErrback(self.log.err, 'Could not change group config version',
+                     tenant_id=tenant_id, scaling_group_id=group_id)
+        return d
+
+
 def get_client_ts(reactor):
     """
     Return EPOCH with microseconds precision as a `Deferred`
@@ -586,6 +1189,25 @@ class CassScalingGroup(object):
     :ivar local_locks: Local locks used when modifying state
     :type local_locks: :class:`WeakLocks`
 
+    :ivar config_cache: Cache of config, launch config and policies. They
+        are always read from cassandra if it is None
+    :type config_cache: :class:`GroupConfigCache`
+
+    :ivar cas_state_writes: Whether state is modified with compare-and-set
+        on its ``state_version`` column instead of with the local and
+        ZooKeeper locks by modifiers marked as
+        :func:`otter.models.interface.repeatable_modifier`. See
+        :meth:`modify_state`
+    :type cas_state_writes: ``bool``
+
+    :ivar reaper: Reaper that resurrected rows found while reading are queued
+        to instead of being deleted inline. Can be None
+    :type reaper: :class:`otter.models.reaper.ResurrectionReaper`
+
+    :ivar webhook_cache: Cache of webhook info by capability hash from which
+        deleted webhooks are removed. Can be None
+    :type webhook_cache: :class:`otter.util.cache.LRUCache`
+
     IMPORTANT REMINDER: In CQL, update will create a new row if one doesn't
     exist.  Therefore, before doing an update, a read must be performed first
     else an entry is created where none should have been.
@@ -600,7 +1222,8 @@ class CassScalingGroup(object):
 
     """
     def __init__(self, log, tenant_id, uuid, connection, buckets, kz_client,
-                 reactor, local_locks):
+                 reactor, local_locks, config_cache=None,
+                 cas_state_writes=False, reaper=None, webhook_cache=None):
         """
         Creates a CassScalingGroup object.
         """
@@ -614,6 +1237,10 @@ class CassScalingGroup(object):
         self.kz_client = kz_client
         self.reactor = reactor
         self.local_locks = local_locks
+        self.config_cache = config_cache
+        self.cas_state_writes = cas_state_writes
+        self.reaper = reaper
+        self.webhook_cache = webhook_cache
 
         self.group_table = "scaling_group"
         self.launch_table = "launch_config"
@@ -622,6 +1249,7 @@ class CassScalingGroup(object):
         self.webhooks_table = "policy_webhooks"
         self.webhooks_keys_table = "webhook_keys"
         self.event_table = "scaling_schedule_v2"
+        self.counts_table = "counts"
 
     def with_timestamp(self, func):
         """
@@ -641,66 +1269,86 @@ class CassScalingGroup(object):
             return d
         return wrapper
 
+    def _cached(self, key, fetch):
+        """
+        Return result of `fetch` through the config cache if there is one
+        """
+        if self.config_cache is None:
+            return fetch()
+        return self.config_cache.get(self.kz_client, self.tenant_id,
+                                     self.uuid, key, fetch)
+
+    def _config_changed(self, result, deleted=False):
+        """
+        Invalidate cached config of this group in all the processes and
+        return `result`
+        """
+        if self.config_cache is None:
+            return result
+        d = self.config_cache.changed(self.kz_client, self.tenant_id,
+                                      self.uuid, deleted)
+        return d.addCallback(lambda _: result)
+
+    def _forget_webhooks(self, capability_hashes):
+        """
+        Remove the webhooks from webhook cache if there is one
+        """
+        if self.webhook_cache is not None:
+            for capability_hash in capability_hashes:
+                self.webhook_cache.pop(capability_hash)
+
+    def _view_group_column(self, column):
+        """
+        Return ``Deferred`` that fires with group's row containing the column
+        """
+        view_query = _cql_view.format(cf=self.group_table, column=column)
+        del_query = _cql_delete_all_in_group.format(
+            cf=self.group_table, name='')
+        return verified_view(self.connection, view_query, del_query,
+                             {"tenantId": self.tenant_id,
+                              "groupId": self.uuid},
+                             DEFAULT_CONSISTENCY,
+                             NoSuchScalingGroupError(self.tenant_id,
+                                                     self.uuid),
+                             self.log, reaper=self.reaper)
+
     def view_manifest(self, with_webhooks=False):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_manifest`
-        """
-        def _get_policies(group):
-            d = self._naive_list_policies()
-            return d.addCallback(lambda policies: (group, policies))
 
-        def _get_policies_and_webhooks(group):
-            d = defer.gatherResults(
-                [self._naive_list_policies(),
-                 self._naive_list_all_webhooks()], consumeErrors=True)
-            return d.addCallback(lambda results: (group, results))
-
-        def _assemble_webhooks((group, results)):
-            policies, webhooks = results
-            return group, assemble_webhooks_in_policies(policies, webhooks)
-
-        def _generate_manifest((group, policies)):
-            return {
-                'groupConfiguration': _jsonloads_data(group['group_config']),
-                'launchConfiguration': _jsonloads_data(group['launch_config']),
-                'scalingPolicies': policies,
-                'id': self.uuid,
-                'state': _unmarshal_state(group)
-            }
+        The group, its policies and webhooks are read in parallel. Policies
+        and webhooks read are ignored if the group does not exist.
+        """
+        def _generate_manifest(results):
+            group, policies = results[:2]
+            if with_webhooks:
+                policies = assemble_webhooks_in_policies(policies, results[2])
+            return _manifest_from_rows(group, policies)
 
         view_query = _cql_view_manifest.format(
             cf=self.group_table)
         del_query = _cql_delete_all_in_group.format(
             cf=self.group_table, name='')
-        d = verified_view(self.connection, view_query, del_query,
-                          {"tenantId": self.tenant_id,
-                           "groupId": self.uuid},
-                          DEFAULT_CONSISTENCY,
-                          NoSuchScalingGroupError(self.tenant_id, self.uuid),
-                          self.log)
+        reads = [verified_view(self.connection, view_query, del_query,
+                               {"tenantId": self.tenant_id,
+                                "groupId": self.uuid},
+                               DEFAULT_CONSISTENCY,
+                               NoSuchScalingGroupError(self.tenant_id,
+                                                       self.uuid),
+                               self.log, reaper=self.reaper),
+                 self._naive_list_policies()]
         if with_webhooks:
-            d.addCallback(_get_policies_and_webhooks)
-            d.addCallback(_assemble_webhooks)
-        else:
-            d.addCallback(_get_policies)
-        d.addCallback(_generate_manifest)
+            reads.append(self._naive_list_all_webhooks())
+        d = defer.gatherResults(reads, consumeErrors=True)
+        d.addCallbacks(_generate_manifest, unwrap_first_error)
         return d
 
     def view_config(self):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_config`
         """
-        view_query = _cql_view.format(
-            cf=self.group_table, column='group_config')
-        del_query = _cql_delete_all_in_group.format(
-            cf=self.group_table, name='')
-        d = verified_view(self.connection, view_query, del_query,
-                          {"tenantId": self.tenant_id,
-                           "groupId": self.uuid},
-                          DEFAULT_CONSISTENCY,
-                          NoSuchScalingGroupError(self.tenant_id, self.uuid),
-                          self.log)
-
+        d = self._cached(('group_config',), functools.partial(
+            self._view_group_column, 'group_config'))
         return d.addCallback(lambda group:
                              _jsonloads_data(group['group_config']))
 
@@ -708,17 +1356,8 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_launch_config`
         """
-        view_query = _cql_view.format(
-            cf=self.group_table, column='launch_config')
-        del_query = _cql_delete_all_in_group.format(
-            cf=self.group_table, name='')
-        d = verified_view(self.connection, view_query, del_query,
-                          {"tenantId": self.tenant_id,
-                           "groupId": self.uuid},
-                          DEFAULT_CONSISTENCY,
-                          NoSuchScalingGroupError(self.tenant_id, self.uuid),
-                          self.log)
-
+        d = self._cached(('launch_config',), functools.partial(
+            self._view_group_column, 'launch_config'))
         return d.addCallback(lambda group:
                              _jsonloads_data(group['launch_config']))
 
@@ -728,51 +1367,89 @@ class CassScalingGroup(object):
         """
         if consistency is None:
             consistency = DEFAULT_CONSISTENCY
+        return self._view_state_row(consistency).addCallback(_unmarshal_state)
 
+    def _view_state_row(self, consistency):
+        """
+        Return ``Deferred`` that fires with the group's row of state columns
+        """
         view_query = _cql_view_group_state.format(cf=self.group_table)
         del_query = _cql_delete_all_in_group.format(
             cf=self.group_table, name='')
-        d = verified_view(self.connection, view_query, del_query,
-                          {"tenantId": self.tenant_id,
-                           "groupId": self.uuid},
-                          consistency,
-                          NoSuchScalingGroupError(self.tenant_id, self.uuid),
-                          self.log)
+        return verified_view(
+            self.connection, view_query, del_query,
+            {"tenantId": self.tenant_id, "groupId": self.uuid},
+            consistency, NoSuchScalingGroupError(self.tenant_id, self.uuid),
+            self.log, reaper=self.reaper)
 
-        return d.addCallback(_unmarshal_state)
+    def _state_columns_to_write(self, new_state, stored):
+        """
+        Return columns of the new state to write along with their params
+
+        :return: (``list`` of (column, placeholder) tuples, params ``dict``)
+        """
+        assert (new_state.tenant_id == self.tenant_id and
+                new_state.group_id == self.uuid)
+        params = _changed_state_columns(new_state, stored)
+        columns = [(column, placeholder)
+                   for column, placeholder in _state_columns
+                   if placeholder in params]
+        params.update({'tenantId': new_state.tenant_id,
+                       'groupId': new_state.group_id})
+        return columns, params
 
     def modify_state(self, modifier_callable, *args, **kwargs):
         """
         see :meth:`otter.models.interface.IScalingGroup.modify_state`
+
+        The state is modified while holding a local lock and a ZooKeeper lock
+        of the group, except when ``cas_state_writes`` is set and the
+        modifier is marked with
+        :func:`otter.models.interface.repeatable_modifier`, in which case it
+        is modified with :meth:`_cas_modify_state`.
+
+        Every locked write changes ``state_version`` too so that
+        compare-and-set writers notice it. When ``cas_state_writes`` is set,
+        locked writes are also conditional on ``state_version`` since
+        compare-and-set writers do not take the locks. The modifier is not
+        called again if such a write conflicts; :class:`StateConflictError`
+        is raised instead, like any other failure to write after the
+        modifier has run.
         """
+        if (self.cas_state_writes and
+                getattr(modifier_callable, 'repeatable', False)):
+            return self._cas_modify_state(modifier_callable, *args, **kwargs)
+
         log = self.log.bind(system='CassScalingGroup.modify_state')
         consistency = DEFAULT_CONSISTENCY
 
         @self.with_timestamp
-        def _write_state(timestamp, new_state):
-            assert (new_state.tenant_id == self.tenant_id and
-                    new_state.group_id == self.uuid)
-            params = {
-                'tenantId': new_state.tenant_id,
-                'groupId': new_state.group_id,
-                'active': serialize_json_data(new_state.active, 1),
-                'pending': serialize_json_data(new_state.pending, 1),
-                'paused': new_state.paused,
-                'desired': new_state.desired,
-                'groupTouched': new_state.group_touched,
-                'policyTouched': serialize_json_data(new_state.policy_touched,
-                                                     1),
-                'ts': timestamp
-            }
-            return self.connection.execute(
-                _cql_insert_group_state.format(cf=self.group_table),
-                params, consistency)
+        def _write_state(timestamp, new_state, stored):
+            columns, params = self._state_columns_to_write(new_state, stored)
+            if not columns:
+                return
+            columns.append(('state_version', 'state_version'))
+            params['state_version'] = _locked_state_version()
+            params['ts'] = timestamp
+            query = _cql_insert_group_state.format(
+                cf=self.group_table,
+                columns=', '.join(column for column, _ in columns),
+                values=', '.join(':' + p for _, p in columns))
+            return self.connection.execute(query, params, consistency)
+
+        def _modify(state):
+            _verify_state_counts(state)
+            stored = _stored_state_scalars(state)
+            d = defer.maybeDeferred(modifier_callable, self, state, *args,
+                                    **kwargs)
+            return d.addCallback(_write_state, stored)
 
         def _modify_state():
+            if self.cas_state_writes:
+                return self._cas_modify_state_once(
+                    modifier_callable, *args, **kwargs)
             d = self.view_state(consistency)
-            d.addCallback(lambda state: modifier_callable(
-                self, state, *args, **kwargs))
-            return d.addCallback(_write_state)
+            return d.addCallback(_modify)
 
         lock = self.kz_client.Lock(LOCK_PATH + '/' + self.uuid)
         lock.acquire = functools.partial(lock.acquire, timeout=120)
@@ -782,6 +1459,70 @@ class CassScalingGroup(object):
             log.bind(category='locking'), acquire_timeout=150,
             release_timeout=30)
 
+    def _cas_modify_state_once(self, modifier_callable, *args, **kwargs):
+        """
+        Read the state, modify it and write it only if the group's
+        ``state_version`` is still the one that was read, as a Cassandra
+        lightweight transaction, and increment it.
+
+        :raises StateConflictError: if the state was changed by someone else
+            in between
+        """
+        consistency = DEFAULT_CONSISTENCY
+
+        def _check_applied(rows):
+            if not bool(ord(rows[0]['[applied]'])):
+                raise StateConflictError(self.tenant_id, self.uuid)
+
+        def _write_state(new_state, stored, version):
+            columns, params = self._state_columns_to_write(new_state, stored)
+            if not columns:
+                return
+            params['new_version'] = (version or 0) + 1
+            if version is None:
+                condition = 'null'
+            else:
+                condition = ':state_version'
+                params['state_version'] = version
+            query = _cql_cas_group_state.format(
+                cf=self.group_table,
+                assignments=', '.join('{0} = :{1}'.format(column, p)
+                                      for column, p in columns),
+                version=condition)
+            d = self.connection.execute(query, params, consistency)
+            return d.addCallback(_check_applied)
+
+        def _modify(row):
+            state = _verify_state_counts(_unmarshal_state(row))
+            stored = _stored_state_scalars(state)
+            d = defer.maybeDeferred(modifier_callable, self, state, *args,
+                                    **kwargs)
+            return d.addCallback(_write_state, stored,
+                                 row.get('state_version'))
+
+        return self._view_state_row(consistency).addCallback(_modify)
+
+    def _cas_modify_state(self, modifier_callable, *args, **kwargs):
+        """
+        Modify the state without locks with :meth:`_cas_modify_state_once`.
+        If the state was changed by someone else in between, the state is
+        read again and `modifier_callable` is called again on it after a
+        short random delay, up to ``CAS_RETRIES`` times after which
+        :class:`StateConflictError` is raised.
+
+        Since the modifier can be called more than once, this is only used
+        for modifiers marked with
+        :func:`otter.models.interface.repeatable_modifier`.
+        """
+        return retry(
+            lambda: self._cas_modify_state_once(
+                modifier_callable, *args, **kwargs),
+            can_retry=compose_retries(
+                terminal_errors_except(StateConflictError),
+                retry_times(CAS_RETRIES)),
+            next_interval=random_interval(*CAS_RETRY_INTERVAL),
+            clock=self.reactor)
+
     def update_status(self, status):
         """
         see :meth:`otter.models.interface.IScalingGroup.update_status`
@@ -810,18 +1551,23 @@ class CassScalingGroup(object):
 
         @self.with_timestamp
         def _do_update_config(ts, lastRev):
-            queries = [_cql_update.format(
-                cf=self.group_table, column='group_config', name=":scaling")]
+            queries = [
+                _cql_update.format(cf=self.group_table,
+                                   column='group_config', name=":scaling"),
+                _cql_update.format(cf=self.group_table,
+                                   column='group_name', name=":name")]
 
             b = Batch(queries, {"tenantId": self.tenant_id,
                                 "groupId": self.uuid,
                                 "scaling": serialize_json_data(data, 1),
+                                "name": data['name'],
                                 "ts": ts},
                       consistency=DEFAULT_CONSISTENCY)
             return b.execute(self.connection)
 
         d = self.view_config()
         d.addCallback(_do_update_config)
+        d.addCallback(self._config_changed)
         return d
 
     def update_launch_config(self, data):
@@ -845,6 +1591,7 @@ class CassScalingGroup(object):
 
         d = self.view_config()
         d.addCallback(_do_update_launch)
+        d.addCallback(self._config_changed)
         return d
 
     def _naive_list_policies(self, limit=None, marker=None):
@@ -853,10 +1600,6 @@ class CassScalingGroup(object):
         all the policies associated with particular scaling group
         irregardless of whether the scaling group still exists.
         """
-        def insert_id(rows):
-            return [dict(id=row['policyId'], **_jsonloads_data(row['data']))
-                    for row in rows]
-
         # TODO: this is just in place so that pagination in the manifest can
         # be handled elsewhere
         if limit is not None:
@@ -868,7 +1611,7 @@ class CassScalingGroup(object):
 
         d = self.connection.execute(cql.format(cf=self.policies_table), params,
                                     DEFAULT_CONSISTENCY)
-        d.addCallback(insert_id)
+        d.addCallback(_policies_from_rows)
         return d
 
     def list_policies(self, limit=100, marker=None):
@@ -890,11 +1633,13 @@ class CassScalingGroup(object):
         see :meth:`otter.models.interface.IScalingGroup.get_policy`
         """
         query = _cql_view_policy.format(cf=self.policies_table)
-        d = self.connection.execute(query,
-                                    {"tenantId": self.tenant_id,
-                                     "groupId": self.uuid,
-                                     "policyId": policy_id},
-                                    DEFAULT_CONSISTENCY)
+        d = self._cached(('policy', policy_id),
+                         lambda: self.connection.execute(
+                             query,
+                             {"tenantId": self.tenant_id,
+                              "groupId": self.uuid,
+                              "policyId": policy_id},
+                             DEFAULT_CONSISTENCY))
 
         def _extract_policy(rows):
             if len(rows) == 0 or version and rows[0]['version'] != version:
@@ -910,16 +1655,13 @@ class CassScalingGroup(object):
         self.log.bind(policies=data).msg("Creating policies")
 
         def _do_limits_check(lastRev):
-            d = self.connection.execute(
-                _cql_count_for_group.format(cf=self.policies_table),
-                {"tenantId": self.tenant_id,
-                 "groupId": self.uuid},
-                DEFAULT_CONSISTENCY)
+            d = read_counts(self.connection, self.counts_table,
+                            counts_scope(self.tenant_id, self.uuid))
             return d.addCallback(_check_limit).addCallback(lambda _: lastRev)
 
-        def _check_limit(curr_policies):
+        def _check_limit(counts):
             max_policies = config_value('limits.absolute.maxPoliciesPerGroup')
-            curr_policies = curr_policies[0]['count']
+            curr_policies = counts['policies']
             if curr_policies + len(data) > max_policies:
                 raise PoliciesOverLimitError(
                     curr_policies=curr_policies,
@@ -940,11 +1682,17 @@ class CassScalingGroup(object):
             b = Batch(queries, cqldata,
                       consistency=DEFAULT_CONSISTENCY)
             d = b.execute(self.connection)
+            d.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _counts_changes({}, self.tenant_id, self.uuid,
+                                policies=len(outpolicies)),
+                self.log))
             return d.addCallback(lambda _: outpolicies)
 
         d = self.view_config()
         d.addCallback(_do_limits_check)
         d.addCallback(_do_create_pol)
+        d.addCallback(self._config_changed)
         return d
 
     def update_policy(self, policy_id, data):
@@ -980,6 +1728,7 @@ class CassScalingGroup(object):
         d = self.get_policy(policy_id)
         d.addCallback(_do_update_schedule)
         d.addCallback(_do_update_policy)
+        d.addCallback(self._config_changed)
         return d
 
     def delete_policy(self, policy_id):
@@ -992,6 +1741,7 @@ class CassScalingGroup(object):
             # delete webhook keys
             queries, params = _del_webhook_queries(
                 self.webhooks_keys_table, webhooks)
+            self._forget_webhooks(w['webhookKey'] for w in webhooks)
             queries.extend([
                 _cql_delete_all_in_policy.format(cf=self.policies_table),
                 _cql_delete_all_in_policy.format(cf=self.webhooks_table)])
@@ -999,11 +1749,20 @@ class CassScalingGroup(object):
                            "policyId": policy_id})
             b = Batch(queries, params,
                       consistency=DEFAULT_CONSISTENCY)
-            return b.execute(self.connection)
+            num_webhooks = len([webhook for webhook in webhooks
+                                if webhook['policyId'] == policy_id])
+            d = b.execute(self.connection)
+            return d.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _counts_changes({}, self.tenant_id, self.uuid, policy_id,
+                                policies=-1, webhooks=-num_webhooks),
+                self.log,
+                deleted=[counts_scope(self.tenant_id, self.uuid, policy_id)]))
 
         d = self.get_policy(policy_id)
         d.addCallback(lambda _: self._naive_list_all_webhooks())
         d.addCallback(_do_delete)
+        d.addCallback(self._config_changed)
         return d
 
     def _naive_list_all_webhooks(self):
@@ -1064,9 +1823,9 @@ class CassScalingGroup(object):
 
         d = self.get_policy(policy_id)  # check that policy exists first
 
-        def _check_limit(curr_webhooks):
+        def _check_limit(counts):
             max_webhooks = config_value('limits.absolute.maxWebhooksPerPolicy')
-            curr_webhooks = curr_webhooks[0]['count']
+            curr_webhooks = counts['webhooks']
             if curr_webhooks + len(data) > max_webhooks:
                 raise WebhooksOverLimitError(
                     curr_webhooks=curr_webhooks,
@@ -1077,10 +1836,9 @@ class CassScalingGroup(object):
                     policy_id=policy_id)
 
         def _do_limits_check(lastRev):
-            d = self.connection.execute(
-                _cql_count_for_policy.format(cf=self.webhooks_table),
-                main_params,
-                DEFAULT_CONSISTENCY)
+            d = read_counts(
+                self.connection, self.counts_table,
+                counts_scope(self.tenant_id, self.uuid, policy_id))
             return d.addCallback(_check_limit).addCallback(lambda _: lastRev)
 
         d.addCallback(_do_limits_check)
@@ -1095,6 +1853,11 @@ class CassScalingGroup(object):
             b = Batch(queries, cql_params,
                       consistency=DEFAULT_CONSISTENCY)
             d = b.execute(self.connection)
+            d.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _counts_changes({}, self.tenant_id, self.uuid, policy_id,
+                                webhooks=len(output)),
+                bound_log))
             return d.addCallback(lambda _: output)
 
         d.addCallback(_do_create)
@@ -1150,6 +1913,7 @@ class CassScalingGroup(object):
         bound_log.msg("Deleting webhook")
 
         def _do_delete(lastRev):
+            self._forget_webhooks([lastRev['capability']['hash']])
             queries = [
                 _cql_delete_one_webhook.format(cf=self.webhooks_table),
                 _cql_del_on_key.format(cf=self.webhooks_keys_table, name='')]
@@ -1162,7 +1926,11 @@ class CassScalingGroup(object):
                  "webhookId": webhook_id,
                  "webhookKey": lastRev['capability']['hash']},
                 DEFAULT_CONSISTENCY)
-            return d
+            return d.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _counts_changes({}, self.tenant_id, self.uuid, policy_id,
+                                webhooks=-1),
+                bound_log))
 
         return self.get_webhook(policy_id, webhook_id).addCallback(_do_delete)
 
@@ -1173,10 +1941,11 @@ class CassScalingGroup(object):
         log = self.log.bind(system='CassScalingGroup.delete_group')
 
         @self.with_timestamp
-        def _delete_everything(ts, webhooks):
+        def _delete_everything(ts, (policies, webhooks)):
             # delete webhook keys
             queries, params = _del_webhook_queries(
                 self.webhooks_keys_table, webhooks)
+            self._forget_webhooks(w['webhookKey'] for w in webhooks)
 
             queries.extend([
                 _cql_delete_all_in_group.format(cf=table, name='') for table in
@@ -1189,18 +1958,38 @@ class CassScalingGroup(object):
             b = Batch(queries, params,
                       consistency=DEFAULT_CONSISTENCY)
 
-            return b.execute(self.connection)
+            d = b.execute(self.connection)
+            deleted = [counts_scope(self.tenant_id, self.uuid)] + [
+                counts_scope(self.tenant_id, self.uuid, policy['id'])
+                for policy in policies]
+            return d.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _group_counts_changes(policies, webhooks), log,
+                deleted=deleted))
+
+        def _group_counts_changes(policies, webhooks):
+            changes = _counts_changes({}, self.tenant_id, self.uuid,
+                                      groups=-1, policies=-len(policies))
+            for policy in policies:
+                num_webhooks = len([webhook for webhook in webhooks
+                                    if webhook['policyId'] == policy['id']])
+                _counts_changes(changes, self.tenant_id, self.uuid,
+                                policy['id'], webhooks=-num_webhooks)
+            return changes
 
         def _maybe_delete(state):
             if len(state.active) + len(state.pending) > 0:
                 raise GroupNotEmptyError(self.tenant_id, self.uuid)
 
-            d = self._naive_list_all_webhooks()
+            d = defer.gatherResults(
+                [self._naive_list_policies(),
+                 self._naive_list_all_webhooks()], consumeErrors=True)
             d.addCallback(_delete_everything)
             return d
 
         def _delete_group():
             d = self.view_state()
+            d.addCallback(_verify_state_counts)
             d.addCallback(_maybe_delete)
             return d
 
@@ -1218,6 +2007,7 @@ class CassScalingGroup(object):
                       release_timeout=30)
         # Cleanup /locks/<groupID> znode as it will not be required anymore
         d.addCallback(_delete_lock_znode)
+        d.addCallback(self._config_changed, deleted=True)
         return d
 
 
@@ -1227,6 +2017,19 @@ class CassScalingGroupCollection:
     .. autointerface:: otter.models.interface.IScalingGroupCollection
 
     :param reactor: IReactorTime provider
+    :param float config_cache_ttl: Seconds for which groups' config, launch
+        config and policies are cached by :class:`GroupConfigCache`. They are
+        not cached if it is None or 0
+    :param bool cas_state_writes: Whether groups' states are modified with
+        compare-and-set instead of locks. See
+        :meth:`CassScalingGroup._cas_modify_state`
+    :param reaper: :class:`otter.models.reaper.ResurrectionReaper` that
+        resurrected groups found while reading are queued to. They are
+        deleted inline if it is None
+    :param bool webhook_index_fallback: Whether capability hashes not found
+        in webhook_keys table are looked up in the index on policy_webhooks
+        table. It can be turned off once webhooks are migrated to
+        webhook_keys table with ``load_cql.py --webhook-migrate``
 
     The Cassandra schema structure::
 
@@ -1257,7 +2060,9 @@ class CassScalingGroupCollection:
     Also, because deletes are done as tombstones rather than actually deleting,
     deletes are also updates and hence a read must be performed before deletes.
     """
-    def __init__(self, connection, reactor):
+    def __init__(self, connection, reactor, config_cache_ttl=None,
+                 cas_state_writes=False, reaper=None,
+                 webhook_index_fallback=True):
         """
         Init
 
@@ -1275,8 +2080,19 @@ class CassScalingGroupCollection:
         self.webhook_keys_table = "webhook_keys"
         self.state_table = "group_state"
         self.event_table = "scaling_schedule_v2"
+        self.counts_table = "counts"
         self.buckets = None
         self.kz_client = None
+        self.cas_state_writes = cas_state_writes
+        self.reaper = reaper
+        self.webhook_index_fallback = webhook_index_fallback
+        self.webhook_cache = LRUCache(WEBHOOK_CACHE_SIZE, reactor,
+                                      WEBHOOK_CACHE_TTL)
+        self.config_cache = None
+        if config_cache_ttl:
+            self.config_cache = GroupConfigCache(
+                reactor, config_cache_ttl,
+                otter_log.bind(system='GroupConfigCache'))
 
     def set_scheduler_buckets(self, buckets):
         """
@@ -1295,12 +2111,10 @@ class CassScalingGroupCollection:
 
         # obey limits
         max_groups = config_value('limits.absolute.maxGroups')
-        d = self.connection.execute(_cql_count_for_tenant.format(
-            cf="scaling_group"), {'tenantId': tenant_id},
-            DEFAULT_CONSISTENCY)
+        d = read_counts(self.connection, self.counts_table, tenant_id)
 
-        def check_groups(cur_groups, max_groups):
-            if cur_groups[0]['count'] >= max_groups:
+        def check_groups(counts, max_groups):
+            if counts['groups'] >= max_groups:
                 log.msg('client has reached maxGroups limit')
                 raise ScalingGroupOverLimitError(tenant_id, max_groups)
 
@@ -1314,9 +2128,12 @@ class CassScalingGroupCollection:
                 "tenantId": tenant_id,
                 "groupId": scaling_group_id,
                 "group_config": serialize_json_data(config, 1),
+                "group_name": config['name'],
                 "launch_config": serialize_json_data(launch, 1),
                 "active": '{}',
                 "pending": '{}',
+                "active_count": 0,
+                "pending_count": 0,
                 "created_at": datetime.utcnow(),
                 "policyTouched": '{}',
                 "paused": False,
@@ -1343,6 +2160,11 @@ class CassScalingGroupCollection:
                       consistency=DEFAULT_CONSISTENCY)
 
             bd = b.execute(self.connection)
+            bd.addCallback(lambda _: change_counts(
+                self.connection, self.counts_table,
+                _counts_changes({}, tenant_id, scaling_group_id, groups=1,
+                                policies=len(outpolicies)),
+                log))
             bd.addCallback(lambda _: {
                 'groupConfiguration': config,
                 'launchConfiguration': launch,
@@ -1357,52 +2179,107 @@ class CassScalingGroupCollection:
         return d.addCallback(_create_group)
 
     def list_scaling_group_states(self, log, tenant_id, limit=100,
-                                  marker=None):
+                                  marker=None,
+                                  projection=StateProjection.FULL):
         """
         see :meth:`IScalingGroupCollection.list_scaling_group_states`.
-        """
-        def _build_states(group_states):
-            return [_unmarshal_state(state) for state in group_states]
-
-        def _filter_resurrected(groups):
-            valid_groups, resurrected_groups = [], []
-            for group in groups:
-                if group['created_at']:
-                    valid_groups.append(group)
-                else:
-                    resurrected_groups.append(group)
-            # We can trigger deletion of resurrected groups and return
-            # valid_groups right away We need not wait till deletion
-            # completes.
-            _delete_resurrected_groups(resurrected_groups)
-            return valid_groups
-
-        def _delete_resurrected_groups(groups):
-            if not groups:
-                return None
-            log.msg('Resurrected rows', rows=groups)
 
+        Group's name and number of active servers and pending jobs are kept
+        in their own columns so that listing counts does not read or decode
+        the config, servers and jobs. Groups whose config or state has not
+        been written since those columns were added get them from their
+        config, servers and jobs.
+        """
+        builders = {
+            StateProjection.FULL: lambda rows: defer.succeed(
+                [_unmarshal_state(row) for row in rows]),
+            StateProjection.COUNTS: lambda rows: self._fill_counts(
+                tenant_id, rows).addCallback(
+                    lambda rows: [_unmarshal_state_counts(row)
+                                  for row in rows])
+        }
+        log = log.bind(tenant_id=tenant_id)
+        cql, params = _paginated_groups(_state_projection_columns[projection],
+                                        tenant_id, limit=limit, marker=marker)
+        d = self.connection.execute(cql.format(cf=self.group_table), params,
+                                    DEFAULT_CONSISTENCY)
+        d.addCallback(self._filter_resurrected, log, tenant_id)
+        d.addCallback(builders[projection])
+        return d
+
+    def _fill_counts(self, tenant_id, rows):
+        """
+        Set group_name, active_count and pending_count of the group rows that
+        do not have them by reading their config, active servers and pending
+        jobs. Only the columns that are needed are read.
+        """
+        no_name = [row for row in rows if row['group_name'] is None]
+        no_counts = [row for row in rows
+                     if row['active_count'] is None or
+                     row['pending_count'] is None]
+        missing = [row for row in rows
+                   if None in (row['group_name'], row['active_count'],
+                               row['pending_count'])]
+        if not missing:
+            return defer.succeed(rows)
+        params = {'groupId{}'.format(i): row['groupId']
+                  for i, row in enumerate(missing)}
+        params['tenantId'] = tenant_id
+        columns = (['group_config'] if no_name else []) + (
+            ['active', 'pending'] if no_counts else [])
+        cql = _cql_list_in_groups.format(
+            cf=self.group_table, columns=', '.join(columns),
+            group_ids=', '.join(':groupId{}'.format(i)
+                                for i in range(len(missing))))
+
+        def fill(group_rows):
+            groups = {row['groupId']: row for row in group_rows}
+            for row in no_name:
+                group = groups.get(row['groupId'])
+                row['group_name'] = _jsonloads_data(
+                    group['group_config'])['name'] if group else ''
+            for row in no_counts:
+                group = groups.get(row['groupId'])
+                row['active_count'] = len(
+                    _jsonloads_data(group['active'])) if group else 0
+                row['pending_count'] = len(
+                    _jsonloads_data(group['pending'])) if group else 0
+            return rows
+
+        d = self.connection.execute(cql, params, DEFAULT_CONSISTENCY)
+        return d.addCallback(fill)
+
+    def _filter_resurrected(self, groups, log, tenant_id):
+        """
+        Return groups that are not resurrected, i.e. rows that have
+        "created_at". Resurrected groups are queued to the reaper if there
+        is one, otherwise their deletion is triggered without waiting for it
+        to complete.
+        """
+        valid_groups, resurrected_groups = [], []
+        for group in groups:
+            if group['created_at']:
+                valid_groups.append(group)
+            else:
+                resurrected_groups.append(group)
+        if resurrected_groups:
+            log.msg('Resurrected rows', rows=resurrected_groups)
+            if self.reaper is not None:
+                for group in resurrected_groups:
+                    self.reaper.enqueue(tenant_id, group['groupId'])
+                return valid_groups
             queries = [
                 _cql_delete_all_in_group.format(cf=table, name=i)
                 for table in (self.group_table,
                               self.policies_table,
                               self.webhooks_table)
-                for i in range(len(groups))]
-
+                for i in range(len(resurrected_groups))]
             params = {'groupId{0}'.format(i): group['groupId']
-                      for i, group in enumerate(groups)}
+                      for i, group in enumerate(resurrected_groups)}
             params['tenantId'] = tenant_id
-
-            b = Batch(queries, params, DEFAULT_CONSISTENCY)
-            return b.execute(self.connection)
-
-        log = log.bind(tenant_id=tenant_id)
-        cql, params = _paginated_list(tenant_id, limit=limit, marker=marker)
-        d = self.connection.execute(cql.format(cf=self.group_table), params,
-                                    DEFAULT_CONSISTENCY)
-        d.addCallback(_filter_resurrected)
-        d.addCallback(_build_states)
-        return d
+            Batch(queries, params, DEFAULT_CONSISTENCY).execute(
+                self.connection)
+        return valid_groups
 
     def get_scaling_group(self, log, tenant_id, scaling_group_id):
         """
@@ -1410,7 +2287,9 @@ class CassScalingGroupCollection:
         """
         return CassScalingGroup(log, tenant_id, scaling_group_id,
                                 self.connection, self.buckets, self.kz_client,
-                                self.reactor, self.local_locks)
+                                self.reactor, self.local_locks,
+                                self.config_cache, self.cas_state_writes,
+                                self.reaper, self.webhook_cache)
 
     def fetch_and_delete(self, bucket, now, size=100):
         """
@@ -1437,6 +2316,98 @@ class CassScalingGroupCollection:
             {"size": size, "now": now, "bucket": bucket}, DEFAULT_CONSISTENCY)
         return d.addCallback(delete_events)
 
+    def _fetch_events_in_buckets(self, buckets, now, size):
+        """
+        Fetch events occurring at or before `now` in given buckets. Each
+        event contains the bucket it is in.
+        """
+        names = ['bucket{}'.format(i) for i in range(len(buckets))]
+        data = dict(zip(names, buckets))
+        data.update({"size": size, "now": now})
+        return self.connection.execute(
+            _cql_fetch_batch_of_events_in_buckets.format(
+                cf=self.event_table,
+                buckets=', '.join(':' + name for name in names)),
+            data, DEFAULT_CONSISTENCY)
+
+    def fetch_and_delete_buckets(self, buckets, now, size=100):
+        """
+        see :meth:`IScalingScheduleCollection.fetch_and_delete_buckets`
+        """
+        def delete_events(events):
+            if not events:
+                return events
+            d = self.delete_events(events)
+            return d.addCallback(
+                lambda _: [dissoc(event, 'bucket') for event in events])
+
+        d = self._fetch_events_in_buckets(buckets, now, size)
+        return d.addCallback(delete_events)
+
+    def get_upcoming_events(self, buckets, until, size=10000):
+        """
+        see :meth:`IScalingScheduleCollection.get_upcoming_events`
+        """
+        def got_events(events):
+            if len(events) < size:
+                return events
+            # Rows of the IN query come in partition order, so the first
+            # buckets could fill the page and leave out the later ones.
+            # Page through each bucket instead.
+            d = defer.gatherResults(
+                [self._fetch_all_bucket_events(bucket, until, size)
+                 for bucket in buckets],
+                consumeErrors=True)
+            return d.addCallback(lambda results: sum(results, []))
+
+        d = self._fetch_events_in_buckets(buckets, until, size)
+        return d.addCallback(got_events)
+
+    @defer.inlineCallbacks
+    def _fetch_all_bucket_events(self, bucket, now, size):
+        """
+        Fetch all events occurring at or before `now` in the bucket, `size`
+        of them at a time in clustering order, i.e. by trigger and then by
+        policy ID.
+        """
+        def execute(query, params):
+            params = dict(params, bucket=bucket, size=size)
+            return self.connection.execute(
+                query.format(cf=self.event_table), params,
+                DEFAULT_CONSISTENCY)
+
+        page = yield execute(_cql_fetch_bucket_events, {'now': now})
+        events = list(page)
+        while len(page) == size:
+            last = {'trigger': page[-1]['trigger'],
+                    'policyId': page[-1]['policyId']}
+            # Rest of the events at the last trigger and then the ones after
+            page = yield execute(_cql_fetch_bucket_events_at_trigger, last)
+            events.extend(page)
+            if len(page) < size:
+                page = yield execute(
+                    _cql_fetch_bucket_events_after_trigger,
+                    {'trigger': last['trigger'], 'now': now})
+                events.extend(page)
+        defer.returnValue(events)
+
+    def delete_events(self, events):
+        """
+        see :meth:`IScalingScheduleCollection.delete_events`
+        """
+        data = {}
+        queries = []
+        for i, event in enumerate(events):
+            event_name = 'event{}'.format(i)
+            queries.append(
+                _cql_delete_event.format(cf=self.event_table,
+                                         name=event_name))
+            data[event_name + 'bucket'] = event['bucket']
+            data[event_name + 'policyId'] = event['policyId']
+            data[event_name + 'trigger'] = event['trigger']
+        b = Batch(queries, data, DEFAULT_CONSISTENCY)
+        return b.execute(self.connection).addCallback(lambda _: None)
+
     def add_cron_events(self, cron_events):
         """
         Add cron events to event table
@@ -1464,7 +2435,18 @@ class CassScalingGroupCollection:
     def webhook_info_by_hash(self, log, capability_hash):
         """
         see :meth:`IScalingGroupCollection.webhook_info_by_hash`
+
+        Webhook info is cached for ``WEBHOOK_CACHE_TTL`` seconds and unknown
+        hashes for ``WEBHOOK_MISS_TTL`` seconds in :obj:`webhook_cache`.
+        Hashes not found in webhook_keys table are looked up in the index if
+        :obj:`webhook_index_fallback` is set.
         """
+        cached = self.webhook_cache.get(capability_hash)
+        if cached is _UNKNOWN_WEBHOOK:
+            return defer.fail(UnrecognizedCapabilityError(capability_hash, 1))
+        elif cached is not None:
+            return defer.succeed(cached)
+
         d = self._webhook_info_from_table(log, capability_hash)
 
         def not_found(f):
@@ -1472,8 +2454,19 @@ class CassScalingGroupCollection:
                 log.err(f, 'Error getting webhook info from table')
             return self._webhook_info_by_index(log, capability_hash)
 
-        d.addErrback(not_found)
-        return d
+        def found(info):
+            self.webhook_cache.set(capability_hash, info)
+            return info
+
+        def unknown(f):
+            f.trap(UnrecognizedCapabilityError)
+            self.webhook_cache.set(capability_hash, _UNKNOWN_WEBHOOK,
+                                   WEBHOOK_MISS_TTL)
+            return f
+
+        if self.webhook_index_fallback:
+            d.addErrback(not_found)
+        return d.addCallbacks(found, unknown)
 
     def _webhook_info_from_table(self, log, capability_hash):
         """
@@ -1558,19 +2551,135 @@ class CassScalingGroupCollection:
         """
         see :meth:`otter.models.interface.IScalingGroupCollection.get_counts`
         """
+        return read_counts(self.connection, self.counts_table, tenant_id,
+                           ConsistencyLevel.ONE)
 
-        fields = ['scaling_group', 'scaling_policies', 'policy_webhooks']
-        deferred = [
-            self.connection.execute(_cql_count_for_tenant.format(cf=field),
-                                    {'tenantId': tenant_id},
-                                    ConsistencyLevel.ONE)
-            for field in fields]
+    def reconcile_counts(self, log, tenant_id):
+        """
+        Fix drift in counts of the tenant and its groups and policies by
+        counting their rows. The change in tenant's counts is applied to
+        the row of counts of all the tenants it belongs to as well. Counts
+        of groups or policies created or deleted while reconciling may drift
+        again and will be fixed by the next reconciliation. Tenants whose
+        groups are all deleted get their counts set to 0.
 
-        d = defer.gatherResults(deferred)
-        d.addCallback(lambda results: [r[0]['count'] for r in results])
-        d.addCallback(lambda results: dict(zip(
-            ('groups', 'policies', 'webhooks'), results)))
-        return d
+        :return: ``Deferred`` that fires with actual ``dict`` of groups,
+            policies and webhooks counts of the tenant
+        """
+        log = log.bind(tenant_id=tenant_id)
+
+        def list_ids(table, columns):
+            return self.connection.execute(
+                _cql_list_tenant_ids.format(cf=table, columns=columns),
+                {'tenantId': tenant_id}, DEFAULT_CONSISTENCY)
+
+        def actual_counts((groups, policies, webhooks)):
+            # Resurrected groups do not have created_at
+            group_ids = set(group['groupId'] for group in groups
+                            if group['created_at'])
+            policies = [policy for policy in policies
+                        if policy['groupId'] in group_ids]
+            webhooks = [webhook for webhook in webhooks
+                        if webhook['groupId'] in group_ids]
+            counts = {tenant_id: {'groups': len(group_ids),
+                                  'policies': len(policies),
+                                  'webhooks': len(webhooks)}}
+            for group_id in group_ids:
+                counts[counts_scope(tenant_id, group_id)] = {'policies': 0}
+            for policy in policies:
+                counts[counts_scope(tenant_id, policy['groupId'])][
+                    'policies'] += 1
+                counts[counts_scope(tenant_id, policy['groupId'],
+                                    policy['policyId'])] = {'webhooks': 0}
+            for webhook in webhooks:
+                scope = counts_scope(tenant_id, webhook['groupId'],
+                                     webhook['policyId'])
+                if scope in counts:
+                    counts[scope]['webhooks'] += 1
+            return counts
+
+        def read_all(counts):
+            scopes = sorted(counts)
+            d = defer.gatherResults(
+                [read_counts(self.connection, self.counts_table, scope)
+                 for scope in scopes], consumeErrors=True)
+            return d.addCallback(
+                lambda current: (counts, dict(zip(scopes, current))))
+
+        def fix((counts, current)):
+            changes = {
+                scope: {column: count - current[scope][column]
+                        for column, count in counts[scope].items()}
+                for scope in counts}
+            changes[all_scope(tenant_id)] = changes[tenant_id]
+            if any(any(c.values()) for c in changes.values()):
+                log.msg('Fixing drifted counts', changes=changes)
+            d = change_counts(self.connection, self.counts_table, changes,
+                              log)
+            return d.addCallback(lambda _: counts[tenant_id])
+
+        d = defer.gatherResults(
+            [list_ids(self.group_table, 'created_at'),
+             list_ids(self.policies_table, '"policyId"'),
+             list_ids(self.webhooks_table, '"policyId"')],
+            consumeErrors=True)
+        d.addCallback(actual_counts)
+        d.addCallback(read_all)
+        return d.addCallback(fix)
+
+    def reconcile_total_counts(self, log, counts):
+        """
+        Fix drift in counts of all the tenants
+
+        :param dict counts: Scope in :data:`ALL_SCOPES` -> actual groups,
+            policies and webhooks counts of the tenants in it, i.e. sum of
+            counts returned by :meth:`reconcile_counts` of every tenant
+            whose :func:`all_scope` is that scope. Missing scopes have no
+            tenants.
+
+        :return: ``Deferred`` that fires with None
+        """
+        empty = {'groups': 0, 'policies': 0, 'webhooks': 0}
+
+        def fix(current):
+            changes = {}
+            for scope, scope_current in zip(ALL_SCOPES, current):
+                actual = counts.get(scope, empty)
+                changes[scope] = {column: actual[column] - count
+                                  for column, count in scope_current.items()}
+            return change_counts(self.connection, self.counts_table, changes,
+                                 log)
+
+        d = defer.gatherResults(
+            [read_counts(self.connection, self.counts_table, scope)
+             for scope in ALL_SCOPES], consumeErrors=True)
+        return d.addCallback(fix)
+
+    @defer.inlineCallbacks
+    def list_counted_tenants(self, batch_size=1000):
+        """
+        List tenants that have a row in counts table. These include tenants
+        whose groups are all deleted and whose counts may still need to be
+        reconciled to 0.
+
+        :return: ``Deferred`` that fires with ``list`` of tenant ids
+        """
+        where = 'WHERE token(scope) > token(:scope)'
+        scopes = []
+        batch = yield self.connection.execute(
+            _cql_list_scopes.format(cf=self.counts_table, where=''),
+            {'limit': batch_size}, DEFAULT_CONSISTENCY)
+        while batch:
+            scopes.extend(row['scope'] for row in batch)
+            if len(batch) < batch_size:
+                break
+            batch = yield self.connection.execute(
+                _cql_list_scopes.format(cf=self.counts_table, where=where),
+                {'limit': batch_size, 'scope': batch[-1]['scope']},
+                DEFAULT_CONSISTENCY)
+        defer.returnValue(
+            [scope for scope in scopes
+             if '/' not in scope and scope not in ALL_SCOPES])
 
     def kazoo_health_check(self):
         """
@@ -1629,35 +2738,72 @@ class CassAdmin(object):
 
     def __init__(self, connection):
         self.connection = connection
+        self.counts_table = "counts"
 
     def get_metrics(self, log):
         """
         see :meth:`otter.models.interface.IAdmin.get_metrics`
         """
-        def _get_metric(table, label):
-            """
-            Execute a CQL statement and return a formatted result
-            """
-            def _format_result(result, label):
-                """
-                :param result: Result from metric collection
-                :param label: Label for the metric
-
-                :return: dict of metric label, value and time
-                """
-                return dict(
-                    id="otter.metrics.{0}".format(label),
-                    value=result[0]['count'],
-                    time=int(time.time()))
-
-            dc = self.connection.execute(_cql_count_all.format(cf=table), {},
-                                         ConsistencyLevel.QUORUM)
-            dc.addCallback(_format_result, label)
-            return dc
-
-        tables = ['scaling_group', 'scaling_policies', 'policy_webhooks']
-        labels = ['groups', 'policies', 'webhooks']
-        mapping = zip(tables, labels)
-
-        deferreds = [_get_metric(table, label) for table, label in mapping]
-        return defer.gatherResults(deferreds, consumeErrors=True)
+        def _format_results(counts):
+            now = int(time.time())
+            return [dict(id="otter.metrics.{0}".format(label),
+                         value=counts[label],
+                         time=now)
+                    for label in ('groups', 'policies', 'webhooks')]
+
+        d = read_total_counts(self.connection, self.counts_table,
+                              ConsistencyLevel.QUORUM)
+        return d.addCallback(_format_results)
+
+
+class CassTenantIdentityStore(object):
+    """
+    Keeps the tenants' username and service catalog found by
+    :class:`otter.auth.ImpersonatingAuthenticator` so that they survive
+    restarts. It is only a cache and hence is read and written with
+    consistency ONE.
+
+    :param connection: silverberg client used to connect to cassandra
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = "tenant_identity"
+
+    def get_identity(self, tenant_id):
+        """
+        Get the tenant's username and service catalog
+
+        :return: ``Deferred`` that fires with (username, catalog) tuple or
+            None if the tenant is not stored
+        """
+        d = self.connection.execute(
+            _cql_view_tenant_identity.format(cf=self.table),
+            {'tenantId': tenant_id}, ConsistencyLevel.ONE)
+        return d.addCallback(
+            lambda rows: (rows[0]['username'], json.loads(rows[0]['catalog']))
+            if rows else None)
+
+    def set_identity(self, tenant_id, username, catalog, ttl):
+        """
+        Store the tenant's username and service catalog for `ttl` seconds
+
+        :return: ``Deferred`` that fires with None
+        """
+        d = self.connection.execute(
+            _cql_insert_tenant_identity.format(cf=self.table),
+            {'tenantId': tenant_id, 'username': username,
+             'catalog': json.dumps(catalog), 'ttl': ttl},
+            ConsistencyLevel.ONE)
+        return d.addCallback(lambda _: None)
+
+    def delete_identity(self, tenant_id):
+        """
+        Remove the tenant's username and service catalog
+
+        :return: ``Deferred`` that fires with None
+        """
+        d = self.connection.execute(
+            _cql_delete_tenant_identity.format(cf=self.table),
+            {'tenantId': tenant_id}, ConsistencyLevel.ONE)
+        return d.addCallback(lambda _: None)
@@ -1,7 +1,11 @@
 """
 Interface to be used by the scaling groups engine
 """
+from copy import copy
 from datetime import datetime
+from time import mktime
+
+from characteristic import attributes
 
 from croniter import croniter
 
@@ -10,6 +14,7 @@ from twisted.python.constants import NamedConstant, Names
 from zope.interface import Attribute, Interface
 
 from otter.util import timestamp
+from otter.util.cache import LRUCache
 
 
 class GroupState(object):
@@ -24,7 +29,9 @@ class GroupState(object):
     :ivar bytes group_name: the name of the scaling group whose state this
         object represents
     :ivar int desired: the desired capacity of the scaling group
-    :ivar dict active: the mapping of active server ids and their info
+    :ivar dict active: the mapping of active server ids and their info. This
+        and ``pending`` and ``policy_touched`` can be any mutable mapping,
+        e.g. one that is decoded lazily by the storage backend
     :ivar dict pending: the list of pending job ids and their info
     :ivar bool paused: whether the scaling group is paused in scaling activities
     :ivar dict policy_touched: dictionary mapping policy ids to the last time
@@ -150,6 +157,31 @@ class GroupState(object):
                 'desired_capacity': len(self.active) + len(self.pending)}
 
 
+@attributes(['tenant_id', 'group_id', 'group_name', 'desired',
+             'active_count', 'pending_count', 'paused'])
+class GroupStateCounts(object):
+    """
+    Summary of a group's state that has the number of active servers and
+    pending jobs instead of the servers and jobs themselves
+
+    :ivar bytes tenant_id: the tenant ID of the scaling group
+    :ivar bytes group_id: the ID of the scaling group
+    :ivar bytes group_name: the name of the scaling group
+    :ivar int desired: the desired capacity of the scaling group
+    :ivar int active_count: the number of active servers
+    :ivar int pending_count: the number of pending jobs
+    :ivar bool paused: whether the scaling group is paused
+    """
+
+
+class StateProjection(Names):
+    """
+    Parts of groups' states to list
+    """
+    FULL = NamedConstant()      # :class:`GroupState`
+    COUNTS = NamedConstant()    # :class:`GroupStateCounts`
+
+
 class UnrecognizedCapabilityError(Exception):
     """
     Error to be raised when a capability hash is not recognized, or does not
@@ -256,6 +288,22 @@ class ScalingGroupStatus(Names):
                                 # policies/converging
 
 
+def repeatable_modifier(modifier):
+    """
+    Mark a state modifier given to :meth:`IScalingGroup.modify_state` as
+    safe to be called more than once for one modification, i.e. it only
+    returns the new state and has no side effects. Implementations may then
+    modify the state optimistically and call it again on conflict.
+
+    :param modifier: The modifier ``callable``. It must allow setting
+        attributes, like functions and :func:`functools.partial` objects do.
+
+    :return: `modifier` itself
+    """
+    modifier.repeatable = True
+    return modifier
+
+
 class IScalingGroup(Interface):
     """
     Scaling group record
@@ -383,7 +431,9 @@ class IScalingGroup(Interface):
         :param modifier_callable: a ``callable`` that takes as first two
             arguments the :class:`IScalingGroup`, a :class:`GroupState`, and
             returns a :class:`GroupState`.  Other arguments provided to
-            :func:`modify_state` will be passed to the ``callable``.
+            :func:`modify_state` will be passed to the ``callable``.  It may
+            be called more than once if it is marked with
+            :func:`repeatable_modifier`.
 
         :return: a :class:`twisted.internet.defer.Deferred` that fires with None
 
@@ -696,6 +746,43 @@ class IScalingScheduleCollection(Interface):
         :rtype: deferred :class:`list` of :class:`dict`
         """
 
+    def fetch_and_delete_buckets(buckets, now, size=100):
+        """
+        Fetch and delete a batch of scheduled events across many buckets in
+        one query. Buckets without any events occurring by `now` cost nothing
+        extra.
+
+        :param list buckets: Indexes of buckets from which to fetch events.
+        :param datetime now: The current time.
+        :param int size: The maximum number of events to fetch from all the
+            buckets together.
+        :return: Deferred that fires with a sequence of events.
+        :rtype: deferred :class:`list` of :class:`dict`
+        """
+
+    def get_upcoming_events(buckets, until, size=10000):
+        """
+        Get scheduled events across many buckets occurring at or before
+        `until` without deleting them.
+
+        :param list buckets: Indexes of buckets from which to get events.
+        :param datetime until: Time before which events are got.
+        :param int size: Number of events to get in one query. All the
+            events are got in as many queries as needed.
+        :return: Deferred that fires with a sequence of events. Each event
+            also contains the ``bucket`` it is in.
+        :rtype: deferred :class:`list` of :class:`dict`
+        """
+
+    def delete_events(events):
+        """
+        Delete given scheduled events.
+
+        :param events: Events got from :meth:`get_upcoming_events`
+        :type events: :class:`list` of :class:`dict`
+        :return: Deferred that fires with :data:`None`
+        """
+
     def add_cron_events(cron_events):
         """
         Add cron events equally distributed among the buckets.
@@ -715,12 +802,48 @@ class IScalingScheduleCollection(Interface):
         """
 
 
+_compiled_crons = LRUCache(1000)
+
+
+def _compiled_cron(cron, start_time):
+    """
+    Return `croniter` of given cron entry starting at `start_time`. The cron
+    entry is parsed only once and copies of its parsed `croniter` are
+    returned after that.
+    """
+    compiled = _compiled_crons.get(cron)
+    if compiled is None:
+        compiled = croniter(cron, start_time=start_time)
+        _compiled_crons.set(cron, compiled)
+    compiled = copy(compiled)
+    compiled.cur = mktime(start_time.timetuple())
+    return compiled
+
+
 def next_cron_occurrence(cron):
     """
     Return next occurence of given cron entry
     """
-    return croniter(
-        cron, start_time=datetime.utcnow()).get_next(ret_type=datetime)
+    return next_cron_occurrences([cron])[0]
+
+
+def next_cron_occurrences(crons, start_time=None):
+    """
+    Return next occurrences of given cron entries. Next occurrence of
+    repeated entries is calculated only once.
+
+    :param list crons: cron entries as ``str``
+    :param datetime start_time: Time after which occurrences are returned.
+        Defaults to current UTC time
+    :return: ``list`` of next occurrence of each cron entry as ``datetime``
+    """
+    start_time = start_time or datetime.utcnow()
+    occurrences = {}
+    for cron in crons:
+        if cron not in occurrences:
+            occurrences[cron] = _compiled_cron(cron, start_time).get_next(
+                ret_type=datetime)
+    return [occurrences[cron] for cron in crons]
 
 
 class IScalingGroupCollection(Interface):
@@ -766,7 +889,8 @@ class IScalingGroupCollection(Interface):
         :rtype: a :class:`twisted.internet.defer.Deferred` that fires with :class:`dict`
         """
 
-    def list_scaling_group_states(log, tenant_id, limit=100, marker=None):
+    def list_scaling_group_states(log, tenant_id, limit=100, marker=None,
+                                  projection=StateProjection.FULL):
         """
         List the scaling groups states for this tenant ID
 
@@ -777,10 +901,15 @@ class IScalingGroupCollection(Interface):
             (for pagination purposes)
         :param bytes marker: the group ID of the last seen group (for
             pagination purposes - page offsets)
+        :param projection: the part of the states to return. Active servers
+            and pending jobs are not read unless it is
+            :obj:`StateProjection.FULL`
+        :type projection: :class:`StateProjection` constant
 
-        :return: a list of scaling group states
+        :return: a list of scaling group states, each a :class:`GroupState`
+            or :class:`GroupStateCounts` as per `projection`
         :rtype: a :class:`twisted.internet.defer.Deferred` that fires with a
-            :class:`list` of :class:`GroupState`
+            :class:`list`
         """
 
     def get_scaling_group(log, tenant_id, scaling_group_id):
@@ -0,0 +1,246 @@
+"""
+Background deletion of resurrected scaling group rows
+"""
+
+from collections import OrderedDict
+
+from kazoo.exceptions import NodeExistsError, NoNodeError
+
+from twisted.application.service import Service
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+
+from otter.metrics import scan_scaling_groups
+from otter.models.cass import DEFAULT_CONSISTENCY, LOCK_PATH
+from otter.util.cqlbatch import Batch
+
+
+# Tables from which rows of a resurrected group are deleted
+REAPED_TABLES = ('scaling_group', 'scaling_policies', 'policy_webhooks')
+
+_cql_delete_group = (
+    'DELETE FROM {cf} WHERE "tenantId" = :tenantId{i} AND '
+    '"groupId" = :groupId{i}')
+_cql_view_created_at = (
+    'SELECT created_at FROM scaling_group WHERE "tenantId" = :tenantId AND '
+    '"groupId" = :groupId;')
+
+# Lock held by the otter node that is scanning for resurrected groups
+SCAN_LOCK_PATH = LOCK_PATH + '/resurrection_scan'
+
+# Znode whose data is the time the last scan for resurrected groups finished
+LAST_SCAN_PATH = '/resurrection_scan'
+
+
+class ResurrectionReaper(Service, object):
+    """
+    Deletes resurrected group rows, i.e. ones without "created_at" that
+    reappear after the group is deleted, in the background. Read paths only
+    :meth:`enqueue` the groups they find and the reaper deletes them in
+    batches every `flush_interval` seconds, or as soon as a batch worth of
+    groups is queued. It also scans all the groups every `scan_interval`
+    seconds to find resurrected rows that are not read. Only one otter node
+    scans at a time and a node does not scan if any node has scanned in the
+    last `scan_interval` seconds, as told by ZooKeeper. Groups are not
+    scanned until :attr:`kz_client` is set.
+
+    The queue is deduplicated and bounded. Groups enqueued when it is full
+    are dropped since the next scan will find them again. Failed deletions
+    are logged and dropped for the same reason.
+
+    :param connection: silverberg client used to connect to cassandra
+    :param clock: `IReactorTime` provider
+    :param log: A bound logger
+    :param int max_queued: Maximum number of groups queued for deletion
+    :param int batch_size: Number of groups deleted in one batch
+    :param float flush_interval: Seconds between deletions of queued groups
+    :param float scan_interval: Seconds between scans of all the groups. Groups
+        are not scanned if it is None
+
+    :ivar kz_client: ZooKeeper client used to coordinate scans with other
+        nodes. It is set after the client is started.
+    """
+
+    def __init__(self, connection, clock, log, max_queued=10000,
+                 batch_size=50, flush_interval=1, scan_interval=None):
+        self.connection = connection
+        self.clock = clock
+        self.log = log
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.scan_interval = scan_interval
+        self._queue = OrderedDict()
+        self._flush_lock = defer.DeferredLock()
+        self._calls = []
+        self.kz_client = None
+
+    def enqueue(self, tenant_id, group_id):
+        """
+        Queue the group for deletion. This does not wait for the deletion
+
+        :param bytes tenant_id: Tenant ID of the resurrected group
+        :param bytes group_id: ID of the resurrected group
+        """
+        key = (tenant_id, group_id)
+        if key in self._queue:
+            return
+        if len(self._queue) >= self.max_queued:
+            self.log.msg('Resurrected group not queued for deletion as queue '
+                         'is full', tenant_id=tenant_id, group_id=group_id)
+            return
+        self._queue[key] = None
+        if len(self._queue) >= self.batch_size:
+            self.flush()
+
+    def __len__(self):
+        """
+        Number of groups queued for deletion
+        """
+        return len(self._queue)
+
+    def flush(self):
+        """
+        Delete all the queued groups in batches
+
+        :return: ``Deferred`` that fires with None after the groups queued
+            at the time of the call are deleted
+        """
+        return self._flush_lock.run(self._delete_queued)
+
+    @defer.inlineCallbacks
+    def _delete_queued(self):
+        while self._queue:
+            keys = []
+            while self._queue and len(keys) < self.batch_size:
+                keys.append(self._queue.popitem(last=False)[0])
+            try:
+                yield self._delete(keys)
+            except Exception:
+                self.log.err(None, 'Could not delete resurrected groups',
+                             groups=keys)
+
+    def _delete(self, keys):
+        """
+        Delete rows of the groups in all of ``REAPED_TABLES`` in one batch
+        """
+        queries = [_cql_delete_group.format(cf=table, i=i)
+                   for i in range(len(keys)) for table in REAPED_TABLES]
+        params = {}
+        for i, (tenant_id, group_id) in enumerate(keys):
+            params['tenantId{0}'.format(i)] = tenant_id
+            params['groupId{0}'.format(i)] = group_id
+        self.log.msg('Deleting resurrected groups', groups=keys)
+        return Batch(queries, params, DEFAULT_CONSISTENCY).execute(
+            self.connection)
+
+    def scan(self):
+        """
+        Scan all the groups and delete the resurrected ones if this node is
+        the only one scanning and no node has scanned in the last
+        `scan_interval` seconds
+
+        :return: ``Deferred`` that fires with None after the scan, or right
+            away if it is not this node's turn to scan
+        """
+        if self.kz_client is None:
+            return defer.succeed(None)
+        d = self._scan_alone()
+        return d.addErrback(self.log.err, 'Could not scan for resurrected '
+                            'groups')
+
+    @defer.inlineCallbacks
+    def _scan_alone(self):
+        lock = self.kz_client.Lock(SCAN_LOCK_PATH)
+        acquired = yield lock.acquire(blocking=False)
+        if not acquired:
+            return
+        try:
+            last_scan = yield self._last_scan_time()
+            if (last_scan is None or self.scan_interval is None or
+                    self.clock.seconds() - last_scan >= self.scan_interval):
+                yield self._scan()
+                yield self._set_last_scan_time(self.clock.seconds())
+        finally:
+            yield lock.release()
+
+    @defer.inlineCallbacks
+    def _last_scan_time(self):
+        """
+        Return time the last scan finished as recorded in ZooKeeper or None
+        """
+        try:
+            data, _ = yield self.kz_client.get(LAST_SCAN_PATH)
+        except NoNodeError:
+            defer.returnValue(None)
+        defer.returnValue(float(data) if data else None)
+
+    @defer.inlineCallbacks
+    def _set_last_scan_time(self, seconds):
+        """
+        Record in ZooKeeper that a scan finished at `seconds`
+        """
+        try:
+            yield self.kz_client.set(LAST_SCAN_PATH, str(seconds))
+        except NoNodeError:
+            try:
+                yield self.kz_client.create(LAST_SCAN_PATH, str(seconds),
+                                            makepath=True)
+            except NodeExistsError:
+                yield self.kz_client.set(LAST_SCAN_PATH, str(seconds))
+
+    def _scan(self):
+        """
+        Scan all the groups and delete the resurrected ones. Groups are
+        scanned with consistency ONE, so each group found without
+        "created_at" is read again with the default consistency before it is
+        deleted.
+        """
+        def is_resurrected(group):
+            d = self.connection.execute(
+                _cql_view_created_at,
+                {'tenantId': group['tenantId'], 'groupId': group['groupId']},
+                DEFAULT_CONSISTENCY)
+            return d.addCallback(
+                lambda rows: len(rows) > 0 and rows[0]['created_at'] is None)
+
+        @defer.inlineCallbacks
+        def visit(groups):
+            for group in groups:
+                if group['created_at']:
+                    continue
+                resurrected = yield is_resurrected(group)
+                if resurrected:
+                    self.enqueue(group['tenantId'], group['groupId'])
+            # Wait for deletions so that the queue does not overflow
+            yield self.flush()
+
+        return scan_scaling_groups(self.connection, visit,
+                                   batch_size=self.batch_size,
+                                   include_resurrected=True)
+
+    def _loop(self, func, interval):
+        call = LoopingCall(func)
+        call.clock = self.clock
+        call.start(interval, now=False).addErrback(self.log.err)
+        self._calls.append(call)
+
+    def startService(self):
+        """
+        Start deleting queued groups and scanning periodically
+        """
+        Service.startService(self)
+        self._loop(self.flush, self.flush_interval)
+        if self.scan_interval is not None:
+            self._loop(self.scan, self.scan_interval)
+
+    def stopService(self):
+        """
+        Stop periodic deletions and scans and delete the remaining queued
+        groups
+        """
+        Service.stopService(self)
+        for call in self._calls:
+            call.stop()
+        self._calls = []
+        return self.flush()
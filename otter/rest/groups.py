@@ -16,6 +16,7 @@ from otter.json_schema.group_schemas import (
 )
 from otter.json_schema.rest_schemas import create_group_request
 from otter.log import log
+from otter.models.interface import StateProjection
 from otter.rest.bobby import get_bobby
 from otter.rest.configs import (
     OtterConfig,
@@ -76,6 +77,30 @@ def format_state_dict(state):
     }
 
 
+def format_state_counts_dict(state):
+    """
+    Takes a summary of a state returned by the model and reformats it to be
+    returned as a response, without the list of active servers.
+
+    :param state: a :class:`otter.models.interface.GroupStateCounts` object
+
+    :return: a ``dict`` like :func:`format_state_dict` without ``active``
+    """
+    if tenant_is_enabled(state.tenant_id, config_value):
+        desired = state.desired
+        pending = state.desired - state.active_count
+    else:
+        pending = state.pending_count
+        desired = state.active_count + pending
+    return {
+        'activeCapacity': state.active_count,
+        'pendingCapacity': pending,
+        'desiredCapacity': desired,
+        'name': state.group_name,
+        'paused': state.paused
+    }
+
+
 def extract_bool_arg(request, key, default=False):
     """
     Get bool query arg from the request
@@ -170,14 +195,21 @@ class OtterGroups(object):
                 "groups_links": []
             }
 
-
+        If the ``servers`` query argument is ``false``, the ``active`` list
+        is left out of each state and the servers are not read at all.
         """
+        with_servers = extract_bool_arg(request, 'servers', True)
+        if with_servers:
+            projection, format_state = StateProjection.FULL, format_state_dict
+        else:
+            projection = StateProjection.COUNTS
+            format_state = format_state_counts_dict
 
         def format_list(group_states):
             groups = [{
                 'id': state.group_id,
                 'links': get_autoscale_links(state.tenant_id, state.group_id),
-                'state': format_state_dict(state)
+                'state': format_state(state)
             } for state in group_states]
             return {
                 "groups": groups,
@@ -186,7 +218,7 @@ class OtterGroups(object):
             }
 
         deferred = self.store.list_scaling_group_states(
-            self.log, self.tenant_id, **paginate)
+            self.log, self.tenant_id, projection=projection, **paginate)
         deferred.addCallback(format_list)
         deferred.addCallback(json.dumps)
         return deferred
@@ -4,9 +4,14 @@ is right all the time and is probably what caused your regular clock to get brok
 in the first place.
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
 
+from kazoo.protocol.states import KazooState
+
+from toolz.dicttoolz import dissoc
+from toolz.itertoolz import concat, groupby, partition_all
+
 from twisted.application.internet import TimerService
 from twisted.internet import defer
 
@@ -14,8 +19,7 @@ from otter.controller import (
     CannotExecutePolicyError, maybe_execute_scaling_policy)
 from otter.log import log as otter_log
 from otter.models.interface import (
-    NoSuchPolicyError, NoSuchScalingGroupError, next_cron_occurrence)
-from otter.util.deferredutils import ignore_and_log
+    NoSuchPolicyError, NoSuchScalingGroupError, next_cron_occurrences)
 from otter.util.hashkey import generate_transaction_id
 
 
@@ -25,7 +29,9 @@ class SchedulerService(TimerService):
     """
 
     def __init__(self, batchsize, interval, store, kz_client,
-                 zk_partition_path, time_boundary, buckets, clock=None, threshold=60):
+                 zk_partition_path, time_boundary, buckets, clock=None,
+                 threshold=60, bucket_group_size=100, preload_horizon=None,
+                 concurrency=10):
         """
         Initialize the scheduler service
 
@@ -36,6 +42,14 @@ class SchedulerService(TimerService):
         :param zk_partition_path: Partiton path used by kz_client to partition the buckets
         :param time_boundary: Time to wait for partition to become stable
         :param clock: An instance of IReactorTime provider that defaults to reactor if not provided
+        :param int bucket_group_size: Number of buckets whose events are
+            fetched together in one query
+        :param int preload_horizon: If given, events occurring within these
+            many seconds are loaded on every iteration and executed at their
+            exact trigger time by :class:`UpcomingEvents` instead of being
+            polled for. It should be more than `interval`
+        :param int concurrency: Maximum number of groups whose events are
+            executed concurrently
         """
         TimerService.__init__(self, interval, self.check_events, batchsize)
         self.store = store
@@ -46,7 +60,18 @@ class SchedulerService(TimerService):
         self.time_boundary = time_boundary
         self.kz_partition = None
         self.threshold = threshold
+        self.bucket_group_size = bucket_group_size
+        self.preload_horizon = preload_horizon
+        self.semaphore = defer.DeferredSemaphore(concurrency)
         self.log = otter_log.bind(system='otter.scheduler')
+        self.upcoming = None
+        if preload_horizon is not None:
+            if clock is None:
+                from twisted.internet import reactor
+                clock = reactor
+            self.upcoming = UpcomingEvents(clock, store, self.log,
+                                           self.semaphore,
+                                           owns=self._owns_bucket)
 
     def startService(self):
         """
@@ -55,6 +80,8 @@ class SchedulerService(TimerService):
         self.kz_partition = self.kz_client.SetPartitioner(
             self.zk_partition_path, set=set(self.buckets),
             time_boundary=self.time_boundary)
+        if self.upcoming is not None:
+            self.kz_client.add_listener(self._zk_state_changed)
         TimerService.startService(self)
 
     def stopService(self):
@@ -62,9 +89,37 @@ class SchedulerService(TimerService):
         Stop this service. This will release buckets partitions it holds
         """
         TimerService.stopService(self)
+        if self.upcoming is not None:
+            self.kz_client.remove_listener(self._zk_state_changed)
+        self._clear_upcoming()
         if self.kz_partition.acquired:
             return self.kz_partition.finish()
 
+    def _clear_upcoming(self):
+        """
+        Forget loaded events since the buckets they are in may not be owned
+        anymore
+        """
+        if self.upcoming is not None:
+            self.upcoming.clear()
+
+    def _owns_bucket(self, bucket):
+        """
+        Is the bucket in the currently acquired partition?
+        """
+        return (self.kz_partition is not None and
+                self.kz_partition.acquired and bucket in self.kz_partition)
+
+    def _zk_state_changed(self, state):
+        """
+        Forget loaded events as soon as the ZooKeeper session is suspended or
+        lost, since the partition may be released before the next check
+        """
+        if state != KazooState.CONNECTED:
+            self.log.msg('ZooKeeper state changed to {state}. Clearing '
+                         'upcoming events', state=state)
+            self._clear_upcoming()
+
     def reset(self, path):
         """
         Reset the scheduler with new path
@@ -119,9 +174,11 @@ class SchedulerService(TimerService):
             return
         if self.kz_partition.release:
             self.log.msg('Partition changed. Repartitioning')
+            self._clear_upcoming()
             return self.kz_partition.release_set()
         if self.kz_partition.failed:
             self.log.msg('Partition failed. Starting new')
+            self._clear_upcoming()
             self.kz_partition = self.kz_client.SetPartitioner(
                 self.zk_partition_path, set=set(self.buckets),
                 time_boundary=self.time_boundary)
@@ -129,6 +186,7 @@ class SchedulerService(TimerService):
         if not self.kz_partition.acquired:
             self.log.err('Unknown state {}. This cannot happen. Starting new'.format(
                 self.kz_partition.state))
+            self._clear_upcoming()
             self.kz_partition.finish()
             self.kz_partition = self.kz_client.SetPartitioner(
                 self.zk_partition_path, set=set(self.buckets),
@@ -142,34 +200,173 @@ class SchedulerService(TimerService):
         # it'll be useful to debug partitioning problems (at least in initial deployment)
         log.msg('Got buckets {buckets}', buckets=buckets, path=self.zk_partition_path)
 
+        if self.upcoming is not None:
+            return self.upcoming.load(
+                log, buckets, utcnow + timedelta(seconds=self.preload_horizon),
+                self.bucket_group_size)
+
+        bucket_groups = partition_all(self.bucket_group_size, buckets)
         return defer.gatherResults(
-            [check_events_in_bucket(
-                log, self.store, bucket, utcnow, batchsize) for bucket in buckets])
+            [check_events_in_buckets(
+                log, self.store, list(bucket_group), utcnow, batchsize,
+                self.semaphore)
+             for bucket_group in bucket_groups])
+
+
+def _event_key(event):
+    """
+    Return key identifying the event in its bucket
+    """
+    return (event['bucket'], event['trigger'], event['policyId'])
 
 
-def check_events_in_bucket(log, store, bucket, now, batchsize):
+class UpcomingEvents(object):
     """
-    Retrieves events in the given bucket that occur before or at now,
-    in batches of batchsize, for processing
+    Events of owned buckets that occur in the near future kept in memory.
+    Each event is deleted and executed at its trigger time instead of waiting
+    for the next poll of its bucket.
+
+    Events that are loaded again while they are being deleted are not
+    scheduled again. An event is known to be deleted for a load that is
+    started after its delete completed.
+
+    An event whose bucket is not owned anymore when it fires is not executed
+    and all the scheduled events are cancelled, since the partition has
+    changed and the new owner polls those buckets.
+
+    :param clock: `IReactorTime` provider
+    :param store: `IScalingScheduleCollection` provider
+    :param log: A bound log for logging
+    :param semaphore: `DeferredSemaphore` passed to :func:`process_events`
+    :param callable owns: Called with a bucket, returns whether the bucket
+        is still owned. Buckets are always owned if not given
+    """
+
+    def __init__(self, clock, store, log, semaphore=None, owns=None):
+        self.clock = clock
+        self.store = store
+        self.log = log
+        self.semaphore = semaphore
+        self.owns = owns
+        self._calls = {}
+        self._fired = {}
+        self._generation = 0
+
+    def load(self, log, buckets, until, bucket_group_size):
+        """
+        Load events occurring at or before `until` in the buckets and
+        schedule the ones not already scheduled. Events that should have
+        already occurred are executed immediately.
+
+        :param log: A bound log for logging
+        :param list buckets: Buckets to load events from
+        :param datetime until: Time before which events are loaded
+        :param int bucket_group_size: Number of buckets whose events are
+            loaded together in one query
+
+        :return: a deferred that fires with number of events scheduled
+        """
+        generation = self._generation
+        self._generation += 1
+        d = defer.gatherResults(
+            [self.store.get_upcoming_events(list(bucket_group), until)
+             for bucket_group in partition_all(bucket_group_size, buckets)],
+            consumeErrors=True)
+        d.addCallback(lambda results: self._schedule(
+            list(concat(results)), generation))
+        d.addErrback(log.err, 'Could not load upcoming events')
+        return d
+
+    def _schedule(self, events, generation):
+        """
+        Schedule events not already scheduled or being deleted
+        """
+        for key, deleted_generation in self._fired.items():
+            if deleted_generation is not None and \
+                    deleted_generation <= generation:
+                del self._fired[key]
+        utcnow = datetime.utcfromtimestamp(self.clock.seconds())
+        scheduled = 0
+        for event in events:
+            key = _event_key(event)
+            if key in self._calls or key in self._fired:
+                continue
+            delay = max((event['trigger'] - utcnow).total_seconds(), 0)
+            self._calls[key] = self.clock.callLater(
+                delay, self._fire, key, event)
+            scheduled += 1
+        return scheduled
+
+    def _fire(self, key, event):
+        """
+        Delete the event and execute it if its bucket is still owned
+        """
+        del self._calls[key]
+        if self.owns is not None and not self.owns(event['bucket']):
+            self.log.msg('Bucket {bucket} not owned anymore. Clearing '
+                         'upcoming events', bucket=event['bucket'])
+            self.clear()
+            return
+        self._fired[key] = None
+        log = self.log.bind(scheduler_run_id=generate_transaction_id(),
+                            bucket=event['bucket'])
+
+        def deleted(_):
+            self._fired[key] = self._generation
+            return process_events([dissoc(event, 'bucket')], self.store, log,
+                                  self.semaphore)
+
+        def not_deleted(failure):
+            # Let a later load schedule it again
+            del self._fired[key]
+            return failure
+
+        d = self.store.delete_events([event])
+        d.addCallbacks(deleted, not_deleted)
+        d.addErrback(log.err, 'Could not execute event')
+        return d
+
+    def clear(self):
+        """
+        Cancel all scheduled events
+        """
+        for call in self._calls.values():
+            call.cancel()
+        self._calls = {}
+
+    def __len__(self):
+        """
+        Number of events scheduled
+        """
+        return len(self._calls)
+
+
+def check_events_in_buckets(log, store, buckets, now, batchsize,
+                            semaphore=None):
+    """
+    Retrieves events in the given buckets that occur before or at now,
+    in batches of batchsize, for processing. Events of all the buckets are
+    fetched together so that empty buckets do not need their own queries.
 
     :param log: A bound log for logging
     :param store: `IScalingGroupCollection` provider
-    :param bucket: Bucket to check events in
+    :param list buckets: Buckets to check events in
     :param now: Time before which events are checked
     :param batchsize: Number of events to check at a time
+    :param semaphore: `DeferredSemaphore` passed to :func:`process_events`
 
     :return: a deferred that fires with None
     """
 
-    log = log.bind(bucket=bucket)
+    log = log.bind(buckets=buckets)
 
     def check_for_more(num_events):
         if num_events == batchsize:
             return _do_check()
 
     def _do_check():
-        d = store.fetch_and_delete(bucket, now, batchsize)
-        d.addCallback(process_events, store, log)
+        d = store.fetch_and_delete_buckets(buckets, now, batchsize)
+        d.addCallback(process_events, store, log, semaphore)
         d.addCallback(check_for_more)
         d.addErrback(log.err)
         return d
@@ -177,13 +374,40 @@ def check_events_in_bucket(log, store, bucket, now, batchsize):
     return _do_check()
 
 
-def process_events(events, store, log):
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60)
+
+
+def latency_histogram(latencies, bounds=LATENCY_BUCKETS):
+    """
+    Count latencies in buckets of given upper bounds
+
+    :param latencies: iterable of latencies in seconds
+    :param bounds: ascending upper bounds of buckets in seconds
+
+    :return: ``dict`` of each bucket's upper bound as ``str`` to number of
+        latencies in it. Latencies beyond the last bound are counted in
+        ``"inf"``
+    """
+    counts = dict.fromkeys(map(str, bounds) + ['inf'], 0)
+    for latency in latencies:
+        bound = next((b for b in bounds if latency <= b), 'inf')
+        counts[str(bound)] += 1
+    return counts
+
+
+def process_events(events, store, log, semaphore=None):
     """
     Executes all the events and adds the next occurrence of each event to the buckets
 
+    Events of a group are executed together by :func:`execute_group_events`
+    and latency histograms of the events' delays and of groups' execution
+    durations are logged.
+
     :param events: list of event dict to process
     :param store: `IScalingGroupCollection` provider
     :param log: A bound log for logging
+    :param semaphore: `DeferredSemaphore` limiting number of groups whose
+        events are executed concurrently. Not limited if not given
 
     :return: a `Deferred` that fires with number of events processed
     """
@@ -193,12 +417,25 @@ def process_events(events, store, log):
     log.msg('Processing {num_events} events', num_events=len(events))
 
     deleted_policy_ids = set()
-
-    deferreds = [
-        execute_event(store, log, event, deleted_policy_ids)
-        for event in events
-    ]
-    d = defer.gatherResults(deferreds, consumeErrors=True)
+    delays, durations = [], []
+
+    def execute(group_events):
+        started = datetime.utcnow()
+        delays.extend((started - event['trigger']).total_seconds()
+                      for event in group_events)
+        d = execute_group_events(store, log, group_events, deleted_policy_ids)
+        return d.addCallback(lambda _: durations.append(
+            (datetime.utcnow() - started).total_seconds()))
+
+    if semaphore is not None:
+        execute = partial(semaphore.run, execute)
+
+    groups = groupby(lambda e: (e['tenantId'], e['groupId']), events)
+    d = defer.gatherResults(map(execute, groups.values()), consumeErrors=True)
+    d.addCallback(lambda _: log.msg(
+        'Executed events of {num_groups} groups', num_groups=len(groups),
+        delays=latency_histogram(delays),
+        durations=latency_histogram(durations)))
     d.addCallback(lambda _: add_cron_events(store, log, events, deleted_policy_ids))
     return d.addCallback(lambda _: len(events))
 
@@ -219,42 +456,84 @@ def add_cron_events(store, log, events, deleted_policy_ids):
     if not events:
         return
 
-    new_cron_events = []
-    for event in events:
-        if event['cron'] and event['policyId'] not in deleted_policy_ids:
-            event['trigger'] = next_cron_occurrence(event['cron'])
-            new_cron_events.append(event)
-
+    new_cron_events = [
+        event for event in events
+        if event['cron'] and event['policyId'] not in deleted_policy_ids]
     if new_cron_events:
+        triggers = next_cron_occurrences(
+            [event['cron'] for event in new_cron_events])
+        for event, trigger in zip(new_cron_events, triggers):
+            event['trigger'] = trigger
         log.msg('Adding {new_cron_events} cron events', new_cron_events=len(new_cron_events))
         return store.add_cron_events(new_cron_events)
 
 
-def execute_event(store, log, event, deleted_policy_ids):
+def execute_group_events(store, log, events, deleted_policy_ids):
     """
-    Execute a single event
+    Execute events of a single group in order of their trigger time in one
+    `modify_state` call so that the group is locked only once. A policy that
+    fails does not stop the following ones or the state from being saved
 
     :param store: `IScalingGroupCollection` provider
     :param log: A bound log for logging
-    :param event: event dict to execute
+    :param events: list of event dicts of the same group to execute
     :param deleted_policy_ids: Set of policy ids that are deleted. Policy id will be added
                                to this if its scaling group or policy has been deleted
     :return: a deferred with None. Any error occurred during execution is logged
     """
-    tenant_id, group_id, policy_id = event['tenantId'], event['groupId'], event['policyId']
-    log = log.bind(tenant_id=tenant_id, scaling_group_id=group_id, policy_id=policy_id)
-    log.msg('Scheduler executing policy {policy_id}')
+    tenant_id, group_id = events[0]['tenantId'], events[0]['groupId']
+    events = sorted(events, key=lambda e: e['trigger'])
+    policy_ids = [event['policyId'] for event in events]
+    log = log.bind(tenant_id=tenant_id, scaling_group_id=group_id)
     group = store.get_scaling_group(log, tenant_id, group_id)
-    d = group.modify_state(partial(maybe_execute_scaling_policy,
-                                   log, generate_transaction_id(),
-                                   policy_id=policy_id, version=event['version']))
-    d.addErrback(ignore_and_log, CannotExecutePolicyError,
-                 log, 'Scheduler cannot execute policy {policy_id}')
-
-    def collect_deleted_policy(failure):
-        failure.trap(NoSuchScalingGroupError, NoSuchPolicyError)
-        deleted_policy_ids.add(policy_id)
-
-    d.addErrback(collect_deleted_policy)
-    d.addErrback(log.err, 'Scheduler failed to execute policy {policy_id}')
-    return d
+
+    def execute_policy(state, group, event):
+        policy_id = event['policyId']
+        plog = log.bind(policy_id=policy_id)
+        plog.msg('Scheduler executing policy {policy_id}')
+        desired, paused = state.desired, state.paused
+        group_touched = state.group_touched
+        policy_touched = state.policy_touched.get(policy_id)
+        d = defer.maybeDeferred(
+            maybe_execute_scaling_policy, plog, generate_transaction_id(),
+            group, state, policy_id=policy_id, version=event['version'])
+
+        def not_executed(failure):
+            if failure.check(CannotExecutePolicyError):
+                plog.msg('Scheduler cannot execute policy {policy_id}',
+                         reason=failure)
+            elif failure.check(NoSuchPolicyError):
+                deleted_policy_ids.add(policy_id)
+            else:
+                # Undo the policy's changes to the group but keep the jobs it
+                # started in pending so that their servers are recorded when
+                # they complete. Earlier policies' changes are still saved
+                plog.err(failure, 'Scheduler failed to execute policy '
+                         '{policy_id}')
+                state.desired, state.paused = desired, paused
+                state.group_touched = group_touched
+                if policy_touched is None:
+                    state.policy_touched.pop(policy_id, None)
+                else:
+                    state.policy_touched[policy_id] = policy_touched
+            # Continue with the last state for the next policy
+            return state
+
+        return d.addErrback(not_executed)
+
+    def execute_policies(group, state):
+        d = defer.succeed(state)
+        for event in events:
+            d.addCallback(execute_policy, group, event)
+        return d
+
+    d = group.modify_state(execute_policies)
+
+    def collect_deleted_group(failure):
+        failure.trap(NoSuchScalingGroupError)
+        deleted_policy_ids.update(policy_ids)
+
+    d.addErrback(collect_deleted_group)
+    d.addErrback(log.err, 'Scheduler failed to execute policies {policy_ids}',
+                 policy_ids=policy_ids)
+    return d.addCallback(lambda _: None)
@@ -71,9 +71,12 @@ class ISupervisor(Interface):
 
 
 @attributes(['lb_region', 'region', 'dispatcher', 'tenant_id',
-             'auth_token', 'service_catalog'])
+             'auth_token', 'service_catalog', 're_auth'])
 class RequestBag(object):
-    """A bag of data useful for making HTTP requests."""
+    """
+    A bag of data useful for making HTTP requests. `re_auth` is called with
+    no arguments to get a new auth token when `auth_token` is rejected.
+    """
 
 
 @implementer(ISupervisor)
@@ -81,8 +84,8 @@ class SupervisorService(object, Service):
     """
     A service which manages execution of launch configurations.
 
-    :ivar IAuthenticator authenticator: Authenticator to use to obtain an
-        auth token and service catalog.
+    :ivar ICachingAuthenticator authenticator: Authenticator to use to obtain
+        an auth token and service catalog.
     :ivar callable coiterate: coiterate function that will be passed to
         InMemoryUndoStack.
     :ivar str region: The region in which this supervisor is operating.
@@ -111,6 +114,11 @@ class SupervisorService(object, Service):
         log.msg("Authenticating for tenant")
         d = self.authenticator.authenticate_tenant(tenant_id, log=log)
 
+        def re_auth():
+            self.authenticator.invalidate(tenant_id)
+            d = self.authenticator.authenticate_tenant(tenant_id, log=log)
+            return d.addCallback(lambda (auth_token, _): auth_token)
+
         def when_authenticated((auth_token, service_catalog)):
             bag = RequestBag(
                 lb_region=lb_region or self.region,
@@ -118,7 +126,8 @@ class SupervisorService(object, Service):
                 dispatcher=dispatcher,
                 tenant_id=tenant_id,
                 auth_token=auth_token,
-                service_catalog=service_catalog
+                service_catalog=service_catalog,
+                re_auth=re_auth
             )
             return bag
 
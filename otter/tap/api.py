@@ -6,14 +6,12 @@ from functools import partial
 
 import jsonfig
 
-from silverberg.cluster import RoundRobinCassandraCluster
 from silverberg.logger import LoggingCQLClient
 
 from twisted.application.service import MultiService, Service
 from twisted.application.strports import service
 from twisted.internet import reactor
 from twisted.internet.defer import gatherResults, maybeDeferred
-from twisted.internet.endpoints import clientFromString
 from twisted.internet.task import coiterate
 from twisted.python import usage
 from twisted.python.log import addObserver
@@ -28,7 +26,10 @@ from otter.convergence.service import Converger, set_converger
 from otter.effect_dispatcher import get_full_dispatcher
 from otter.log import log
 from otter.log.cloudfeeds import CloudFeedsObserver
-from otter.models.cass import CassAdmin, CassScalingGroupCollection
+from otter.models.cass import (
+    CassAdmin, CassScalingGroupCollection, CassTenantIdentityStore,
+    PARTITION_KEYS)
+from otter.models.reaper import ResurrectionReaper
 from otter.rest.admin import OtterAdmin
 from otter.rest.application import Otter
 from otter.rest.bobby import set_bobby
@@ -36,7 +37,10 @@ from otter.scheduler import SchedulerService
 from otter.supervisor import SupervisorService, set_supervisor
 from otter.util.config import config_value, set_config_data
 from otter.util.cqlbatch import TimingOutCQLClient
+from otter.util.cqlcluster import cluster_from_config
 from otter.util.deferredutils import timeout_deferred
+from otter.util.httppool import HTTPPoolRegistry, set_pool_registry
+from otter.util.throttle import LimiterRegistry, set_limiter_registry
 
 
 class Options(usage.Options):
@@ -171,21 +175,25 @@ def makeService(config):
 
     region = config_value('region')
 
-    seed_endpoints = [
-        clientFromString(reactor, str(host))
-        for host in config_value('cassandra.seed_hosts')]
-
+    cass_log = log.bind(system='otter.silverberg')
     cassandra_cluster = LoggingCQLClient(
         TimingOutCQLClient(
             reactor,
-            RoundRobinCassandraCluster(
-                seed_endpoints,
-                config_value('cassandra.keyspace'),
+            cluster_from_config(
+                reactor, config_value('cassandra'), PARTITION_KEYS, cass_log,
                 disconnect_on_cancel=True),
             config_value('cassandra.timeout') or 30),
-        log.bind(system='otter.silverberg'))
-
-    store = CassScalingGroupCollection(cassandra_cluster, reactor)
+        cass_log)
+
+    reaper = ResurrectionReaper(
+        cassandra_cluster, reactor, log.bind(system='otter.reaper'),
+        scan_interval=config_value('cassandra.resurrection_scan_interval'))
+    config_cache_ttl = config_value('cassandra.config_cache_ttl')
+    store = CassScalingGroupCollection(
+        cassandra_cluster, reactor,
+        30 if config_cache_ttl is None else config_cache_ttl,
+        config_value('cassandra.state_writes') == 'cas', reaper,
+        config_value('cassandra.webhook_index_fallback') is not False)
     admin_store = CassAdmin(cassandra_cluster)
 
     bobby_url = config_value('bobby_url')
@@ -194,7 +202,20 @@ def makeService(config):
 
     service_configs = get_service_configs(config)
 
-    authenticator = generate_authenticator(reactor, config['identity'])
+    http_pools = HTTPPoolRegistry(
+        reactor, config_value('http_pool.max_per_host') or 10,
+        config_value('http_pool.idle_timeout') or 240)
+    set_pool_registry(http_pools)
+    limiters = LimiterRegistry(
+        config_value('concurrency.initial'),
+        config_value('concurrency.maximum') or 20)
+    set_limiter_registry(limiters)
+
+    identity_store = None
+    if config_value('identity.persist_tenant_identity'):
+        identity_store = CassTenantIdentityStore(cassandra_cluster)
+    authenticator = generate_authenticator(reactor, config['identity'],
+                                           identity_store)
     dispatcher = get_full_dispatcher(reactor, authenticator, log,
                                      get_service_configs(config))
     supervisor = SupervisorService(authenticator, region, coiterate,
@@ -206,7 +227,9 @@ def makeService(config):
     health_checker = HealthChecker(reactor, {
         'store': getattr(store, 'health_check', None),
         'kazoo': store.kazoo_health_check,
-        'supervisor': supervisor.health_check
+        'supervisor': supervisor.health_check,
+        'http_pools': http_pools.health_check,
+        'concurrency': limiters.health_check
     })
 
     # Setup cassandra cluster to disconnect when otter shuts down
@@ -214,6 +237,13 @@ def makeService(config):
         s.addService(FunctionalService(stop=partial(
             call_after_supervisor, cassandra_cluster.disconnect, supervisor)))
 
+    # Added after cassandra disconnection so that it is stopped before it
+    reaper.setServiceParent(s)
+
+    # Close idle HTTP connections when otter shuts down
+    s.addService(FunctionalService(stop=partial(
+        call_after_supervisor, http_pools.close, supervisor)))
+
     otter = Otter(store, region, health_checker.health_check,
                   es_host=config_value('elasticsearch.host'))
     site = Site(otter.app.resource())
@@ -262,13 +292,19 @@ def makeService(config):
             # not finished and the kz_client is not set in which case
             # policy execution and group delete will fail
             store.kz_client = kz_client
+            reaper.kz_client = kz_client
             # Setup kazoo to stop when shutting down
             s.addService(FunctionalService(
                 stop=partial(call_after_supervisor,
                              kz_client.stop, supervisor)))
 
             # setup converger service
-            converger_service = Converger(reactor, kz_client, dispatcher)
+            data_ttl = config_value('converger.data_ttl')
+            converger_service = Converger(
+                reactor, kz_client, dispatcher,
+                data_ttl=10 if data_ttl is None else data_ttl,
+                max_drained_nodes=(
+                    config_value('converger.max_drained_nodes') or 10000))
             s.addService(converger_service)
             set_converger(converger_service)
 
@@ -294,6 +330,9 @@ def setup_scheduler(parent, store, kz_client):
         int(config_value('scheduler.batchsize')),
         int(config_value('scheduler.interval')),
         store, kz_client, partition_path, time_boundary,
-        buckets)
+        buckets,
+        bucket_group_size=config_value('scheduler.bucket_group_size') or 100,
+        preload_horizon=config_value('scheduler.preload_horizon'),
+        concurrency=config_value('scheduler.concurrency') or 10)
     scheduler_service.setServiceParent(parent)
     return scheduler_service
@@ -2,21 +2,33 @@
 
 import calendar
 from functools import partial
+from urllib import urlencode
 
-from effect import Constant, Effect
+from effect import (
+    ComposedDispatcher, Constant, Effect, Func, TypeDispatcher,
+    base_dispatcher, sync_perform)
 from effect.testing import Stub
 
 from pyrsistent import pmap
 
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.constants import ServiceType
 from otter.convergence.gathering import (
+    CachedDrainedAt,
+    CachedTenantData,
+    ForgetDrainedAt,
+    InvalidateTenantData,
     get_all_convergence_data,
     extract_CLB_drained_at,
     get_all_server_details,
     get_clb_contents,
     get_scaling_group_servers,
+    perform_cached_drained_at,
+    perform_cached_tenant_data,
+    perform_forget_drained_at,
+    perform_invalidate_tenant_data,
     to_nova_server,
     _private_ipv4_addresses,
     _servicenet_address)
@@ -27,13 +39,16 @@ from otter.convergence.model import (
     CLBNodeType,
     NovaServer,
     ServerState)
+from otter.effect_dispatcher import get_simple_dispatcher
 from otter.http import service_request
 from otter.test.utils import (
+    StubResponse,
     patch,
     resolve_effect,
     resolve_retry_stubs,
-    resolve_stubs
 )
+from otter.util.cache import LRUCache, TTLCache
+from otter.util.config import set_config_data
 from otter.util.retry import (
     ShouldDelayAndRetry, exponential_backoff_interval, retry_times)
 from otter.util.timestamp import from_timestamp
@@ -58,47 +73,105 @@ def resolve_svcreq(eff, result, service_type,
     return resolve_effect(eff, result)
 
 
+def resolve_server_pages(eff, pages, batch_size=1000):
+    """
+    Resolve requests made by :func:`get_all_server_details` with given pages
+    of servers, followed by an empty page if the last one is full, and return
+    the result
+    """
+    marker = None
+    if not pages or len(pages[-1]) == batch_size:
+        pages = pages + [[]]
+    for page in pages:
+        query = [('limit', batch_size)]
+        if marker is not None:
+            query.append(('marker', marker))
+        eff = resolve_svcreq(
+            resolve_retry_stubs(eff), (object(), {'servers': page}),
+            ServiceType.CLOUD_SERVERS, 'GET',
+            'servers/detail?' + urlencode(query))
+        if page:
+            marker = page[-1]['id']
+    return eff
+
+
 class GetAllServerDetailsTests(SynchronousTestCase):
     """
     Tests for :func:`get_all_server_details`
     """
 
-    def setUp(self):
-        """Save basic reused data."""
-        self.req = (ServiceType.CLOUD_SERVERS, 'GET',
-                    'servers/detail?limit=10')
-        self.servers = [{'id': i} for i in range(9)]
-
-    def test_get_all_less_batch_size(self):
+    def test_get_all_until_short_page(self):
         """
-        `get_all_server_details` will not fetch again if first get returns
-        results with size < batch_size
+        `get_all_server_details` fetches pages from the last server of the
+        previous page until a page is smaller than `batch_size`
         """
-        fake_response = object()
-        body = {'servers': self.servers}
+        servers = [{'id': i} for i in range(19)]
         eff = get_all_server_details(batch_size=10)
         svcreq = resolve_retry_stubs(eff)
-        result = resolve_svcreq(svcreq, (fake_response, body), *self.req)
-        self.assertEqual(result, self.servers)
+        next_retry = resolve_svcreq(
+            svcreq, (object(), {'servers': servers[:10]}),
+            ServiceType.CLOUD_SERVERS, 'GET', 'servers/detail?limit=10')
+        result = resolve_svcreq(
+            resolve_retry_stubs(next_retry),
+            (object(), {'servers': servers[10:]}),
+            ServiceType.CLOUD_SERVERS, 'GET',
+            'servers/detail?limit=10&marker=9')
+        self.assertEqual(result, servers)
+
+    def test_get_all_until_empty_page(self):
+        """
+        When the last page is full, the next one is fetched and is empty
+        """
+        servers = [{'id': i} for i in range(20)]
+        eff = get_all_server_details(batch_size=10)
+        self.assertEqual(
+            resolve_server_pages(eff, [servers[:10], servers[10:]],
+                                 batch_size=10),
+            servers)
+
+    def test_no_servers(self):
+        """
+        `get_all_server_details` returns empty list if first page is empty
+        """
+        self.assertEqual(
+            resolve_server_pages(get_all_server_details(batch_size=10), [],
+                                 batch_size=10),
+            [])
+
+    def test_default_batch_size(self):
+        """
+        Servers are fetched in batches of Nova's default maximum page size by
+        default
+        """
+        servers = [{'id': i} for i in range(9)]
+        self.assertEqual(
+            resolve_server_pages(get_all_server_details(), [servers]),
+            servers)
 
-    def test_get_all_above_batch_size(self):
+    def test_configured_batch_size(self):
         """
-        `get_all_server_details` will fetch again until batch returned has
-        size < batch_size
+        Servers are fetched in batches of ``converger.osapi_max_limit`` when
+        it is configured
+        """
+        set_config_data({'converger': {'osapi_max_limit': 5}})
+        self.addCleanup(set_config_data, {})
+        servers = [{'id': i} for i in range(9)]
+        self.assertEqual(
+            resolve_server_pages(get_all_server_details(),
+                                 [servers[:5], servers[5:]], batch_size=5),
+            servers)
+
+    def test_server_predicate(self):
+        """
+        Only servers satisfying `server_predicate` are returned. Next batch
+        is fetched from the last server in the unfiltered batch
         """
         servers = [{'id': i} for i in range(19)]
-        req2 = (ServiceType.CLOUD_SERVERS, 'GET',
-                'servers/detail?limit=10&marker=9')
-        svcreq = resolve_retry_stubs(get_all_server_details(batch_size=10))
-        fake_response = object()
-        body = {'servers': servers[:10]}
-
-        next_retry = resolve_svcreq(svcreq, (fake_response, body),
-                                    *self.req)
-        next_req = resolve_retry_stubs(next_retry)
-        body = {'servers': servers[10:]}
-        result = resolve_svcreq(next_req, (fake_response, body), *req2)
-        self.assertEqual(result, servers)
+        eff = get_all_server_details(batch_size=10,
+                                     server_predicate=lambda s: s['id'] < 5)
+        result = resolve_server_pages(eff, [servers[:10], servers[10:]],
+                                      batch_size=10)
+        self.assertEqual(result, servers[:5])
 
     def test_retry(self):
         """The HTTP requests are retried with some appropriate policy."""
@@ -114,20 +187,12 @@ class GetScalingGroupServersTests(SynchronousTestCase):
     Tests for :func:`get_scaling_group_servers`
     """
 
-    def setUp(self):
-        """Save basic reused data."""
-        self.req = (ServiceType.CLOUD_SERVERS, 'GET',
-                    'servers/detail?limit=100')
-
     def test_filters_no_metadata(self):
         """
         Servers without metadata are not included in the result.
         """
         servers = [{'id': i} for i in range(10)]
-        eff = resolve_retry_stubs(get_scaling_group_servers())
-        fake_response = object()
-        body = {'servers': servers}
-        result = resolve_svcreq(eff, (fake_response, body), *self.req)
+        result = resolve_server_pages(get_scaling_group_servers(), [servers])
         self.assertEqual(result, {})
 
     def test_filters_no_as_metadata(self):
@@ -136,10 +201,7 @@ class GetScalingGroupServersTests(SynchronousTestCase):
         in it
         """
         servers = [{'id': i, 'metadata': {}} for i in range(10)]
-        eff = resolve_retry_stubs(get_scaling_group_servers())
-        fake_response = object()
-        body = {'servers': servers}
-        result = resolve_svcreq(eff, (fake_response, body), *self.req)
+        result = resolve_server_pages(get_scaling_group_servers(), [servers])
         self.assertEqual(result, {})
 
     def test_returns_as_servers(self):
@@ -152,11 +214,8 @@ class GetScalingGroupServersTests(SynchronousTestCase):
             [{'metadata': {'rax:auto_scaling_group_id': 'b'}, 'id': i}
              for i in range(5, 8)] +
             [{'metadata': {'rax:auto_scaling_group_id': 'a'}, 'id': 10}])
-        servers = as_servers + [{'metadata': 'junk'}] * 3
-        eff = resolve_retry_stubs(get_scaling_group_servers())
-        fake_response = object()
-        body = {'servers': servers}
-        result = resolve_svcreq(eff, (fake_response, body), *self.req)
+        servers = as_servers + [{'metadata': 'junk', 'id': 11}] * 3
+        result = resolve_server_pages(get_scaling_group_servers(), [servers])
         self.assertEqual(
             result,
             {'a': as_servers[:5] + [as_servers[-1]], 'b': as_servers[5:8]})
@@ -170,13 +229,10 @@ class GetScalingGroupServersTests(SynchronousTestCase):
              for i in range(5)] +
             [{'metadata': {'rax:auto_scaling_group_id': 'b'}, 'id': i}
              for i in range(5, 8)])
-        servers = as_servers + [{'metadata': 'junk'}] * 3
-        eff = resolve_retry_stubs(
-            get_scaling_group_servers(
-                server_predicate=lambda s: s['id'] % 3 == 0))
-        fake_response = object()
-        body = {'servers': servers}
-        result = resolve_svcreq(eff, (fake_response, body), *self.req)
+        servers = as_servers + [{'metadata': 'junk', 'id': 11}] * 3
+        eff = get_scaling_group_servers(
+            server_predicate=lambda s: s['id'] % 3 == 0)
+        result = resolve_server_pages(eff, [servers])
         self.assertEqual(
             result,
             {'a': [as_servers[0], as_servers[3]], 'b': [as_servers[6]]})
@@ -235,6 +291,7 @@ class GetLBContentsTests(SynchronousTestCase):
             ('GET', 'loadbalancers/1/nodes/11.atom', False): '11feed',
             ('GET', 'loadbalancers/2/nodes/22.atom', False): '22feed'
         }
+        self.codes = {}
         self.feeds = {'11feed': 1.0, '22feed': 2.0}
         self.mock_eda = patch(
             self, 'otter.convergence.gathering.extract_CLB_drained_at',
@@ -250,9 +307,29 @@ class GetLBContentsTests(SynchronousTestCase):
             ShouldDelayAndRetry(can_retry=retry_times(5),
                                 next_interval=exponential_backoff_interval(2)))
         req = eff.intent.effect.intent
-        body = self.reqs[(req.method, req.url, req.json_response)]
-        fake_response = object()
-        return resolve_effect(eff, (fake_response, body))
+        key = (req.method, req.url, req.json_response)
+        response = StubResponse(self.codes.get(key, 200), {})
+        self.assertTrue(req.success_pred(response, None))
+        return resolve_effect(eff, (response, self.reqs[key]))
+
+    def _resolve_drained(self, feed_fetches):
+        """
+        Resolve the parallel fetch of drained times of draining nodes and
+        the forgetting of the drained times of other nodes if any. Forgotten
+        nodes are stored in ``self.forgotten``.
+        """
+        for fetch in feed_fetches.intent.effects:
+            self.assertIs(type(fetch.intent), CachedDrainedAt)
+        result = resolve_effect(
+            feed_fetches,
+            [self._resolve_request(fetch.intent.effect)
+             for fetch in feed_fetches.intent.effects])
+        self.forgotten = []
+        if type(result) is Effect:
+            self.assertIs(type(result.intent), ForgetDrainedAt)
+            self.forgotten = result.intent.nodes
+            result = resolve_effect(result, None)
+        return result
 
     def _resolve_lb(self, eff):
         """Resolve the tree of effects used to fetch LB information."""
@@ -268,11 +345,8 @@ class GetLBContentsTests(SynchronousTestCase):
             lb_nodes_fetch,
             map(self._resolve_request, lb_nodes_fetch.intent.effects))
         # which results in a list parallel fetch of feeds for the nodes
-        lbnodes = resolve_effect(
-            feed_fetches,
-            map(self._resolve_request, feed_fetches.intent.effects))
         # and we finally have the CLBNodes.
-        return lbnodes
+        return self._resolve_drained(feed_fetches)
 
     def test_success(self):
         """
@@ -305,6 +379,43 @@ class GetLBContentsTests(SynchronousTestCase):
                      description=make_desc(lb_id='2',
                                            weight=3,
                                            condition=draining))])
+        self.assertEqual(self.forgotten, [('1', '12'), ('2', '21')])
+
+    def test_all_draining(self):
+        """
+        Drained times are not forgotten if all nodes are draining
+        """
+        del self.reqs[('GET', 'loadbalancers/1/nodes', True)][1]
+        del self.reqs[('GET', 'loadbalancers/2/nodes', True)][0]
+        lbnodes = self._resolve_lb(get_clb_contents())
+        self.assertEqual([n.drained_at for n in lbnodes], [1.0, 2.0])
+        self.assertEqual(self.forgotten, [])
+
+    def test_given_lbs(self):
+        """
+        Only nodes of given load balancers are fetched without listing all
+        the load balancers
+        """
+        eff = get_clb_contents(lb_ids=[2])
+        feed_fetches = resolve_effect(
+            eff, map(self._resolve_request, eff.intent.effects))
+        lbnodes = self._resolve_drained(feed_fetches)
+        self.assertEqual([n.node_id for n in lbnodes], ['21', '22'])
+        self.assertEqual(lbnodes[1].drained_at, 2.0)
+
+    def test_deleted_lbs(self):
+        """
+        Load balancers whose nodes cannot be got since they are deleted (404)
+        or being deleted (422) have no nodes
+        """
+        for lb_id, code in [(1, 404), (2, 422)]:
+            key = ('GET', 'loadbalancers/{}/nodes'.format(lb_id), True)
+            self.codes[key] = code
+            self.reqs[key] = {'message': 'deleted'}
+        eff = get_clb_contents(lb_ids=[1, 2])
+        feed_fetches = resolve_effect(
+            eff, map(self._resolve_request, eff.intent.effects))
+        self.assertEqual(self._resolve_drained(feed_fetches), [])
 
     def test_no_lb(self):
         """
@@ -552,21 +663,7 @@ class GetAllConvergenceDataTests(SynchronousTestCase):
              'addresses': {'private': [{'addr': u'10.0.0.2',
                                         'version': 4}]}}
         ]
-
-    def test_success(self):
-        """The data is returned as a tuple of ([NovaServer], [CLBNode])."""
-        lb_nodes = [CLBNode(node_id='node1', address='ip1',
-                            description=CLBDescription(lb_id='lb1', port=80))]
-
-        get_servers = lambda: Effect(Stub(Constant({'gid': self.servers})))
-        get_lb = lambda: Effect(Stub(Constant(lb_nodes)))
-
-        eff = get_all_convergence_data(
-            'gid',
-            get_scaling_group_servers=get_servers,
-            get_clb_contents=get_lb)
-
-        expected_servers = [
+        self.expected_servers = [
             NovaServer(id='a',
                        state=ServerState.ACTIVE,
                        image_id='image',
@@ -580,19 +677,236 @@ class GetAllConvergenceDataTests(SynchronousTestCase):
                        created=1,
                        servicenet_address='10.0.0.2'),
         ]
-        self.assertEqual(resolve_stubs(eff), (expected_servers, lb_nodes))
+
+    def _perform(self, eff):
+        return sync_perform(get_simple_dispatcher(Clock()), eff)
+
+    def test_success(self):
+        """The data is returned as a tuple of ([NovaServer], [CLBNode])."""
+        lb_nodes = [CLBNode(node_id='node1', address='ip1',
+                            description=CLBDescription(lb_id='lb1', port=80))]
+
+        def get_servers():
+            return Effect(Constant({'gid': self.servers}))
+
+        def get_lb(lb_ids):
+            self.assertEqual(lb_ids, ['lb1'])
+            return Effect(Constant(lb_nodes))
+
+        eff = get_all_convergence_data(
+            'gid', ['lb1'],
+            get_scaling_group_servers=get_servers,
+            get_clb_contents=get_lb)
+
+        self.assertEqual(self._perform(eff),
+                         (self.expected_servers, lb_nodes))
+
+    def test_only_desired_lbs(self):
+        """
+        Nodes of only the given load balancers are fetched, each of them
+        separately
+        """
+        nodes = {
+            lb_id: [CLBNode(node_id='n' + lb_id, address='ip',
+                            description=CLBDescription(lb_id=lb_id, port=80))]
+            for lb_id in ['1', '2']}
+
+        def get_lb(lb_ids):
+            [lb_id] = lb_ids
+            return Effect(Constant(nodes[lb_id]))
+
+        eff = get_all_convergence_data(
+            'gid', [2, 1],
+            get_scaling_group_servers=lambda **k: Effect(Constant({})),
+            get_clb_contents=get_lb)
+
+        self.assertEqual(self._perform(eff), ([], nodes['1'] + nodes['2']))
+
+    def test_lbs_in_server_metadata(self):
+        """
+        Nodes of load balancers that the servers' metadata refer to are
+        also fetched even if they are not desired anymore
+        """
+        self.servers[0]['metadata'] = {
+            'rax:autoscale:lb:3': '[{"port": 80}]',
+            'rax:autoscale:lb:1': '[{"port": 80}]'}
+        nodes = {
+            lb_id: [CLBNode(node_id='n' + lb_id, address='ip',
+                            description=CLBDescription(lb_id=lb_id, port=80))]
+            for lb_id in ['1', '3']}
+        fetched = []
+
+        def get_lb(lb_ids):
+            fetched.extend(lb_ids)
+            return Effect(Constant(nodes[lb_ids[0]]))
+
+        eff = get_all_convergence_data(
+            'gid', ['1'],
+            get_scaling_group_servers=lambda **k: Effect(Constant(
+                {'gid': self.servers})),
+            get_clb_contents=get_lb)
+
+        servers, lb_nodes = self._perform(eff)
+        self.assertEqual([s.id for s in servers], ['a', 'b'])
+        self.assertEqual(lb_nodes, nodes['1'] + nodes['3'])
+        self.assertEqual(fetched, ['1', '3'])
+
+    def test_cached_tenant_data(self):
+        """
+        If `tenant_id` is given, the servers of all groups and each LB's
+        nodes are got from tenant's cached data and the group's servers are
+        picked from it
+        """
+        lb_nodes = [CLBNode(node_id='node1', address='ip1',
+                            description=CLBDescription(lb_id='lb1', port=80))]
+        get_servers = lambda: Effect(Constant({}))
+        get_lb = lambda lb_ids: Effect(Constant(lb_ids))
+
+        eff = get_all_convergence_data(
+            'gid', ['lb1'], tenant_id='tid',
+            get_scaling_group_servers=get_servers,
+            get_clb_contents=get_lb)
+
+        servers_eff, lbs_eff = eff.intent.effects
+        self.assertEqual(servers_eff.intent.tenant_id, 'tid')
+        self.assertEqual(servers_eff.intent.key, 'servers')
+        self.assertEqual(self._perform(servers_eff.intent.effect), {})
+        [lb_eff] = lbs_eff.intent.effects
+        self.assertIsInstance(lb_eff.intent, CachedTenantData)
+        self.assertEqual(lb_eff.intent.tenant_id, 'tid')
+        self.assertEqual(lb_eff.intent.key, ('clb', 'lb1'))
+        self.assertEqual(self._perform(lb_eff.intent.effect), ['lb1'])
+        self.assertEqual(
+            resolve_effect(eff, [{'gid': self.servers, 'other': ['junk']},
+                                 lb_nodes]),
+            (self.expected_servers, lb_nodes))
 
     def test_no_group_servers(self):
         """
         If there are no servers in a group, get_all_convergence_data includes
         an empty list.
         """
-        get_servers = lambda: Effect(Stub(Constant({})))
-        get_lb = lambda: Effect(Stub(Constant([])))
+        get_servers = lambda **k: Effect(Constant({}))
+        get_lb = lambda lb_ids: Effect(Constant([]))
 
         eff = get_all_convergence_data(
-            'gid',
+            'gid', [],
             get_scaling_group_servers=get_servers,
             get_clb_contents=get_lb)
 
-        self.assertEqual(resolve_stubs(eff), ([], []))
+        self.assertEqual(self._perform(eff), ([], []))
+
+
+class TenantDataCacheTests(SynchronousTestCase):
+    """
+    Tests for :func:`perform_cached_tenant_data` and
+    :func:`perform_invalidate_tenant_data`
+    """
+
+    def setUp(self):
+        """
+        Dispatcher with the cache performers
+        """
+        self.cache = TTLCache(Clock(), 10)
+        self.dispatcher = ComposedDispatcher([
+            TypeDispatcher({
+                CachedTenantData: partial(perform_cached_tenant_data,
+                                          self.cache),
+                InvalidateTenantData: partial(perform_invalidate_tenant_data,
+                                              self.cache)}),
+            base_dispatcher])
+        self.fetches = 0
+
+    def _get(self, tenant_id, key='k'):
+        def fetch():
+            self.fetches += 1
+            return ('data', self.fetches)
+        return sync_perform(
+            self.dispatcher,
+            Effect(CachedTenantData(tenant_id=tenant_id, key=key,
+                                    effect=Effect(Func(fetch)))))
+
+    def test_cached_per_tenant_key(self):
+        """
+        Tenant's data is fetched once and shared by subsequent requests
+        for the same tenant and key
+        """
+        self.assertEqual(self._get('t1'), ('data', 1))
+        self.assertEqual(self._get('t1'), ('data', 1))
+        self.assertEqual(self._get('t1', 'k2'), ('data', 2))
+        self.assertEqual(self._get('t2'), ('data', 3))
+
+    def test_invalidate(self):
+        """
+        All of tenant's data is fetched again after it is invalidated
+        """
+        self._get('t1')
+        self._get('t1', 'k2')
+        self._get('t2')
+        sync_perform(self.dispatcher,
+                     Effect(InvalidateTenantData(tenant_id='t1')))
+        self.assertEqual(self._get('t1'), ('data', 4))
+        self.assertEqual(self._get('t1', 'k2'), ('data', 5))
+        self.assertEqual(self._get('t2'), ('data', 3))
+
+
+class DrainedAtCacheTests(SynchronousTestCase):
+    """
+    Tests for :func:`perform_cached_drained_at` and
+    :func:`perform_forget_drained_at`
+    """
+
+    def setUp(self):
+        """
+        Dispatcher with the cache performers
+        """
+        self.cache = LRUCache(2)
+        self.dispatcher = ComposedDispatcher([
+            TypeDispatcher({
+                CachedDrainedAt: partial(perform_cached_drained_at,
+                                         self.cache),
+                ForgetDrainedAt: partial(perform_forget_drained_at,
+                                         self.cache)}),
+            base_dispatcher])
+        self.fetches = 0
+
+    def _get(self, lb_id, node_id):
+        def fetch():
+            self.fetches += 1
+            return float(self.fetches)
+        return sync_perform(
+            self.dispatcher,
+            Effect(CachedDrainedAt(lb_id=lb_id, node_id=node_id,
+                                   effect=Effect(Func(fetch)))))
+
+    def test_cached_per_node(self):
+        """
+        Drained time of a node is fetched once and then returned from cache
+        """
+        self.assertEqual(self._get('1', '11'), 1.0)
+        self.assertEqual(self._get('1', '11'), 1.0)
+        self.assertEqual(self._get('1', '12'), 2.0)
+        self.assertEqual(self._get('2', '11'), 3.0)
+        self.assertEqual(self.fetches, 3)
+
+    def test_failure_not_cached(self):
+        """
+        Drained time is not cached if fetching it fails
+        """
+        eff = Effect(CachedDrainedAt(
+            lb_id='1', node_id='11',
+            effect=Effect(Func(lambda: 1 / 0))))
+        self.assertRaises(ZeroDivisionError, sync_perform,
+                          self.dispatcher, eff)
+        self.assertNotIn(('1', '11'), self.cache)
+
+    def test_forget(self):
+        """
+        Forgotten nodes' drained times are fetched again
+        """
+        self._get('1', '11')
+        self._get('1', '12')
+        sync_perform(self.dispatcher,
+                     Effect(ForgetDrainedAt(nodes=[('1', '11'), ('3', '3')])))
+        self.assertEqual(self._get('1', '11'), 3.0)
+        self.assertEqual(self._get('1', '12'), 2.0)
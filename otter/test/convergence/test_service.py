@@ -1,15 +1,20 @@
-from effect import Constant, Effect, ParallelEffects, parallel
+from effect import (
+    ComposedDispatcher, Constant, Effect, ParallelEffects, parallel)
 from effect.testing import Stub
 
 import mock
 
 from pyrsistent import freeze, pmap
 
+from testtools.matchers import IsInstance
+
 from twisted.internet.defer import fail
 from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.constants import ServiceType
+from otter.convergence.gathering import (
+    CachedTenantData, InvalidateTenantData)
 from otter.convergence.model import (
     CLBDescription, CLBNode, NovaServer, ServerState)
 from otter.convergence.service import (
@@ -19,7 +24,7 @@ from otter.models.intents import ModifyGroupState
 from otter.models.interface import GroupState
 from otter.test.convergence.test_planning import server
 from otter.test.utils import (
-    CheckFailure, LockMixin, mock_group, mock_log, resolve_effect,
+    CheckFailure, LockMixin, matches, mock_group, mock_log, resolve_effect,
     resolve_stubs)
 from otter.util.fp import assoc_obj
 
@@ -62,9 +67,17 @@ class ConvergerTests(SynchronousTestCase):
         self.kz_client.Lock().release.assert_called_once_with()
         expected_converge_args = (self.group, 0, self.lc, time(), log)
         perform.assert_called_once_with(
-            self.dispatcher,
+            matches(IsInstance(ComposedDispatcher)),
             Effect(TenantScope(Effect(Constant(expected_converge_args)),
                                'tenant-id')))
+        # The dispatcher extends given dispatcher with cache performers
+        dispatcher = perform.call_args[0][0]
+        self.assertIs(dispatcher.dispatchers[-1], self.dispatcher)
+        self.assertIsNot(
+            dispatcher(CachedTenantData(tenant_id='t', key='k', effect=None)),
+            None)
+        self.assertIsNot(
+            dispatcher(InvalidateTenantData(tenant_id='t')), None)
 
     def test_converge_error_log(self):
         """If performance fails, the error is logged."""
@@ -90,7 +103,10 @@ class ExecuteConvergenceTests(SynchronousTestCase):
         self.state = GroupState('tenant-id', 'group-id', 'group-name',
                                 {}, {}, None, {}, False)
         self.group = mock_group(self.state, 'tenant-id', 'group-id')
-        self.lc = {'args': {'server': {'name': 'foo'}, 'loadBalancers': []}}
+        self.lc = {'args': {'server': {'name': 'foo'},
+                            'loadBalancers': [{'loadBalancerId': 23,
+                                               'port': 80}]}}
+        self.lb_ids = [23]
         self.desired_lbs = freeze({23: [CLBDescription(lb_id='23', port=80)]})
         self.servers = [
             NovaServer(id='a',
@@ -110,8 +126,10 @@ class ExecuteConvergenceTests(SynchronousTestCase):
         ]
 
     def _get_gacd_func(self, group_id):
-        def get_all_convergence_data(grp_id):
+        def get_all_convergence_data(grp_id, lb_ids, tenant_id):
             self.assertEqual(grp_id, group_id)
+            self.assertEqual(lb_ids, self.lb_ids)
+            self.assertEqual(tenant_id, 'tenant-id')
             return Effect(Stub(Constant((self.servers, []))))
         return get_all_convergence_data
 
@@ -120,6 +138,7 @@ class ExecuteConvergenceTests(SynchronousTestCase):
         self.assertEqual(effect.intent.scaling_group, self.group)
         self.assertEqual(effect.intent.modifier(self.group, self.state),
                          assoc_obj(self.state, active=active))
+        self.assertTrue(effect.intent.modifier.repeatable)
 
     def test_no_steps(self):
         """
@@ -172,11 +191,31 @@ class ExecuteConvergenceTests(SynchronousTestCase):
                        'condition': 'ENABLED', 'address': '10.0.0.2'}),
                  pmap({'weight': 1, 'type': 'PRIMARY', 'port': 80,
                        'condition': 'ENABLED', 'address': '10.0.0.1'})]))
-        r = resolve_effect(eff, ['stuff'])
+        eff = resolve_effect(eff, ['stuff'])
+        # Tenant's cached convergence data is invalidated after the steps
+        self.assertEqual(eff.intent,
+                         InvalidateTenantData(tenant_id='tenant-id'))
+        r = resolve_effect(eff, None)
         # The result of the parallel is returned directly
         # TODO: This must change with issue #844.
         self.assertEqual(r, ['stuff'])
 
+    def test_steps_failure_invalidates(self):
+        """
+        Tenant's cached convergence data is invalidated even if the steps
+        fail and the error is propagated
+        """
+        log = mock_log()
+        gacd = self._get_gacd_func(self.group.uuid)
+        eff = execute_convergence(self.group, 2, self.lc, 0, log,
+                                  get_all_convergence_data=gacd)
+        eff = resolve_effect(resolve_stubs(eff), None)
+        eff = resolve_effect(eff, (ValueError, ValueError('bad'), None),
+                             is_error=True)
+        self.assertEqual(eff.intent,
+                         InvalidateTenantData(tenant_id='tenant-id'))
+        self.assertRaises(ValueError, resolve_effect, eff, None)
+
 
 class DetermineActiveTests(SynchronousTestCase):
     """Tests for :func:`determine_active`."""
@@ -13,6 +13,7 @@ from effect.testing import resolve_effect
 
 from jsonschema import ValidationError
 
+from kazoo.exceptions import NodeExistsError, NoNodeError
 from kazoo.protocol.states import KazooState
 
 import mock
@@ -32,25 +33,40 @@ from otter.models.cass import (
     CassAdmin,
     CassScalingGroup,
     CassScalingGroupCollection,
+    CassTenantIdentityStore,
     CQLQueryExecute,
+    CAS_RETRIES,
+    GroupConfigCache,
+    ALL_SCOPES,
+    LazyJSONMap,
+    StateConflictError,
+    WEBHOOK_CACHE_TTL,
+    WEBHOOK_MISS_TTL,
     WeakLocks,
     _assemble_webhook_from_row,
+    _counts_changes,
+    all_scope,
     assemble_webhooks_in_policies,
+    change_counts,
     perform_cql_query,
+    read_total_counts,
     serialize_json_data,
     verified_view
 )
 from otter.models.interface import (
     GroupNotEmptyError,
     GroupState,
+    GroupStateCounts,
     NoSuchPolicyError,
     NoSuchScalingGroupError,
     NoSuchWebhookError,
     PoliciesOverLimitError,
     ScalingGroupOverLimitError,
     ScalingGroupStatus,
+    StateProjection,
     UnrecognizedCapabilityError,
-    WebhooksOverLimitError
+    WebhooksOverLimitError,
+    repeatable_modifier
 )
 from otter.test.models.test_interface import (
     IScalingGroupCollectionProviderMixin,
@@ -149,6 +165,98 @@ class SerialJsonDataTestCase(SynchronousTestCase):
                          json.dumps({'_ver': 'version'}))
 
 
+class LazyJSONMapTests(SynchronousTestCase):
+    """
+    Tests for :class:`LazyJSONMap`
+    """
+
+    def setUp(self):
+        """
+        Sample map whose decoding is recorded
+        """
+        self.loads = []
+        self.patch(json, 'loads', lambda s: self.loads.append(s) or
+                   {'a': 1, 'b': {'c': 2}, '_ver': 1})
+        self.map = LazyJSONMap('raw', 2)
+
+    def test_length_without_decoding(self):
+        """
+        Stored length is returned without decoding the JSON
+        """
+        self.assertEqual(len(self.map), 2)
+        self.assertEqual(self.loads, [])
+        self.assertTrue(self.map.length_stored)
+        self.assertFalse(LazyJSONMap('raw').length_stored)
+
+    def test_verify_length(self):
+        """
+        ``verify_length`` keeps the stored length if it is the number of
+        items in the JSON and forgets it otherwise
+        """
+        self.map.verify_length()
+        self.assertTrue(self.map.length_stored)
+        self.assertEqual(self.loads, ['raw'])
+        m = LazyJSONMap('raw', 5)
+        m.verify_length()
+        self.assertFalse(m.length_stored)
+        self.assertEqual(len(m), 2)
+
+    def test_distrust_length(self):
+        """
+        ``distrust_length`` does not decode the JSON but makes the length
+        be verified against it when it is used
+        """
+        m = LazyJSONMap('raw', 5)
+        m.distrust_length()
+        self.assertEqual(self.loads, [])
+        self.assertEqual(len(m), 2)
+        self.assertEqual(self.loads, ['raw'])
+        self.assertFalse(m.length_stored)
+
+    def test_decodes_once(self):
+        """
+        JSON without version is decoded on first access of items and only
+        once
+        """
+        self.assertEqual(self.map['a'], 1)
+        self.assertIn('b', self.map)
+        self.assertEqual(sorted(self.map), ['a', 'b'])
+        self.assertEqual(self.map, {'a': 1, 'b': {'c': 2}})
+        self.assertEqual(self.loads, ['raw'])
+
+    def test_not_changed_on_reads(self):
+        """
+        Reading immutable values does not change the map
+        """
+        self.map['a']
+        self.map.get('x')
+        'a' in self.map
+        len(self.map)
+        self.assertFalse(self.map.changed)
+
+    def test_changed_on_writes(self):
+        """
+        Setting or deleting items changes the map
+        """
+        self.map['x'] = 3
+        self.assertTrue(self.map.changed)
+        self.assertEqual(len(self.map), 3)
+        m = LazyJSONMap('raw', 2)
+        del m['a']
+        self.assertTrue(m.changed)
+        self.assertEqual(m.copy(), {'b': {'c': 2}})
+
+    def test_changed_on_mutable_values(self):
+        """
+        Handing out a mutable value changes the map since it could be
+        changed in place
+        """
+        self.map['b']['c'] = 3
+        self.assertTrue(self.map.changed)
+        self.assertEqual(serialize_json_data(self.map, 1),
+                         json.dumps({'a': 1, 'b': {'c': 3}, '_ver': 1}))
+
+
 class AssembleWebhooksTests(SynchronousTestCase):
     """
     Tests for `assemble_webhooks_in_policies`
@@ -313,6 +421,23 @@ class VerifiedViewTests(SynchronousTestCase):
             [mock.call('vq', {'d': 2}, ConsistencyLevel.TWO),
              mock.call('dq', {'d': 2}, ConsistencyLevel.TWO)])
 
+    def test_resurrected_view_reaper(self):
+        """
+        If a reaper is given, the resurrected group is queued to it instead
+        of being deleted
+        """
+        self.connection.execute.return_value = defer.succeed(
+            [{'c1': 2, 'created_at': None}])
+        reaper = mock.Mock()
+        r = verified_view(self.connection, 'vq', 'dq',
+                          {'tenantId': 't', 'groupId': 'g'},
+                          ConsistencyLevel.TWO, ValueError, self.log,
+                          reaper=reaper)
+        self.failureResultOf(r, ValueError)
+        self.connection.execute.assert_called_once_with(
+            'vq', {'tenantId': 't', 'groupId': 'g'}, ConsistencyLevel.TWO)
+        reaper.enqueue.assert_called_once_with('t', 'g')
+
     def test_empty_view(self):
         """
         Raise empty error if no result
@@ -325,6 +450,127 @@ class VerifiedViewTests(SynchronousTestCase):
         self.assertFalse(self.log.msg.called)
 
 
+class CountsTests(SynchronousTestCase):
+    """
+    Tests for `_counts_changes` and `change_counts`
+    """
+
+    def setUp(self):
+        """
+        Mock connection object.
+        """
+        self.connection = mock.MagicMock(spec=['execute'])
+        self.log = mock_log()
+
+    def test_counts_changes(self):
+        """
+        Tenant and all scopes get all the changes, group scope gets policies
+        change and policy scope gets webhooks change. Changes are added to
+        existing ones.
+        """
+        changes = _counts_changes({}, 't', 'g', policies=-1, webhooks=-2)
+        self.assertIs(
+            _counts_changes(changes, 't', 'g', 'p', webhooks=-2), changes)
+        self.assertEqual(
+            changes,
+            {all_scope('t'): {'policies': -1, 'webhooks': -4},
+             't': {'policies': -1, 'webhooks': -4},
+             't/g': {'policies': -1},
+             't/g/p': {'webhooks': -2}})
+
+    def test_change_counts(self):
+        """
+        Non-zero changes are applied in a counter batch
+        """
+        self.connection.execute.return_value = defer.succeed(None)
+        d = change_counts(self.connection, 'counts',
+                          {'*': {'groups': 1, 'policies': -2},
+                           't/g': {'policies': 0}},
+                          self.log)
+        self.assertIsNone(self.successResultOf(d))
+        self.connection.execute.assert_called_once_with(
+            'BEGIN COUNTER BATCH '
+            'UPDATE counts SET groups = groups + :scope0groups, '
+            'policies = policies + :scope0policies WHERE scope = :scope0 '
+            'APPLY BATCH;',
+            {'scope0': '*', 'scope0groups': 1, 'scope0policies': -2},
+            ConsistencyLevel.QUORUM)
+
+    def test_change_counts_deleted(self):
+        """
+        Rows of deleted scopes are deleted in the same counter batch and
+        their changes are ignored
+        """
+        self.connection.execute.return_value = defer.succeed(None)
+        d = change_counts(self.connection, 'counts',
+                          {'t': {'policies': -1}, 't/g': {'policies': -1},
+                           't/g/p': {'webhooks': -2}},
+                          self.log, deleted=['t/g/p', 't/g'])
+        self.assertIsNone(self.successResultOf(d))
+        self.connection.execute.assert_called_once_with(
+            'BEGIN COUNTER BATCH '
+            'DELETE FROM counts WHERE scope = :scope0 '
+            'DELETE FROM counts WHERE scope = :scope1 '
+            'UPDATE counts SET policies = policies + :scope2policies '
+            'WHERE scope = :scope2 '
+            'APPLY BATCH;',
+            {'scope0': 't/g', 'scope1': 't/g/p', 'scope2': 't',
+             'scope2policies': -1},
+            ConsistencyLevel.QUORUM)
+
+    def test_all_scope(self):
+        """
+        Tenants are spread across all the scopes of counts of all the tenants
+        and a tenant always gets the same one
+        """
+        self.assertEqual(len(ALL_SCOPES), 16)
+        scopes = set(all_scope(str(tenant)) for tenant in range(1000))
+        self.assertEqual(scopes, set(ALL_SCOPES))
+        self.assertEqual(all_scope('t'), all_scope('t'))
+
+    def test_read_total_counts(self):
+        """
+        Counts of all the tenants are the sum of the rows they are spread
+        across
+        """
+        self.connection.execute.return_value = defer.succeed(
+            [{'groups': 1, 'policies': 2, 'webhooks': None},
+             {'groups': 3, 'policies': 4, 'webhooks': 5}])
+        d = read_total_counts(self.connection, 'counts',
+                              ConsistencyLevel.ONE)
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 4, 'policies': 6, 'webhooks': 5})
+        [(query, params, consistency)] = [
+            c[1] for c in self.connection.execute.mock_calls]
+        self.assertEqual(sorted(params.values()), sorted(ALL_SCOPES))
+        self.assertEqual(
+            query,
+            'SELECT groups, policies, webhooks FROM counts WHERE scope IN '
+            '({});'.format(', '.join(':' + name for name in sorted(params))))
+        self.assertEqual(consistency, ConsistencyLevel.ONE)
+
+    def test_change_counts_nothing(self):
+        """
+        Nothing is executed if there are no non-zero changes
+        """
+        d = change_counts(self.connection, 'counts', {'*': {'groups': 0}},
+                          self.log)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertFalse(self.connection.execute.called)
+
+    def test_change_counts_error(self):
+        """
+        Failure to change counts is logged and not propagated
+        """
+        self.connection.execute.return_value = defer.fail(DummyException())
+        changes = {'*': {'groups': 1}}
+        d = change_counts(self.connection, 'counts', changes, self.log)
+        self.assertIsNone(self.successResultOf(d))
+        self.log.err.assert_called_once_with(
+            CheckFailure(DummyException), 'Could not change counts',
+            changes=changes)
+
+
 class WeakLocksTests(SynchronousTestCase):
     """
     Tests for `WeakLocks`
@@ -355,6 +601,154 @@ class WeakLocksTests(SynchronousTestCase):
         self.assertIsNot(self.locks.get_lock('a'), self.locks.get_lock('b'))
 
 
+class GroupConfigCacheTests(SynchronousTestCase):
+    """
+    Tests for :class:`GroupConfigCache`
+    """
+
+    def setUp(self):
+        """
+        Sample cache with mock kazoo client
+        """
+        self.clock = Clock()
+        self.log = mock_log()
+        self.cache = GroupConfigCache(self.clock, 10, self.log)
+        self.kz_client = mock.Mock(spec=['exists', 'set', 'create', 'delete'])
+        self.watches = []
+
+        def exists(path, watch):
+            self.watches.append((path, watch))
+            return defer.succeed(None)
+
+        self.kz_client.exists.side_effect = exists
+        self.fetches = []
+
+    def _get(self, key=('config',), group_id='g', kz_client=False):
+        def fetch():
+            self.fetches.append(key)
+            return defer.succeed(len(self.fetches))
+        return self.successResultOf(self.cache.get(
+            self.kz_client if kz_client is False else kz_client, 't',
+            group_id, key, fetch))
+
+    def test_caches(self):
+        """
+        Values are fetched once per key until they expire
+        """
+        self.assertEqual(self._get(), 1)
+        self.assertEqual(self._get(), 1)
+        self.assertEqual(self._get(('policy', 'p')), 2)
+        self.clock.advance(10)
+        self.assertEqual(self._get(), 3)
+
+    def test_watches_group_once(self):
+        """
+        Group's znode is watched once before fetching and watch firing
+        invalidates the group's entries
+        """
+        self._get()
+        self._get(('policy', 'p'))
+        self._get(group_id='g2')
+        self.assertEqual([path for path, _ in self.watches],
+                         ['/config_versions/g', '/config_versions/g2'])
+        self.watches[0][1]('event')
+        self.assertEqual(self._get(), 4)
+        self.assertEqual(self._get(group_id='g2'), 3)
+        self.assertEqual(len(self.watches), 3)
+
+    def test_max_watched(self):
+        """
+        Groups beyond `max_watched` watched groups are fetched every time
+        without watching them. They are cached once a watch fires.
+        """
+        self.cache.max_watched = 1
+        self._get()
+        self.assertEqual(self._get(group_id='g2'), 2)
+        self.assertEqual(self._get(group_id='g2'), 3)
+        self.assertEqual(self._get(), 1)
+        self.assertEqual(len(self.watches), 1)
+        self.watches[0][1]('event')
+        self.assertEqual(self._get(group_id='g2'), 4)
+        self.assertEqual(self._get(group_id='g2'), 4)
+        self.assertEqual([path for path, _ in self.watches],
+                         ['/config_versions/g', '/config_versions/g2'])
+
+    def test_watch_error(self):
+        """
+        Error setting watch is logged and value is fetched. Watch is tried
+        again on next fetch.
+        """
+        self.kz_client.exists.side_effect = lambda *a, **kw: defer.fail(
+            DummyException())
+        self.assertEqual(self._get(), 1)
+        self.log.err.assert_called_once_with(
+            CheckFailure(DummyException),
+            'Could not watch group config version', tenant_id='t',
+            scaling_group_id='g')
+        self.clock.advance(10)
+        self._get()
+        self.assertEqual(self.kz_client.exists.call_count, 2)
+
+    def test_no_kz_client(self):
+        """
+        Values are cached without watching if there is no kazoo client
+        """
+        self.assertEqual(self._get(kz_client=None), 1)
+        self.assertEqual(self._get(kz_client=None), 1)
+        self.successResultOf(self.cache.changed(None, 't', 'g'))
+        self.assertEqual(self._get(kz_client=None), 2)
+
+    def test_changed_sets_znode(self):
+        """
+        `changed` invalidates group's entries and sets its znode
+        """
+        self.kz_client.set.return_value = defer.succeed(None)
+        self._get()
+        self._get(group_id='g2')
+        self.successResultOf(self.cache.changed(self.kz_client, 't', 'g'))
+        self.kz_client.set.assert_called_once_with('/config_versions/g', '')
+        self.assertEqual(self._get(), 3)
+        self.assertEqual(self._get(group_id='g2'), 2)
+
+    def test_changed_creates_znode(self):
+        """
+        `changed` creates group's znode if it does not exist. Its creation by
+        another process in between is ignored.
+        """
+        self.kz_client.set.side_effect = lambda *a: defer.fail(NoNodeError())
+        self.kz_client.create.return_value = defer.succeed('path')
+        self.assertIsNone(self.successResultOf(
+            self.cache.changed(self.kz_client, 't', 'g')))
+        self.kz_client.create.assert_called_once_with(
+            '/config_versions/g', makepath=True)
+        self.kz_client.create.return_value = defer.fail(NodeExistsError())
+        self.assertIsNone(self.successResultOf(
+            self.cache.changed(self.kz_client, 't', 'g')))
+        self.assertFalse(self.log.err.called)
+
+    def test_changed_deleted(self):
+        """
+        `changed` deletes group's znode if group is deleted, ignoring its
+        absence
+        """
+        self.kz_client.delete.return_value = defer.fail(NoNodeError())
+        self.assertIsNone(self.successResultOf(
+            self.cache.changed(self.kz_client, 't', 'g', deleted=True)))
+        self.kz_client.delete.assert_called_once_with('/config_versions/g')
+        self.assertFalse(self.log.err.called)
+
+    def test_changed_error(self):
+        """
+        `changed` logs zookeeper errors without propagating them
+        """
+        self.kz_client.set.return_value = defer.fail(DummyException())
+        self.successResultOf(self.cache.changed(self.kz_client, 't', 'g'))
+        self.log.err.assert_called_once_with(
+            CheckFailure(DummyException),
+            'Could not change group config version', tenant_id='t',
+            scaling_group_id='g')
+
+
 class CassScalingGroupTestCase(IScalingGroupProviderMixin, LockMixin,
                                SynchronousTestCase):
     """
@@ -436,6 +830,9 @@ class CassScalingGroupTestCase(IScalingGroupProviderMixin, LockMixin,
             self, 'otter.models.cass.next_cron_occurrence',
             return_value='next_time')
 
+        patch(self, 'otter.models.cass._locked_state_version',
+              return_value=-7)
+
 
 class CassScalingGroupTests(CassScalingGroupTestCase):
     """
@@ -520,8 +917,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         r = self.successResultOf(d)
         expectedCql = (
             'SELECT "tenantId", "groupId", group_config, active, pending, '
-            '"groupTouched", "policyTouched", paused, desired, created_at '
-            'FROM scaling_group '
+            'active_count, pending_count, "groupTouched", "policyTouched", '
+            'paused, desired, state_version, created_at FROM scaling_group '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId;')
         expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id}
         self.connection.execute.assert_called_once_with(
@@ -619,8 +1016,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.failureResultOf(d, NoSuchScalingGroupError)
         viewCql = (
             'SELECT "tenantId", "groupId", group_config, active, pending, '
-            '"groupTouched", "policyTouched", paused, desired, created_at '
-            'FROM scaling_group '
+            'active_count, pending_count, "groupTouched", "policyTouched", '
+            'paused, desired, state_version, created_at FROM scaling_group '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId;')
         delCql = ('DELETE FROM scaling_group '
                   'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
@@ -684,14 +1081,18 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.group.view_state.assert_called_once_with(ConsistencyLevel.QUORUM)
         expectedCql = (
             'INSERT INTO scaling_group("tenantId", "groupId", active, '
-            'pending, "groupTouched", "policyTouched", paused, desired) '
-            'VALUES(:tenantId, :groupId, :active, :pending, :groupTouched, '
-            ':policyTouched, :paused, :desired) USING TIMESTAMP :ts')
+            'pending, active_count, pending_count, "groupTouched", '
+            '"policyTouched", paused, desired, state_version) '
+            'VALUES(:tenantId, :groupId, :active, :pending, :active_count, '
+            ':pending_count, :groupTouched, :policyTouched, :paused, '
+            ':desired, :state_version) USING TIMESTAMP :ts')
         expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id,
                         "active": _S({}), "pending": _S({}),
+                        "active_count": 0, "pending_count": 0,
                         "groupTouched": '0001-01-01T00:00:00Z',
                         "policyTouched": _S({}),
-                        "paused": True, "desired": 5, "ts": 10345000}
+                        "paused": True, "desired": 5, "state_version": -7,
+                        "ts": 10345000}
         self.connection.execute.assert_called_once_with(
             expectedCql, expectedData, ConsistencyLevel.QUORUM)
 
@@ -861,6 +1262,139 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.assertTrue(f.check(AssertionError))
         self.assertEqual(self.connection.execute.call_count, 0)
 
+    def _state_row(self, **kwargs):
+        """
+        Return group row as read by ``view_state``
+        """
+        row = {'tenantId': self.tenant_id,
+               'groupId': self.group_id,
+               'group_config': '{"name": "a"}',
+               'active': '{"A": {"id": "A"}}',
+               'pending': '{}',
+               'active_count': 1,
+               'pending_count': 0,
+               'groupTouched': '2014-01-01T00:00:05Z.1234',
+               'policyTouched': '{}',
+               'paused': '\x00',
+               'desired': 1,
+               'created_at': 23}
+        row.update(kwargs)
+        return row
+
+    def test_modify_state_writes_changed_columns(self):
+        """
+        ``modify_state`` only writes the columns the modifier changed and
+        does not re-serialize unchanged JSON columns
+        """
+        def modifier(_group, state):
+            self.assertEqual(len(state.active) + len(state.pending), 1)
+            state.desired = 2
+            state.policy_touched['p'] = 'now'
+            return state
+
+        self.returns = [[self._state_row()], None]
+        self.clock.advance(10.345)
+        d = self.group.modify_state(modifier)
+        self.assertIsNone(self.successResultOf(d))
+        expectedCql = (
+            'INSERT INTO scaling_group("tenantId", "groupId", '
+            '"policyTouched", desired, state_version) '
+            'VALUES(:tenantId, :groupId, :policyTouched, :desired, '
+            ':state_version) USING TIMESTAMP :ts')
+        expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id,
+                        "policyTouched": '{"p": "now", "_ver": 1}',
+                        "desired": 2, "state_version": -7, "ts": 10345000}
+        self.connection.execute.assert_called_with(
+            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+
+    def test_modify_state_writes_json_and_count_together(self):
+        """
+        ``modify_state`` writes the count of a JSON column along with it
+        when it is changed
+        """
+        def modifier(_group, state):
+            state.remove_active('A')
+            return state
+
+        self.returns = [[self._state_row()], None]
+        d = self.group.modify_state(modifier)
+        self.assertIsNone(self.successResultOf(d))
+        expectedCql = (
+            'INSERT INTO scaling_group("tenantId", "groupId", active, '
+            'active_count, state_version) VALUES(:tenantId, :groupId, '
+            ':active, :active_count, :state_version) USING TIMESTAMP :ts')
+        expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id,
+                        "active": '{"_ver": 1}', "active_count": 0,
+                        "state_version": -7, "ts": 0}
+        self.connection.execute.assert_called_with(
+            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+
+    def test_modify_state_writes_counts_not_stored(self):
+        """
+        ``modify_state`` writes the counts of a group that does not have them
+        stored even if their JSON is not changed
+        """
+        self.returns = [[self._state_row(active_count=None,
+                                         pending_count=None)], None]
+        d = self.group.modify_state(lambda _group, state: state)
+        self.assertIsNone(self.successResultOf(d))
+        expectedCql = (
+            'INSERT INTO scaling_group("tenantId", "groupId", active_count, '
+            'pending_count, state_version) VALUES(:tenantId, :groupId, '
+            ':active_count, :pending_count, :state_version) '
+            'USING TIMESTAMP :ts')
+        expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id,
+                        "active_count": 1, "pending_count": 0,
+                        "state_version": -7, "ts": 0}
+        self.connection.execute.assert_called_with(
+            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+
+    def test_modify_state_fixes_counts_out_of_sync(self):
+        """
+        ``modify_state`` gives the modifier the actual number of active
+        servers when the stored count is out of sync and writes it again
+        """
+        def modifier(_group, state):
+            self.assertEqual(len(state.active), 1)
+            return state
+
+        self.returns = [[self._state_row(active_count=3)], None]
+        d = self.group.modify_state(modifier)
+        self.assertIsNone(self.successResultOf(d))
+        expectedCql = (
+            'INSERT INTO scaling_group("tenantId", "groupId", active_count, '
+            'state_version) VALUES(:tenantId, :groupId, :active_count, '
+            ':state_version) USING TIMESTAMP :ts')
+        expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id,
+                        "active_count": 1, "state_version": -7, "ts": 0}
+        self.connection.execute.assert_called_with(
+            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+
+    def test_modify_state_unread_counts_not_decoded(self):
+        """
+        ``modify_state`` does not decode the JSON of counts the modifier does
+        not use, even if they are out of sync
+        """
+        loads = []
+        real_loads = json.loads
+        self.patch(json, 'loads',
+                   lambda s: loads.append(s) or real_loads(s))
+        self.returns = [[self._state_row(active_count=3)]]
+        d = self.group.modify_state(lambda _group, state: state)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertNotIn('{"A": {"id": "A"}}', loads)
+        self.assertEqual(self.connection.execute.call_count, 1)
+
+    def test_modify_state_unchanged_not_written(self):
+        """
+        ``modify_state`` does not write anything if the modifier does not
+        change the state
+        """
+        self.returns = [[self._state_row()]]
+        d = self.group.modify_state(lambda _group, state: state)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.call_count, 1)
+
     @mock.patch('otter.models.cass.CassScalingGroup.view_config',
                 return_value=defer.succeed({}))
     def test_update_status(self, mock_vc):
@@ -985,7 +1519,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             self.connection, viewCql, delCql, expectedData,
             ConsistencyLevel.QUORUM,
             matches(IsInstance(NoSuchScalingGroupError)),
-            self.mock_log)
+            self.mock_log, reaper=None)
 
     @mock.patch('otter.models.cass.CassScalingGroup.view_config',
                 return_value=defer.succeed({}))
@@ -995,14 +1529,17 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         value is None
         """
         self.clock.advance(10.345)
-        d = self.group.update_config({"b": "lah"})
+        d = self.group.update_config({"name": "g"})
         self.assertIsNone(self.successResultOf(d))  # update returns None
         expectedCql = (
             'BEGIN BATCH '
             'INSERT INTO scaling_group("tenantId", "groupId", group_config) '
             'VALUES (:tenantId, :groupId, :scaling) USING TIMESTAMP :ts '
+            'INSERT INTO scaling_group("tenantId", "groupId", group_name) '
+            'VALUES (:tenantId, :groupId, :name) USING TIMESTAMP :ts '
             'APPLY BATCH;')
-        expectedData = {"scaling": '{"_ver": 1, "b": "lah"}',
+        expectedData = {"scaling": '{"_ver": 1, "name": "g"}',
+                        "name": "g",
                         "groupId": '12345678g',
                         "tenantId": '11111', 'ts': 10345000}
         self.connection.execute.assert_called_with(
@@ -1277,13 +1814,16 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
     @mock.patch('otter.models.cass.CassScalingGroup.get_policy',
                 return_value=defer.succeed({}))
     @mock.patch('otter.models.cass.CassScalingGroup._naive_list_all_webhooks',
-                return_value=defer.succeed([{'webhookKey': 'w1'},
-                                            {'webhookKey': 'w2'}]))
+                return_value=defer.succeed(
+                    [{'webhookKey': 'w1', 'policyId': '3222'},
+                     {'webhookKey': 'w2', 'policyId': '3222'}]))
     def test_delete_policy_valid_policy(self, mock_webhooks, mock_get_policy):
         """
         When you delete a scaling policy, it checks if the policy exists and
-        if it does, deletes the policy and all its associated webhooks.
+        if it does, deletes the policy and all its associated webhooks and
+        then decrements the counts.
         """
+        self.returns = [None, None]
         d = self.group.delete_policy('3222')
         # delete returns None
         self.assertIsNone(self.successResultOf(d))
@@ -1304,9 +1844,29 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             "policyId": "3222",
             "key0webhookKey": 'w1',
             "key1webhookKey": 'w2'}
+        expected_counter_cql = (
+            'BEGIN COUNTER BATCH '
+            'DELETE FROM counts WHERE scope = :scope0 '
+            'UPDATE counts SET policies = policies + :scope1policies, '
+            'webhooks = webhooks + :scope1webhooks WHERE scope = :scope1 '
+            'UPDATE counts SET policies = policies + :scope2policies, '
+            'webhooks = webhooks + :scope2webhooks WHERE scope = :scope2 '
+            'UPDATE counts SET policies = policies + :scope3policies '
+            'WHERE scope = :scope3 '
+            'APPLY BATCH;')
+        scope = '{}/{}'.format(self.tenant_id, self.group_id)
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             mock.call(expected_counter_cql,
+                       {'scope0': scope + '/3222',
+                        'scope1': all_scope(self.tenant_id),
+                        'scope2': self.tenant_id, 'scope3': scope,
+                        'scope1policies': -1, 'scope1webhooks': -2,
+                        'scope2policies': -1, 'scope2webhooks': -2,
+                        'scope3policies': -1},
+                       ConsistencyLevel.QUORUM)])
 
     @mock.patch('otter.models.cass.CassScalingGroup.get_policy',
                 return_value=defer.fail(NoSuchPolicyError('t', 'g', 'p')))
@@ -1365,7 +1925,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             return mock_ids.pop(0)
 
         self.mock_key.side_effect = _return_uuid
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'webhooks': 0}], None, None]
         result = self.validate_create_webhooks_return_value(
             '23456789',
             [{'name': 'a name'}, {'name': 'new name', 'metadata': {"k": "v"}}])
@@ -1398,7 +1958,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             return mock_ids.pop(0)
 
         self.mock_key.side_effect = _return_uuid
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'webhooks': 0}], None, None]
         policy_id = '23456789'
 
         self.validate_create_webhooks_return_value(
@@ -1406,9 +1966,18 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             [{'name': 'a name'}, {'name': 'new name', 'metadata': {'k': 'v'}}])
 
         expected_count_cql = (
-            'SELECT COUNT(*) FROM policy_webhooks '
-            'WHERE "tenantId" = :tenantId '
-            'AND "groupId" = :groupId AND "policyId" = :policyId;')
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
+        scope = '{}/{}/{}'.format(self.tenant_id, self.group_id, policy_id)
+        expected_counter_cql = (
+            'BEGIN COUNTER BATCH '
+            'UPDATE counts SET webhooks = webhooks + :scope0webhooks '
+            'WHERE scope = :scope0 '
+            'UPDATE counts SET webhooks = webhooks + :scope1webhooks '
+            'WHERE scope = :scope1 '
+            'UPDATE counts SET webhooks = webhooks + :scope2webhooks '
+            'WHERE scope = :scope2 '
+            'APPLY BATCH;')
         expected_params = {'tenantId': self.tenant_id,
                            'groupId': self.group_id,
                            'policyId': policy_id}
@@ -1441,12 +2010,19 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         # compare
         self.assertEqual(
             self.connection.execute.mock_calls,
-            [mock.call(expected_count_cql, expected_params,
+            [mock.call(expected_count_cql, {'scope': scope},
                        ConsistencyLevel.QUORUM),
              mock.call(expected_insert_cql, mock.ANY,
+                       ConsistencyLevel.QUORUM),
+             mock.call(expected_counter_cql,
+                       {'scope0': all_scope(self.tenant_id),
+                        'scope1': self.tenant_id,
+                        'scope2': scope,
+                        'scope0webhooks': 2, 'scope1webhooks': 2,
+                        'scope2webhooks': 2},
                        ConsistencyLevel.QUORUM)])
 
-        cql_params = self.connection.execute.call_args[0][1]
+        cql_params = self.connection.execute.call_args_list[1][0][1]
 
         for name in ('webhook0', 'webhook1'):
             cql_params[name] = json.loads(cql_params[name])
@@ -1485,16 +2061,15 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         Can't add a webhook if already at limit
         """
         policy_id = '23456789'
-        self.returns = [[{'count': 1000}], None]
+        self.returns = [[{'webhooks': 1000}], None]
         d = self.group.create_webhooks(policy_id, [{}])
         self.failureResultOf(d, WebhooksOverLimitError)
 
         expected_cql = (
-            'SELECT COUNT(*) FROM policy_webhooks '
-            'WHERE "tenantId" = :tenantId '
-            'AND "groupId" = :groupId AND "policyId" = :policyId;')
-        expected_data = {'tenantId': self.tenant_id, 'groupId': self.group_id,
-                         'policyId': policy_id}
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
+        expected_data = {'scope': '{}/{}/{}'.format(
+            self.tenant_id, self.group_id, policy_id)}
 
         self.connection.execute.assert_called_once_with(
             expected_cql, expected_data, ConsistencyLevel.QUORUM)
@@ -1507,16 +2082,15 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         limit
         """
         policy_id = '23456789'
-        self.returns = [[{'count': 990}], None]
+        self.returns = [[{'webhooks': 990}], None]
         d = self.group.create_webhooks(policy_id, [{} for i in range(20)])
         self.failureResultOf(d, WebhooksOverLimitError)
 
         expected_cql = (
-            'SELECT COUNT(*) FROM policy_webhooks '
-            'WHERE "tenantId" = :tenantId '
-            'AND "groupId" = :groupId AND "policyId" = :policyId;')
-        expected_data = {'tenantId': self.tenant_id, 'groupId': self.group_id,
-                         'policyId': policy_id}
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
+        expected_data = {'scope': '{}/{}/{}'.format(
+            self.tenant_id, self.group_id, policy_id)}
 
         self.connection.execute.assert_called_once_with(
             expected_cql, expected_data, ConsistencyLevel.QUORUM)
@@ -1816,10 +2390,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         Tests that you can delete a scaling policy webhook, and if successful
         return value is None
         """
-        # return values for get webhook and then delete
+        # return values for get webhook, delete and then counts change
         self.returns = [
             _cassandrify_data([{'data': '{}', 'capability': '{"1": "h"}'}]),
-            None]
+            None, None]
         d = self.group.delete_webhook('3444', '4555')
         self.assertIsNone(self.successResultOf(d))  # delete returns None
         expectedCql = ('BEGIN BATCH '
@@ -1838,11 +2412,27 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
                         "webhookId": "4555",
                         'webhookKey': 'h'}
 
+        expectedCounterCql = (
+            'BEGIN COUNTER BATCH '
+            'UPDATE counts SET webhooks = webhooks + :scope0webhooks '
+            'WHERE scope = :scope0 '
+            'UPDATE counts SET webhooks = webhooks + :scope1webhooks '
+            'WHERE scope = :scope1 '
+            'UPDATE counts SET webhooks = webhooks + :scope2webhooks '
+            'WHERE scope = :scope2 '
+            'APPLY BATCH;')
+
         self.assertEqual(len(self.connection.execute.mock_calls),
-                         2)  # view, delete
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   expectedData,
-                                                   ConsistencyLevel.QUORUM)
+                         3)  # view, delete, counts change
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             mock.call(expectedCounterCql,
+                       {'scope0': all_scope('11111'), 'scope1': '11111',
+                        'scope2': '11111/12345678g/3444',
+                        'scope0webhooks': -1, 'scope1webhooks': -1,
+                        'scope2webhooks': -1},
+                       ConsistencyLevel.QUORUM)])
 
     def test_delete_non_existant_webhooks(self):
         """
@@ -1909,7 +2499,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             self.connection, view_cql, del_cql,
             exp_data, ConsistencyLevel.QUORUM,
             matches(IsInstance(NoSuchScalingGroupError)),
-            self.mock_log)
+            self.mock_log, reaper=None)
 
     @mock.patch('otter.models.cass.assemble_webhooks_in_policies')
     @mock.patch('otter.models.cass.verified_view')
@@ -2006,8 +2596,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
     def test_view_manifest_no_such_group(self, verified_view):
         """
         When viewing the manifest, if the group doesn't exist
-        ``NoSuchScalingGroupError`` is raised and the policies is never
-        retrieved.
+        ``NoSuchScalingGroupError`` is raised and the policies retrieved
+        are ignored.
         """
         self.group._naive_list_policies = mock.MagicMock(
             return_value=defer.succeed('policies'))
@@ -2015,7 +2605,37 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         d = self.group.view_manifest()
         self.failureResultOf(d, NoSuchScalingGroupError)
         self.flushLoggedErrors()
-        self.assertFalse(self.group._naive_list_policies.called)
+
+    @mock.patch('otter.models.cass.verified_view')
+    def test_view_manifest_reads_in_parallel(self, verified_view):
+        """
+        Group, its policies and webhooks are read at the same time
+        """
+        group_d = defer.Deferred()
+        verified_view.return_value = group_d
+        self.group._naive_list_policies = mock.Mock(
+            return_value=defer.succeed([]))
+        self.group._naive_list_all_webhooks = mock.Mock(
+            return_value=defer.succeed([]))
+
+        d = self.group.view_manifest(with_webhooks=True)
+        self.assertNoResult(d)
+        self.group._naive_list_policies.assert_called_once_with()
+        self.group._naive_list_all_webhooks.assert_called_once_with()
+        group_d.callback({
+            'tenantId': self.tenant_id,
+            'groupId': self.group_id,
+            'group_config': serialize_json_data(self.config, 1.0),
+            'launch_config': serialize_json_data(self.launch_config, 1.0),
+            'active': '{}',
+            'pending': '{}',
+            'groupTouched': None,
+            'policyTouched': '{}',
+            'paused': '\x00',
+            'desired': 0,
+            'created_at': 23
+        })
+        self.assertEqual(self.successResultOf(d)['id'], self.group_id)
 
     def test_view_manifest_resurrected_entry(self):
         """
@@ -2062,23 +2682,44 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.flushLoggedErrors(GroupNotEmptyError)
 
     @mock.patch('otter.models.cass.CassScalingGroup.view_state')
+    def test_delete_stale_count_scaling_group_fails(self, mock_view_state):
+        """
+        ``delete_group`` errbacks with :class:`GroupNotEmptyError` if scaling
+        group state has servers even though their stored count is 0
+        """
+        mock_view_state.return_value = defer.succeed(GroupState(
+            self.tenant_id, self.group_id, '',
+            LazyJSONMap('{"1": {}}', 0), LazyJSONMap('{}', 0),
+            None, {}, False))
+        self.failureResultOf(self.group.delete_group(), GroupNotEmptyError)
+        self.assertFalse(self.connection.execute.called)
+        self.flushLoggedErrors(GroupNotEmptyError)
+
+    @mock.patch('otter.models.cass.CassScalingGroup.view_state')
+    @mock.patch('otter.models.cass.CassScalingGroup._naive_list_policies')
     @mock.patch('otter.models.cass.CassScalingGroup._naive_list_all_webhooks')
     def test_delete_empty_scaling_group_with_policies(self, mock_naive,
+                                                      mock_policies,
                                                       mock_view_state):
         """
         ``delete_group`` deletes config, launch config, state, and the group's
-        policies and webhooks if the scaling group is empty.
+        policies and webhooks if the scaling group is empty and then
+        decrements the counts.
         """
         mock_view_state.return_value = defer.succeed(GroupState(
             self.tenant_id, self.group_id, '', {}, {}, None, {}, False))
+        mock_policies.return_value = defer.succeed(
+            [{'id': 'p1'}, {'id': 'p2'}])
         mock_naive.return_value = defer.succeed(
-            [{'webhookKey': 'w1'}, {'webhookKey': 'w2'}])
+            [{'webhookKey': 'w1', 'policyId': 'p1'},
+             {'webhookKey': 'w2', 'policyId': 'p1'}])
 
-        self.returns = [None]
+        self.returns = [None, None]
         self.clock.advance(34.575)
         result = self.successResultOf(self.group.delete_group())
         self.assertIsNone(result)  # delete returns None
         mock_naive.assert_called_once_with()
+        mock_policies.assert_called_once_with()
 
         expected_data = {'tenantId': self.tenant_id,
                          'groupId': self.group_id,
@@ -2102,9 +2743,32 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
 
             'APPLY BATCH;')
+        expected_counter_cql = (
+            'BEGIN COUNTER BATCH '
+            'DELETE FROM counts WHERE scope = :scope0 '
+            'DELETE FROM counts WHERE scope = :scope1 '
+            'DELETE FROM counts WHERE scope = :scope2 '
+            'UPDATE counts SET groups = groups + :scope3groups, '
+            'policies = policies + :scope3policies, '
+            'webhooks = webhooks + :scope3webhooks WHERE scope = :scope3 '
+            'UPDATE counts SET groups = groups + :scope4groups, '
+            'policies = policies + :scope4policies, '
+            'webhooks = webhooks + :scope4webhooks WHERE scope = :scope4 '
+            'APPLY BATCH;')
+        scope = '{}/{}'.format(self.tenant_id, self.group_id)
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             mock.call(expected_counter_cql,
+                       {'scope0': scope, 'scope1': scope + '/p1',
+                        'scope2': scope + '/p2',
+                        'scope3': all_scope(self.tenant_id),
+                        'scope4': self.tenant_id,
+                        'scope3groups': -1, 'scope3policies': -2,
+                        'scope3webhooks': -2, 'scope4groups': -1,
+                        'scope4policies': -2, 'scope4webhooks': -2},
+                       ConsistencyLevel.QUORUM)])
 
         self.kz_client.Lock.assert_called_once_with(
             '/locks/' + self.group.uuid)
@@ -2114,8 +2778,11 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             '/locks/' + self.group.uuid, recursive=True)
 
     @mock.patch('otter.models.cass.CassScalingGroup.view_state')
+    @mock.patch('otter.models.cass.CassScalingGroup._naive_list_policies',
+                return_value=defer.succeed([]))
     @mock.patch('otter.models.cass.CassScalingGroup._naive_list_all_webhooks')
     def test_delete_empty_scaling_group_with_zero_policies(self, mock_naive,
+                                                           mock_policies,
                                                            mock_view_state):
         """
         ``delete_group`` deletes config, launch config, state, and the group's
@@ -2126,7 +2793,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             self.tenant_id, self.group_id, '', {}, {}, None, {}, False))
         mock_naive.return_value = defer.succeed([])
 
-        self.returns = [None]
+        self.returns = [None, None]
         self.clock.advance(34.575)
         result = self.successResultOf(self.group.delete_group())
         self.assertIsNone(result)  # delete returns None
@@ -2147,9 +2814,25 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             'DELETE FROM scaling_group USING TIMESTAMP :ts '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
             'APPLY BATCH;')
+        expected_counter_cql = (
+            'BEGIN COUNTER BATCH '
+            'DELETE FROM counts WHERE scope = :scope0 '
+            'UPDATE counts SET groups = groups + :scope1groups '
+            'WHERE scope = :scope1 '
+            'UPDATE counts SET groups = groups + :scope2groups '
+            'WHERE scope = :scope2 '
+            'APPLY BATCH;')
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             mock.call(expected_counter_cql,
+                       {'scope0': '{}/{}'.format(self.tenant_id,
+                                                 self.group_id),
+                        'scope1': all_scope(self.tenant_id),
+                        'scope2': self.tenant_id,
+                        'scope1groups': -1, 'scope2groups': -1},
+                       ConsistencyLevel.QUORUM)])
 
         self.kz_client.Lock.assert_called_once_with(
             '/locks/' + self.group.uuid)
@@ -2194,62 +2877,305 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.assertEqual(log.bind().bind().msg.call_count, 4)
 
 
-class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
+class CassScalingGroupConfigCacheTests(CassScalingGroupTestCase):
     """
-    Tests for `ScalingGroup.update_policy`
+    Tests for caching of config, launch config and policies by
+    :class:`CassScalingGroup`
     """
 
     def setUp(self):
         """
-        Mock `get_policy`
+        Group with config cache
         """
-        super(CassScalingGroupUpdatePolicyTests, self).setUp()
-        self.get_policy = patch(
-            self, 'otter.models.cass.CassScalingGroup.get_policy')
+        super(CassScalingGroupConfigCacheTests, self).setUp()
+        self.kz_client.exists.side_effect = (
+            lambda path, watch: defer.succeed(None))
+        self.kz_client.set.side_effect = lambda path, data: defer.succeed(None)
+        self.group.config_cache = GroupConfigCache(self.clock, 10, mock_log())
 
-    def validate_policy_update(self, policy_json):
+    def test_view_config_cached(self):
         """
-        Validate CQL calls made to update the policy
+        Config and launch config are read from cassandra once
         """
-        expectedCql = (
-            'BEGIN BATCH '
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}],
+                        [{'launch_config': '{"b": 2}', 'created_at': 24}]]
+        for _ in range(2):
+            self.assertEqual(self.successResultOf(self.group.view_config()),
+                             {'a': 1})
+            self.assertEqual(
+                self.successResultOf(self.group.view_launch_config()),
+                {'b': 2})
+        self.assertEqual(self.connection.execute.call_count, 2)
 
-            'INSERT INTO scaling_policies("tenantId", "groupId", "policyId", '
-            'data, version) '
-            'VALUES (:tenantId, :groupId, :policyId, :data, :version) '
+    def test_get_policy_cached(self):
+        """
+        Policy is read from cassandra once and its version is checked against
+        the cached one
+        """
+        self.returns = [[{'data': '{"name": "p"}', 'version': 'v1'}]]
+        d = self.group.get_policy('p1', version='v1')
+        self.assertEqual(self.successResultOf(d), {'name': 'p'})
+        d = self.group.get_policy('p1', version='v2')
+        self.failureResultOf(d, NoSuchPolicyError)
+        self.assertEqual(self.connection.execute.call_count, 1)
 
-            'APPLY BATCH;')
-        expectedData = {"data": policy_json,
-                        "groupId": '12345678g',
-                        "policyId": '12345678',
-                        "tenantId": '11111',
-                        "version": "timeuuid"}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+    def test_update_config_invalidates(self):
+        """
+        Updating config invalidates the cached config
+        """
+        self.returns = [[{'group_config': '{"name": "a"}', 'created_at': 24}],
+                        None,
+                        [{'group_config': '{"name": "b"}', 'created_at': 24}]]
+        self.successResultOf(self.group.view_config())
+        self.successResultOf(self.group.update_config({'name': 'b'}))
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'name': 'b'})
+        self.assertEqual(self.connection.execute.call_count, 3)
 
-    def test_update_scaling_policy(self):
+    def test_update_policy_invalidates(self):
         """
-        Test that you can update a scaling policy, and if successful it returns
-        None
+        Updating policy invalidates the cached policy
         """
-        self.returns = [None]
-        self.get_policy.return_value = defer.succeed({"type": "helvetica"})
-        d = self.group.update_policy(
-            '12345678', {"b": "lah", "type": "helvetica"})
-        self.assertIsNone(self.successResultOf(d))  # update returns None
-        self.validate_policy_update(
-            '{"_ver": 1, "b": "lah", "type": "helvetica"}')
+        self.returns = [[{'data': '{"type": "webhook"}', 'version': 'v1'}],
+                        None,
+                        [{'data': '{"type": "webhook", "change": 2}',
+                          'version': 'v2'}]]
+        self.successResultOf(self.group.update_policy(
+            'p1', {'type': 'webhook', 'change': 2}))
+        self.assertEqual(self.successResultOf(self.group.get_policy('p1')),
+                         {'type': 'webhook', 'change': 2})
 
-    def test_update_scaling_policy_schedule_no_change(self):
+    def test_changes_through_zookeeper(self):
         """
-        Schedule policy update with no args difference also updates
-        scaling_schedule_v2 table.
+        Changes are told to other processes by changing group's znode
         """
-        self.returns = [None]
-        self.get_policy.return_value = defer.succeed(
-            {"type": "schedule", "args": {"cron": "1 * * * *"}})
-        d = self.group.update_policy(
-            '12345678', {"type": "schedule", "args": {"cron": "1 * * * *"}})
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}],
+                        None]
+        self.successResultOf(self.group.update_launch_config({'b': 2}))
+        self.kz_client.set.assert_called_once_with(
+            '/config_versions/12345678g', '')
+
+
+class CassScalingGroupCASStateTests(LockMixin, SynchronousTestCase):
+    """
+    Tests for :meth:`CassScalingGroup.modify_state` with compare-and-set
+    """
+
+    def setUp(self):
+        """
+        Group that modifies state with compare-and-set
+        """
+        self.tenant_id = '11111'
+        self.group_id = '12345678g'
+        self.returns = []
+        self.connection = mock.Mock(spec=CQLClient)
+        self.connection.execute.side_effect = \
+            lambda *a: defer.succeed(self.returns.pop(0))
+        self.kz_client = mock.Mock()
+        self.kz_client.Lock.return_value = self.mock_lock()
+        self.clock = Clock()
+        self.group = CassScalingGroup(
+            mock.Mock(), self.tenant_id, self.group_id, self.connection,
+            None, self.kz_client, self.clock, WeakLocks(),
+            cas_state_writes=True)
+        self.modified = []
+        self.modifier = repeatable_modifier(partial(self._modifier))
+
+    def _row(self, version):
+        """
+        Group row as read by ``view_state`` with given state version
+        """
+        return {'tenantId': self.tenant_id,
+                'groupId': self.group_id,
+                'group_config': '{"name": "a"}',
+                'active': '{}',
+                'pending': '{}',
+                'active_count': 0,
+                'pending_count': 0,
+                'groupTouched': '2014-01-01T00:00:05Z.1234',
+                'policyTouched': '{}',
+                'paused': '\x00',
+                'desired': 1,
+                'state_version': version,
+                'created_at': 23}
+
+    def _modifier(self, _group, state, desired):
+        self.modified.append(state.desired)
+        state.desired = desired
+        return state
+
+    def _update_call(self, condition, **params):
+        params.update(tenantId=self.tenant_id, groupId=self.group_id)
+        return mock.call(
+            'UPDATE scaling_group SET desired = :desired, '
+            'state_version = :new_version '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+            'IF state_version = ' + condition,
+            params, ConsistencyLevel.QUORUM)
+
+    def test_writes_if_version_unchanged(self):
+        """
+        Changed columns are written and the version is incremented only if it
+        is still the version that was read, without taking any lock
+        """
+        self.returns = [[self._row(3)], [{'[applied]': '\x01'}]]
+        d = self.group.modify_state(self.modifier, 5)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            self.connection.execute.call_args,
+            self._update_call(':state_version', desired=5, new_version=4,
+                              state_version=3))
+        self.assertFalse(self.kz_client.Lock.called)
+
+    def test_writes_if_no_version(self):
+        """
+        The state of a group that does not have a version is written only if
+        it still does not have one
+        """
+        self.returns = [[self._row(None)], [{'[applied]': '\x01'}]]
+        d = self.group.modify_state(self.modifier, 5)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.call_args,
+                         self._update_call('null', desired=5, new_version=1))
+
+    def test_retries_on_conflict(self):
+        """
+        If the version changed since it was read, the state is read and
+        modified again after a short delay
+        """
+        self.returns = [[self._row(3)], [{'[applied]': '\x00'}],
+                        [dict(self._row(4), desired=2)],
+                        [{'[applied]': '\x01'}]]
+        d = self.group.modify_state(self.modifier, 5)
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.modified, [1, 2])
+        self.assertEqual(
+            self.connection.execute.call_args,
+            self._update_call(':state_version', desired=5, new_version=5,
+                              state_version=4))
+
+    def test_gives_up_on_conflicts(self):
+        """
+        If the state keeps conflicting, modification fails with
+        :class:`StateConflictError` after ``CAS_RETRIES`` retries
+        """
+        self.returns = [[self._row(3)], [{'[applied]': '\x00'}]] * (
+            CAS_RETRIES + 1)
+        d = self.group.modify_state(self.modifier, 5)
+        for _ in range(CAS_RETRIES):
+            self.clock.advance(0.1)
+        self.failureResultOf(d, StateConflictError)
+        self.assertEqual(len(self.modified), CAS_RETRIES + 1)
+        self.assertEqual(self.returns, [])
+
+    def test_modifier_error_not_retried(self):
+        """
+        Errors other than conflicts are not retried and nothing is written
+        """
+        self.returns = [[self._row(3)]]
+
+        @repeatable_modifier
+        def modifier(_group, state):
+            raise ValueError('bad')
+
+        d = self.group.modify_state(modifier)
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.connection.execute.call_count, 1)
+
+    def test_unchanged_not_written(self):
+        """
+        Nothing is written if the modifier does not change the state
+        """
+        self.returns = [[self._row(3)]]
+        d = self.group.modify_state(
+            repeatable_modifier(lambda _group, state: state))
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.call_count, 1)
+
+    def test_not_repeatable_locked(self):
+        """
+        A modifier that is not marked repeatable is called with the group
+        locked, and its state is still written only if the version is
+        unchanged so that concurrent compare-and-set writes are not lost
+        """
+        self.returns = [[self._row(3)], [{'[applied]': '\x01'}]]
+        d = self.group.modify_state(self._modifier, 5)
+        self.assertIsNone(self.successResultOf(d))
+        self.kz_client.Lock.assert_called_once_with('/locks/12345678g')
+        self.assertEqual(
+            self.connection.execute.call_args,
+            self._update_call(':state_version', desired=5, new_version=4,
+                              state_version=3))
+
+    def test_not_repeatable_not_retried(self):
+        """
+        A modifier that is not marked repeatable is not called again if its
+        write conflicts; :class:`StateConflictError` is raised instead
+        """
+        self.returns = [[self._row(3)], [{'[applied]': '\x00'}]]
+        d = self.group.modify_state(self._modifier, 5)
+        self.failureResultOf(d, StateConflictError)
+        self.assertEqual(self.modified, [1])
+
+
+class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
+    """
+    Tests for `ScalingGroup.update_policy`
+    """
+
+    def setUp(self):
+        """
+        Mock `get_policy`
+        """
+        super(CassScalingGroupUpdatePolicyTests, self).setUp()
+        self.get_policy = patch(
+            self, 'otter.models.cass.CassScalingGroup.get_policy')
+
+    def validate_policy_update(self, policy_json):
+        """
+        Validate CQL calls made to update the policy
+        """
+        expectedCql = (
+            'BEGIN BATCH '
+
+            'INSERT INTO scaling_policies("tenantId", "groupId", "policyId", '
+            'data, version) '
+            'VALUES (:tenantId, :groupId, :policyId, :data, :version) '
+
+            'APPLY BATCH;')
+        expectedData = {"data": policy_json,
+                        "groupId": '12345678g',
+                        "policyId": '12345678',
+                        "tenantId": '11111',
+                        "version": "timeuuid"}
+        self.connection.execute.assert_called_with(
+            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+
+    def test_update_scaling_policy(self):
+        """
+        Test that you can update a scaling policy, and if successful it returns
+        None
+        """
+        self.returns = [None]
+        self.get_policy.return_value = defer.succeed({"type": "helvetica"})
+        d = self.group.update_policy(
+            '12345678', {"b": "lah", "type": "helvetica"})
+        self.assertIsNone(self.successResultOf(d))  # update returns None
+        self.validate_policy_update(
+            '{"_ver": 1, "b": "lah", "type": "helvetica"}')
+
+    def test_update_scaling_policy_schedule_no_change(self):
+        """
+        Schedule policy update with no args difference also updates
+        scaling_schedule_v2 table.
+        """
+        self.returns = [None]
+        self.get_policy.return_value = defer.succeed(
+            {"type": "schedule", "args": {"cron": "1 * * * *"}})
+        d = self.group.update_policy(
+            '12345678', {"type": "schedule", "args": {"cron": "1 * * * *"}})
         self.assertIsNone(self.successResultOf(d))
         expected_cql = (
             'BEGIN BATCH '
@@ -2393,15 +3319,14 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         If current policies is at max policies, fail with
         PoliciesOverLimitError
         """
-        self.returns = [[{'count': 1000}]]
+        self.returns = [[{'policies': 1000}]]
         d = self.group.create_policies([{"b": "lah"}])
         self.failureResultOf(d, PoliciesOverLimitError)
 
         expected_cql = (
-            'SELECT COUNT(*) FROM scaling_policies '
-            'WHERE "tenantId" = :tenantId '
-            'AND "groupId" = :groupId;')
-        expected_data = {'tenantId': self.tenant_id, 'groupId': self.group_id}
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
+        expected_data = {'scope': '11111/12345678g'}
 
         self.connection.execute.assert_called_once_with(
             expected_cql, expected_data, ConsistencyLevel.QUORUM)
@@ -2411,15 +3336,14 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         If current policies + new policies will go over max policies, fail with
         PoliciesOverLimitError
         """
-        self.returns = [[{'count': 998}]]
+        self.returns = [[{'policies': 998}]]
         d = self.group.create_policies([{"b": "lah"}] * 5)
         self.failureResultOf(d, PoliciesOverLimitError)
 
         expected_cql = (
-            'SELECT COUNT(*) FROM scaling_policies '
-            'WHERE "tenantId" = :tenantId '
-            'AND "groupId" = :groupId;')
-        expected_data = {'tenantId': self.tenant_id, 'groupId': self.group_id}
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
+        expected_data = {'scope': '11111/12345678g'}
 
         self.connection.execute.assert_called_once_with(
             expected_cql, expected_data, ConsistencyLevel.QUORUM)
@@ -2430,7 +3354,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         that there is such a scaling group
         """
         self.group.view_config = mock.MagicMock(return_value=defer.succeed({}))
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'policies': 0}], None, None]
         d = self.group.create_policies([{"b": "lah"}])
         self.successResultOf(d)
         self.group.view_config.assert_called_once_with()
@@ -2440,7 +3364,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy, and what is returned is a
         list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'policies': 0}], None, None]
         d = self.group.create_policies([{"b": "lah"}])
         result = self.successResultOf(d)
         expectedCql = (
@@ -2457,8 +3381,24 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
                         "groupId": '12345678g',
                         "policy0policyId": '12345678',
                         "tenantId": '11111'}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        expectedCounterCql = (
+            'BEGIN COUNTER BATCH '
+            'UPDATE counts SET policies = policies + :scope0policies '
+            'WHERE scope = :scope0 '
+            'UPDATE counts SET policies = policies + :scope1policies '
+            'WHERE scope = :scope1 '
+            'UPDATE counts SET policies = policies + :scope2policies '
+            'WHERE scope = :scope2 '
+            'APPLY BATCH;')
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             mock.call(expectedCounterCql,
+                       {'scope0': all_scope('11111'), 'scope1': '11111',
+                        'scope2': '11111/12345678g',
+                        'scope0policies': 1, 'scope1policies': 1,
+                        'scope2policies': 1},
+                       ConsistencyLevel.QUORUM)])
 
         self.assertEqual(result, [{'b': 'lah',
                                    'id': self.mock_key.return_value}])
@@ -2470,7 +3410,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy with 'at' schedule and what is
         returned is a list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'policies': 0}], None, None]
         expected_at = '2012-10-20T03:23:45'
         pol = {'cooldown': 5,
                'type': 'schedule',
@@ -2504,8 +3444,9 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
             "tenantId": '11111',
             "policy0bucket": 2,
             "policy0version": 'timeuuid'}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM))
 
         pol['id'] = self.mock_key.return_value
         self.assertEqual(result, [pol])
@@ -2515,7 +3456,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy with 'cron' schedule and what is
         returned is a list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'policies': 0}], None, None]
         pol = {'cooldown': 5,
                'type': 'schedule',
                'name': 'scale up by 10',
@@ -2550,8 +3491,9 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
                         "policy0cron": "* * * * *",
                         "policy0bucket": 2,
                         "policy0version": "timeuuid"}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM))
 
         pol['id'] = self.mock_key.return_value
         self.assertEqual(result, [pol])
@@ -2699,6 +3641,153 @@ class CassScalingScheduleCollectionTestCase(
             [mock.call(fetch_cql, fetch_data, ConsistencyLevel.QUORUM),
              mock.call(del_cql, del_data, ConsistencyLevel.QUORUM)])
 
+    def test_fetch_and_delete_buckets(self):
+        """
+        Events of many buckets are fetched in one query and deleted from
+        their respective buckets
+        """
+        self.returns = [[{'bucket': 2,
+                          'tenantId': '1d2',
+                          'groupId': 'gr2',
+                          'policyId': 'ef',
+                          'trigger': 100,
+                          'cron': 'c1',
+                          'version': 'uuid1'},
+                         {'bucket': 5,
+                          'tenantId': '1d2',
+                          'groupId': 'gr2',
+                          'policyId': 'ex',
+                          'trigger': 122,
+                          'cron': 'c2',
+                          'version': 'uuid2'}],
+                        None]
+
+        fetch_data = {'bucket0': 2, 'bucket1': 5, 'bucket2': 7, 'now': 1234,
+                      'size': 100}
+        fetch_cql = (
+            'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", '
+            'cron, version '
+            'FROM scaling_schedule_v2 '
+            'WHERE bucket IN (:bucket0, :bucket1, :bucket2) '
+            'AND trigger <= :now LIMIT :size;')
+        del_cql = ('BEGIN BATCH '
+
+                   'DELETE FROM scaling_schedule_v2 '
+                   'WHERE bucket = :event0bucket '
+                   'AND trigger = :event0trigger '
+                   'AND "policyId" = :event0policyId; '
+
+                   'DELETE FROM scaling_schedule_v2 '
+                   'WHERE bucket = :event1bucket '
+                   'AND trigger = :event1trigger '
+                   'AND "policyId" = :event1policyId; '
+
+                   'APPLY BATCH;')
+        del_data = {'event0bucket': 2, 'event0trigger': 100,
+                    'event0policyId': 'ef',
+                    'event1bucket': 5, 'event1trigger': 122,
+                    'event1policyId': 'ex'}
+
+        result = self.successResultOf(
+            self.collection.fetch_and_delete_buckets([2, 5, 7], 1234, 100))
+
+        self.assertEqual(
+            result,
+            [{'tenantId': '1d2', 'groupId': 'gr2', 'policyId': 'ef',
+              'trigger': 100, 'cron': 'c1', 'version': 'uuid1'},
+             {'tenantId': '1d2', 'groupId': 'gr2', 'policyId': 'ex',
+              'trigger': 122, 'cron': 'c2', 'version': 'uuid2'}])
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(fetch_cql, fetch_data, ConsistencyLevel.QUORUM),
+             mock.call(del_cql, del_data, ConsistencyLevel.QUORUM)])
+
+    def test_fetch_and_delete_buckets_empty(self):
+        """
+        Nothing is deleted if there are no events in any of the buckets
+        """
+        self.returns = [[]]
+        d = self.collection.fetch_and_delete_buckets([2, 5], 1234, 100)
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertEqual(self.connection.execute.call_count, 1)
+
+    def test_get_upcoming_events(self):
+        """
+        Events of many buckets are got in one query along with their buckets
+        without deleting them
+        """
+        events = [{'bucket': 2, 'tenantId': '1d2', 'groupId': 'gr2',
+                   'policyId': 'ef', 'trigger': 100, 'cron': 'c1',
+                   'version': 'uuid1'}]
+        self.returns = [events]
+        d = self.collection.get_upcoming_events([2, 5], 1234, 50)
+        self.assertEqual(self.successResultOf(d), events)
+        self.connection.execute.assert_called_once_with(
+            'SELECT bucket, "tenantId", "groupId", "policyId", "trigger", '
+            'cron, version '
+            'FROM scaling_schedule_v2 '
+            'WHERE bucket IN (:bucket0, :bucket1) '
+            'AND trigger <= :now LIMIT :size;',
+            {'bucket0': 2, 'bucket1': 5, 'now': 1234, 'size': 50},
+            ConsistencyLevel.QUORUM)
+
+    def test_get_upcoming_events_paged(self):
+        """
+        If events of all the buckets fill a page, events of each bucket are
+        paged through by trigger and policy ID so that no bucket is left out
+        """
+        def event(bucket, policy_id, trigger):
+            return {'bucket': bucket, 'tenantId': 't', 'groupId': 'g',
+                    'policyId': policy_id, 'trigger': trigger, 'cron': None,
+                    'version': 'v'}
+
+        e1, e2, e3, e4 = (event(2, 'a', 10), event(2, 'b', 10),
+                          event(2, 'c', 20), event(5, 'a', 30))
+        self.returns = [[e1, e2], [e1, e2], [], [e3], [e4]]
+        d = self.collection.get_upcoming_events([2, 5], 1234, 2)
+        self.assertEqual(self.successResultOf(d), [e1, e2, e3, e4])
+        select = ('SELECT bucket, "tenantId", "groupId", "policyId", '
+                  '"trigger", cron, version FROM scaling_schedule_v2 ')
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(select + 'WHERE bucket = :bucket AND trigger <= :now '
+                       'LIMIT :size;',
+                       {'bucket': 2, 'now': 1234, 'size': 2},
+                       ConsistencyLevel.QUORUM),
+             mock.call(select + 'WHERE bucket = :bucket AND '
+                       'trigger = :trigger AND "policyId" > :policyId '
+                       'LIMIT :size;',
+                       {'bucket': 2, 'trigger': 10, 'policyId': 'b',
+                        'size': 2},
+                       ConsistencyLevel.QUORUM),
+             mock.call(select + 'WHERE bucket = :bucket AND '
+                       'trigger > :trigger AND trigger <= :now LIMIT :size;',
+                       {'bucket': 2, 'trigger': 10, 'now': 1234, 'size': 2},
+                       ConsistencyLevel.QUORUM),
+             mock.call(select + 'WHERE bucket = :bucket AND trigger <= :now '
+                       'LIMIT :size;',
+                       {'bucket': 5, 'now': 1234, 'size': 2},
+                       ConsistencyLevel.QUORUM)])
+
+    def test_delete_events(self):
+        """
+        Events are deleted from their buckets in a batch
+        """
+        d = self.collection.delete_events(
+            [{'bucket': 2, 'policyId': 'ef', 'trigger': 100},
+             {'bucket': 5, 'policyId': 'ex', 'trigger': 122}])
+        self.assertIsNone(self.successResultOf(d))
+        self.connection.execute.assert_called_once_with(
+            'BEGIN BATCH '
+            'DELETE FROM scaling_schedule_v2 WHERE bucket = :event0bucket '
+            'AND trigger = :event0trigger AND "policyId" = :event0policyId; '
+            'DELETE FROM scaling_schedule_v2 WHERE bucket = :event1bucket '
+            'AND trigger = :event1trigger AND "policyId" = :event1policyId; '
+            'APPLY BATCH;',
+            {'event0bucket': 2, 'event0trigger': 100, 'event0policyId': 'ef',
+             'event1bucket': 5, 'event1trigger': 122, 'event1policyId': 'ex'},
+            ConsistencyLevel.QUORUM)
+
     def test_add_cron_events(self):
         """
         Tests for `add_cron_events`
@@ -2781,7 +3870,7 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         set_config_data({'limits': {'absolute': {'maxGroups': 1000}}})
         self.addCleanup(set_config_data, {})
 
-        self.returns = [[{"count": 0}], None]
+        self.returns = [[{"groups": 0}], None, None]
 
         def _responses(*args):
             result = self.returns.pop(0)
@@ -2833,11 +3922,14 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.clock.advance(10.345)
         expectedData = {
             'group_config': _S(self.config),
+            'group_name': self.config['name'],
             'launch_config': _S(self.launch),
             'groupId': '12345678',
             'tenantId': '123',
             "active": '{}',
             "pending": '{}',
+            "active_count": 0,
+            "pending_count": 0,
             "policyTouched": '{}',
             "paused": False,
             "desired": 0,
@@ -2846,11 +3938,11 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
             'BEGIN BATCH '
 
             'INSERT INTO scaling_group("tenantId", "groupId", group_config, '
-            'launch_config, active, pending, "policyTouched", '
-            'paused, desired, created_at) '
-            'VALUES (:tenantId, :groupId, :group_config, :launch_config, '
-            ':active, :pending, :policyTouched, :paused, :desired, '
-            ':created_at) '
+            'group_name, launch_config, active, pending, active_count, '
+            'pending_count, "policyTouched", paused, desired, created_at) '
+            'VALUES (:tenantId, :groupId, :group_config, :group_name, '
+            ':launch_config, :active, :pending, :active_count, '
+            ':pending_count, :policyTouched, :paused, :desired, :created_at) '
             'USING TIMESTAMP :ts '
 
             'APPLY BATCH;')
@@ -2867,13 +3959,24 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
 
         # Verify data argument seperately since data in actual call will have
         # datetime.utcnow which cannot be mocked or predicted.
-        data = self.connection.execute.call_args[0][1]
+        data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(data.pop('created_at'), datetime))
         self.assertEqual(expectedData, data)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM))
+        self.assertEqual(
+            self.connection.execute.mock_calls[2],
+            mock.call('BEGIN COUNTER BATCH '
+                      'UPDATE counts SET groups = groups + :scope0groups '
+                      'WHERE scope = :scope0 '
+                      'UPDATE counts SET groups = groups + :scope1groups '
+                      'WHERE scope = :scope1 '
+                      'APPLY BATCH;',
+                      {'scope0': all_scope('123'), 'scope1': '123',
+                       'scope0groups': 1, 'scope1groups': 1},
+                      ConsistencyLevel.QUORUM))
 
     def test_create_with_policy(self):
         """
@@ -2885,11 +3988,14 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.clock.advance(10.567)
         expectedData = {
             'group_config': _S(self.config),
+            'group_name': self.config['name'],
             'launch_config': _S(self.launch),
             'groupId': '12345678',
             'tenantId': '123',
             "active": '{}',
             "pending": '{}',
+            "active_count": 0,
+            "pending_count": 0,
             "desired": 0,
             "ts": 10567000,
             "policyTouched": '{}',
@@ -2901,11 +4007,11 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
             'BEGIN BATCH '
 
             'INSERT INTO scaling_group("tenantId", "groupId", group_config, '
-            'launch_config, active, pending, "policyTouched", paused, '
-            'desired, created_at) '
-            'VALUES (:tenantId, :groupId, :group_config, :launch_config, '
-            ':active, :pending, :policyTouched, :paused, :desired, '
-            ':created_at) '
+            'group_name, launch_config, active, pending, active_count, '
+            'pending_count, "policyTouched", paused, desired, created_at) '
+            'VALUES (:tenantId, :groupId, :group_config, :group_name, '
+            ':launch_config, :active, :pending, :active_count, '
+            ':pending_count, :policyTouched, :paused, :desired, :created_at) '
             'USING TIMESTAMP :ts '
 
             'INSERT INTO scaling_policies("tenantId", "groupId", "policyId", '
@@ -2927,13 +4033,13 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(result['id'], self.mock_key.return_value)
         self.assertTrue(isinstance(result['state'], GroupState))
 
-        called_data = self.connection.execute.call_args[0][1]
+        called_data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(called_data.pop('created_at'), datetime))
         self.assertEqual(called_data, expectedData)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM))
 
     def test_create_with_policy_multiple(self):
         """
@@ -2945,11 +4051,14 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.clock.advance(10.466)
         expectedData = {
             'group_config': _S(self.config),
+            'group_name': self.config['name'],
             'launch_config': _S(self.launch),
             'groupId': '1',
             'tenantId': '123',
             "active": '{}',
             "pending": '{}',
+            "active_count": 0,
+            "pending_count": 0,
             "policyTouched": '{}',
             "paused": False,
             "desired": 0,
@@ -2964,11 +4073,11 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
             'BEGIN BATCH '
 
             'INSERT INTO scaling_group("tenantId", "groupId", group_config, '
-            'launch_config, active, pending, "policyTouched", paused, '
-            'desired, created_at) '
-            'VALUES (:tenantId, :groupId, :group_config, :launch_config, '
-            ':active, :pending, :policyTouched, :paused, :desired, '
-            ':created_at) '
+            'group_name, launch_config, active, pending, active_count, '
+            'pending_count, "policyTouched", paused, desired, created_at) '
+            'VALUES (:tenantId, :groupId, :group_config, :group_name, '
+            ':launch_config, :active, :pending, :active_count, '
+            ':pending_count, :policyTouched, :paused, :desired, :created_at) '
             'USING TIMESTAMP :ts '
 
             'INSERT INTO scaling_policies("tenantId", "groupId", "policyId", '
@@ -3002,29 +4111,49 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(result['id'], '1')
         self.assertTrue(isinstance(result['state'], GroupState))
 
-        called_data = self.connection.execute.call_args[0][1]
+        called_data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(called_data.pop('created_at'), datetime))
         self.assertEqual(called_data, expectedData)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM))
+        self.assertEqual(
+            self.connection.execute.mock_calls[2],
+            mock.call('BEGIN COUNTER BATCH '
+                      'UPDATE counts SET groups = groups + :scope0groups, '
+                      'policies = policies + :scope0policies '
+                      'WHERE scope = :scope0 '
+                      'UPDATE counts SET groups = groups + :scope1groups, '
+                      'policies = policies + :scope1policies '
+                      'WHERE scope = :scope1 '
+                      'UPDATE counts '
+                      'SET policies = policies + :scope2policies '
+                      'WHERE scope = :scope2 '
+                      'APPLY BATCH;',
+                      {'scope0': all_scope('123'), 'scope1': '123',
+                       'scope2': '123/1',
+                       'scope0groups': 1, 'scope0policies': 2,
+                       'scope1groups': 1, 'scope1policies': 2,
+                       'scope2policies': 2},
+                      ConsistencyLevel.QUORUM))
 
     def test_max_groups_underlimit(self):
         """
         test scaling group creation when below maxGroups limit
         """
-        self.returns = [[{'count': 1}], None]
+        self.returns = [[{'groups': 1}], None, None]
+        self.mock_key.return_value = '12345678'
 
-        expectedData = {'tenantId': '1234'}
-        expectedCQL = ('SELECT COUNT(*) FROM scaling_group '
-                       'WHERE "tenantId" = :tenantId;')
+        expectedData = {'scope': '1234'}
+        expectedCQL = ('SELECT groups, policies, webhooks FROM counts '
+                       'WHERE scope = :scope;')
 
         d = self.collection.create_scaling_group(
             mock.Mock(), '1234', self.config, self.launch)
         self.assertTrue(isinstance(self.successResultOf(d), dict))
 
-        self.assertEqual(len(self.connection.execute.mock_calls), 2)
+        self.assertEqual(len(self.connection.execute.mock_calls), 3)
         self.assertEqual(
             self.connection.execute.mock_calls[0],
             mock.call(expectedCQL, expectedData, ConsistencyLevel.QUORUM))
@@ -3034,12 +4163,12 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         test scaling group creation when at maxGroups limit
         """
         set_config_data({'limits': {'absolute': {'maxGroups': 1}}})
-        self.returns = [[{'count': 1}]]
+        self.returns = [[{'groups': 1}]]
 
-        expectedData = {'tenantId': '1234'}
+        expectedData = {'scope': '1234'}
         expectedCQL = (
-            'SELECT COUNT(*) FROM scaling_group '
-            'WHERE "tenantId" = :tenantId;')
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;')
 
         d = self.collection.create_scaling_group(
             mock.Mock(), '1234', self.config, self.launch)
@@ -3280,6 +4409,121 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
                                         policy_touched={},
                                         paused=False)])
 
+    def test_list_states_queues_resurrected_groups(self):
+        """
+        If the collection has a reaper, resurrected groups are queued to it
+        instead of being deleted
+        """
+        self.collection.reaper = mock.Mock()
+        self.returns = [[
+            {'tenantId': '123', 'groupId': 'group123',
+             'group_config': '{"name": "test123"}', 'active': '{}',
+             'pending': '{}', 'groupTouched': None, 'policyTouched': '{}',
+             'paused': '\x00', 'desired': 0, 'created_at': 23},
+            {'tenantId': '123', 'groupId': 'group124', 'created_at': None}]]
+        r = self.validate_list_states_return_value(self.mock_log, '123')
+        self.assertEqual([s.group_id for s in r], ['group123'])
+        self.assertEqual(self.connection.execute.call_count, 1)
+        self.collection.reaper.enqueue.assert_called_once_with(
+            '123', 'group124')
+
+    def test_reaper_given_to_groups(self):
+        """
+        Groups got from the collection queue resurrected rows to its reaper
+        """
+        collection = CassScalingGroupCollection(self.connection, self.clock,
+                                                reaper='reaper')
+        g = collection.get_scaling_group(self.mock_log, '123', '12345678')
+        self.assertEqual(g.reaper, 'reaper')
+
+    def _count_rows(self, counts, name='test'):
+        return [{
+            'tenantId': '123',
+            'groupId': 'group{}'.format(i),
+            'group_name': name,
+            'desired': 3,
+            'active_count': active,
+            'pending_count': pending,
+            'paused': '\x00',
+            'created_at': 23
+        } for i, (active, pending) in enumerate(counts)]
+
+    def test_list_states_counts(self):
+        """
+        ``list_scaling_group_states`` with counts projection returns
+        :class:`GroupStateCounts` from count columns without reading active
+        servers and pending jobs
+        """
+        self.returns = [self._count_rows([(2, 1), (0, 0)])]
+        d = self.collection.list_scaling_group_states(
+            self.mock_log, '123', limit=2, marker='group',
+            projection=StateProjection.COUNTS)
+        self.assertEqual(
+            self.successResultOf(d),
+            [GroupStateCounts(tenant_id='123', group_id='group0',
+                              group_name='test', desired=3, active_count=2,
+                              pending_count=1, paused=False),
+             GroupStateCounts(tenant_id='123', group_id='group1',
+                              group_name='test', desired=3, active_count=0,
+                              pending_count=0, paused=False)])
+        self.connection.execute.assert_called_once_with(
+            'SELECT "tenantId", "groupId", group_name, desired, '
+            'active_count, pending_count, paused, created_at '
+            'FROM scaling_group WHERE "tenantId" = :tenantId '
+            'AND "groupId" > :marker LIMIT :limit;',
+            {'tenantId': '123', 'limit': 2, 'marker': 'group'},
+            ConsistencyLevel.QUORUM)
+
+    def test_list_states_counts_not_stored(self):
+        """
+        ``list_scaling_group_states`` with counts projection counts active
+        servers and pending jobs of groups that do not have their counts
+        stored in one query
+        """
+        self.returns = [
+            self._count_rows([(None, None), (1, 1), (None, None)]),
+            [{'groupId': 'group0', 'active': '{"s1": {}, "s2": {}}',
+              'pending': '{"_ver": 1}'}]]
+        d = self.collection.list_scaling_group_states(
+            self.mock_log, '123', projection=StateProjection.COUNTS)
+        self.assertEqual(
+            [(s.active_count, s.pending_count)
+             for s in self.successResultOf(d)],
+            [(2, 0), (1, 1), (0, 0)])
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call('SELECT "groupId", active, pending FROM scaling_group '
+                      'WHERE "tenantId" = :tenantId AND "groupId" IN '
+                      '(:groupId0, :groupId1);',
+                      {'tenantId': '123', 'groupId0': 'group0',
+                       'groupId1': 'group2'},
+                      ConsistencyLevel.QUORUM))
+
+    def test_list_states_counts_name_not_stored(self):
+        """
+        ``list_scaling_group_states`` with counts projection reads the name
+        of groups that do not have it stored from their config, and reads
+        active servers and pending jobs only if some counts are missing too
+        """
+        self.returns = [
+            self._count_rows([(1, 1), (2, 0)], name=None),
+            [{'groupId': 'group0', 'group_config': '{"name": "n0"}'},
+             {'groupId': 'group1', 'group_config': '{"name": "n1"}'}]]
+        d = self.collection.list_scaling_group_states(
+            self.mock_log, '123', projection=StateProjection.COUNTS)
+        self.assertEqual(
+            [(s.group_name, s.active_count, s.pending_count)
+             for s in self.successResultOf(d)],
+            [('n0', 1, 1), ('n1', 2, 0)])
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call('SELECT "groupId", group_config FROM scaling_group '
+                      'WHERE "tenantId" = :tenantId AND "groupId" IN '
+                      '(:groupId0, :groupId1);',
+                      {'tenantId': '123', 'groupId0': 'group0',
+                       'groupId1': 'group1'},
+                      ConsistencyLevel.QUORUM))
+
     def test_get_scaling_group(self):
         """
         Tests that you can get a scaling group
@@ -3291,6 +4535,30 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(g.uuid, '12345678')
         self.assertEqual(g.tenant_id, '123')
         self.assertIs(g.local_locks, self.collection.local_locks)
+        self.assertIs(g.config_cache, self.collection.config_cache)
+
+    def test_config_cache(self):
+        """
+        Groups' config is cached for `config_cache_ttl` seconds if given
+        """
+        self.assertIsNone(self.collection.config_cache)
+        collection = CassScalingGroupCollection(self.connection, self.clock,
+                                                config_cache_ttl=20)
+        self.assertEqual(collection.config_cache._cache.ttl, 20)
+        g = collection.get_scaling_group(self.mock_log, '123', '12345678')
+        self.assertIs(g.config_cache, collection.config_cache)
+
+    def test_cas_state_writes(self):
+        """
+        Groups modify their state with compare-and-set if
+        `cas_state_writes` is given
+        """
+        g = self.collection.get_scaling_group(self.mock_log, '123', '1234')
+        self.assertFalse(g.cas_state_writes)
+        collection = CassScalingGroupCollection(self.connection, self.clock,
+                                                cas_state_writes=True)
+        g = collection.get_scaling_group(self.mock_log, '123', '12345678')
+        self.assertTrue(g.cas_state_writes)
 
     def test_webhook_hash_from_table(self):
         """
@@ -3346,6 +4614,79 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.mock_log.err.assert_called_once_with(
             CheckFailure(ValueError), 'Error getting webhook info from table')
 
+    def test_webhook_hash_cached(self):
+        """
+        `webhook_info_by_hash` returns found info from cache until
+        ``WEBHOOK_CACHE_TTL`` seconds
+        """
+        self.collection._webhook_info_from_table = mock.Mock(
+            side_effect=lambda *a: defer.succeed('g'))
+
+        for _ in range(2):
+            d = self.collection.webhook_info_by_hash(self.mock_log, 'hash')
+            self.assertEqual(self.successResultOf(d), 'g')
+        self.assertEqual(
+            self.collection._webhook_info_from_table.call_count, 1)
+        self.clock.advance(WEBHOOK_CACHE_TTL)
+        self.collection.webhook_info_by_hash(self.mock_log, 'hash')
+        self.assertEqual(
+            self.collection._webhook_info_from_table.call_count, 2)
+
+    def test_webhook_hash_unknown_cached(self):
+        """
+        `webhook_info_by_hash` fails with UnrecognizedCapabilityError from
+        cache until ``WEBHOOK_MISS_TTL`` seconds after hash is not found.
+        Other errors are not cached.
+        """
+        self.collection._webhook_info_from_table = mock.Mock(
+            side_effect=lambda *a: defer.fail(
+                UnrecognizedCapabilityError('hash', 1)))
+        self.collection._webhook_info_by_index = mock.Mock(
+            side_effect=lambda *a: defer.fail(
+                UnrecognizedCapabilityError('hash', 1)))
+
+        for _ in range(2):
+            d = self.collection.webhook_info_by_hash(self.mock_log, 'hash')
+            self.failureResultOf(d, UnrecognizedCapabilityError)
+        self.assertEqual(
+            self.collection._webhook_info_by_index.call_count, 1)
+        self.clock.advance(WEBHOOK_MISS_TTL)
+        self.collection._webhook_info_by_index.side_effect = \
+            lambda *a: defer.fail(ValueError('e'))
+        for _ in range(2):
+            d = self.collection.webhook_info_by_hash(self.mock_log, 'hash')
+            self.failureResultOf(d, ValueError)
+        self.assertEqual(
+            self.collection._webhook_info_by_index.call_count, 3)
+
+    def test_webhook_hash_no_index_fallback(self):
+        """
+        `webhook_info_by_hash` does not lookup the index if
+        `webhook_index_fallback` is False
+        """
+        self.collection.webhook_index_fallback = False
+        self.collection._webhook_info_from_table = mock.Mock(
+            return_value=defer.fail(UnrecognizedCapabilityError('hash', 1)))
+        self.collection._webhook_info_by_index = mock.Mock()
+
+        d = self.collection.webhook_info_by_hash(self.mock_log, 'hash')
+
+        self.failureResultOf(d, UnrecognizedCapabilityError)
+        self.assertFalse(self.collection._webhook_info_by_index.called)
+
+    def test_webhook_cache_given_to_groups(self):
+        """
+        Groups got from the collection remove their deleted webhooks from
+        collection's webhook cache
+        """
+        g = self.collection.get_scaling_group(self.mock_log, '123', '1234')
+        self.assertIs(g.webhook_cache, self.collection.webhook_cache)
+        self.collection.webhook_cache.set('h1', 'info')
+        self.collection.webhook_cache.set('h2', 'info')
+        g._forget_webhooks(['h1'])
+        self.assertNotIn('h1', self.collection.webhook_cache)
+        self.assertIn('h2', self.collection.webhook_cache)
+
     def test_webhook_hash_index(self):
         """
         `_webhook_info_by_index` uses webhooks_by_token INDEX
@@ -3402,36 +4743,179 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
 
     def test_get_counts(self):
         """
-        Check get_count returns dictionary in proper format
+        Check get_count returns dictionary in proper format read from the
+        tenant's row in counts table
         """
-        self.returns = [
-            [{'count': 100}],
-            [{'count': 101}],
-            [{'count': 102}],
-        ]
-
-        expectedData = {'tenantId': '123'}
-        expectedResults = {
-            "groups": 100,
-            "policies": 101,
-            "webhooks": 102
-        }
-        config_query = ('SELECT COUNT(*) FROM scaling_group '
-                        'WHERE "tenantId" = :tenantId;')
-        policy_query = ('SELECT COUNT(*) FROM scaling_policies '
-                        'WHERE "tenantId" = :tenantId;')
-        webhook_query = ('SELECT COUNT(*) FROM policy_webhooks '
-                         'WHERE "tenantId" = :tenantId;')
-
-        calls = [
-            mock.call(config_query, expectedData, ConsistencyLevel.ONE),
-            mock.call(policy_query, expectedData, ConsistencyLevel.ONE),
-            mock.call(webhook_query, expectedData, ConsistencyLevel.ONE)]
+        self.returns = [[{'groups': 100, 'policies': 101, 'webhooks': 102}]]
 
         d = self.collection.get_counts(self.mock_log, '123')
         result = self.successResultOf(d)
-        self.assertEquals(result, expectedResults)
-        self.connection.execute.assert_has_calls(calls)
+        self.assertEquals(result,
+                          {"groups": 100, "policies": 101, "webhooks": 102})
+        self.connection.execute.assert_called_once_with(
+            'SELECT groups, policies, webhooks FROM counts '
+            'WHERE scope = :scope;',
+            {'scope': '123'}, ConsistencyLevel.ONE)
+
+    def test_get_counts_no_row(self):
+        """
+        Counts are 0 if tenant does not have a row in counts table
+        """
+        self.returns = [[]]
+        d = self.collection.get_counts(self.mock_log, '123')
+        self.assertEquals(self.successResultOf(d),
+                          {"groups": 0, "policies": 0, "webhooks": 0})
+
+    def test_reconcile_counts(self):
+        """
+        `reconcile_counts` counts rows of the tenant's groups, policies and
+        webhooks and changes the counts in counts table by the difference.
+        Policies and webhooks of resurrected groups are not counted.
+        """
+        self.returns = [
+            [{'groupId': 'g1', 'created_at': 1},
+             {'groupId': 'g2', 'created_at': None}],
+            [{'groupId': 'g1', 'policyId': 'p1'},
+             {'groupId': 'g1', 'policyId': 'p2'},
+             {'groupId': 'g2', 'policyId': 'p3'}],
+            [{'groupId': 'g1', 'policyId': 'p1'},
+             {'groupId': 'g2', 'policyId': 'p3'}],
+            # current counts of the scopes
+            [{'groups': 2, 'policies': 2, 'webhooks': 1}],
+            [{'policies': 3}], [{'webhooks': 1}], [],
+            None]
+
+        d = self.collection.reconcile_counts(self.mock_log, 't1')
+
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 1, 'policies': 2, 'webhooks': 1})
+        calls = self.connection.execute.mock_calls
+        self.assertEqual(
+            calls[:3],
+            [mock.call('SELECT "groupId", {} FROM {} '
+                       'WHERE "tenantId" = :tenantId;'.format(columns, table),
+                       {'tenantId': 't1'}, ConsistencyLevel.QUORUM)
+             for table, columns in [('scaling_group', 'created_at'),
+                                    ('scaling_policies', '"policyId"'),
+                                    ('policy_webhooks', '"policyId"')]])
+        self.assertEqual(
+            [call[1][1]['scope'] for call in calls[3:7]],
+            ['t1', 't1/g1', 't1/g1/p1', 't1/g1/p2'])
+        self.assertEqual(
+            calls[7],
+            mock.call('BEGIN COUNTER BATCH '
+                      'UPDATE counts SET groups = groups + :scope0groups '
+                      'WHERE scope = :scope0 '
+                      'UPDATE counts SET groups = groups + :scope1groups '
+                      'WHERE scope = :scope1 '
+                      'UPDATE counts '
+                      'SET policies = policies + :scope2policies '
+                      'WHERE scope = :scope2 '
+                      'APPLY BATCH;',
+                      {'scope0': all_scope('t1'), 'scope1': 't1',
+                       'scope2': 't1/g1',
+                       'scope0groups': -1, 'scope1groups': -1,
+                       'scope2policies': -1},
+                      ConsistencyLevel.QUORUM))
+        self.mock_log.msg.assert_called_once_with(
+            'Fixing drifted counts', changes=mock.ANY, tenant_id='t1')
+
+    def test_reconcile_counts_no_drift(self):
+        """
+        `reconcile_counts` does not change counts if they have not drifted
+        """
+        self.returns = [
+            [{'groupId': 'g1', 'created_at': 1}], [], [],
+            [{'groups': 1, 'policies': 0, 'webhooks': 0}], []]
+
+        d = self.collection.reconcile_counts(self.mock_log, 't1')
+
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 1, 'policies': 0, 'webhooks': 0})
+        self.assertEqual(len(self.connection.execute.mock_calls), 5)
+        self.assertFalse(self.mock_log.msg.called)
+
+    def test_reconcile_counts_no_groups(self):
+        """
+        `reconcile_counts` sets counts of a tenant whose groups are all
+        deleted to 0
+        """
+        self.returns = [[], [], [],
+                        [{'groups': 1, 'policies': 2, 'webhooks': 0}], None]
+
+        d = self.collection.reconcile_counts(self.mock_log, 't1')
+
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 0, 'policies': 0, 'webhooks': 0})
+        self.connection.execute.assert_called_with(
+            'BEGIN COUNTER BATCH '
+            'UPDATE counts SET groups = groups + :scope0groups, '
+            'policies = policies + :scope0policies WHERE scope = :scope0 '
+            'UPDATE counts SET groups = groups + :scope1groups, '
+            'policies = policies + :scope1policies WHERE scope = :scope1 '
+            'APPLY BATCH;',
+            {'scope0': all_scope('t1'), 'scope1': 't1',
+             'scope0groups': -1, 'scope0policies': -2,
+             'scope1groups': -1, 'scope1policies': -2},
+            ConsistencyLevel.QUORUM)
+
+    def test_reconcile_total_counts(self):
+        """
+        `reconcile_total_counts` changes every row of counts of all tenants
+        by the difference from the given counts. Rows not given are changed
+        to 0.
+        """
+        current = [[{'groups': 5, 'policies': 3, 'webhooks': 2}],
+                   [{'groups': 1, 'policies': 0, 'webhooks': 0}]]
+        self.returns = current + [[]] * (len(ALL_SCOPES) - 2) + [None]
+
+        d = self.collection.reconcile_total_counts(
+            self.mock_log,
+            {ALL_SCOPES[0]: {'groups': 4, 'policies': 3, 'webhooks': 6}})
+
+        self.assertIsNone(self.successResultOf(d))
+        calls = self.connection.execute.mock_calls
+        self.assertEqual([call[1][1]['scope'] for call in calls[:-1]],
+                         ALL_SCOPES)
+        self.assertEqual(
+            calls[-1],
+            mock.call(
+                'BEGIN COUNTER BATCH '
+                'UPDATE counts SET groups = groups + :scope0groups, '
+                'webhooks = webhooks + :scope0webhooks WHERE scope = :scope0 '
+                'UPDATE counts SET groups = groups + :scope1groups '
+                'WHERE scope = :scope1 '
+                'APPLY BATCH;',
+                {'scope0': ALL_SCOPES[0], 'scope0groups': -1,
+                 'scope0webhooks': 4,
+                 'scope1': ALL_SCOPES[1], 'scope1groups': -1},
+                ConsistencyLevel.QUORUM))
+
+    def test_list_counted_tenants(self):
+        """
+        `list_counted_tenants` pages through scopes of counts table and
+        returns the ones of tenants
+        """
+        self.returns = [
+            [{'scope': 't1'}, {'scope': ALL_SCOPES[3]}],
+            [{'scope': 't1/g1'}, {'scope': 't2'}],
+            [{'scope': 't1/g1/p1'}]]
+
+        d = self.collection.list_counted_tenants(batch_size=2)
+
+        self.assertEqual(self.successResultOf(d), ['t1', 't2'])
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call('SELECT scope FROM counts  LIMIT :limit;',
+                       {'limit': 2}, ConsistencyLevel.QUORUM),
+             mock.call('SELECT scope FROM counts '
+                       'WHERE token(scope) > token(:scope) LIMIT :limit;',
+                       {'limit': 2, 'scope': ALL_SCOPES[3]},
+                       ConsistencyLevel.QUORUM),
+             mock.call('SELECT scope FROM counts '
+                       'WHERE token(scope) > token(:scope) LIMIT :limit;',
+                       {'limit': 2, 'scope': 't2'},
+                       ConsistencyLevel.QUORUM)])
 
 
 class CassScalingGroupsCollectionHealthCheckTestCase(
@@ -3562,13 +5046,9 @@ class CassAdminTestCase(SynchronousTestCase):
         """
         time.time.return_value = 1234567890
 
-        self.returns = [
-            [{'count': 190}],
-            [{'count': 191}],
-            [{'count': 192}],
-        ]
+        self.returns = [[{'groups': 90, 'policies': 191, 'webhooks': 192},
+                         {'groups': 100, 'policies': None}]]
 
-        # These are now reversed for an unknown reason.
         expectedResults = [
             {
                 'id': 'otter.metrics.groups',
@@ -3586,15 +5066,69 @@ class CassAdminTestCase(SynchronousTestCase):
                 'time': 1234567890
             }
         ]
-        config_query = ('SELECT COUNT(*) FROM scaling_group;')
-        policy_query = ('SELECT COUNT(*) FROM scaling_policies;')
-        webhook_query = ('SELECT COUNT(*) FROM policy_webhooks;')
-
-        calls = [mock.call(config_query, {}, ConsistencyLevel.QUORUM),
-                 mock.call(policy_query, {}, ConsistencyLevel.QUORUM),
-                 mock.call(webhook_query, {},  ConsistencyLevel.QUORUM)]
 
         d = self.collection.get_metrics(self.mock_log)
         result = self.successResultOf(d)
         self.assertEquals(result, expectedResults)
-        self.connection.execute.assert_has_calls(calls)
+        [(query, params, consistency)] = [
+            c[1] for c in self.connection.execute.mock_calls]
+        self.assertIn('WHERE scope IN (', query)
+        self.assertEqual(sorted(params.values()), sorted(ALL_SCOPES))
+        self.assertEqual(consistency, ConsistencyLevel.QUORUM)
+
+
+class CassTenantIdentityStoreTests(SynchronousTestCase):
+    """
+    Tests for :class:`CassTenantIdentityStore`
+    """
+
+    def setUp(self):
+        """
+        Store with mock connection
+        """
+        self.connection = mock.Mock(spec=['execute'])
+        self.connection.execute.return_value = defer.succeed([])
+        self.store = CassTenantIdentityStore(self.connection)
+
+    def test_get_identity(self):
+        """
+        Returns username and decoded catalog of the tenant
+        """
+        self.connection.execute.return_value = defer.succeed(
+            [{'username': 'u', 'catalog': '[{"name": "n"}]'}])
+        d = self.store.get_identity('t1')
+        self.assertEqual(self.successResultOf(d), ('u', [{'name': 'n'}]))
+        self.connection.execute.assert_called_once_with(
+            'SELECT username, catalog FROM tenant_identity '
+            'WHERE "tenantId" = :tenantId;', {'tenantId': 't1'},
+            ConsistencyLevel.ONE)
+
+    def test_get_identity_not_found(self):
+        """
+        Returns None if tenant is not stored
+        """
+        self.assertIsNone(
+            self.successResultOf(self.store.get_identity('t1')))
+
+    def test_set_identity(self):
+        """
+        Inserts username and encoded catalog with TTL
+        """
+        d = self.store.set_identity('t1', 'u', [{'name': 'n'}], 20)
+        self.assertIsNone(self.successResultOf(d))
+        self.connection.execute.assert_called_once_with(
+            'INSERT INTO tenant_identity("tenantId", username, catalog) '
+            'VALUES(:tenantId, :username, :catalog) USING TTL :ttl;',
+            {'tenantId': 't1', 'username': 'u', 'catalog': '[{"name": "n"}]',
+             'ttl': 20},
+            ConsistencyLevel.ONE)
+
+    def test_delete_identity(self):
+        """
+        Deletes the tenant's row
+        """
+        self.assertIsNone(
+            self.successResultOf(self.store.delete_identity('t1')))
+        self.connection.execute.assert_called_once_with(
+            'DELETE FROM tenant_identity WHERE "tenantId" = :tenantId;',
+            {'tenantId': 't1'}, ConsistencyLevel.ONE)
@@ -2,10 +2,14 @@
 Tests for :mod:`otter.models.interface`
 """
 from collections import namedtuple
+from datetime import datetime
+from functools import partial
 
 
 import mock
 
+from croniter import croniter
+
 from zope.interface.verify import verifyObject
 
 from twisted.internet import defer
@@ -13,9 +17,12 @@ from twisted.trial.unittest import SynchronousTestCase
 
 from otter.models.interface import (
     GroupState, IScalingGroup, IScalingGroupCollection, IScalingScheduleCollection,
-    NoSuchScalingGroupError)
+    NoSuchScalingGroupError, next_cron_occurrence, next_cron_occurrences,
+    repeatable_modifier)
 from otter.json_schema.group_schemas import launch_config
 from otter.json_schema import model_schemas, validate
+from otter.test.utils import patch
+from otter.util.cache import LRUCache
 
 
 class GroupStateTestCase(SynchronousTestCase):
@@ -201,6 +208,79 @@ class GroupStateTestCase(SynchronousTestCase):
         })
 
 
+class NextCronOccurrenceTests(SynchronousTestCase):
+    """
+    Tests for :func:`next_cron_occurrence` and :func:`next_cron_occurrences`
+    """
+
+    def setUp(self):
+        """
+        Use empty cache of parsed cron entries
+        """
+        patch(self, 'otter.models.interface._compiled_crons', LRUCache(2))
+        self.croniter = patch(self, 'otter.models.interface.croniter',
+                              wraps=croniter)
+
+    def test_next_occurrence(self):
+        """
+        Returns next occurrence of cron entry after utcnow
+        """
+        before = datetime.utcnow()
+        occurrence = next_cron_occurrence('* * * * *')
+        self.assertTrue(0 < (occurrence - before).total_seconds() <= 60)
+        self.assertEqual(occurrence.second, 0)
+
+    def test_parsed_once(self):
+        """
+        Cron entry is parsed only once and its next occurrence is based on
+        given start time every time
+        """
+        self.assertEqual(
+            next_cron_occurrences(['*/10 * * * *'],
+                                  datetime(2015, 1, 1, 10, 5, 30)),
+            [datetime(2015, 1, 1, 10, 10)])
+        self.assertEqual(
+            next_cron_occurrences(['*/10 * * * *'],
+                                  datetime(2015, 1, 1, 10, 15)),
+            [datetime(2015, 1, 1, 10, 20)])
+        self.assertEqual(self.croniter.call_count, 1)
+
+    def test_batch(self):
+        """
+        Next occurrence of each cron entry is returned in order and repeated
+        entries are calculated once
+        """
+        self.assertEqual(
+            next_cron_occurrences(['0 12 * * *', '*/10 * * * *',
+                                   '0 12 * * *'],
+                                  datetime(2015, 1, 1, 10, 5, 30)),
+            [datetime(2015, 1, 1, 12, 0), datetime(2015, 1, 1, 10, 10),
+             datetime(2015, 1, 1, 12, 0)])
+        self.assertEqual(self.croniter.call_count, 2)
+
+    def test_invalid(self):
+        """
+        Invalid cron entry raises error and is not cached
+        """
+        self.assertRaises(ValueError, next_cron_occurrence, '* * *')
+        self.assertRaises(ValueError, next_cron_occurrence, '* * *')
+        self.assertEqual(self.croniter.call_count, 2)
+
+
+class RepeatableModifierTests(SynchronousTestCase):
+    """
+    Tests for :func:`repeatable_modifier`
+    """
+
+    def test_marks_modifier(self):
+        """
+        The modifier is marked repeatable and returned as it is
+        """
+        modifier = partial(lambda group, state, x: state, x=1)
+        self.assertIs(repeatable_modifier(modifier), modifier)
+        self.assertTrue(modifier.repeatable)
+
+
 class IScalingGroupProviderMixin(object):
     """
     Mixin that tests for anything that provides
@@ -0,0 +1,270 @@
+"""
+Tests for :mod:`otter.models.reaper`
+"""
+
+import mock
+
+from kazoo.exceptions import NoNodeError
+
+from silverberg.client import CQLClient, ConsistencyLevel
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.models.reaper import ResurrectionReaper
+from otter.test.utils import mock_log, patch
+
+
+def _delete_query(groups):
+    deletes = [
+        'DELETE FROM {0} WHERE "tenantId" = :tenantId{1} AND '
+        '"groupId" = :groupId{1}'.format(table, i)
+        for i in range(groups)
+        for table in ('scaling_group', 'scaling_policies', 'policy_webhooks')]
+    return 'BEGIN BATCH ' + ' '.join(deletes) + ' APPLY BATCH;'
+
+
+class ResurrectionReaperTests(SynchronousTestCase):
+    """
+    Tests for :class:`ResurrectionReaper`
+    """
+
+    def setUp(self):
+        """
+        Reaper with mock connection
+        """
+        self.connection = mock.Mock(spec=CQLClient)
+        self.deletes = []
+
+        def execute(query, params, consistency):
+            self.deletes.append(defer.Deferred())
+            return self.deletes[-1]
+
+        self.connection.execute.side_effect = execute
+        self.clock = Clock()
+        self.log = mock_log()
+        self.reaper = ResurrectionReaper(self.connection, self.clock,
+                                         self.log, max_queued=3,
+                                         batch_size=2, flush_interval=5)
+
+    def test_flush_deletes_in_batches(self):
+        """
+        Queued groups are deleted from all the tables in batches of
+        `batch_size` one after another
+        """
+        self.reaper.enqueue('t1', 'g1')
+        self.reaper.enqueue('t2', 'g2')
+        self.reaper.enqueue('t1', 'g3')
+        self.assertEqual(len(self.deletes), 1)
+        self.connection.execute.assert_called_once_with(
+            _delete_query(2),
+            {'tenantId0': 't1', 'groupId0': 'g1',
+             'tenantId1': 't2', 'groupId1': 'g2'},
+            ConsistencyLevel.QUORUM)
+        d = self.reaper.flush()
+        self.deletes[0].callback(None)
+        self.assertNoResult(d)
+        self.assertEqual(self.connection.execute.call_args, mock.call(
+            _delete_query(1), {'tenantId0': 't1', 'groupId0': 'g3'},
+            ConsistencyLevel.QUORUM))
+        self.deletes[1].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(len(self.reaper), 0)
+
+    def test_enqueue_dedupes(self):
+        """
+        A group already queued is not queued again
+        """
+        self.reaper.enqueue('t1', 'g1')
+        self.reaper.enqueue('t1', 'g1')
+        self.assertEqual(len(self.reaper), 1)
+        self.assertEqual(self.deletes, [])
+
+    def test_enqueue_bounded(self):
+        """
+        Groups enqueued when the queue is full are dropped
+        """
+        self.reaper.batch_size = 10
+        for i in range(4):
+            self.reaper.enqueue('t', 'g{}'.format(i))
+        self.assertEqual(len(self.reaper), 3)
+        self.log.msg.assert_called_once_with(
+            'Resurrected group not queued for deletion as queue is full',
+            tenant_id='t', group_id='g3')
+
+    def test_failed_delete_logged(self):
+        """
+        Failure to delete a batch is logged and the remaining batches are
+        still deleted
+        """
+        self.reaper.batch_size = 1
+        self.reaper.enqueue('t', 'g1')
+        self.reaper.enqueue('t', 'g2')
+        d = self.reaper.flush()
+        self.deletes[0].errback(ValueError('bad'))
+        self.log.err.assert_called_once_with(
+            None, 'Could not delete resurrected groups', groups=[('t', 'g1')])
+        self.deletes[1].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+
+    def _scan_setup(self, acquired=True, last_scan=None):
+        """
+        Give the reaper a ZooKeeper client whose scan lock is acquired as per
+        `acquired` and that has `last_scan` as the last scan time, and patch
+        :func:`scan_scaling_groups`
+
+        :return: ``list`` of visit functions given to scan_scaling_groups
+        """
+        self.reaper.scan_interval = 20
+        self.kz_client = mock.Mock(spec=['Lock', 'get', 'set', 'create'])
+        self.lock = mock.Mock(spec=['acquire', 'release'])
+        self.lock.acquire.return_value = defer.succeed(acquired)
+        self.lock.release.return_value = defer.succeed(None)
+        self.kz_client.Lock.return_value = self.lock
+        if last_scan is None:
+            self.kz_client.get.side_effect = \
+                lambda path: defer.fail(NoNodeError())
+            self.kz_client.set.side_effect = \
+                lambda path, value: defer.fail(NoNodeError())
+        else:
+            self.kz_client.get.return_value = defer.succeed(
+                (str(last_scan), None))
+            self.kz_client.set.return_value = defer.succeed(None)
+        self.kz_client.create.return_value = defer.succeed(None)
+        self.reaper.kz_client = self.kz_client
+        visits = []
+        self.scan = patch(
+            self, 'otter.models.reaper.scan_scaling_groups',
+            side_effect=lambda c, visit, **k: visits.append(visit) or
+            defer.succeed(None))
+        return visits
+
+    def test_scan(self):
+        """
+        Scan holds the scan lock without waiting for it, queues the groups
+        that are resurrected among all the groups, waits for them to be
+        deleted and records the time it finished
+        """
+        visits = self._scan_setup()
+        self.clock.advance(100)
+        self.successResultOf(self.reaper.scan())
+        self.kz_client.Lock.assert_called_once_with(
+            '/locks/resurrection_scan')
+        self.lock.acquire.assert_called_once_with(blocking=False)
+        self.scan.assert_called_once_with(self.connection, mock.ANY,
+                                          batch_size=2,
+                                          include_resurrected=True)
+        self.kz_client.create.assert_called_once_with(
+            '/resurrection_scan', '100.0', makepath=True)
+        self.lock.release.assert_called_once_with()
+
+        d = visits[0]([{'tenantId': 't', 'groupId': 'g1', 'created_at': 2},
+                       {'tenantId': 't', 'groupId': 'g2',
+                        'created_at': None}])
+        self.assertEqual(
+            self.connection.execute.call_args,
+            mock.call('SELECT created_at FROM scaling_group WHERE '
+                      '"tenantId" = :tenantId AND "groupId" = :groupId;',
+                      {'tenantId': 't', 'groupId': 'g2'},
+                      ConsistencyLevel.QUORUM))
+        self.deletes[0].callback([{'created_at': None}])
+        self.assertNoResult(d)
+        self.assertEqual(self.connection.execute.call_args[0][1],
+                         {'tenantId0': 't', 'groupId0': 'g2'})
+        self.deletes[1].callback(None)
+        self.successResultOf(d)
+
+    def test_scan_rereads_candidates(self):
+        """
+        Groups found without "created_at" are not deleted if they have it or
+        do not exist when read again with quorum
+        """
+        visits = self._scan_setup()
+        self.successResultOf(self.reaper.scan())
+        d = visits[0]([{'tenantId': 't', 'groupId': 'g1', 'created_at': None},
+                       {'tenantId': 't', 'groupId': 'g2',
+                        'created_at': None}])
+        self.deletes[0].callback([{'created_at': 23}])
+        self.deletes[1].callback([])
+        self.successResultOf(d)
+        self.assertEqual(len(self.deletes), 2)
+        self.assertEqual(len(self.reaper), 0)
+
+    def test_scan_records_time(self):
+        """
+        The time the scan finished is set on the existing znode
+        """
+        self._scan_setup(last_scan=10)
+        self.clock.advance(30)
+        self.successResultOf(self.reaper.scan())
+        self.kz_client.set.assert_called_once_with('/resurrection_scan',
+                                                   '30.0')
+        self.assertFalse(self.kz_client.create.called)
+
+    def test_scan_not_due(self):
+        """
+        Groups are not scanned if some node scanned them in the last
+        `scan_interval` seconds
+        """
+        self._scan_setup(last_scan=10)
+        self.clock.advance(25)
+        self.successResultOf(self.reaper.scan())
+        self.assertFalse(self.scan.called)
+        self.assertFalse(self.kz_client.set.called)
+        self.lock.release.assert_called_once_with()
+
+    def test_scan_lock_not_acquired(self):
+        """
+        Groups are not scanned if another node holds the scan lock
+        """
+        self._scan_setup(acquired=False)
+        self.successResultOf(self.reaper.scan())
+        self.assertFalse(self.scan.called)
+        self.assertFalse(self.lock.release.called)
+
+    def test_scan_no_kz_client(self):
+        """
+        Groups are not scanned until there is a ZooKeeper client
+        """
+        self._scan_setup()
+        self.reaper.kz_client = None
+        self.successResultOf(self.reaper.scan())
+        self.assertFalse(self.scan.called)
+
+    def test_scan_error_logged(self):
+        """
+        Scan failure is logged, the lock is released and the scan time is
+        not recorded
+        """
+        self._scan_setup()
+        self.scan.side_effect = None
+        self.scan.return_value = defer.fail(ValueError('bad'))
+        self.successResultOf(self.reaper.scan())
+        self.log.err.assert_called_once_with(
+            mock.ANY, 'Could not scan for resurrected groups')
+        self.lock.release.assert_called_once_with()
+        self.assertFalse(self.kz_client.create.called)
+
+    def test_service(self):
+        """
+        When started, queued groups are deleted every `flush_interval` and
+        groups are scanned every `scan_interval` seconds. Remaining queued
+        groups are deleted when stopped.
+        """
+        self.reaper.scan_interval = 20
+        self.reaper.scan = mock.Mock(return_value=defer.succeed(None))
+        self.reaper.startService()
+        self.reaper.enqueue('t', 'g1')
+        self.clock.advance(5)
+        self.assertEqual(len(self.deletes), 1)
+        self.deletes[0].callback(None)
+        self.clock.advance(15)
+        self.reaper.scan.assert_called_once_with()
+
+        self.reaper.enqueue('t', 'g2')
+        d = self.reaper.stopService()
+        self.assertNoResult(d)
+        self.deletes[1].callback(None)
+        self.successResultOf(d)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
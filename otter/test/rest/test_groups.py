@@ -26,12 +26,18 @@ from otter.json_schema.group_schemas import MAX_ENTITIES
 from otter.models.interface import (
     GroupNotEmptyError,
     GroupState,
+    GroupStateCounts,
     NoSuchScalingGroupError,
+    StateProjection,
 )
 from otter.rest import groups
 from otter.rest.bobby import set_bobby
 from otter.rest.decorators import InvalidJsonError, InvalidQueryArgument
-from otter.rest.groups import extract_bool_arg, format_state_dict
+from otter.rest.groups import (
+    extract_bool_arg,
+    format_state_counts_dict,
+    format_state_dict,
+)
 from otter.supervisor import (
     CannotDeleteServerBelowMinError,
     ServerNotFoundError,
@@ -131,6 +137,36 @@ class FormatterHelpers(SynchronousTestCase):
         self.assertEqual(result['desiredCapacity'], 3)
         self.assertEqual(result['pendingCapacity'], 0)
 
+    def test_format_state_counts_dict(self):
+        """
+        :func:`otter.rest.groups.format_state_counts_dict` transforms a
+        :class:`GroupStateCounts` into the state dictionary without the
+        active servers list
+        """
+        self.assertEqual(
+            format_state_counts_dict(
+                GroupStateCounts(
+                    tenant_id='11111', group_id='one', group_name='test',
+                    desired=10, active_count=3, pending_count=2,
+                    paused=True)),
+            {'name': 'test', 'activeCapacity': 3, 'pendingCapacity': 2,
+             'desiredCapacity': 5, 'paused': True})
+
+    @mock.patch('otter.rest.groups.config_value')
+    def test_format_state_counts_dict_with_convergence(self, config_value):
+        """
+        When convergence is enabled for a tenant, desiredCapacity is the
+        stored `desired` and pendingCapacity is derived from it and the
+        number of active servers
+        """
+        config_value.side_effect = {'convergence-tenants': ['11111']}.get
+        result = format_state_counts_dict(
+            GroupStateCounts(
+                tenant_id='11111', group_id='one', group_name='test',
+                desired=10, active_count=3, pending_count=2, paused=True))
+        self.assertEqual(result['desiredCapacity'], 10)
+        self.assertEqual(result['pendingCapacity'], 7)
+
 
 class ExtractBoolArgTests(SynchronousTestCase):
     """
@@ -260,7 +296,7 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
             [])
         body = self.assert_status_code(200)
         self.mock_store.list_scaling_group_states.assert_called_once_with(
-            mock.ANY, '11111', limit=100)
+            mock.ANY, '11111', projection=StateProjection.FULL, limit=100)
 
         resp = json.loads(body)
         self.assertEqual(resp, {"groups": [], "groups_links": []})
@@ -283,7 +319,7 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
 
         self.assert_status_code(200)
         self.mock_store.list_scaling_group_states.assert_called_once_with(
-            mock.ANY, '11111', limit=100)
+            mock.ANY, '11111', projection=StateProjection.FULL, limit=100)
 
         mock_format.assert_has_calls([mock.call(state) for state in states])
         self.assertEqual(len(mock_format.mock_calls), 2)
@@ -328,7 +364,40 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
         self.assert_status_code(
             200, endpoint="{0}?limit=5".format(self.endpoint))
         self.mock_store.list_scaling_group_states.assert_called_once_with(
-            mock.ANY, '11111', limit=5)
+            mock.ANY, '11111', projection=StateProjection.FULL, limit=5)
+
+    def test_list_group_without_servers(self):
+        """
+        ``list_all_scaling_groups`` lists only the counts of the groups
+        without their active servers if the 'servers' query argument is
+        false
+        """
+        self.mock_store.list_scaling_group_states.return_value = defer.succeed(
+            [GroupStateCounts(tenant_id='11111', group_id='1',
+                              group_name='test', desired=2, active_count=1,
+                              pending_count=1, paused=False)])
+        body = self.assert_status_code(
+            200, endpoint="{0}?servers=false".format(self.endpoint))
+        self.mock_store.list_scaling_group_states.assert_called_once_with(
+            mock.ANY, '11111', projection=StateProjection.COUNTS, limit=100)
+        resp = json.loads(body)
+        self.assertEqual(resp['groups'][0]['state'], {
+            'name': 'test',
+            'activeCapacity': 1,
+            'pendingCapacity': 1,
+            'desiredCapacity': 2,
+            'paused': False
+        })
+
+    def test_list_group_invalid_servers_query_400(self):
+        """
+        ``list_all_scaling_groups`` returns a 400 if the 'servers' query
+        argument is not a boolean
+        """
+        self.assert_status_code(
+            400, endpoint="{0}?servers=blah".format(self.endpoint))
+        self.assertFalse(self.mock_store.list_scaling_group_states.called)
+        self.flushLoggedErrors(InvalidQueryArgument)
 
     def test_list_group_invalid_limit_query_400(self):
         """
@@ -349,7 +418,8 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
         self.assert_status_code(
             200, endpoint="{0}?marker=123456".format(self.endpoint))
         self.mock_store.list_scaling_group_states.assert_called_once_with(
-            mock.ANY, '11111', marker='123456', limit=100)
+            mock.ANY, '11111', projection=StateProjection.FULL,
+            marker='123456', limit=100)
 
     def test_list_groups_returns_next_link_formatted(self):
         """
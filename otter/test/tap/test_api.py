@@ -16,8 +16,12 @@ from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import CachingAuthenticator
 from otter.constants import ServiceType, get_service_configs
+from otter.convergence.service import get_converger, set_converger
 from otter.log.cloudfeeds import CloudFeedsObserver
-from otter.models.cass import CassScalingGroupCollection as OriginalStore
+from otter.models.cass import (
+    CassScalingGroupCollection as OriginalStore, CassTenantIdentityStore,
+    PARTITION_KEYS)
+from otter.models.reaper import ResurrectionReaper
 from otter.supervisor import SupervisorService, get_supervisor, set_supervisor
 from otter.tap.api import (
     HealthChecker,
@@ -30,6 +34,9 @@ from otter.test.test_auth import identity_config
 from otter.test.utils import CheckFailure, matches, patch
 from otter.util.config import set_config_data
 from otter.util.deferredutils import DeferredPool
+from otter.util.httppool import get_pool, set_pool_registry
+from otter.util.throttle import (
+    LimiterRegistry, get_limiter, set_limiter_registry)
 
 
 test_config = {
@@ -266,15 +273,15 @@ class APIMakeServiceTests(SynchronousTestCase):
         """
         self.service = patch(self, 'otter.tap.api.service')
         self.Site = patch(self, 'otter.tap.api.Site')
-        self.clientFromString = patch(self, 'otter.tap.api.clientFromString')
-
-        self.RoundRobinCassandraCluster = patch(
-            self, 'otter.tap.api.RoundRobinCassandraCluster')
+        self.cluster_from_config = patch(
+            self, 'otter.tap.api.cluster_from_config')
         self.LoggingCQLClient = patch(
             self, 'otter.tap.api.LoggingCQLClient')
         self.TimingOutCQLClient = patch(
             self, 'otter.tap.api.TimingOutCQLClient')
         self.log = patch(self, 'otter.tap.api.log')
+        self.addCleanup(set_pool_registry, None)
+        self.addCleanup(lambda: set_limiter_registry(LimiterRegistry()))
 
         Otter_patcher = mock.patch('otter.tap.api.Otter')
         self.Otter = Otter_patcher.start()
@@ -350,36 +357,15 @@ class APIMakeServiceTests(SynchronousTestCase):
         self.service.return_value.setServiceParent.assert_called_with(
             expected_parent)
 
-    def test_cassandra_seed_hosts_endpoints(self):
-        """
-        makeService will create a client endpoint for each address in the
-        cassandra seed_hosts.
-        """
-        makeService(test_config)
-        self.clientFromString.assert_called_once_with(
-            self.reactor, 'tcp:127.0.0.1:9160')
-
-    def test_unicode_cassandra_seed_hosts_endpoints(self):
-        """
-        makeService will create a client endpoint for each address in the
-        cassandra seed_hosts with a byte endpoint string even if config was
-        given in unicode
-        """
-        unicode_config = json.loads(json.dumps(test_config, encoding="utf-8"))
-        makeService(unicode_config)
-        self.clientFromString.assert_called_once_with(
-            self.reactor, 'tcp:127.0.0.1:9160')
-        self.assertTrue(isinstance(self.clientFromString.call_args[0][1], str))
-
-    def test_cassandra_cluster_with_endpoints_and_keyspace(self):
+    def test_cassandra_cluster_from_config(self):
         """
-        makeService configures a RoundRobinCassandraCluster with the
-        seed_endpoints and the keyspace from the config.
+        makeService configures a token aware cassandra cluster from the
+        cassandra config with the models' partition keys.
         """
         makeService(test_config)
-        self.RoundRobinCassandraCluster.assert_called_once_with(
-            [self.clientFromString.return_value],
-            'otter_test', disconnect_on_cancel=True)
+        self.cluster_from_config.assert_called_once_with(
+            self.reactor, test_config['cassandra'], PARTITION_KEYS,
+            self.log.bind.return_value, disconnect_on_cancel=True)
 
     def test_cassandra_scaling_group_collection_with_cluster(self):
         """
@@ -387,10 +373,10 @@ class APIMakeServiceTests(SynchronousTestCase):
         cassandra cluster connection.
         """
         makeService(test_config)
-        self.log.bind.assert_called_once_with(system='otter.silverberg')
+        self.log.bind.assert_any_call(system='otter.silverberg')
         self.TimingOutCQLClient.assert_called_once_with(
             self.reactor,
-            self.RoundRobinCassandraCluster.return_value,
+            self.cluster_from_config.return_value,
             10)
         self.LoggingCQLClient.assert_called_once_with(
             self.TimingOutCQLClient.return_value,
@@ -400,6 +386,108 @@ class APIMakeServiceTests(SynchronousTestCase):
                          self.LoggingCQLClient.return_value)
         self.assertEqual(self.store.reactor, self.reactor)
 
+    def test_config_cache_ttl(self):
+        """
+        makeService configures the CassScalingGroupCollection to cache
+        groups' config for the cassandra config_cache_ttl seconds, defaulting
+        to 30. Setting it to 0 turns off caching.
+        """
+        makeService(test_config)
+        self.assertEqual(self.store.config_cache._cache.ttl, 30)
+        config = deepcopy(test_config)
+        config['cassandra']['config_cache_ttl'] = 5
+        makeService(config)
+        self.assertEqual(self.store.config_cache._cache.ttl, 5)
+        config['cassandra']['config_cache_ttl'] = 0
+        makeService(config)
+        self.assertIsNone(self.store.config_cache)
+
+    def test_resurrection_reaper(self):
+        """
+        makeService sets up a ResurrectionReaper service that the store
+        queues resurrected groups to. It scans groups every cassandra
+        resurrection_scan_interval seconds if configured.
+        """
+        service = makeService(test_config)
+        self.assertIsInstance(self.store.reaper, ResurrectionReaper)
+        self.assertIsNone(self.store.reaper.scan_interval)
+        self.assertIs(self.store.reaper.parent, service)
+        config = deepcopy(test_config)
+        config['cassandra']['resurrection_scan_interval'] = 60
+        makeService(config)
+        self.assertEqual(self.store.reaper.scan_interval, 60)
+
+    def test_state_writes(self):
+        """
+        makeService configures the CassScalingGroupCollection to modify
+        groups' states with compare-and-set if cassandra state_writes is
+        "cas" and with locks otherwise.
+        """
+        makeService(test_config)
+        self.assertFalse(self.store.cas_state_writes)
+        config = deepcopy(test_config)
+        config['cassandra']['state_writes'] = 'cas'
+        makeService(config)
+        self.assertTrue(self.store.cas_state_writes)
+
+    def test_webhook_index_fallback(self):
+        """
+        makeService configures the CassScalingGroupCollection to lookup
+        webhooks in the index when not found in the webhook_keys table
+        unless cassandra webhook_index_fallback is false.
+        """
+        makeService(test_config)
+        self.assertTrue(self.store.webhook_index_fallback)
+        config = deepcopy(test_config)
+        config['cassandra']['webhook_index_fallback'] = False
+        makeService(config)
+        self.assertFalse(self.store.webhook_index_fallback)
+
+    def test_http_pools(self):
+        """
+        makeService sets up the HTTP pool registry with http_pool config,
+        reports its pools in health check and closes their idle connections
+        when stopped
+        """
+        config = deepcopy(test_config)
+        config['http_pool'] = {'max_per_host': 4, 'idle_timeout': 30}
+        service = makeService(config)
+        pool = get_pool(ServiceType.CLOUD_SERVERS)
+        self.assertEqual(pool.maxPersistentPerHost, 4)
+        self.assertEqual(pool.cachedConnectionTimeout, 30)
+        self.assertEqual(self.health_checker.checks['http_pools'](),
+                         (True, {'CLOUD_SERVERS': pool.stats}))
+        pool.closeCachedConnections = mock.Mock(
+            return_value=defer.succeed(None))
+        service.stopService()
+        pool.closeCachedConnections.assert_called_once_with()
+
+    def test_concurrency_limits(self):
+        """
+        makeService sets up the limiter registry with concurrency config and
+        reports it in health check
+        """
+        config = deepcopy(test_config)
+        config['concurrency'] = {'initial': 5, 'maximum': 50}
+        makeService(config)
+        limiter = get_limiter(ServiceType.CLOUD_SERVERS, 't')
+        self.assertEqual(limiter.limit, 5)
+        self.assertEqual(limiter.maximum, 50)
+        self.assertEqual(
+            self.health_checker.checks['concurrency'](),
+            (True, {'active': 0, 'queued': 0, 'queued_limiters': {}}))
+
+    def test_concurrency_initial_default(self):
+        """
+        Limiters start at the configured maximum if initial concurrency is
+        not configured
+        """
+        config = deepcopy(test_config)
+        config['concurrency'] = {'maximum': 50}
+        makeService(config)
+        limiter = get_limiter(ServiceType.CLOUD_SERVERS, 't')
+        self.assertEqual((limiter.limit, limiter.maximum), (50, 50))
+
     def test_cassandra_cluster_disconnects_on_stop(self):
         """
         Cassandra cluster connection is disconnected when main service is
@@ -429,10 +517,25 @@ class APIMakeServiceTests(SynchronousTestCase):
         """
         self.addCleanup(lambda: set_supervisor(None))
         makeService(test_config)
-        mock_ga.assert_called_once_with(mock_reactor, test_config['identity'])
+        mock_ga.assert_called_once_with(mock_reactor, test_config['identity'],
+                                        None)
         self.assertIdentical(get_supervisor().authenticator,
                              mock_ga.return_value)
 
+    @mock.patch('otter.tap.api.generate_authenticator')
+    def test_persist_tenant_identity(self, mock_ga):
+        """
+        Authenticator keeps tenants' identity in cassandra if identity
+        persist_tenant_identity is set
+        """
+        self.addCleanup(lambda: set_supervisor(None))
+        config = deepcopy(test_config)
+        config['identity']['persist_tenant_identity'] = True
+        makeService(config)
+        store = mock_ga.call_args[0][2]
+        self.assertIsInstance(store, CassTenantIdentityStore)
+        self.assertIs(store.connection, self.LoggingCQLClient.return_value)
+
     @mock.patch('otter.tap.api.SupervisorService', wraps=SupervisorService)
     def test_health_checker_no_zookeeper(self, supervisor):
         """
@@ -493,8 +596,8 @@ class APIMakeServiceTests(SynchronousTestCase):
     def test_kazoo_client_success(self, mock_txkz, mock_setup_scheduler):
         """
         TxKazooClient is started and calls `setup_scheduler`. Its instance
-        is also set in store.kz_client after start has finished, and the
-        scheduler added to the health checker
+        is also set in store.kz_client and the resurrection reaper after
+        start has finished, and the scheduler added to the health checker
         """
         config = test_config.copy()
         config['zookeeper'] = {'hosts': 'zk_hosts', 'threads': 20}
@@ -517,12 +620,14 @@ class APIMakeServiceTests(SynchronousTestCase):
         # added to the health checker
         self.assertFalse(mock_setup_scheduler.called)
         self.assertIsNone(self.store.kz_client)
+        self.assertIsNone(self.store.reaper.kz_client)
 
         # they are called after start completes
         start_d.callback(None)
         mock_setup_scheduler.assert_called_once_with(
             parent, self.store, kz_client)
         self.assertEqual(self.store.kz_client, kz_client)
+        self.assertIs(self.store.reaper.kz_client, kz_client)
         sch = mock_setup_scheduler.return_value
         self.assertEqual(self.health_checker.checks['scheduler'],
                          sch.health_check)
@@ -599,6 +704,52 @@ class APIMakeServiceTests(SynchronousTestCase):
         self.successResultOf(d)
         self.assertTrue(kz_client.stop.called)
 
+    @mock.patch('otter.tap.api.setup_scheduler')
+    @mock.patch('otter.tap.api.TxKazooClient')
+    @mock.patch('otter.tap.api.Converger')
+    def test_converger_config(self, mock_converger, mock_txkz,
+                              mock_setup_scheduler):
+        """
+        Converger is setup with data TTL and maximum drained nodes from
+        config. A data TTL of 0 is used as is.
+        """
+        self.addCleanup(set_converger, get_converger())
+        config = test_config.copy()
+        config['zookeeper'] = {'hosts': 'zk_hosts', 'threads': 20}
+        config['converger'] = {'data_ttl': 0, 'max_drained_nodes': 50}
+        kz_client = mock.Mock(spec=['start', 'stop'])
+        kz_client.start.return_value = defer.succeed(None)
+        mock_txkz.return_value = kz_client
+
+        makeService(config)
+
+        mock_converger.assert_called_once_with(
+            self.reactor, kz_client, mock.ANY, data_ttl=0,
+            max_drained_nodes=50)
+        self.assertIs(get_converger(), mock_converger.return_value)
+
+    @mock.patch('otter.tap.api.setup_scheduler')
+    @mock.patch('otter.tap.api.TxKazooClient')
+    @mock.patch('otter.tap.api.Converger')
+    def test_converger_config_defaults(self, mock_converger, mock_txkz,
+                                       mock_setup_scheduler):
+        """
+        Converger is setup with default data TTL and maximum drained nodes
+        if they are not in config
+        """
+        self.addCleanup(set_converger, get_converger())
+        config = test_config.copy()
+        config['zookeeper'] = {'hosts': 'zk_hosts', 'threads': 20}
+        kz_client = mock.Mock(spec=['start', 'stop'])
+        kz_client.start.return_value = defer.succeed(None)
+        mock_txkz.return_value = kz_client
+
+        makeService(config)
+
+        mock_converger.assert_called_once_with(
+            self.reactor, kz_client, mock.ANY, data_ttl=10,
+            max_drained_nodes=10000)
+
 
 class SchedulerSetupTests(SynchronousTestCase):
     """
@@ -638,10 +789,51 @@ class SchedulerSetupTests(SynchronousTestCase):
         buckets = range(1, 11)
         self.store.set_scheduler_buckets.assert_called_once_with(buckets)
         self.scheduler_service.assert_called_once_with(
-            100, 10, self.store, self.kz_client, '/part_path', 15, buckets)
+            100, 10, self.store, self.kz_client, '/part_path', 15, buckets,
+            bucket_group_size=100, preload_horizon=None,
+            concurrency=10)
         self.scheduler_service.return_value.setServiceParent\
             .assert_called_once_with(self.parent)
 
+    def test_bucket_group_size(self):
+        """
+        `SchedulerService` fetches events of `bucket_group_size` buckets
+        together if configured
+        """
+        self.config['scheduler']['bucket_group_size'] = 5
+        set_config_data(self.config)
+        setup_scheduler(self.parent, self.store, self.kz_client)
+        self.scheduler_service.assert_called_once_with(
+            100, 10, self.store, self.kz_client, '/part_path', 15,
+            range(1, 11), bucket_group_size=5, preload_horizon=None,
+            concurrency=10)
+
+    def test_concurrency(self):
+        """
+        `SchedulerService` executes events of configured number of groups
+        concurrently
+        """
+        self.config['scheduler']['concurrency'] = 3
+        set_config_data(self.config)
+        setup_scheduler(self.parent, self.store, self.kz_client)
+        self.scheduler_service.assert_called_once_with(
+            100, 10, self.store, self.kz_client, '/part_path', 15,
+            range(1, 11), bucket_group_size=100, preload_horizon=None,
+            concurrency=3)
+
+    def test_preload_horizon(self):
+        """
+        `SchedulerService` loads upcoming events in memory if
+        `preload_horizon` is configured
+        """
+        self.config['scheduler']['preload_horizon'] = 120
+        set_config_data(self.config)
+        setup_scheduler(self.parent, self.store, self.kz_client)
+        self.scheduler_service.assert_called_once_with(
+            100, 10, self.store, self.kz_client, '/part_path', 15,
+            range(1, 11), bucket_group_size=100, preload_horizon=120,
+            concurrency=10)
+
     def test_mock_store_with_scheduler(self):
         """
         SchedulerService is not created with mock store
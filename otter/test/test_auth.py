@@ -32,8 +32,9 @@ from otter.auth import (
     public_endpoint_url,
     user_for_tenant,
 )
+from otter.constants import ServiceType
 from otter.effect_dispatcher import get_simple_dispatcher
-from otter.test.utils import SameJSON, iMock, mock_log, patch
+from otter.test.utils import CheckFailure, SameJSON, iMock, mock_log, patch
 from otter.util.http import APIError, UpstreamError
 
 
@@ -105,7 +106,8 @@ class HelperTests(SynchronousTestCase):
                      'content-type': ['application/json'],
                      'User-Agent': ['OtterScale/0.0']},
             log=self.log,
-            pool=pool)
+            pool=pool,
+            service_type=ServiceType.IDENTITY)
 
     def test_authenticate_user_with_pool(self):
         """
@@ -169,7 +171,8 @@ class HelperTests(SynchronousTestCase):
                 }
             }),
             headers=expected_headers,
-            log=self.log)
+            log=self.log,
+            service_type=ServiceType.IDENTITY)
 
     def test_impersonate_user_expire_in_seconds(self):
         """
@@ -199,7 +202,8 @@ class HelperTests(SynchronousTestCase):
                 }
             }),
             headers=expected_headers,
-            log=None)
+            log=None,
+            service_type=ServiceType.IDENTITY)
 
     def test_impersonate_user_propogates_errors(self):
         """
@@ -237,7 +241,8 @@ class HelperTests(SynchronousTestCase):
 
         self.treq.get.assert_called_once_with(
             'http://identity/v2.0/tokens/user-token/endpoints',
-            headers=expected_headers, log=self.log)
+            headers=expected_headers, log=self.log,
+            service_type=ServiceType.IDENTITY)
 
     def test_endpoints_for_token_propogates_errors(self):
         """
@@ -276,7 +281,8 @@ class HelperTests(SynchronousTestCase):
         self.treq.get.assert_called_once_with(
             'http://identity/v1.1/mosso/111111',
             auth=('username', 'password'),
-            allow_redirects=False, log=self.log)
+            allow_redirects=False, log=self.log,
+            service_type=ServiceType.IDENTITY)
 
     def test_user_for_tenant_propagates_errors(self):
         """
@@ -530,6 +536,120 @@ class ImpersonatingAuthenticatorTests(SynchronousTestCase):
         self.assertEqual(f.value.reason.value.code, 500)
 
 
+class ImpersonatingAuthenticatorIdentityCacheTests(SynchronousTestCase):
+    """
+    Tests for caching tenants' username and catalog in
+    `ImpersonatingAuthenticator`
+    """
+    def setUp(self):
+        """
+        Mock the helper functions that do IO and an identity store
+        """
+        self.user_for_tenant = patch(self, 'otter.auth.user_for_tenant')
+        self.impersonate_user = patch(self, 'otter.auth.impersonate_user')
+        self.endpoints_for_token = patch(self,
+                                         'otter.auth.endpoints_for_token')
+        self.user_for_tenant.side_effect = lambda *a, **kw: succeed('user')
+        self.impersonate_user.side_effect = lambda *a, **kw: succeed(
+            {'access': {'token': {'id': 'token'}}})
+        self.endpoints_for_token.side_effect = lambda *a, **kw: succeed(
+            {'endpoints': [{'name': 'e', 'type': 't'}]})
+        self.catalog = [{'name': 'e', 'type': 't',
+                         'endpoints': [{'name': 'e', 'type': 't'}]}]
+
+        self.store = mock.Mock(spec=['get_identity', 'set_identity',
+                                     'delete_identity'])
+        self.store.get_identity.return_value = succeed(None)
+        self.store.set_identity.return_value = succeed(None)
+        self.store.delete_identity.return_value = succeed(None)
+        self.clock = Clock()
+        self.ia = ImpersonatingAuthenticator(
+            'u', 'p', 'url', 'admin', reactor=self.clock, identity_ttl=100,
+            identity_store=self.store)
+
+    def test_cached(self):
+        """
+        Username and catalog are looked up once and stored, after which only
+        impersonation is done until they expire
+        """
+        for _ in range(2):
+            d = self.ia.authenticate_tenant('t1')
+            self.assertEqual(self.successResultOf(d),
+                             ('token', self.catalog))
+        self.assertEqual(self.user_for_tenant.call_count, 1)
+        self.assertEqual(self.endpoints_for_token.call_count, 1)
+        self.assertEqual(self.impersonate_user.call_count, 2)
+        self.store.get_identity.assert_called_once_with('t1')
+        self.store.set_identity.assert_called_once_with(
+            't1', 'user', self.catalog, 100)
+
+        self.clock.advance(100)
+        self.successResultOf(self.ia.authenticate_tenant('t1'))
+        self.assertEqual(self.user_for_tenant.call_count, 2)
+        self.assertEqual(self.endpoints_for_token.call_count, 2)
+
+    def test_loaded_from_store(self):
+        """
+        Username and catalog are taken from the identity store if it has
+        them
+        """
+        self.store.get_identity.return_value = succeed(('suser', 'scatalog'))
+        d = self.ia.authenticate_tenant('t1')
+        self.assertEqual(self.successResultOf(d), ('token', 'scatalog'))
+        self.assertFalse(self.user_for_tenant.called)
+        self.assertFalse(self.endpoints_for_token.called)
+        self.impersonate_user.assert_called_once_with(
+            'admin', None, 'suser', log=None)
+        self.assertFalse(self.store.set_identity.called)
+
+    def test_store_errors_logged(self):
+        """
+        Errors loading from or storing to identity store are logged and
+        ignored
+        """
+        log = mock_log()
+        self.store.get_identity.return_value = fail(ValueError('get'))
+        self.store.set_identity.return_value = fail(ValueError('set'))
+        d = self.ia.authenticate_tenant('t1', log=log)
+        self.assertEqual(self.successResultOf(d), ('token', self.catalog))
+        log.err.assert_has_calls([
+            mock.call(CheckFailure(ValueError),
+                      'Error loading tenant identity',
+                      system='otter.auth.impersonate', tenant_id='t1'),
+            mock.call(CheckFailure(ValueError),
+                      'Error storing tenant identity',
+                      system='otter.auth.impersonate', tenant_id='t1')])
+
+    def test_forgotten_on_failure(self):
+        """
+        Username and catalog are forgotten if authenticating fails
+        """
+        self.successResultOf(self.ia.authenticate_tenant('t1'))
+        self.impersonate_user.side_effect = lambda *a, **kw: fail(
+            UpstreamError(Failure(APIError(404, '')), 'identity', 'o'))
+        self.failureResultOf(self.ia.authenticate_tenant('t1'),
+                             UpstreamError)
+        self.store.delete_identity.assert_called_once_with('t1')
+
+        self.impersonate_user.side_effect = lambda *a, **kw: succeed(
+            {'access': {'token': {'id': 'token'}}})
+        self.successResultOf(self.ia.authenticate_tenant('t1'))
+        self.assertEqual(self.user_for_tenant.call_count, 2)
+        self.assertEqual(self.endpoints_for_token.call_count, 2)
+
+    def test_no_reactor(self):
+        """
+        Username and catalog are not cached without reactor
+        """
+        self.ia = ImpersonatingAuthenticator('u', 'p', 'url', 'admin',
+                                             identity_store=self.store)
+        for _ in range(2):
+            self.successResultOf(self.ia.authenticate_tenant('t1'))
+        self.assertEqual(self.user_for_tenant.call_count, 2)
+        self.assertFalse(self.store.get_identity.called)
+        self.assertFalse(self.store.set_identity.called)
+
+
 class CachingAuthenticatorTests(SynchronousTestCase):
     """
     Test the in memory cache of authentication tokens.
@@ -672,6 +792,88 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         d = self.ca.authenticate_tenant(1)
         self.assertEqual(self.successResultOf(d), 'r2')
 
+    def test_bounded(self):
+        """
+        Least recently used tenant is evicted when more than `max_size`
+        tenants are cached.
+        """
+        self.ca = CachingAuthenticator(self.clock, self.ca._authenticator,
+                                       10, max_size=2)
+        self.resps.update({2: 'r2', 3: 'r3'})
+        for tenant_id in (1, 2, 1, 3):
+            self.successResultOf(self.ca.authenticate_tenant(tenant_id))
+        self.assertEqual(len(self.ca), 2)
+        self.resps.update({1: 'n1', 2: 'n2', 3: 'n3'})
+        self.assertEqual(
+            [self.successResultOf(self.ca.authenticate_tenant(t))
+             for t in (1, 3, 2)],
+            [self.result, 'r3', 'n2'])
+        self.assertEqual(self.ca.stats,
+                         {'hits': 3, 'misses': 4, 'refreshes': 0})
+
+    def test_refresh_ahead(self):
+        """
+        A token used after `refresh_ratio` of ttl is returned from cache and
+        refreshed in the background only once at a time. The refreshed token
+        is cached for another ttl.
+        """
+        self.successResultOf(self.ca.authenticate_tenant(1))
+        self.clock.advance(7)
+        self.successResultOf(self.ca.authenticate_tenant(1))
+        self.assertEqual(self.ca.stats['refreshes'], 0)
+
+        self.clock.advance(1)
+        auth_d = Deferred()
+        self.resps[1] = auth_d
+        for _ in range(2):
+            d = self.ca.authenticate_tenant(1)
+            self.assertEqual(self.successResultOf(d), self.result)
+        self.assertEqual(self.ca.stats['refreshes'], 1)
+
+        auth_d.callback('r2')
+        self.clock.advance(5)
+        d = self.ca.authenticate_tenant(1)
+        self.assertEqual(self.successResultOf(d), 'r2')
+        self.assertEqual(self.ca.stats,
+                         {'hits': 4, 'misses': 1, 'refreshes': 1})
+
+    def test_refresh_failure(self):
+        """
+        If refreshing a token fails, it is logged and the cached token is
+        returned until it expires.
+        """
+        log = mock_log()
+        self.successResultOf(self.ca.authenticate_tenant(1))
+        self.clock.advance(8)
+        self.resps[1] = APIError(500, '500')
+        d = self.ca.authenticate_tenant(1, log=log)
+        self.assertEqual(self.successResultOf(d), self.result)
+        log.err.assert_called_once_with(
+            CheckFailure(APIError), 'otter.auth.cache.refresh-failed',
+            system='otter.auth.cache', authenticator=self.ca._authenticator,
+            cache_ttl=10, tenant_id=1)
+        d = self.ca.authenticate_tenant(1, log=log)
+        self.assertEqual(self.successResultOf(d), self.result)
+        self.assertEqual(self.ca.stats['refreshes'], 2)
+        self.assertEqual(log.err.call_count, 2)
+
+        self.clock.advance(2)
+        self.failureResultOf(self.ca.authenticate_tenant(1, log=log),
+                             APIError)
+
+    def test_no_refresh(self):
+        """
+        Tokens are not refreshed if `refresh_ratio` is None
+        """
+        self.ca = CachingAuthenticator(self.clock, self.ca._authenticator,
+                                       10, refresh_ratio=None)
+        self.successResultOf(self.ca.authenticate_tenant(1))
+        self.clock.advance(9)
+        self.resps[1] = 'r2'
+        d = self.ca.authenticate_tenant(1)
+        self.assertEqual(self.successResultOf(d), self.result)
+        self.assertEqual(self.ca.stats['refreshes'], 0)
+
 
 class RetryingAuthenticatorTests(SynchronousTestCase):
     """
@@ -815,6 +1017,8 @@ class AuthenticatorTests(SynchronousTestCase):
         self.assertIsInstance(a, CachingAuthenticator)
         self.assertIdentical(a._reactor, r)
         self.assertEqual(a._ttl, 50)
+        self.assertEqual(a._cache.max_size, 10000)
+        self.assertEqual(a._refresh_ratio, 0.8)
 
         wa = a._authenticator
         self.assertIsInstance(wa, WaitingAuthenticator)
@@ -833,6 +1037,9 @@ class AuthenticatorTests(SynchronousTestCase):
         self.assertEqual(ia._identity_admin_password, 'pwd')
         self.assertEqual(ia._url, 'htp')
         self.assertEqual(ia._admin_url, 'ad')
+        self.assertEqual(ia._identity_ttl, 86400)
+        self.assertIsNone(ia._identity_store)
+        self.assertIsNotNone(ia._users)
 
     def test_wait_defaults(self):
         """
@@ -851,3 +1058,25 @@ class AuthenticatorTests(SynchronousTestCase):
         r = mock.Mock()
         a = generate_authenticator(r, self.config)
         self.assertEqual(a._ttl, 300)
+
+    def test_identity_cache(self):
+        """
+        ImpersonatingAuthenticator is created with identity_cache_ttl from
+        config and the given identity store
+        """
+        self.config['identity_cache_ttl'] = 20
+        a = generate_authenticator(mock.Mock(), self.config, 'store')
+        ia = a._authenticator._authenticator._authenticator
+        self.assertEqual(ia._identity_ttl, 20)
+        self.assertEqual(ia._identity_store, 'store')
+
+    def test_cache_size_and_refresh_ratio(self):
+        """
+        CachingAuthenticator is created with cache_size and
+        cache_refresh_ratio from config
+        """
+        self.config['cache_size'] = 20
+        self.config['cache_refresh_ratio'] = 0.5
+        a = generate_authenticator(mock.Mock(), self.config)
+        self.assertEqual(a._cache.max_size, 20)
+        self.assertEqual(a._refresh_ratio, 0.5)
@@ -1,12 +1,23 @@
 """ CQL Batch wrapper test """
+import struct
+from datetime import datetime
+from uuid import UUID
+
 from twisted.trial.unittest import SynchronousTestCase
 import mock
 from twisted.internet import defer
 from twisted.internet.task import Clock
 
-from silverberg.client import ConsistencyLevel
+from silverberg.cassandra import ttypes
+from silverberg.client import CQLClient, ConsistencyLevel
+from silverberg.cluster import RoundRobinCassandraCluster
 
-from otter.util.cqlbatch import Batch, TimingOutCQLClient
+from otter.util.cqlbatch import (
+    Batch,
+    PreparingCQLClient,
+    PreparingCassandraCluster,
+    TimingOutCQLClient,
+    _SilverbergInternals)
 from otter.util.deferredutils import TimedOutError
 
 
@@ -114,3 +125,318 @@ class TimingOutCQLClientTests(SynchronousTestCase):
         self.assertNoResult(d)
         self.clock.advance(10)
         self.failureResultOf(d, TimedOutError)
+
+
+_marshal = 'org.apache.cassandra.db.marshal.'
+
+
+def _succeed(result):
+    return lambda *args: defer.succeed(result)
+
+
+def _fail(error):
+    return lambda *args: defer.fail(error)
+
+
+class PreparingCQLClientTests(SynchronousTestCase):
+    """
+    Tests for :class:`PreparingCQLClient`
+    """
+
+    def setUp(self):
+        """
+        Client with mock thrift connection
+        """
+        self.client = PreparingCQLClient(mock.Mock(), 'ks', max_statements=2)
+        self.thrift = self._connect()
+        self.query = ('SELECT a FROM t WHERE "tenantId" = :tenantId '
+                      'AND bucket = :bucket AND trigger <= :now')
+        self.params = {'tenantId': u'ten', 'bucket': 5,
+                       'now': datetime(1970, 1, 1, 0, 0, 2, 500000)}
+        self.result = ttypes.CqlResult(
+            type=ttypes.CqlResultType.ROWS,
+            schema=ttypes.CqlMetadata(
+                value_types={'a': _marshal + 'AsciiType'}),
+            rows=[ttypes.CqlRow(columns=[ttypes.Column(name='a', value='v')])])
+
+    def _connect(self):
+        thrift = mock.Mock(spec=['prepare_cql3_query',
+                                 'execute_prepared_cql3_query',
+                                 'execute_cql3_query'])
+        thrift.prepare_cql3_query.side_effect = _succeed(
+            ttypes.CqlPreparedResult(
+                itemId=3, count=3,
+                variable_types=[_marshal + 'AsciiType', _marshal + 'Int32Type',
+                                _marshal + 'DateType']))
+        self.client._connection = lambda: defer.succeed(thrift)
+        return thrift
+
+    def _execute(self, query=None):
+        d = self.client.execute(query or self.query, self.params,
+                                ConsistencyLevel.QUORUM)
+        return self.successResultOf(d)
+
+    def test_prepares_once(self):
+        """
+        Query is prepared once and then executed with values serialized as
+        per the types of the variables
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            self.result)
+        self.assertEqual(self._execute(), [{'a': 'v'}])
+        self.assertEqual(self._execute(), [{'a': 'v'}])
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            'SELECT a FROM t WHERE "tenantId" = ? AND bucket = ? '
+            'AND trigger <= ?', ttypes.Compression.NONE)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.mock_calls,
+            [mock.call(3, ['ten', struct.pack('>i', 5),
+                           struct.pack('>q', 2500)],
+                       ConsistencyLevel.QUORUM)] * 2)
+
+    def test_prepares_again_on_new_connection(self):
+        """
+        Statements prepared in previous connection are prepared again in
+        new connection
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            self.result)
+        self._execute()
+        thrift = self._connect()
+        thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            self.result)
+        self.assertEqual(self._execute(), [{'a': 'v'}])
+        self.assertEqual(len(thrift.prepare_cql3_query.mock_calls), 1)
+
+    def test_forgets_least_recently_used(self):
+        """
+        Statements beyond `max_statements` are forgotten, least recently used
+        first
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            self.result)
+        for query in ['q1 :a', 'q2 :a', 'q1 :a', 'q3 :a', 'q1 :a', 'q2 :a']:
+            self.params = {'a': 's'}
+            self._execute(query)
+        self.assertEqual(
+            [call[1][0] for call in self.thrift.prepare_cql3_query.mock_calls],
+            ['q1 ?', 'q2 ?', 'q3 ?', 'q2 ?'])
+
+    def test_unpreparable(self):
+        """
+        Query that cannot be prepared is executed as text with values
+        substituted and is not prepared again
+        """
+        self.thrift.prepare_cql3_query.side_effect = _fail(
+            ttypes.InvalidRequestException(why='bad'))
+        self.thrift.execute_cql3_query.side_effect = _succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=4))
+        self.assertEqual(self._execute(), 4)
+        self.assertEqual(self._execute(), 4)
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            mock.ANY, ttypes.Compression.NONE)
+        self.thrift.execute_cql3_query.assert_called_with(
+            'SELECT a FROM t WHERE "tenantId" = \'ten\' AND bucket = 5 '
+            'AND trigger <= 2500', ttypes.Compression.NONE,
+            ConsistencyLevel.QUORUM)
+        self.assertFalse(self.thrift.execute_prepared_cql3_query.called)
+
+    def test_prepare_error(self):
+        """
+        Errors other than invalid request when preparing are propagated
+        """
+        self.thrift.prepare_cql3_query.side_effect = _fail(
+            ttypes.TimedOutException())
+        d = self.client.execute(self.query, self.params,
+                                ConsistencyLevel.QUORUM)
+        self.failureResultOf(d, ttypes.TimedOutException)
+
+    def test_statement_not_found(self):
+        """
+        Statement forgotten by the node is prepared again and executed
+        """
+        self.thrift.prepare_cql3_query.side_effect = [
+            defer.succeed(ttypes.CqlPreparedResult(
+                itemId=itemId, count=1,
+                variable_types=[_marshal + 'AsciiType']))
+            for itemId in (3, 4)]
+        self.thrift.execute_prepared_cql3_query.side_effect = [
+            defer.fail(ttypes.InvalidRequestException(
+                why='Prepared query with ID 3 not found')),
+            defer.succeed(ttypes.CqlResult(type=ttypes.CqlResultType.VOID))]
+        self.params = {'a': 'v'}
+        self.assertIsNone(self._execute('q :a'))
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.mock_calls,
+            [mock.call(3, ['v'], ConsistencyLevel.QUORUM),
+             mock.call(4, ['v'], ConsistencyLevel.QUORUM)])
+
+    def test_statement_not_found_again(self):
+        """
+        Statement is prepared again only once if it is not found
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = _fail(
+            ttypes.InvalidRequestException(why='Prepared query not found'))
+        d = self.client.execute(self.query, self.params,
+                                ConsistencyLevel.QUORUM)
+        self.failureResultOf(d, ttypes.InvalidRequestException)
+        self.assertEqual(
+            len(self.thrift.execute_prepared_cql3_query.mock_calls), 2)
+
+    def test_execute_error(self):
+        """
+        Other errors when executing are propagated
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = _fail(
+            ttypes.InvalidRequestException(why='bad value'))
+        d = self.client.execute(self.query, self.params,
+                                ConsistencyLevel.QUORUM)
+        self.failureResultOf(d, ttypes.InvalidRequestException)
+        self.assertEqual(
+            len(self.thrift.execute_prepared_cql3_query.mock_calls), 1)
+
+    def test_serialize(self):
+        """
+        UUIDs can be strings and reversed types are serialized as their
+        subtypes
+        """
+        uuid = UUID('a8098c1a-f86e-11da-bd1a-00112444be1e')
+        self.thrift.prepare_cql3_query.side_effect = _succeed(
+            ttypes.CqlPreparedResult(
+                itemId=3, count=3,
+                variable_types=[
+                    _marshal + 'TimeUUIDType', _marshal + 'UUIDType',
+                    _marshal + 'ReversedType(' + _marshal + 'DateType)']))
+        self.thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.VOID))
+        self.params = {'b': uuid, 'c': str(uuid), 'd': 1000}
+        self._execute('q :b :c :d')
+        self.thrift.execute_prepared_cql3_query.assert_called_once_with(
+            3, [uuid.bytes, uuid.bytes, struct.pack('>q', 1000)],
+            ConsistencyLevel.QUORUM)
+
+    def test_null_params(self):
+        """
+        Params that are None are sent as null literals in the prepared query
+        instead of being bound
+        """
+        self.thrift.prepare_cql3_query.side_effect = _succeed(
+            ttypes.CqlPreparedResult(
+                itemId=3, count=1, variable_types=[_marshal + 'AsciiType']))
+        self.thrift.execute_prepared_cql3_query.side_effect = _succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.VOID))
+        self.params = {'a': None, 'b': 'v', 'c': None}
+        self._execute("UPDATE t SET x = :a, y = :c WHERE k = :b")
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            'UPDATE t SET x = null, y = null WHERE k = ?',
+            ttypes.Compression.NONE)
+        self.thrift.execute_prepared_cql3_query.assert_called_once_with(
+            3, ['v'], ConsistencyLevel.QUORUM)
+
+    def test_dynamic_not_prepared(self):
+        """
+        Batches and queries with IN lists are executed as text without
+        preparing them
+        """
+        self.thrift.execute_cql3_query.side_effect = _succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.VOID))
+        self.params = {'a0': 'x', 'a1': None}
+        for query, text in [
+                ('BEGIN BATCH UPDATE t SET x = :a1 WHERE k = :a0 '
+                 'APPLY BATCH;',
+                 "BEGIN BATCH UPDATE t SET x = null WHERE k = 'x' "
+                 "APPLY BATCH;"),
+                ('SELECT x FROM t WHERE k IN (:a0, :a1)',
+                 "SELECT x FROM t WHERE k IN ('x', null)")]:
+            self._execute(query)
+            self.thrift.execute_cql3_query.assert_called_with(
+                text, ttypes.Compression.NONE, ConsistencyLevel.QUORUM)
+        self.assertFalse(self.thrift.prepare_cql3_query.called)
+        self.assertFalse(self.thrift.execute_prepared_cql3_query.called)
+
+    def test_cluster(self):
+        """
+        :class:`PreparingCassandraCluster` executes with
+        :class:`PreparingCQLClient` of each endpoint
+        """
+        cluster = PreparingCassandraCluster(
+            ['e1', 'e2'], 'ks', disconnect_on_cancel=True, max_statements=5)
+        self.assertEqual(len(cluster._seed_clients), 2)
+        for client in cluster._seed_clients:
+            self.assertIsInstance(client, PreparingCQLClient)
+            self.assertEqual(client._internals.keyspace, 'ks')
+            self.assertTrue(client._internals.disconnect_on_cancel)
+            self.assertEqual(client._max_statements, 5)
+
+    def test_describe_ring(self):
+        """
+        `describe_ring` returns token ranges of the client's keyspace
+        """
+        self.thrift = mock.Mock(spec=['describe_ring'])
+        self.thrift.describe_ring.side_effect = _succeed(['r1', 'r2'])
+        self.client._connection = lambda: defer.succeed(self.thrift)
+        self.assertEqual(
+            self.successResultOf(self.client.describe_ring()), ['r1', 'r2'])
+        self.thrift.describe_ring.assert_called_once_with('ks')
+
+    def test_describe_partitioner(self):
+        """
+        `describe_partitioner` returns partitioner of the cluster
+        """
+        self.thrift = mock.Mock(spec=['describe_partitioner'])
+        self.thrift.describe_partitioner.side_effect = _succeed('p')
+        self.client._connection = lambda: defer.succeed(self.thrift)
+        self.assertEqual(
+            self.successResultOf(self.client.describe_partitioner()), 'p')
+
+
+class SilverbergInternalsTests(SynchronousTestCase):
+    """
+    Tests for :class:`_SilverbergInternals` against the installed silverberg
+    """
+
+    def setUp(self):
+        """
+        Real silverberg client with mock endpoint
+        """
+        self.endpoint = mock.Mock(spec=['connect'])
+        self.endpoint.connect.return_value = defer.Deferred()
+        self.client = CQLClient(self.endpoint, 'ks',
+                                disconnect_on_cancel=True)
+        self.internals = _SilverbergInternals(self.client)
+
+    def test_attributes(self):
+        """
+        Keyspace and whether to disconnect on cancel are the client's
+        """
+        self.assertEqual(self.internals.keyspace, 'ks')
+        self.assertTrue(self.internals.disconnect_on_cancel)
+
+    def test_connection(self):
+        """
+        Connection is got by connecting to the client's endpoint
+        """
+        d = self.internals.connection()
+        self.assertNoResult(d)
+        self.assertEqual(self.endpoint.connect.call_count, 1)
+
+    def test_unmarshal_rows(self):
+        """
+        Rows are unmarshalled to ``list`` of ``dict``
+        """
+        schema = ttypes.CqlMetadata(value_types={'a': _marshal + 'AsciiType'})
+        rows = [ttypes.CqlRow(columns=[ttypes.Column(name='a', value='v')])]
+        self.assertEqual(self.internals.unmarshal_rows(schema, rows),
+                         [{'a': 'v'}])
+
+    def test_set_cluster_clients(self):
+        """
+        Cluster executes queries with the clients set
+        """
+        cluster = RoundRobinCassandraCluster([], 'ks')
+        client = mock.Mock(spec=['execute'])
+        client.execute.return_value = defer.succeed('r')
+        _SilverbergInternals.set_cluster_clients(cluster, [client])
+        self.assertEqual(
+            self.successResultOf(cluster.execute('q', {}, 1)), 'r')
+        client.execute.assert_called_once_with('q', {}, 1)
@@ -115,7 +115,8 @@ class PerformServiceRequestTests(SynchronousTestCase):
         self.assertEqual(
             next_eff.intent,
             Request(method='GET', url='http://dfw.openstack/servers',
-                    headers=headers('token'), log=self.log))
+                    headers=headers('token'), log=self.log,
+                    service_type=ServiceType.CLOUD_SERVERS, tenant_id=1))
 
     def test_invalidate_on_auth_error_code(self):
         """
@@ -9,8 +9,10 @@ from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 
+from otter.constants import ServiceType
 from otter.util import logging_treq
 from otter.util.deferredutils import TimedOutError
+from otter.util.httppool import HTTPPoolRegistry, set_pool_registry
 from otter.test.utils import CheckFailure, DummyException, mock_log, patch
 
 
@@ -272,3 +274,34 @@ class LoggingTreqTest(SynchronousTestCase):
         On timed out call to delete, failure is returned and request logged
         """
         self._test_method_timeout('delete')
+
+    def test_service_pool(self):
+        """
+        Requests use the pool of their service type from the pool registry
+        unless a pool is given. No pool is used if there is no registry.
+        """
+        pools = HTTPPoolRegistry(self.clock)
+        set_pool_registry(pools)
+        self.addCleanup(set_pool_registry, None)
+
+        logging_treq.get(self.url, log=self.log,
+                         service_type=ServiceType.CLOUD_SERVERS)
+        self.treq.get.assert_called_once_with(
+            url=self.url, headers=None,
+            pool=pools.get_pool(ServiceType.CLOUD_SERVERS))
+
+        logging_treq.get(self.url, log=self.log)
+        self.assertEqual(self.treq.get.call_args,
+                         mock.call(url=self.url, headers=None,
+                                   pool=pools.get_pool()))
+
+        logging_treq.get(self.url, log=self.log, pool='p',
+                         service_type=ServiceType.CLOUD_SERVERS)
+        self.assertEqual(self.treq.get.call_args,
+                         mock.call(url=self.url, headers=None, pool='p'))
+
+        set_pool_registry(None)
+        logging_treq.get(self.url, log=self.log,
+                         service_type=ServiceType.CLOUD_SERVERS)
+        self.assertEqual(self.treq.get.call_args,
+                         mock.call(url=self.url, headers=None))
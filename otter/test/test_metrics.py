@@ -5,7 +5,10 @@ Tests for `metrics.py`
 import operator
 from io import StringIO
 
-from effect import Constant, Effect, base_dispatcher
+from effect import (
+    ComposedDispatcher, Constant, Effect, Error, TypeDispatcher,
+    base_dispatcher)
+from effect.twisted import deferred_performer
 
 import mock
 
@@ -18,25 +21,31 @@ from testtools.matchers import IsInstance
 from toolz.dicttoolz import merge
 
 from twisted.internet.base import ReactorBase
-from twisted.internet.defer import fail, succeed
-from twisted.internet.task import Clock
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock, Cooperator
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import IAuthenticator
 from otter.constants import ServiceType
 from otter.http import TenantScope
 from otter.metrics import (
+    EffectWindow,
     GroupMetrics,
     MetricsService,
+    MetricsTotals,
     Options,
     add_to_cloud_metrics,
     collect_metrics,
+    fold_tenant_metrics,
     get_all_metrics,
     get_all_metrics_effects,
     get_scaling_groups,
     get_tenant_metrics,
     makeService,
     metrics_log,
+    scan_scaling_groups,
+    scan_token_range,
+    token_ranges,
 )
 from otter.test.test_auth import identity_config
 from otter.test.utils import (
@@ -67,8 +76,7 @@ class GetScalingGroupsTests(SynchronousTestCase):
             return succeed(self.exec_args[freeze((query, params))])
 
         self.client.execute.side_effect = _exec
-        self.select = ('SELECT "groupId","tenantId",'
-                       'active,created_at,desired,pending '
+        self.select = ('SELECT "groupId","tenantId",created_at,desired '
                        'FROM scaling_group ')
 
     def _add_exec_args(self, query, params, ret):
@@ -132,8 +140,7 @@ class GetScalingGroupsTests(SynchronousTestCase):
                   {'tenantId': 1, 'groupId': 3, 'desired': 2,
                    'created_at': 'c', 'launch': 'b'}]
         self._add_exec_args(
-            ('SELECT "groupId","tenantId",active,created_at,'
-             'desired,launch,pending '
+            ('SELECT "groupId","tenantId",created_at,desired,launch '
              'FROM scaling_group  LIMIT :limit;'),
             {'limit': 5}, groups)
         d = get_scaling_groups(self.client, props=['launch'], batch_size=5)
@@ -193,6 +200,217 @@ class GetScalingGroupsTests(SynchronousTestCase):
         self.assertEqual(list(self.successResultOf(d)), groups1 + groups2)
 
 
+class TokenRangesTests(SynchronousTestCase):
+    """
+    Tests for :func:`token_ranges`
+    """
+
+    def test_splits_ring(self):
+        """
+        Ring is split into given number of contiguous ranges covering
+        whole ring
+        """
+        self.assertEqual(token_ranges(4, 0, 100),
+                         [(0, 25), (25, 50), (50, 75), (75, 100)])
+
+    def test_uneven(self):
+        """
+        Last range extends till the max token when the ring cannot be
+        split evenly
+        """
+        self.assertEqual(token_ranges(3, 0, 10), [(0, 3), (3, 6), (6, 10)])
+
+    def test_default_murmur3_bounds(self):
+        """
+        Murmur3 token bounds are used by default
+        """
+        ranges = token_ranges(2)
+        self.assertEqual(ranges[0][0], -2 ** 63)
+        self.assertEqual(ranges[-1][1], 2 ** 63 - 1)
+        self.assertEqual(ranges[0][1], ranges[1][0])
+
+
+class ScanTokenRangeTests(SynchronousTestCase):
+    """
+    Tests for :func:`scan_token_range`
+    """
+
+    def setUp(self):
+        """
+        Mock client and setup queries
+        """
+        self.client = mock.Mock(spec=CQLClient)
+        self.exec_args = {}
+
+        def _exec(query, params, c):
+            return succeed(self.exec_args[freeze((query, params))])
+
+        self.client.execute.side_effect = _exec
+        select = ('SELECT "groupId","tenantId",created_at,desired '
+                  'FROM scaling_group ')
+        self.range_query = select + (
+            'WHERE token("tenantId") > :start AND '
+            'token("tenantId") <= :end LIMIT :limit;')
+        self.tenant_query = select + (
+            'WHERE "tenantId"=:tenantId AND '
+            '"groupId">:groupId LIMIT :limit;')
+        self.token_query = select + (
+            'WHERE token("tenantId") > token(:tenantId) AND '
+            'token("tenantId") <= :end LIMIT :limit;')
+        self.visited = []
+
+    def _add_exec_args(self, query, params, ret):
+        self.exec_args[freeze((query, params))] = ret
+
+    def _scan(self, **kwargs):
+        return scan_token_range(self.client, (-5, 5), self.visited.append,
+                                batch_size=3, **kwargs)
+
+    def test_less_than_batch(self):
+        """
+        Groups in the range are visited once when there are fewer
+        groups than the batch size
+        """
+        groups = [{'tenantId': 1, 'groupId': i,
+                   'desired': 3, 'created_at': 'c'} for i in range(2)]
+        self._add_exec_args(self.range_query,
+                            {'limit': 3, 'start': -5, 'end': 5}, groups)
+        self.assertIsNone(self.successResultOf(self._scan()))
+        self.assertEqual(self.visited, [groups])
+
+    def test_visits_tenants_together(self):
+        """
+        Remaining groups of last tenant in a batch are fetched and visited
+        along with that batch. Then groups of next tenants within the
+        range are fetched
+        """
+        groups1 = [{'tenantId': 1, 'groupId': i,
+                    'desired': 3, 'created_at': 'c'} for i in range(4)]
+        groups2 = [{'tenantId': 2, 'groupId': i,
+                    'desired': 3, 'created_at': 'c'} for i in range(2)]
+        self._add_exec_args(self.range_query,
+                            {'limit': 3, 'start': -5, 'end': 5},
+                            groups1[:3])
+        self._add_exec_args(self.tenant_query,
+                            {'limit': 3, 'tenantId': 1, 'groupId': 2},
+                            groups1[3:])
+        self._add_exec_args(self.token_query,
+                            {'limit': 3, 'tenantId': 1, 'end': 5},
+                            groups2)
+        self.assertIsNone(self.successResultOf(self._scan()))
+        self.assertEqual(self.visited, [groups1, groups2])
+
+    def test_filters_groups(self):
+        """
+        Groups without desired or created_at and the ones not satisfying
+        `group_pred` are not visited
+        """
+        groups = [{'tenantId': 1, 'groupId': 1,
+                   'desired': None, 'created_at': 'c'},
+                  {'tenantId': 1, 'groupId': 2,
+                   'desired': 2, 'created_at': None},
+                  {'tenantId': 1, 'groupId': 3,
+                   'desired': 2, 'created_at': 'c'}]
+        self._add_exec_args(self.range_query,
+                            {'limit': 3, 'start': -5, 'end': 5}, groups[:2])
+        self.successResultOf(self._scan())
+        self.assertEqual(self.visited, [[]])
+
+    def test_include_resurrected(self):
+        """
+        Groups without desired or created_at are visited if
+        `include_resurrected` is True
+        """
+        groups = [{'tenantId': 1, 'groupId': 1,
+                   'desired': None, 'created_at': None},
+                  {'tenantId': 1, 'groupId': 2,
+                   'desired': 2, 'created_at': 'c'}]
+        self._add_exec_args(self.range_query,
+                            {'limit': 3, 'start': -5, 'end': 5}, groups)
+        self.successResultOf(self._scan(include_resurrected=True))
+        self.assertEqual(self.visited, [groups])
+
+    def test_waits_for_visit(self):
+        """
+        Next batch is not fetched until the `Deferred` returned by `visit`
+        fires
+        """
+        groups = [{'tenantId': i, 'groupId': 1,
+                   'desired': 3, 'created_at': 'c'} for i in range(4)]
+        self._add_exec_args(self.range_query,
+                            {'limit': 3, 'start': -5, 'end': 5}, groups[:3])
+        self._add_exec_args(self.tenant_query,
+                            {'limit': 3, 'tenantId': 2, 'groupId': 1}, [])
+        self._add_exec_args(self.token_query,
+                            {'limit': 3, 'tenantId': 2, 'end': 5},
+                            groups[3:])
+        visits = []
+
+        def visit(groups):
+            visits.append((groups, Deferred()))
+            return visits[-1][1]
+
+        d = scan_token_range(self.client, (-5, 5), visit, batch_size=3)
+        self.assertNoResult(d)
+        self.assertEqual(len(visits), 1)
+        self.assertEqual(self.client.execute.call_count, 2)
+        visits[0][1].callback(None)
+        self.assertEqual(visits[1][0], groups[3:])
+        visits[1][1].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+
+
+class ScanScalingGroupsTests(SynchronousTestCase):
+    """
+    Tests for :func:`scan_scaling_groups`
+    """
+
+    def setUp(self):
+        """
+        Mock scan_token_range
+        """
+        self.scans = {}
+
+        def scan(client, token_range, visit, **kwargs):
+            self.assertEqual(kwargs, {'props': ['p'], 'batch_size': 10,
+                                      'group_pred': None,
+                                      'include_resurrected': False})
+            self.scans[token_range] = Deferred()
+            return self.scans[token_range]
+
+        self.scan = patch(self, 'otter.metrics.scan_token_range',
+                          side_effect=scan)
+        patch(self, 'otter.metrics.token_ranges',
+              side_effect=lambda n: [(i, i + 1) for i in range(n)])
+
+    def test_bounded_parallel(self):
+        """
+        Scans all the ranges with at most `parallel` scans at a time
+        """
+        d = scan_scaling_groups('client', 'visit', props=['p'],
+                                batch_size=10, num_ranges=3, parallel=2)
+        self.assertEqual(sorted(self.scans.keys()), [(0, 1), (1, 2)])
+        self.scans[(1, 2)].callback(None)
+        self.assertEqual(sorted(self.scans.keys()), [(0, 1), (1, 2), (2, 3)])
+        self.assertNoResult(d)
+        self.scans[(0, 1)].callback(None)
+        self.scans[(2, 3)].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            [c[1][:3] for c in self.scan.mock_calls],
+            [('client', (i, i + 1), 'visit') for i in range(3)])
+
+    def test_error(self):
+        """
+        Fails if any of the range scans fail
+        """
+        d = scan_scaling_groups('client', 'visit', props=['p'],
+                                batch_size=10, num_ranges=2, parallel=2)
+        self.scans[(0, 1)].errback(ValueError('e'))
+        self.scans[(1, 2)].callback(None)
+        self.failureResultOf(d)
+
+
 class GetTenantMetricsTests(SynchronousTestCase):
     """Tests for :func:`get_tenant_metrics`"""
 
@@ -276,32 +494,190 @@ class GetAllMetricsEffectsTests(SynchronousTestCase):
             CheckFailureValue(ZeroDivisionError('foo bar')))
 
 
+class MetricsTotalsTests(SynchronousTestCase):
+    """
+    Tests for :class:`MetricsTotals` and :func:`fold_tenant_metrics`
+    """
+
+    def test_add(self):
+        """
+        Metrics are added to running totals without keeping the groups
+        """
+        totals = MetricsTotals()
+        totals.add([GroupMetrics('t', 'g1', 3, 2, 1)])
+        totals.add([GroupMetrics('t2', 'g2', 4, 1, 2),
+                    GroupMetrics('t2', 'g3', 1, 1, 0)])
+        self.assertEqual((totals.desired, totals.actual, totals.pending),
+                         (8, 4, 3))
+        self.assertIsNone(totals.groups)
+
+    def test_add_keep_groups(self):
+        """
+        Folded groups are kept if asked for
+        """
+        totals = MetricsTotals(keep_groups=True)
+        metrics = [GroupMetrics('t', 'g1', 3, 2, 1)]
+        totals.add(metrics)
+        self.assertEqual(totals.groups, metrics)
+
+    def test_fold_tenant_metrics(self):
+        """
+        Tenant's metrics are logged and folded into the totals
+        """
+        totals, log = MetricsTotals(), mock_log()
+        fold_tenant_metrics(totals, log,
+                            [GroupMetrics('t', 'g1', 3, 2, 1),
+                             GroupMetrics('t', 'g2', 4, 1, 0)])
+        self.assertEqual((totals.desired, totals.actual, totals.pending),
+                         (7, 3, 1))
+        log.msg.assert_called_once_with(
+            'tenant metrics', tenant_id='t', desired=7, actual=3, pending=1)
+
+    def test_fold_tenant_metrics_none(self):
+        """
+        Nothing is folded or logged when tenant's metrics is None
+        """
+        totals, log = MetricsTotals(), mock_log()
+        fold_tenant_metrics(totals, log, None)
+        self.assertEqual((totals.desired, totals.actual, totals.pending),
+                         (0, 0, 0))
+        self.assertFalse(log.msg.called)
+
+
+class _Wait(object):
+    """Intent that results in the given Deferred's result"""
+    def __init__(self, d):
+        self.d = d
+
+
 class GetAllMetricsTests(SynchronousTestCase):
     """
-    Tests for :func:`get_all_metrics`.
+    Tests for :func:`get_all_metrics` and :class:`EffectWindow`
     """
 
+    def setUp(self):
+        """
+        Setup window performing effects with a dispatcher that can wait
+        """
+        self.totals = MetricsTotals(keep_groups=True)
+        self.dispatcher = ComposedDispatcher([
+            TypeDispatcher({
+                _Wait: deferred_performer(lambda d, intent: intent.d)}),
+            base_dispatcher])
+        self.log = mock_log()
+        self.cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=lambda f: f())
+        self.window = EffectWindow(self.dispatcher, 2, self.log,
+                                   coiterate=self.cooperator.coiterate)
+
+    def _get_all_metrics(self, effs):
+        def _game(groups, log, _print=False):
+            return effs
+        return get_all_metrics(self.window, object(), self.totals,
+                               get_all_metrics_effects=_game)
+
     def test_get_all_metrics(self):
-        """Gets group's metrics"""
-        def _game(groups, logs, _print=False):
-            return [Effect(Constant(['foo', 'bar'])),
-                    Effect(Constant(['baz']))]
-        d = get_all_metrics(base_dispatcher, object(),
-                            get_all_metrics_effects=_game)
-        self.assertEqual(set(self.successResultOf(d)),
-                         set(['foo', 'bar', 'baz']))
+        """Gets group's metrics and folds them into totals"""
+        m1 = GroupMetrics('t', 'g1', 3, 2, 1)
+        m2 = GroupMetrics('t2', 'g2', 4, 1, 0)
+        m3 = GroupMetrics('t2', 'g3', 2, 2, 0)
+        d = self._get_all_metrics([Effect(Constant([m1])),
+                                   Effect(Constant([m2, m3]))])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertIsNone(self.successResultOf(self.window.wait()))
+        self.assertEqual(set(self.totals.groups), set([m1, m2, m3]))
+        self.assertEqual(
+            (self.totals.desired, self.totals.actual, self.totals.pending),
+            (9, 5, 1))
 
     def test_ignore_error_results(self):
         """
         When get_all_metrics_effects returns a list containing a None, those
         elements are ignored.
         """
-        def _game(groups, log, _print=False):
-            return [Effect(Constant(None)),
-                    Effect(Constant(['foo']))]
-        d = get_all_metrics(base_dispatcher, object(),
-                            get_all_metrics_effects=_game)
-        self.assertEqual(self.successResultOf(d), ['foo'])
+        m = GroupMetrics('t', 'g1', 3, 2, 1)
+        d = self._get_all_metrics([Effect(Constant(None)),
+                                   Effect(Constant([m]))])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.totals.groups, [m])
+
+    def test_folds_as_completed(self):
+        """
+        Tenant's metrics are folded as soon as they are available even if
+        other tenants' metrics are pending. get_all_metrics returns once all
+        the effects are started and the window waits for them to complete.
+        """
+        m1 = GroupMetrics('t', 'g1', 3, 2, 1)
+        m2 = GroupMetrics('t2', 'g2', 4, 1, 0)
+        m3 = GroupMetrics('t3', 'g3', 2, 2, 0)
+        slow = Deferred()
+        effs = [Effect(_Wait(slow)), Effect(Constant([m2])),
+                Effect(Constant([m3]))]
+        self.successResultOf(self._get_all_metrics(effs))
+        self.assertEqual(self.totals.groups, [m2, m3])
+        d = self.window.wait()
+        self.assertNoResult(d)
+        slow.callback([m1])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.totals.groups, [m2, m3, m1])
+
+    def test_limit_shared(self):
+        """
+        No more than `limit` effects are performed concurrently across all
+        the batches submitted to the window. A batch is submitted once its
+        last effect is started.
+        """
+        ds = [Deferred() for _ in range(3)]
+        started = []
+
+        def effs(indexes):
+            for i in indexes:
+                started.append(i)
+                yield Effect(_Wait(ds[i]))
+
+        d1 = self._get_all_metrics(effs([0, 1]))
+        self.successResultOf(d1)
+        d2 = self._get_all_metrics(effs([2]))
+        self.assertNoResult(d2)
+        self.assertEqual(started, [0, 1, 2])
+        ds[1].callback(None)
+        self.successResultOf(d2)
+        ds[0].callback(None)
+        d = self.window.wait()
+        self.assertNoResult(d)
+        ds[2].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_performed_by_cooperative_tasks(self):
+        """
+        Effects are performed by at most `limit` tasks of the cooperator, so
+        nothing is performed until the cooperator runs them
+        """
+        ticks = []
+        cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=ticks.append)
+        window = EffectWindow(self.dispatcher, 2, self.log,
+                              coiterate=cooperator.coiterate)
+        d = window.submit([Effect(Constant([m]))
+                           for m in [GroupMetrics('t', 'g', 1, 1, 0)] * 3])
+        self.assertNoResult(d)
+        while ticks:
+            ticks.pop(0)()
+        self.successResultOf(d)
+        self.successResultOf(window.wait())
+
+    def test_error_logged(self):
+        """
+        Failure of an effect is logged and frees its slot
+        """
+        d = self.window.submit([Effect(Error(ValueError('bad'))),
+                                Effect(Constant(None)),
+                                Effect(Constant(None))])
+        self.successResultOf(d)
+        self.log.err.assert_called_once_with(CheckFailure(ValueError),
+                                             'metrics effect failed')
 
 
 class AddToCloudMetricsTests(SynchronousTestCase):
@@ -352,15 +728,23 @@ class CollectMetricsTests(SynchronousTestCase):
         self.connect_cass_servers.return_value = self.client
 
         self.groups = mock.Mock()
-        self.get_scaling_groups = patch(
-            self, 'otter.metrics.get_scaling_groups',
-            return_value=succeed(self.groups))
+
+        def scan(client, visit, **kwargs):
+            return visit(self.groups)
+
+        self.scan_scaling_groups = patch(
+            self, 'otter.metrics.scan_scaling_groups', side_effect=scan)
 
         self.metrics = [GroupMetrics('t', 'g1', 3, 2, 0),
                         GroupMetrics('t2', 'g1', 4, 4, 1),
                         GroupMetrics('t2', 'g', 100, 20, 0)]
+
+        def get_all_metrics(window, groups, totals, **kwargs):
+            totals.add(self.metrics)
+            return succeed(None)
+
         self.get_all_metrics = patch(self, 'otter.metrics.get_all_metrics',
-                                     return_value=succeed(self.metrics))
+                                     side_effect=get_all_metrics)
 
         self.add_to_cloud_metrics = patch(self,
                                           'otter.metrics.add_to_cloud_metrics',
@@ -396,10 +780,15 @@ class CollectMetricsTests(SynchronousTestCase):
         self.assertIsNone(self.successResultOf(d))
 
         self.connect_cass_servers.assert_called_once_with(_reactor, 'c')
-        self.get_scaling_groups.assert_called_once_with(
-            self.client, props=['status'], group_pred=IsCallable())
+        self.scan_scaling_groups.assert_called_once_with(
+            self.client, IsCallable(), props=['status'],
+            group_pred=IsCallable(), num_ranges=16, parallel=4)
         self.get_all_metrics.assert_called_once_with(
-            self.dispatcher, self.groups, _print=False)
+            matches(IsInstance(EffectWindow)), self.groups,
+            matches(IsInstance(MetricsTotals)), _print=False)
+        window = self.get_all_metrics.call_args[0][0]
+        self.assertIs(window.dispatcher, self.dispatcher)
+        self.assertEqual(window.limit, 10)
         self.add_to_cloud_metrics.assert_called_once_with(
             self.config['metrics']['ttl'], 'r', 107, 26, 1,
             log=metrics_log)
@@ -427,7 +816,11 @@ class CollectMetricsTests(SynchronousTestCase):
                             get_full_dispatcher=self.get_full_dispatcher)
         self.assertIsNone(self.successResultOf(d))
         self.get_all_metrics.assert_called_once_with(
-            self.dispatcher, self.groups, _print=False)
+            matches(IsInstance(EffectWindow)), self.groups,
+            matches(IsInstance(MetricsTotals)), _print=False)
+        window = self.get_all_metrics.call_args[0][0]
+        self.assertIs(window.dispatcher, self.dispatcher)
+        self.assertEqual(window.limit, 10)
 
 
 class APIOptionsTests(SynchronousTestCase):
@@ -1,16 +1,23 @@
 """
 Tests for :mod:`otter.scheduler`
 """
+import calendar
 from datetime import datetime, timedelta
 
 import mock
 
+from kazoo.protocol.states import KazooState
+
+from toolz.dicttoolz import dissoc
+
 from twisted.internet import defer
+from twisted.internet.defer import FirstError
 from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.controller import CannotExecutePolicyError
 from otter.models.interface import (
+    GroupState,
     IScalingGroup,
     IScalingGroupCollection,
     IScalingScheduleCollection,
@@ -19,15 +26,19 @@ from otter.models.interface import (
 )
 from otter.scheduler import (
     SchedulerService,
+    UpcomingEvents,
     add_cron_events,
-    check_events_in_bucket,
-    execute_event,
+    check_events_in_buckets,
+    execute_group_events,
+    latency_histogram,
     process_events
 )
 from otter.test.utils import (
     CheckFailure,
     DeferredFunctionMixin,
+    IsBoundWith,
     iMock,
+    matches,
     mock_log,
     patch
 )
@@ -58,8 +69,8 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
         """
         Mock all the dependencies of SchedulingService.
 
-        This includes logging, store's fetch_and_delete, TxKazooClient
-        stuff, TimerService, check_events_in_bucket and
+        This includes logging, store's fetch_and_delete_buckets, TxKazooClient
+        stuff, TimerService, check_events_in_buckets and
         twisted.internet.task.Clock is used to simulate time.
         """
         super(SchedulerServiceTests, self).setUp()
@@ -90,8 +101,8 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
         self.scheduler_service.running = False
         self.timer_service = patch(self, 'otter.scheduler.TimerService')
 
-        self.check_events_in_bucket = patch(
-            self, 'otter.scheduler.check_events_in_bucket')
+        self.check_events_in_buckets = patch(
+            self, 'otter.scheduler.check_events_in_buckets')
 
         self.returns = []
         self.setup_func(self.mock_store.get_oldest_event)
@@ -254,7 +265,7 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
 
         # Ensure others are not called
         self.assertFalse(self.kz_partition.__iter__.called)
-        self.assertFalse(self.check_events_in_bucket.called)
+        self.assertFalse(self.check_events_in_buckets.called)
 
     def test_check_events_release(self):
         """
@@ -270,7 +281,7 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
 
         # Ensure others are not called
         self.assertFalse(self.kz_partition.__iter__.called)
-        self.assertFalse(self.check_events_in_bucket.called)
+        self.assertFalse(self.check_events_in_buckets.called)
 
     def test_check_events_failed(self):
         """
@@ -298,7 +309,7 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
         # Ensure others are not called
         self.assertFalse(self.kz_partition.__iter__.called)
         self.assertFalse(new_kz_partition.__iter__.called)
-        self.assertFalse(self.check_events_in_bucket.called)
+        self.assertFalse(self.check_events_in_buckets.called)
 
     def test_check_events_bad_state(self):
         """`self.kz_partition.state` is none of the exepected values.
@@ -330,21 +341,23 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
         # Ensure others are not called
         self.assertFalse(self.kz_partition.__iter__.called)
         self.assertFalse(new_kz_partition.__iter__.called)
-        self.assertFalse(self.check_events_in_bucket.called)
+        self.assertFalse(self.check_events_in_buckets.called)
 
     @mock.patch('otter.scheduler.datetime')
     def test_check_events_acquired(self, mock_datetime):
         """
-        `check_events` checks events in each bucket when they are partitoned.
+        `check_events` checks events in groups of `bucket_group_size` buckets
+        when they are partitoned.
         """
         self.kz_partition.acquired = True
         self._start_service()
-        self.kz_partition.__iter__.return_value = [2, 3]
+        self.scheduler_service.bucket_group_size = 2
+        self.kz_partition.__iter__.return_value = [2, 3, 4]
         self.scheduler_service.log = mock.Mock()
         mock_datetime.utcnow.return_value = 'utcnow'
 
         responses = [4, 5]
-        self.check_events_in_bucket.side_effect = \
+        self.check_events_in_buckets.side_effect = \
             lambda *_: defer.succeed(responses.pop(0))
 
         d = self.scheduler_service.check_events(100)
@@ -355,22 +368,263 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
             scheduler_run_id='transaction-id', utcnow='utcnow')
         log = self.scheduler_service.log.bind.return_value
         log.msg.assert_called_once_with('Got buckets {buckets}',
-                                        buckets=[2, 3], path='/part_path')
-        self.assertEqual(self.check_events_in_bucket.mock_calls,
-                         [mock.call(log, self.mock_store, 2, 'utcnow', 100),
-                          mock.call(log, self.mock_store, 3, 'utcnow', 100)])
+                                        buckets=[2, 3, 4], path='/part_path')
+        self.assertEqual(self.check_events_in_buckets.mock_calls,
+                         [mock.call(log, self.mock_store, [2, 3], 'utcnow',
+                                    100, self.scheduler_service.semaphore),
+                          mock.call(log, self.mock_store, [4], 'utcnow',
+                                    100, self.scheduler_service.semaphore)])
 
 
-class CheckEventsInBucketTests(SchedulerTests):
+class SchedulerServicePreloadTests(SchedulerTests):
     """
-    Tests for `check_events_in_bucket`
+    Tests for `SchedulerService` with `preload_horizon`
     """
 
     def setUp(self):
         """
-        Mock store.fetch_and_delete and `process_events`
+        Mock dependencies of SchedulerService and `UpcomingEvents`
+        """
+        super(SchedulerServicePreloadTests, self).setUp()
+        self.kz_client = mock.Mock(
+            spec=['SetPartitioner', 'add_listener', 'remove_listener'])
+        self.kz_partition = mock.MagicMock(allocating=False, release=False,
+                                           failed=False, acquired=True)
+        self.kz_client.SetPartitioner.return_value = self.kz_partition
+        self.kz_partition.__iter__.return_value = [2, 3]
+        self.kz_partition.__contains__.side_effect = lambda b: b in [2, 3]
+        self.upcoming = patch(self, 'otter.scheduler.UpcomingEvents')
+        self.check_events_in_buckets = patch(
+            self, 'otter.scheduler.check_events_in_buckets')
+        self.scheduler_service = SchedulerService(
+            100, 1, self.mock_store, self.kz_client, '/part_path', 15,
+            range(1, 10), Clock(), bucket_group_size=5, preload_horizon=60)
+        patch(self, 'otter.scheduler.TimerService')
+        self.scheduler_service.startService()
+
+    @mock.patch('otter.scheduler.datetime')
+    def test_loads_upcoming(self, mock_datetime):
+        """
+        Events occurring within horizon are loaded instead of polling for
+        events occurring now
         """
-        super(CheckEventsInBucketTests, self).setUp()
+        mock_datetime.utcnow.return_value = datetime(2015, 1, 1)
+        self.upcoming.return_value.load.return_value = defer.succeed(3)
+        d = self.scheduler_service.check_events(100)
+        self.assertEqual(self.successResultOf(d), 3)
+        self.upcoming.return_value.load.assert_called_once_with(
+            mock.ANY, [2, 3], datetime(2015, 1, 1, 0, 1), 5)
+        self.assertFalse(self.check_events_in_buckets.called)
+
+    def test_partition_changed(self):
+        """
+        Loaded events are cleared when partition changes
+        """
+        self.kz_partition.release = True
+        self.scheduler_service.check_events(100)
+        self.upcoming.return_value.clear.assert_called_once_with()
+        self.assertFalse(self.upcoming.return_value.load.called)
+
+    def test_stop_service(self):
+        """
+        Loaded events are cleared and ZooKeeper state is not listened to
+        anymore when service is stopped
+        """
+        self.scheduler_service.stopService()
+        self.upcoming.return_value.clear.assert_called_once_with()
+        self.kz_client.remove_listener.assert_called_once_with(
+            self.scheduler_service._zk_state_changed)
+
+    def test_owns_bucket(self):
+        """
+        `UpcomingEvents` is given a function telling whether a bucket is in
+        the partition while it is acquired
+        """
+        owns = self.upcoming.call_args[1]['owns']
+        self.assertEqual([owns(2), owns(4)], [True, False])
+        self.kz_partition.acquired = False
+        self.assertFalse(owns(2))
+
+    def test_zk_state_change_clears(self):
+        """
+        Loaded events are cleared as soon as the ZooKeeper session is
+        suspended or lost, without waiting for the next check
+        """
+        (listener,), _ = self.kz_client.add_listener.call_args
+        listener(KazooState.CONNECTED)
+        self.assertFalse(self.upcoming.return_value.clear.called)
+        listener(KazooState.SUSPENDED)
+        listener(KazooState.LOST)
+        self.assertEqual(self.upcoming.return_value.clear.call_count, 2)
+
+
+class UpcomingEventsTests(SchedulerTests):
+    """
+    Tests for `UpcomingEvents`
+    """
+
+    def setUp(self):
+        """
+        Mock store and `process_events`
+        """
+        super(UpcomingEventsTests, self).setUp()
+        self.clock = Clock()
+        self.log = mock_log()
+        self.clock.advance(calendar.timegm(datetime(2015, 1, 1).timetuple()))
+        self.upcoming = UpcomingEvents(self.clock, self.mock_store, self.log)
+        self.events = [
+            {'bucket': 2, 'tenantId': 't', 'groupId': 'g', 'policyId': 'p1',
+             'trigger': datetime(2015, 1, 1, 0, 0, 10), 'cron': None,
+             'version': 'v'},
+            {'bucket': 3, 'tenantId': 't', 'groupId': 'g', 'policyId': 'p2',
+             'trigger': datetime(2015, 1, 1, 0, 0, 20), 'cron': None,
+             'version': 'v'}]
+        self.mock_store.get_upcoming_events.return_value = defer.succeed(
+            self.events)
+        self.deletes = []
+
+        def delete_events(events):
+            d = defer.Deferred()
+            self.deletes.append((events, d))
+            return d
+
+        self.mock_store.delete_events.side_effect = delete_events
+        self.process_events = patch(
+            self, 'otter.scheduler.process_events',
+            side_effect=lambda events, *_: defer.succeed(len(events)))
+
+    def test_load_in_bucket_groups(self):
+        """
+        Events of buckets are loaded in groups
+        """
+        self.mock_store.get_upcoming_events.side_effect = [
+            defer.succeed(self.events[:1]), defer.succeed(self.events[1:])]
+        d = self.upcoming.load(self.log, [2, 3], 'until', 1)
+        self.assertEqual(self.successResultOf(d), 2)
+        self.assertEqual(self.mock_store.get_upcoming_events.mock_calls,
+                         [mock.call([2], 'until'), mock.call([3], 'until')])
+        self.assertEqual(len(self.upcoming), 2)
+
+    def test_fires_at_trigger(self):
+        """
+        Each event is deleted and then executed at its trigger time
+        """
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.clock.advance(9)
+        self.assertEqual(self.deletes, [])
+        self.clock.advance(1)
+        self.assertEqual(self.deletes, [([self.events[0]], mock.ANY)])
+        self.assertFalse(self.process_events.called)
+        self.deletes[0][1].callback(None)
+        self.process_events.assert_called_once_with(
+            [dissoc(self.events[0], 'bucket')], self.mock_store, mock.ANY,
+            None)
+        self.assertEqual(len(self.upcoming), 1)
+
+    def test_past_event_fired_immediately(self):
+        """
+        Events whose trigger time has passed are fired immediately
+        """
+        self.clock.advance(60)
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.clock.advance(0)
+        self.assertEqual(len(self.deletes), 2)
+
+    def test_not_scheduled_again(self):
+        """
+        Loading again does not schedule events already scheduled or being
+        deleted when the load started
+        """
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.clock.advance(10)
+        d = self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.assertEqual(self.successResultOf(d), 0)
+
+        # load started before delete completed still returns the event
+        load_d = defer.Deferred()
+        self.mock_store.get_upcoming_events.return_value = load_d
+        d = self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.deletes[0][1].callback(None)
+        load_d.callback(self.events)
+        self.assertEqual(self.successResultOf(d), 0)
+
+        # load started after delete completed does not get the event
+        self.mock_store.get_upcoming_events.return_value = defer.succeed(
+            self.events[1:])
+        d = self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.assertEqual(self.successResultOf(d), 0)
+        self.assertEqual(self.upcoming._fired, {})
+
+    def test_delete_fails(self):
+        """
+        If event could not be deleted, it is not executed and it is scheduled
+        again by a later load
+        """
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.clock.advance(10)
+        self.deletes[0][1].errback(ValueError('e'))
+        self.assertFalse(self.process_events.called)
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'Could not execute event', bucket=2,
+            scheduler_run_id='transaction-id')
+        d = self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.assertEqual(self.successResultOf(d), 1)
+
+    def test_load_fails(self):
+        """
+        Error loading events is logged
+        """
+        self.mock_store.get_upcoming_events.return_value = defer.fail(
+            ValueError('e'))
+        d = self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.successResultOf(d)
+        self.log.err.assert_called_once_with(
+            CheckFailure(FirstError), 'Could not load upcoming events')
+
+    def test_not_owned_bucket_not_fired(self):
+        """
+        An event whose bucket is not owned anymore when it fires is not
+        deleted or executed and all the scheduled events are cancelled
+        """
+        owned = set([2, 3])
+        self.upcoming.owns = owned.__contains__
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        owned.remove(2)
+        self.clock.advance(10)
+        self.assertEqual(self.deletes, [])
+        self.assertEqual(len(self.upcoming), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertFalse(self.process_events.called)
+
+    def test_owned_bucket_fired(self):
+        """
+        An event whose bucket is still owned when it fires is deleted
+        """
+        self.upcoming.owns = set([2, 3]).__contains__
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.clock.advance(10)
+        self.assertEqual(self.deletes, [([self.events[0]], mock.ANY)])
+
+    def test_clear(self):
+        """
+        Scheduled events are cancelled
+        """
+        self.upcoming.load(self.log, [2, 3], 'until', 10)
+        self.upcoming.clear()
+        self.assertEqual(len(self.upcoming), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class CheckEventsInBucketsTests(SchedulerTests):
+    """
+    Tests for `check_events_in_buckets`
+    """
+
+    def setUp(self):
+        """
+        Mock store.fetch_and_delete_buckets and `process_events`
+        """
+        super(CheckEventsInBucketsTests, self).setUp()
 
         self.returns = [[]]
 
@@ -380,28 +634,28 @@ class CheckEventsInBucketTests(SchedulerTests):
                 return defer.fail(result)
             return defer.succeed(result)
 
-        self.mock_store.fetch_and_delete.side_effect = _responses
+        self.mock_store.fetch_and_delete_buckets.side_effect = _responses
         self.process_events = patch(
             self, 'otter.scheduler.process_events',
-            side_effect=lambda events, store, log: defer.succeed(len(events)))
+            side_effect=lambda events, *_: defer.succeed(len(events)))
         self.log = mock.Mock()
 
     def test_fetch_called(self):
         """
-        `fetch_and_delete` called correctly
+        `fetch_and_delete_buckets` called correctly
         """
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'utcnow', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'utcnow', 100)
         self.successResultOf(d)
-        self.mock_store.fetch_and_delete.assert_called_once_with(
-            1, 'utcnow', 100)
-        self.log.bind.assert_called_once_with(bucket=1)
+        self.mock_store.fetch_and_delete_buckets.assert_called_once_with(
+            [1], 'utcnow', 100)
+        self.log.bind.assert_called_once_with(buckets=[1])
 
     def test_no_events(self):
         """When no events are fetched, they are not processed."""
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'utcnow', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'utcnow', 100)
         self.successResultOf(d)
         self.process_events.assert_called_once_with(
-            [], self.mock_store, self.log.bind())
+            [], self.mock_store, self.log.bind(), None)
 
     def test_events_in_limit(self):
         """
@@ -416,14 +670,14 @@ class CheckEventsInBucketTests(SchedulerTests):
                   for i in range(10)]
         self.returns = [events]
 
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'utcnow', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'utcnow', 100)
 
         self.successResultOf(d)
-        # Ensure fetch_and_delete and process_events is called only once
-        self.mock_store.fetch_and_delete.assert_called_once_with(
-            1, 'utcnow', 100)
+        # Ensure fetch_and_delete_buckets and process_events is called only once
+        self.mock_store.fetch_and_delete_buckets.assert_called_once_with(
+            [1], 'utcnow', 100)
         self.process_events.assert_called_once_with(
-            events, self.mock_store, self.log.bind())
+            events, self.mock_store, self.log.bind(), None)
 
     def test_events_process_error(self):
         """
@@ -431,7 +685,7 @@ class CheckEventsInBucketTests(SchedulerTests):
         """
         self.returns = [ValueError('e')]
 
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'now', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'now', 100)
 
         self.successResultOf(d)
         self.log.bind.return_value.err.assert_called_once_with(
@@ -456,18 +710,18 @@ class CheckEventsInBucketTests(SchedulerTests):
                    for i in range(10)]
         self.returns = [events1, events2]
 
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'now', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'now', 100)
 
         self.successResultOf(d)
-        self.assertEqual(self.mock_store.fetch_and_delete.mock_calls,
-                         [mock.call(1, 'now', 100)] * 2)
+        self.assertEqual(self.mock_store.fetch_and_delete_buckets.mock_calls,
+                         [mock.call([1], 'now', 100)] * 2)
         self.assertEqual(self.process_events.mock_calls,
                          [mock.call(events1,
                                     self.mock_store,
-                                    self.log.bind()),
+                                    self.log.bind(), None),
                           mock.call(events2,
                                     self.mock_store,
-                                    self.log.bind())])
+                                    self.log.bind(), None)])
 
     def test_events_batch_error(self):
         """
@@ -483,15 +737,15 @@ class CheckEventsInBucketTests(SchedulerTests):
                   for i in range(100)]
         self.returns = [events, ValueError('some')]
 
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'now', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'now', 100)
 
         self.successResultOf(d)
         self.log.bind.return_value.err.assert_called_once_with(
             CheckFailure(ValueError))
-        self.assertEqual(self.mock_store.fetch_and_delete.mock_calls,
-                         [mock.call(1, 'now', 100)] * 2)
+        self.assertEqual(self.mock_store.fetch_and_delete_buckets.mock_calls,
+                         [mock.call([1], 'now', 100)] * 2)
         self.process_events.assert_called_once_with(events, self.mock_store,
-                                                    self.log.bind())
+                                                    self.log.bind(), None)
 
     def test_events_batch_process(self):
         """
@@ -518,16 +772,38 @@ class CheckEventsInBucketTests(SchedulerTests):
                     'bucket': 1} for i in range(10)]
         self.returns = [events1, events2, events3]
 
-        d = check_events_in_bucket(self.log, self.mock_store, 1, 'now', 100)
+        d = check_events_in_buckets(self.log, self.mock_store, [1], 'now', 100)
 
         self.successResultOf(d)
-        self.assertEqual(self.mock_store.fetch_and_delete.mock_calls,
-                         [mock.call(1, 'now', 100)] * 3)
+        self.assertEqual(self.mock_store.fetch_and_delete_buckets.mock_calls,
+                         [mock.call([1], 'now', 100)] * 3)
         self.assertEqual(self.process_events.mock_calls,
-                         [mock.call(events, self.mock_store, self.log.bind())
+                         [mock.call(events, self.mock_store,
+                                    self.log.bind(), None)
                           for events in [events1, events2, events3]])
 
 
+class LatencyHistogramTests(SynchronousTestCase):
+    """
+    Tests for `latency_histogram`
+    """
+
+    def test_histogram(self):
+        """
+        Latencies are counted in buckets of their upper bounds
+        """
+        self.assertEqual(
+            latency_histogram([0, 1, 1.5, 5, 100], bounds=(1, 5)),
+            {'1': 2, '5': 2, 'inf': 1})
+
+    def test_empty(self):
+        """
+        All buckets are 0 for no latencies
+        """
+        self.assertEqual(latency_histogram([], bounds=(1, 5)),
+                         {'1': 0, '5': 0, 'inf': 0})
+
+
 class ProcessEventsTests(SchedulerTests):
     """
     Tests for `process_events`.
@@ -535,11 +811,19 @@ class ProcessEventsTests(SchedulerTests):
 
     def setUp(self):
         """
-        Mock `execute_event` and `add_cron_events`.
+        Mock `execute_group_events` and `add_cron_events`.
         """
         super(ProcessEventsTests, self).setUp()
-        self.execute_event = patch(self, 'otter.scheduler.execute_event',
-                                   return_value=defer.succeed(None))
+        self.executions = []
+
+        def execute_group_events(store, log, events, deleted_policy_ids):
+            d = defer.Deferred()
+            self.executions.append((events, d))
+            return d
+
+        self.execute_group_events = patch(
+            self, 'otter.scheduler.execute_group_events',
+            side_effect=execute_group_events)
 
         def fake_add_cron_events(store, log, events, deleted_policy_ids):
             return defer.succeed(events)
@@ -548,6 +832,18 @@ class ProcessEventsTests(SchedulerTests):
             self, 'otter.scheduler.add_cron_events',
             side_effect=fake_add_cron_events)
         self.log = mock_log()
+        self.now = datetime(2015, 1, 1, 0, 0, 10)
+        patch(self, 'otter.scheduler.datetime').utcnow.side_effect = \
+            lambda: self.now
+        self.events = [
+            {'tenantId': 't{}'.format(i % 3), 'groupId': 'g{}'.format(i % 3),
+             'policyId': 'p{}'.format(i), 'trigger': datetime(2015, 1, 1),
+             'cron': None, 'version': 'v'}
+            for i in range(6)]
+
+    def _executed(self):
+        return sorted(
+            [[e['policyId'] for e in events] for events, _ in self.executions])
 
     def test_no_events(self):
         """
@@ -555,25 +851,49 @@ class ProcessEventsTests(SchedulerTests):
         """
         process_events([], self.mock_store, self.log)
         self.assertFalse(self.log.msg.called)
-        self.assertFalse(self.execute_event.called)
+        self.assertFalse(self.execute_group_events.called)
         self.assertFalse(self.add_cron_events.called)
 
     def test_success(self):
         """
-        Test success path: Logs number of events, calls `execute_event` on
-        each event and calls `add_cron_events.`
-        """
-        events = range(10)
-        d = process_events(events, self.mock_store, self.log)
-        self.assertEqual(self.successResultOf(d), 10)
-        self.log.msg.assert_called_once_with(
-            'Processing {num_events} events', num_events=10)
+        Test success path: Logs number of events, calls `execute_group_events`
+        on events of each group, logs latency histograms and calls
+        `add_cron_events.`
+        """
+        d = process_events(self.events, self.mock_store, self.log)
+        self.assertEqual(self._executed(),
+                         [['p0', 'p3'], ['p1', 'p4'], ['p2', 'p5']])
+        self.now = datetime(2015, 1, 1, 0, 0, 12)
+        for _, execution in self.executions:
+            execution.callback(None)
+        self.assertEqual(self.successResultOf(d), 6)
         self.assertEqual(
-            self.execute_event.mock_calls,
-            [mock.call(self.mock_store, self.log, event, set())
-             for event in events])
+            self.log.msg.mock_calls,
+            [mock.call('Processing {num_events} events', num_events=6),
+             mock.call('Executed events of {num_groups} groups',
+                       num_groups=3,
+                       delays=latency_histogram([10] * 6),
+                       durations=latency_histogram([2] * 3))])
+        self.assertEqual(self.execute_group_events.call_args[0][3], set())
         self.add_cron_events.assert_called_once_with(
-            self.mock_store, self.log, events, set())
+            self.mock_store, self.log, self.events, set())
+
+    def test_semaphore(self):
+        """
+        Events of only as many groups as allowed by semaphore are executed
+        concurrently
+        """
+        d = process_events(self.events, self.mock_store, self.log,
+                           defer.DeferredSemaphore(2))
+        self.assertEqual(len(self.executions), 2)
+        self.executions[0][1].callback(None)
+        self.assertEqual(len(self.executions), 3)
+        self.assertEqual(self._executed(),
+                         [['p0', 'p3'], ['p1', 'p4'], ['p2', 'p5']])
+        self.assertNoResult(d)
+        for _, execution in self.executions[1:]:
+            execution.callback(None)
+        self.assertEqual(self.successResultOf(d), 6)
 
 
 class AddCronEventsTests(SchedulerTests):
@@ -583,13 +903,13 @@ class AddCronEventsTests(SchedulerTests):
 
     def setUp(self):
         """
-        Mock store.add_cron_events and next_cron_occurrence.
+        Mock store.add_cron_events and next_cron_occurrences.
         """
         super(AddCronEventsTests, self).setUp()
         self.mock_store.add_cron_events.return_value = defer.succeed(None)
-        self.next_cron_occurrence = patch(
-            self, 'otter.scheduler.next_cron_occurrence',
-            return_value='next')
+        self.next_cron_occurrences = patch(
+            self, 'otter.scheduler.next_cron_occurrences',
+            side_effect=lambda crons: ['next'] * len(crons))
         self.log = mock_log()
 
     def test_no_events(self):
@@ -599,7 +919,7 @@ class AddCronEventsTests(SchedulerTests):
         d = add_cron_events(self.mock_store, self.log, [], set())
         self.assertIsNone(d)
         self.assertFalse(self.log.msg.called)
-        self.assertFalse(self.next_cron_occurrence.called)
+        self.assertFalse(self.next_cron_occurrences.called)
         self.assertFalse(self.mock_store.add_cron_events.called)
 
     def test_no_events_to_add(self):
@@ -617,7 +937,7 @@ class AddCronEventsTests(SchedulerTests):
                             set(['pol4{}'.format(i) for i in range(3)]))
         self.assertIsNone(d)
         self.assertFalse(self.log.msg.called)
-        self.assertFalse(self.next_cron_occurrence.called)
+        self.assertFalse(self.next_cron_occurrences.called)
         self.assertFalse(self.mock_store.add_cron_events.called)
 
     def test_store_add_cron_called(self):
@@ -642,25 +962,26 @@ class AddCronEventsTests(SchedulerTests):
             self.mock_store, self.log, events, deleted_policy_ids)
 
         self.assertIsNone(self.successResultOf(d), None)
-        self.assertEqual(self.next_cron_occurrence.call_count, 8)
+        self.next_cron_occurrences.assert_called_once_with(['*'] * 8)
         self.mock_store.add_cron_events.assert_called_once_with(new_events)
 
 
-class ExecuteEventTests(SchedulerTests):
+class ExecuteGroupEventsTests(SchedulerTests):
     """
-    Tests for `execute_event`.
+    Tests for `execute_group_events`.
     """
 
     def setUp(self):
         """
         Mock execution of scaling policy.
         """
-        super(ExecuteEventTests, self).setUp()
+        super(ExecuteGroupEventsTests, self).setUp()
         self.mock_group = iMock(IScalingGroup)
         self.mock_store.get_scaling_group.return_value = self.mock_group
 
         # mock out modify state
-        self.mock_state = mock.MagicMock(spec=[])  # so nothing can call it
+        self.mock_state = GroupState('1234', 'scal44', 'name', {}, {}, None,
+                                     {}, False, now=lambda: 'now')
         self.new_state = None
 
         def _set_new_state(new_state):
@@ -671,104 +992,167 @@ class ExecuteEventTests(SchedulerTests):
             return d.addCallback(_set_new_state)
 
         self.mock_group.modify_state.side_effect = _mock_modify_state
+        self.results = {}
+        self.executed_with = []
+
+        def maybe_exec_policy(log, transaction_id, group, state, policy_id,
+                              version):
+            # Launch a server and then fail with the configured error if any
+            self.executed_with.append(sorted(state.pending))
+            state.desired += 1
+            state.add_job(policy_id + '-job')
+            state.mark_executed(policy_id)
+            result = self.results.get(policy_id)
+            if isinstance(result, Exception):
+                return defer.fail(result)
+            return defer.succeed(state)
+
         self.maybe_exec_policy = patch(
             self, 'otter.scheduler.maybe_execute_scaling_policy',
-            return_value=defer.succeed('newstate'))
-        self.log = mock.Mock()
-        self.log_args = {
-            'tenant_id': '1234',
-            'scaling_group_id': 'scal44',
-            'policy_id': 'pol44'
-        }
-        self.event = {
-            'tenantId': '1234',
-            'groupId': 'scal44',
-            'policyId': 'pol44',
-            'trigger': 'now',
-            'cron': '*',
-            'bucket': 1,
-            'version': 'v2'
-        }
-
-    def test_event_executed(self):
-        """
-        Event is executed successfully and appropriate logs logged.
+            side_effect=maybe_exec_policy)
+        self.log = mock_log()
+        self.events = [
+            {'tenantId': '1234', 'groupId': 'scal44', 'policyId': 'pol45',
+             'trigger': datetime(2015, 1, 1, 0, 1), 'cron': '*',
+             'version': 'v3'},
+            {'tenantId': '1234', 'groupId': 'scal44', 'policyId': 'pol44',
+             'trigger': datetime(2015, 1, 1), 'cron': '*', 'version': 'v2'}]
+
+    def _execute(self, del_pol_ids):
+        return execute_group_events(self.mock_store, self.log, self.events,
+                                    del_pol_ids)
+
+    def test_events_executed(self):
+        """
+        Events are executed in order of their trigger times in one
+        `modify_state` call with each policy getting state updated by the
+        previous policy. Appropriate logs are logged.
         """
         del_pol_ids = set()
-        d = execute_event(self.mock_store, self.log, self.event, del_pol_ids)
+        d = self._execute(del_pol_ids)
 
         self.assertIsNone(self.successResultOf(d))
-        self.log.bind.assert_called_with(**self.log_args)
-        log = self.log.bind.return_value
-        log.msg.assert_called_once_with(
-            'Scheduler executing policy {policy_id}')
-        self.maybe_exec_policy.assert_called_once_with(
-            log, 'transaction-id', self.mock_group, self.mock_state,
-            policy_id=self.event['policyId'], version=self.event['version'])
-        self.assertTrue(self.mock_group.modify_state.called)
-        self.assertEqual(self.new_state, 'newstate')
+        self.mock_store.get_scaling_group.assert_called_once_with(
+            matches(IsBoundWith(tenant_id='1234', scaling_group_id='scal44')),
+            '1234', 'scal44')
+        self.assertEqual(
+            self.log.msg.mock_calls,
+            [mock.call('Scheduler executing policy {policy_id}',
+                       tenant_id='1234', scaling_group_id='scal44',
+                       policy_id=policy_id)
+             for policy_id in ['pol44', 'pol45']])
+        self.assertEqual(
+            self.maybe_exec_policy.mock_calls,
+            [mock.call(mock.ANY, 'transaction-id', self.mock_group,
+                       self.mock_state, policy_id=policy_id, version=version)
+             for policy_id, version in [('pol44', 'v2'), ('pol45', 'v3')]])
+        self.assertEqual(self.executed_with, [[], ['pol44-job']])
+        self.assertEqual(self.mock_group.modify_state.call_count, 1)
+        self.assertEqual(sorted(self.new_state.pending),
+                         ['pol44-job', 'pol45-job'])
         self.assertEqual(len(del_pol_ids), 0)
 
     def test_deleted_group_event(self):
         """This event's group has been deleted.
 
-        Its policyId is logged, and no attempt is made to execute it.
+        Its policyIds are collected, and no attempt is made to execute them.
         """
         del_pol_ids = set()
         self.mock_group.modify_state.side_effect = \
             lambda *_: defer.fail(NoSuchScalingGroupError(1, 2))
 
-        d = execute_event(self.mock_store, self.log, self.event, del_pol_ids)
+        d = self._execute(del_pol_ids)
 
         self.assertIsNone(self.successResultOf(d))
-        self.assertEqual(del_pol_ids, set(['pol44']))
+        self.assertEqual(del_pol_ids, set(['pol44', 'pol45']))
         self.assertFalse(self.maybe_exec_policy.called)
 
     def test_deleted_policy_event(self):
-        """This event's policy has been deleted.
+        """One of the events' policy has been deleted.
 
-        Its policyId is added to deleted_policy_ids, and no attempt is
-        made to execute it.
+        Its policyId is added to deleted_policy_ids, and the other policy is
+        executed.
         """
         del_pol_ids = set()
-        self.mock_group.modify_state.side_effect = (
-            lambda *_: defer.fail(NoSuchPolicyError(1, 2, 3)))
+        self.results['pol44'] = NoSuchPolicyError(1, 2, 3)
 
-        d = execute_event(self.mock_store, self.log, self.event, del_pol_ids)
+        d = self._execute(del_pol_ids)
 
         self.assertIsNone(self.successResultOf(d))
         self.assertEqual(del_pol_ids, set(['pol44']))
-        self.assertFalse(self.maybe_exec_policy.called)
+        self.assertEqual(self.executed_with, [[], ['pol44-job']])
 
     def test_semantic_prob(self):
         """
         Policy execution causes semantic error like cooldowns not met.
-        i.e. CannotExecutePolicyError is captured and logged.
+        i.e. CannotExecutePolicyError is captured and logged and the next
+        policy is executed with the same state.
         """
         del_pol_ids = set()
-        self.maybe_exec_policy.return_value = defer.fail(
-            CannotExecutePolicyError(*range(4)))
+        self.results['pol44'] = CannotExecutePolicyError(*range(4))
 
-        d = execute_event(self.mock_store, self.log, self.event, del_pol_ids)
+        d = self._execute(del_pol_ids)
 
         self.assertIsNone(self.successResultOf(d))
         self.assertEqual(len(del_pol_ids), 0)
-        self.log.bind.return_value.msg.assert_called_with(
+        self.log.msg.assert_any_call(
             'Scheduler cannot execute policy {policy_id}',
-            reason=CheckFailure(CannotExecutePolicyError))
+            reason=CheckFailure(CannotExecutePolicyError),
+            tenant_id='1234', scaling_group_id='scal44', policy_id='pol44')
+        self.assertEqual(self.executed_with, [[], ['pol44-job']])
 
     def test_unknown_error(self):
         """
-        Unknown error occurs. It is logged and not propagated.
+        Unknown error occurs executing a policy. It is logged and not
+        propagated, the policy's changes other than the jobs it started are
+        undone and the next policy is executed.
         """
         del_pol_ids = set()
-        self.log.bind.return_value.err.return_value = None
-        self.maybe_exec_policy.return_value = defer.fail(ValueError(4))
+        self.results['pol44'] = ValueError(4)
 
-        d = execute_event(self.mock_store, self.log, self.event, del_pol_ids)
+        d = self._execute(del_pol_ids)
 
         self.assertIsNone(self.successResultOf(d))
         self.assertEqual(len(del_pol_ids), 0)
-        self.log.bind.return_value.err.assert_called_with(
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError),
+            'Scheduler failed to execute policy {policy_id}',
+            policy_id='pol44', tenant_id='1234', scaling_group_id='scal44')
+        self.assertEqual(self.maybe_exec_policy.call_count, 2)
+        self.assertEqual(self.new_state.desired, 1)
+        self.assertEqual(self.new_state.policy_touched, {'pol45': 'now'})
+
+    def test_later_policy_error_keeps_earlier_policies(self):
+        """
+        When a later policy fails unexpectedly, the state saved for the group
+        still has the jobs started by the earlier policies
+        """
+        self.results['pol45'] = ValueError(4)
+
+        d = self._execute(set())
+
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.mock_group.modify_state.call_count, 1)
+        self.assertIs(self.new_state, self.mock_state)
+        self.assertIn('pol44-job', self.new_state.pending)
+        self.assertEqual(self.new_state.desired, 1)
+        self.assertEqual(self.new_state.policy_touched, {'pol44': 'now'})
+        self.assertEqual(self.new_state.group_touched, 'now')
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError),
+            'Scheduler failed to execute policy {policy_id}',
+            policy_id='pol45', tenant_id='1234', scaling_group_id='scal44')
+
+    def test_modify_state_error(self):
+        """
+        Error modifying state is logged and not propagated
+        """
+        self.mock_group.modify_state.side_effect = \
+            lambda *_: defer.fail(ValueError(4))
+        d = self._execute(set())
+        self.assertIsNone(self.successResultOf(d))
+        self.log.err.assert_called_once_with(
             CheckFailure(ValueError),
-            'Scheduler failed to execute policy {policy_id}')
+            'Scheduler failed to execute policies {policy_ids}',
+            policy_ids=['pol44', 'pol45'], tenant_id='1234',
+            scaling_group_id='scal44')
@@ -211,6 +211,22 @@ class LaunchConfigTests(SupervisorTests):
         self.assertEqual(launch_config, {'server': {}})
         self.assertEqual(undo, self.undo)
 
+    def test_execute_config_request_bag_re_auths(self):
+        """
+        The request bag's ``re_auth`` invalidates the cached token of the
+        group owner and fires with a new one.
+        """
+        self.supervisor.execute_config(self.log, 'transaction-id',
+                                       self.group, self.launch_config)
+        request_bag = self.launch_server.call_args[0][1]
+        self.auth_function.return_value = succeed(('new-token', 'catalog'))
+        d = request_bag.re_auth()
+        self.assertEqual(self.successResultOf(d), 'new-token')
+        self.authenticator.invalidate.assert_called_once_with(11111)
+        self.auth_function.assert_called_with(
+            11111, log=matches(IsBoundWith(tenant_id=11111,
+                                           worker='launch_server')))
+
     def test_execute_config_rewinds_undo_stack_on_failure(self):
         """
         execute_config rewinds the undo stack passed to launch_server,
@@ -362,6 +362,18 @@ class TimestampTests(SynchronousTestCase):
         self.assertEqual(parsed.replace(tzinfo=None),
                          mock_datetime.utcnow.return_value)
 
+    def test_epoch_to_timestamp(self):
+        """
+        epoch_to_timestamp returns ISO8601 zulu timestamp of EPOCH seconds
+        that timestamp_to_epoch can read
+        """
+        self.assertEqual(timestamp.epoch_to_timestamp(1.5),
+                         '1970-01-01T00:00:01.500000Z')
+        self.assertEqual(
+            timestamp.timestamp_to_epoch(
+                timestamp.epoch_to_timestamp(1432000000)),
+            1432000000)
+
     def test_from_timestamp_can_read_min_timestamp(self):
         """
         ``from_timestamp`` can parse timestamps produced by ``MIN``
@@ -0,0 +1,227 @@
+"""
+Tests for :mod:`otter.util.cache`
+"""
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.util.cache import LRUCache, TTLCache
+
+
+class TTLCacheTests(SynchronousTestCase):
+    """
+    Tests for :class:`TTLCache`
+    """
+
+    def setUp(self):
+        """
+        Sample cache
+        """
+        self.clock = Clock()
+        self.cache = TTLCache(self.clock, 10)
+        self.fetches = []
+
+    def _fetch(self, result=None):
+        def fetch():
+            self.fetches.append(result)
+            return result
+        return fetch
+
+    def test_fetches_and_caches(self):
+        """
+        Value is fetched on first get and returned from cache afterwards
+        """
+        d = self.cache.get('k', self._fetch(succeed('v')))
+        self.assertEqual(self.successResultOf(d), 'v')
+        self.assertIn('k', self.cache)
+        d = self.cache.get('k', self._fetch(succeed('v2')))
+        self.assertEqual(self.successResultOf(d), 'v')
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_coalesces_concurrent_gets(self):
+        """
+        Gets of a key being fetched wait on the same fetch
+        """
+        fd = Deferred()
+        d1 = self.cache.get('k', self._fetch(fd))
+        d2 = self.cache.get('k', self._fetch(succeed('other')))
+        self.assertNoResult(d1)
+        self.assertNoResult(d2)
+        fd.callback('v')
+        self.assertEqual(self.successResultOf(d1), 'v')
+        self.assertEqual(self.successResultOf(d2), 'v')
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_expires(self):
+        """
+        Value is evicted after ttl seconds
+        """
+        self.cache.get('k', self._fetch('v'))
+        self.clock.advance(9)
+        self.assertIn('k', self.cache)
+        self.clock.advance(1)
+        self.assertNotIn('k', self.cache)
+        d = self.cache.get('k', self._fetch('v2'))
+        self.assertEqual(self.successResultOf(d), 'v2')
+
+    def test_failure_not_cached(self):
+        """
+        Failed fetch is given to all waiters and not cached
+        """
+        fd = Deferred()
+        d1 = self.cache.get('k', self._fetch(fd))
+        d2 = self.cache.get('k', self._fetch(None))
+        fd.errback(ValueError('e'))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, ValueError)
+        self.assertNotIn('k', self.cache)
+        d = self.cache.get('k', self._fetch(fail(ValueError('e'))))
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_invalidate(self):
+        """
+        Invalidated key is fetched again and its eviction is cancelled
+        """
+        self.cache.get('k', self._fetch('v'))
+        self.cache.invalidate('k')
+        self.assertNotIn('k', self.cache)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        d = self.cache.get('k', self._fetch('v2'))
+        self.assertEqual(self.successResultOf(d), 'v2')
+
+    def test_invalidate_while_fetching(self):
+        """
+        If key is invalidated while fetching, the fetch's result is given to
+        its waiters but not cached and next get fetches again
+        """
+        fd = Deferred()
+        d1 = self.cache.get('k', self._fetch(fd))
+        self.cache.invalidate('k')
+        fd2 = Deferred()
+        d2 = self.cache.get('k', self._fetch(fd2))
+        fd.callback('old')
+        self.assertEqual(self.successResultOf(d1), 'old')
+        self.assertNotIn('k', self.cache)
+        self.assertNoResult(d2)
+        fd2.callback('new')
+        self.assertEqual(self.successResultOf(d2), 'new')
+        self.assertIn('k', self.cache)
+
+    def test_invalidate_missing(self):
+        """
+        Invalidating a key that is not cached does nothing
+        """
+        self.cache.invalidate('k')
+        self.assertNotIn('k', self.cache)
+
+    def test_keys(self):
+        """
+        Keys that are cached or being fetched are returned
+        """
+        self.cache.get('k1', self._fetch('v'))
+        self.cache.get('k2', self._fetch(Deferred()))
+        self.assertEqual(sorted(self.cache.keys()), ['k1', 'k2'])
+
+
+class LRUCacheTests(SynchronousTestCase):
+    """
+    Tests for :class:`LRUCache`
+    """
+
+    def test_get_set(self):
+        """
+        Set values are got and missing keys return default
+        """
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 3), 3)
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        """
+        Least recently used key is evicted when a key beyond `max_size` is
+        added
+        """
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_evicts_least_recently_used_evictable(self):
+        """
+        Only the least recently used key whose value is evictable is evicted
+        and none is if no other value is evictable
+        """
+        cache = LRUCache(2, evictable=lambda value: value > 1)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(cache.items(), [('a', 1), ('c', 3)])
+        cache.set('c', 0)
+        cache.set('d', 4)
+        self.assertEqual(cache.items(), [('a', 1), ('c', 0), ('d', 4)])
+
+    def test_pop(self):
+        """
+        Popped key is removed and its value returned
+        """
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.pop('a', 5), 5)
+
+    def test_expires(self):
+        """
+        Keys expire `ttl` seconds after being set, or after the ttl given
+        when setting them
+        """
+        clock = Clock()
+        cache = LRUCache(3, clock, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=5)
+        cache.set('c', 3)
+        clock.advance(5)
+        self.assertIsNone(cache.get('b'))
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('a', 4)
+        clock.advance(5)
+        self.assertEqual(cache.get('a'), 4)
+        self.assertEqual(cache.pop('c', 'x'), 'x')
+        self.assertEqual(len(cache), 1)
+
+    def test_no_expiry(self):
+        """
+        Keys do not expire if there is no ttl
+        """
+        cache = LRUCache(2, Clock())
+        cache.set('a', 1)
+        cache.clock.advance(1000)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_items(self):
+        """
+        `items` returns keys that are not expired with their values, least
+        recently used first, without marking them used
+        """
+        cache = LRUCache(3, Clock(), 10)
+        cache.set('a', 1)
+        cache.set('b', 2, 5)
+        cache.set('c', 3)
+        cache.get('a')
+        self.assertEqual(cache.items(), [('b', 2), ('c', 3), ('a', 1)])
+        cache.clock.advance(5)
+        self.assertEqual(cache.items(), [('c', 3), ('a', 1)])
@@ -0,0 +1,447 @@
+"""
+Tests for :mod:`otter.util.cqlcluster`
+"""
+
+import struct
+
+import mock
+
+from silverberg.cassandra.ttypes import TimedOutException, TokenRange
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.error import ConnectError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.test.utils import CheckFailure, mock_log
+from otter.util.cqlcluster import (
+    TokenAwareCassandraCluster,
+    _Ring,
+    cluster_from_config,
+    idempotent,
+    md5_token,
+    murmur3_token,
+    routing_key)
+
+
+MURMUR3 = 'org.apache.cassandra.dht.Murmur3Partitioner'
+
+
+class TokenTests(SynchronousTestCase):
+    """
+    Tests for :func:`murmur3_token` and :func:`md5_token`
+    """
+
+    def test_murmur3(self):
+        """
+        Tokens are same as the ones generated by Cassandra
+        """
+        vectors = [
+            ('123', -7468325962851647638),
+            ('\x00\xff\x10\xfa\x99' * 10, 5837342703291459765),
+            ('\xfe' * 8, -8927430733708461935),
+            ('\x10' * 8, 1446172840243228796),
+            (str(2 ** 63 - 1), 7162290910810015547)]
+        for key, token in vectors:
+            self.assertEqual(murmur3_token(key), token)
+
+    def test_md5(self):
+        """
+        Token is absolute value of md5 hash as signed 128 bit number
+        """
+        self.assertEqual(md5_token('a'),
+                         int('0cc175b9c0f1b6a831c399e269772661', 16))
+        self.assertEqual(
+            md5_token('b'),
+            (1 << 128) - int('92eb5ffee6ae2fec3ad71c777531578f', 16))
+
+
+class RoutingKeyTests(SynchronousTestCase):
+    """
+    Tests for :func:`routing_key`
+    """
+
+    keys = {'scaling_group': 'tenantId', 'scaling_schedule_v2': 'bucket'}
+
+    def test_select(self):
+        """
+        Value of the param bound to the partition key is returned
+        """
+        self.assertEqual(
+            routing_key('SELECT * FROM scaling_group WHERE "tenantId" = :t '
+                        'AND "groupId" = :g;', {'t': u'ten', 'g': 'g'},
+                        self.keys),
+            'ten')
+
+    def test_insert(self):
+        """
+        Value of the param bound to the partition key column of an INSERT
+        is returned
+        """
+        self.assertEqual(
+            routing_key('INSERT INTO scaling_group("groupId", "tenantId") '
+                        'VALUES (:g, :t);', {'t': 'ten', 'g': 'g'},
+                        self.keys),
+            'ten')
+
+    def test_int(self):
+        """
+        Numbers are serialized as int
+        """
+        self.assertEqual(
+            routing_key('SELECT * FROM scaling_schedule_v2 '
+                        'WHERE bucket = :bucket', {'bucket': 5}, self.keys),
+            struct.pack('>i', 5))
+
+    def test_batch_same_partition(self):
+        """
+        Batch whose statements are all about the same partition is routed
+        """
+        query = ('BEGIN BATCH '
+                 'UPDATE scaling_group SET a = :a WHERE "tenantId" = :t1; '
+                 'DELETE FROM scaling_group WHERE "tenantId" = :t2; '
+                 'APPLY BATCH;')
+        self.assertEqual(
+            routing_key(query, {'a': 1, 't1': 'ten', 't2': 'ten'}, self.keys),
+            'ten')
+        self.assertIsNone(
+            routing_key(query, {'a': 1, 't1': 'ten', 't2': 'other'},
+                        self.keys))
+
+    def test_not_routable(self):
+        """
+        None is returned if table is not known, partition key is not bound to
+        a param or query is not about a table
+        """
+        self.assertIsNone(
+            routing_key('SELECT * FROM other WHERE "tenantId" = :t',
+                        {'t': 'ten'}, self.keys))
+        self.assertIsNone(
+            routing_key('SELECT * FROM scaling_group WHERE "groupId" = :g',
+                        {'g': 'g'}, self.keys))
+        self.assertIsNone(
+            routing_key('SELECT * FROM scaling_group WHERE "tenantId" = :t',
+                        {}, self.keys))
+        self.assertIsNone(routing_key('USE ks', {}, self.keys))
+
+
+def _range(end, hosts):
+    return TokenRange(start_token='0', end_token=str(end), endpoints=hosts,
+                      rpc_endpoints=hosts)
+
+
+class RingTests(SynchronousTestCase):
+    """
+    Tests for :class:`_Ring`
+    """
+
+    def setUp(self):
+        """
+        Ring with keys as tokens
+        """
+        self.ring = _Ring(int, [_range(20, ['b']), _range(10, ['a']),
+                                _range(30, ['c', 'a'])])
+
+    def test_replicas(self):
+        """
+        Replicas of the range the key's token falls into are returned
+        """
+        self.assertEqual(self.ring.replicas(5), ['a'])
+        self.assertEqual(self.ring.replicas(10), ['a'])
+        self.assertEqual(self.ring.replicas(11), ['b'])
+        self.assertEqual(self.ring.replicas(30), ['c', 'a'])
+
+    def test_wraps_around(self):
+        """
+        Tokens beyond last range belong to the first range
+        """
+        self.assertEqual(self.ring.replicas(31), ['a'])
+
+    def test_hosts(self):
+        """
+        All the hosts are returned
+        """
+        self.assertEqual(self.ring.hosts(), set(['a', 'b', 'c']))
+
+    def test_listen_address(self):
+        """
+        Listen address is used when rpc address is 0.0.0.0
+        """
+        ring = _Ring(int, [TokenRange(start_token='0', end_token='1',
+                                      endpoints=['10.0.0.1', '10.0.0.2'],
+                                      rpc_endpoints=['0.0.0.0', '1.1.1.2'])])
+        self.assertEqual(ring.hosts(), set(['10.0.0.1', '1.1.1.2']))
+
+    def test_empty(self):
+        """
+        Empty ring has no replicas
+        """
+        self.assertEqual(_Ring(int, []).replicas(1), [])
+
+
+class TokenAwareCassandraClusterTests(SynchronousTestCase):
+    """
+    Tests for :class:`TokenAwareCassandraCluster`
+    """
+
+    def setUp(self):
+        """
+        Cluster with fake clients
+        """
+        self.clock = Clock()
+        self.log = mock_log()
+        self.clients = {}
+        self.partitioner = lambda: succeed(MURMUR3)
+        token = murmur3_token('ten')
+        self.ranges = [_range(token - 1, ['a']), _range(token, ['b', 'c']),
+                       _range(2 ** 63 - 1, ['c'])]
+        self.cluster = TokenAwareCassandraCluster(
+            self.clock, ['s1', 's2'], 'ks', lambda host: 'tcp:' + host,
+            {'scaling_group': 'tenantId'}, self.log, connections_per_node=2,
+            ring_refresh_interval=100, client_factory=self._client,
+            timeout=3)
+        self.query = 'SELECT * FROM scaling_group WHERE "tenantId" = :t'
+        self.params = {'t': 'ten'}
+
+    def _client(self, endpoint, keyspace, timeout):
+        self.assertEqual((keyspace, timeout), ('ks', 3))
+        client = mock.Mock(spec=['execute', 'describe_ring',
+                                 'describe_partitioner', 'disconnect'])
+        client.execute.side_effect = lambda *a: succeed(endpoint)
+        client.describe_partitioner.side_effect = lambda: self.partitioner()
+        client.describe_ring.side_effect = lambda: succeed(self.ranges)
+        client.disconnect.side_effect = lambda: succeed(None)
+        self.clients.setdefault(endpoint, []).append(client)
+        return client
+
+    def _execute(self, query=None, params=None):
+        return self.successResultOf(self.cluster.execute(
+            query or self.query, params or self.params, 1))
+
+    def test_routes_to_replica(self):
+        """
+        Ring is fetched on first query and queries about a partition go to
+        its replicas. Connections of a node are used round robin.
+        """
+        self.assertEqual(self._execute(), 'tcp:b')
+        self.assertEqual(sorted(self.clients),
+                         ['s1', 's2', 'tcp:a', 'tcp:b', 'tcp:c'])
+        self.assertEqual(len(self.clients['tcp:b']), 2)
+        self.assertEqual(self._execute(), 'tcp:b')
+        for client in self.clients['tcp:b']:
+            client.execute.assert_called_once_with(self.query, self.params, 1)
+
+    def test_seeds_before_ring(self):
+        """
+        Queries go to seeds round robin while ring is being fetched
+        """
+        self.partitioner = Deferred
+        self.assertEqual(self._execute(), 's1')
+        self.assertEqual(self._execute(), 's2')
+        self.assertEqual(self._execute(), 's1')
+        self.assertEqual(
+            self.clients['s2'][0].describe_partitioner.call_count, 1)
+
+    def test_unroutable_to_seeds(self):
+        """
+        Queries whose partition is not known go to seeds
+        """
+        self._execute()
+        self.assertIn(
+            self._execute('SELECT * FROM scaling_group', {}), ['s1', 's2'])
+
+    def test_prefers_low_latency(self):
+        """
+        Replica with lower latency is tried first
+        """
+        self._execute()
+        slow = Deferred()
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: slow
+        d = self.cluster.execute(self.query, self.params, 1)
+        self.clock.advance(5)
+        slow.callback('tcp:b')
+        self.successResultOf(d)
+        self.assertEqual(self._execute(), 'tcp:c')
+        self.assertEqual(self.cluster._nodes['b'].latency, 1)
+        self.assertEqual(self.cluster._nodes['c'].latency, 0)
+
+    def test_fails_over_on_connect_error(self):
+        """
+        Next replica is tried if a replica cannot be connected to. Connection
+        error of last one is returned.
+        """
+        self._execute()
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: fail(ConnectError())
+        self.assertEqual(self._execute(), 'tcp:c')
+        for client in self.clients['tcp:c']:
+            client.execute.side_effect = lambda *a: fail(ConnectError())
+        self.failureResultOf(
+            self.cluster.execute(self.query, self.params, 1), ConnectError)
+
+    def test_fails_over_on_timeout(self):
+        """
+        Next replica is tried if an idempotent query times out in a replica
+        """
+        self._execute()
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: fail(TimedOutException())
+        self.assertEqual(self._execute(), 'tcp:c')
+
+    def test_non_idempotent_not_failed_over_on_timeout(self):
+        """
+        Query that is not idempotent is not tried in other replicas if it
+        times out since it may have been applied. It is tried in other
+        replicas if the replica cannot be connected to.
+        """
+        self._execute()
+        query = ('UPDATE scaling_group SET c = c + :c '
+                 'WHERE "tenantId" = :t')
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: fail(TimedOutException())
+        self.failureResultOf(
+            self.cluster.execute(query, {'t': 'ten', 'c': 1}, 1),
+            TimedOutException)
+        for client in self.clients['tcp:c']:
+            self.assertFalse(client.execute.called)
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: fail(ConnectError())
+        self.assertEqual(self._execute(query, {'t': 'ten', 'c': 1}), 'tcp:c')
+
+    def test_failure_penalized(self):
+        """
+        Failed attempt counts as the time it took plus the failure penalty
+        towards node's latency
+        """
+        self._execute()
+        slow = Deferred()
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: slow
+        d = self.cluster.execute(self.query, self.params, 1)
+        self.clock.advance(2)
+        slow.errback(TimedOutException())
+        self.assertEqual(self.successResultOf(d), 'tcp:c')
+        self.assertEqual(self.cluster._nodes['b'].latency, 0.2 * 3)
+        self.assertEqual(self._execute(), 'tcp:c')
+
+    def test_idempotent(self):
+        """
+        Counter and collection updates relative to current value and
+        conditional updates are not idempotent
+        """
+        for query in [
+                'SELECT * FROM t WHERE k = :k',
+                'UPDATE t SET a = :a, b = :b WHERE k = :k',
+                'BEGIN BATCH INSERT INTO t (k, a) VALUES (:k, :a) '
+                'DELETE FROM t WHERE k = :k2 APPLY BATCH;']:
+            self.assertTrue(idempotent(query), query)
+        for query in [
+                'UPDATE t SET a = a + :a WHERE k = :k',
+                'UPDATE t SET "a" = "a" - :a WHERE k = :k',
+                'BEGIN COUNTER BATCH DELETE FROM t WHERE k = :k APPLY BATCH;',
+                'UPDATE t SET a = :a WHERE k = :k IF a = :b',
+                'INSERT INTO t (k, a) VALUES (:k, :a) IF NOT EXISTS']:
+            self.assertFalse(idempotent(query), query)
+
+    def test_other_errors_not_retried(self):
+        """
+        Errors other than connection errors are returned without trying
+        other replicas
+        """
+        self._execute()
+        for client in self.clients['tcp:b']:
+            client.execute.side_effect = lambda *a: fail(ValueError())
+        self.failureResultOf(
+            self.cluster.execute(self.query, self.params, 1), ValueError)
+        for client in self.clients['tcp:c']:
+            self.assertFalse(client.execute.called)
+
+    def test_refreshes_ring(self):
+        """
+        Ring is fetched again after refresh interval and nodes not in it
+        anymore are disconnected
+        """
+        self._execute()
+        self.clock.advance(99)
+        self._execute()
+        self.assertEqual(
+            self.clients['s2'][0].describe_partitioner.call_count, 1)
+        self.ranges = [_range(2 ** 63 - 1, ['c', 'd'])]
+        self.clock.advance(1)
+        self._execute()
+        self.assertEqual(sorted(self.cluster._nodes), ['c', 'd'])
+        for client in self.clients['tcp:a'] + self.clients['tcp:b']:
+            client.disconnect.assert_called_once_with()
+        self.assertEqual(self._execute(), 'tcp:c')
+
+    def test_unknown_partitioner(self):
+        """
+        Queries are not routed if partitioner is not known
+        """
+        self.partitioner = lambda: succeed('OrderPreservingPartitioner')
+        self.assertEqual(self._execute(), 's1')
+        self.log.msg.assert_called_once_with(
+            'Cannot route queries of partitioner',
+            partitioner='OrderPreservingPartitioner')
+        self.assertEqual(self._execute(), 's2')
+        self.assertEqual(sorted(self.clients), ['s1', 's2'])
+
+    def test_ring_fetch_error(self):
+        """
+        Error fetching the ring is logged and queries go to seeds
+        """
+        self.partitioner = lambda: fail(ValueError('bad'))
+        self.assertEqual(self._execute(), 's1')
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'Could not fetch Cassandra ring')
+
+    def test_disconnect(self):
+        """
+        All the connections are disconnected
+        """
+        self._execute()
+        self.successResultOf(self.cluster.disconnect())
+        for clients in self.clients.values():
+            for client in clients:
+                client.disconnect.assert_called_once_with()
+
+
+class ClusterFromConfigTests(SynchronousTestCase):
+    """
+    Tests for :func:`cluster_from_config`
+    """
+
+    @mock.patch('otter.util.cqlcluster.clientFromString')
+    def test_cluster(self, client_from_string):
+        """
+        Cluster is created with endpoints of seeds and nodes from config
+        """
+        client_from_string.side_effect = lambda r, s: (r, s)
+        log = mock_log()
+        cluster = cluster_from_config(
+            'r', {'seed_hosts': [u'tcp:127.0.0.1:9160'], 'keyspace': 'ks',
+                  'rpc_port': 9161, 'connections_per_node': 3},
+            {'t': 'k'}, log, client_factory=mock.Mock())
+        cluster.client_factory.assert_called_once_with(
+            ('r', 'tcp:127.0.0.1:9160'), 'ks')
+        self.assertIsInstance(
+            client_from_string.call_args_list[0][0][1], str)
+        self.assertEqual(cluster.endpoint_factory('h'), ('r', 'tcp:h:9161'))
+        self.assertEqual(cluster.connections_per_node, 3)
+        self.assertEqual(cluster.partition_keys, {'t': 'k'})
+        self.assertIs(cluster.log, log)
+        self.assertIs(cluster.clock, 'r')
+
+    @mock.patch('otter.util.cqlcluster.clientFromString')
+    def test_defaults(self, client_from_string):
+        """
+        Nodes are connected on 9160 with 2 connections by default
+        """
+        client_from_string.side_effect = lambda r, s: s
+        cluster = cluster_from_config(
+            'r', {'seed_hosts': [], 'keyspace': 'ks'}, {}, mock_log(),
+            disconnect_on_cancel=True, client_factory=mock.Mock())
+        self.assertEqual(cluster.endpoint_factory('h'), 'tcp:h:9160')
+        self.assertEqual(cluster.connections_per_node, 2)
+        self.assertEqual(cluster.client_kwargs, {'disconnect_on_cancel': True})
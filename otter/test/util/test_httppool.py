@@ -0,0 +1,118 @@
+"""
+Tests for :mod:`otter.util.httppool`
+"""
+
+import mock
+
+from twisted.internet import defer
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.constants import ServiceType
+from otter.util.httppool import (
+    HTTPPoolRegistry, ServicePool, get_pool, set_pool_registry)
+
+
+class ClockReactor(MemoryReactor):
+    """
+    MemoryReactor with settable time
+    """
+    now = 0
+
+    def seconds(self):
+        return self.now
+
+
+class ServicePoolTests(SynchronousTestCase):
+    """
+    Tests for :class:`ServicePool`
+    """
+
+    def setUp(self):
+        """
+        Pool with a reactor whose time can be set
+        """
+        self.reactor = ClockReactor()
+        self.pool = ServicePool(self.reactor, 5, 30)
+        self.endpoint = mock.Mock()
+        self.connected = defer.Deferred()
+        self.endpoint.connect.return_value = self.connected
+
+    def test_config(self):
+        """
+        Pool is persistent with given limit and idle timeout
+        """
+        self.assertTrue(self.pool.persistent)
+        self.assertEqual(self.pool.maxPersistentPerHost, 5)
+        self.assertEqual(self.pool.cachedConnectionTimeout, 30)
+
+    def test_stats(self):
+        """
+        Connections given out, created and time taken to get them are
+        counted
+        """
+        d = self.pool.getConnection('key', self.endpoint)
+        self.assertEqual(self.pool.stats,
+                         {'requests': 1, 'created': 1, 'wait_time': 0})
+        self.reactor.now = 2
+        self.connected.callback('connection')
+        self.assertEqual(self.successResultOf(d), 'connection')
+        self.assertEqual(self.pool.stats,
+                         {'requests': 1, 'created': 1, 'wait_time': 2})
+
+
+class HTTPPoolRegistryTests(SynchronousTestCase):
+    """
+    Tests for :class:`HTTPPoolRegistry`
+    """
+
+    def setUp(self):
+        """
+        Registry with MemoryReactor
+        """
+        self.registry = HTTPPoolRegistry(ClockReactor(), 3, 60)
+
+    def test_pool_per_service(self):
+        """
+        One pool is created per service type with the registry's settings
+        """
+        servers = self.registry.get_pool(ServiceType.CLOUD_SERVERS)
+        self.assertIs(servers,
+                      self.registry.get_pool(ServiceType.CLOUD_SERVERS))
+        self.assertIsNot(servers, self.registry.get_pool())
+        self.assertEqual(servers.maxPersistentPerHost, 3)
+        self.assertEqual(servers.cachedConnectionTimeout, 60)
+
+    def test_health_check(self):
+        """
+        Health check is healthy with stats of each pool by service name
+        """
+        self.registry.get_pool(ServiceType.IDENTITY)
+        self.registry.get_pool()
+        zero = {'requests': 0, 'created': 0, 'wait_time': 0}
+        self.assertEqual(self.registry.health_check(),
+                         (True, {'IDENTITY': zero, 'default': zero}))
+
+    def test_close(self):
+        """
+        Closes idle connections of all the pools
+        """
+        pools = [self.registry.get_pool(ServiceType.IDENTITY),
+                 self.registry.get_pool()]
+        for pool in pools:
+            pool.closeCachedConnections = mock.Mock(
+                return_value=defer.succeed('c'))
+        self.assertIsNone(self.successResultOf(self.registry.close()))
+        for pool in pools:
+            pool.closeCachedConnections.assert_called_once_with()
+
+    def test_get_pool(self):
+        """
+        :func:`get_pool` returns pool from registry set with
+        :func:`set_pool_registry` or None if it is not set
+        """
+        self.assertIsNone(get_pool(ServiceType.IDENTITY))
+        set_pool_registry(self.registry)
+        self.addCleanup(set_pool_registry, None)
+        self.assertIs(get_pool(ServiceType.IDENTITY),
+                      self.registry.get_pool(ServiceType.IDENTITY))
@@ -11,10 +11,12 @@ from testtools import TestCase
 
 from twisted.trial.unittest import SynchronousTestCase
 
+from otter.constants import ServiceType
 from otter.effect_dispatcher import get_simple_dispatcher
 from otter.test.utils import (
     StubResponse, StubTreq, resolve_stubs, stub_pure_response)
 from otter.util.http import APIError
+from otter.util.throttle import LimiterRegistry, set_limiter_registry
 from otter.util.pure_http import (
     Request,
     add_bind_root,
@@ -49,7 +51,8 @@ class RequestEffectTests(SynchronousTestCase):
         The Request effect dispatches a request to treq, and returns a
         two-tuple of the Twisted Response object and the content as bytes.
         """
-        req = ('GET', 'http://google.com/', None, None, None, {'log': None})
+        req = ('GET', 'http://google.com/', None, None, None,
+               {'log': None, 'service_type': None})
         response = StubResponse(200, {})
         treq = StubTreq(reqs=[(req, response)],
                         contents=[(response, "content")])
@@ -66,7 +69,8 @@ class RequestEffectTests(SynchronousTestCase):
         implementation.
         """
         log = object()
-        req = ('GET', 'http://google.com/', None, None, None, {'log': log})
+        req = ('GET', 'http://google.com/', None, None, None,
+               {'log': log, 'service_type': None})
         response = StubResponse(200, {})
         treq = StubTreq(reqs=[(req, response)],
                         contents=[(response, "content")])
@@ -77,6 +81,50 @@ class RequestEffectTests(SynchronousTestCase):
             self.successResultOf(perform(dispatcher, Effect(req))),
             (response, "content"))
 
+    def test_service_type(self):
+        """
+        The service type specified in the Request is passed on to the treq
+        implementation so that it uses the service's connection pool.
+        """
+        req = ('GET', 'http://google.com/', None, None, None,
+               {'log': None, 'service_type': ServiceType.CLOUD_SERVERS})
+        response = StubResponse(200, {})
+        treq = StubTreq(reqs=[(req, response)],
+                        contents=[(response, "content")])
+        req = Request(method="get", url="http://google.com/",
+                      service_type=ServiceType.CLOUD_SERVERS)
+        req.treq = treq
+        dispatcher = get_simple_dispatcher(None)
+        self.assertEqual(
+            self.successResultOf(perform(dispatcher, Effect(req))),
+            (response, "content"))
+
+    def test_concurrency_limit(self):
+        """
+        Requests with service type are performed within the concurrency
+        limit of the service and tenant.
+        """
+        registry = LimiterRegistry(1)
+        set_limiter_registry(registry)
+        self.addCleanup(lambda: set_limiter_registry(LimiterRegistry()))
+        req = ('GET', 'http://google.com/', None, None, None,
+               {'log': None, 'service_type': ServiceType.CLOUD_SERVERS})
+        response = StubResponse(200, {})
+        treq = StubTreq(reqs=[(req, response)],
+                        contents=[(response, "content")])
+        req = Request(method="get", url="http://google.com/",
+                      service_type=ServiceType.CLOUD_SERVERS, tenant_id='t')
+        req.treq = treq
+        limiter = registry.get_limiter(ServiceType.CLOUD_SERVERS, 't')
+        limiter.active = 1
+        d = perform(get_simple_dispatcher(None), Effect(req))
+        self.assertNoResult(d)
+        self.assertEqual(limiter.queued, 1)
+        limiter.active = 0
+        limiter._start_waiting()
+        self.assertEqual(self.successResultOf(d), (response, "content"))
+        self.assertEqual(limiter.limit, 2)
+
 
 class AddErrorHandlingTests(SynchronousTestCase):
     """Tests :func:`add_error_handling`."""
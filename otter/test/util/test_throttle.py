@@ -0,0 +1,210 @@
+"""
+Tests for :mod:`otter.util.throttle`
+"""
+
+import mock
+
+from twisted.internet import defer
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.constants import ServiceType
+from otter.util.http import APIError
+from otter.util.throttle import (
+    AdaptiveLimiter, LimiterRegistry, get_limiter, set_limiter_registry)
+
+
+class AdaptiveLimiterTests(SynchronousTestCase):
+    """
+    Tests for :class:`AdaptiveLimiter`
+    """
+
+    def setUp(self):
+        """
+        Limiter starting at 2 calls and deferreds returned by calls
+        """
+        self.limiter = AdaptiveLimiter(2, maximum=4)
+        self.calls = []
+
+    def call(self):
+        """
+        Deferred returned by function run within limiter
+        """
+        self.calls.append(defer.Deferred())
+        return self.calls[-1]
+
+    def test_limits_concurrency(self):
+        """
+        Calls beyond the limit wait for calls in progress to finish
+        """
+        ds = [self.limiter.run(self.call) for _ in range(3)]
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (2, 1))
+        self.calls[0].callback('r')
+        self.assertEqual(self.successResultOf(ds[0]), 'r')
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (2, 0))
+
+    def test_cancel_queued(self):
+        """
+        A queued call that is cancelled is not called and does not take a
+        slot from the calls queued after it
+        """
+        ds = [self.limiter.run(self.call) for _ in range(4)]
+        ds[2].cancel()
+        self.failureResultOf(ds[2], defer.CancelledError)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (2, 1))
+        self.calls[0].callback('r')
+        self.assertEqual(len(self.calls), 3)
+        self.calls[1].callback('r')
+        self.calls[2].callback('r')
+        self.successResultOf(ds[3])
+        self.assertEqual((self.limiter.active, self.limiter.queued), (0, 0))
+
+    def test_skips_called_waiters(self):
+        """
+        Queued calls that have already fired are skipped
+        """
+        ds = [self.limiter.run(self.call) for _ in range(4)]
+        self.limiter._waiting[0].errback(ValueError('gone'))
+        self.failureResultOf(ds[2], ValueError)
+        self.calls[0].callback('r')
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (2, 0))
+
+    def test_additive_increase(self):
+        """
+        Limit increases by 1 / limit on every call with 2xx response up to
+        maximum
+        """
+        ok = (mock.Mock(code=200), 'content')
+        self.successResultOf(self.limiter.run(lambda: ok))
+        self.assertEqual(self.limiter.limit, 2.5)
+        for _ in range(10):
+            self.successResultOf(self.limiter.run(lambda: ok))
+        self.assertEqual(self.limiter.limit, 4)
+
+    def test_non_2xx_do_not_increase(self):
+        """
+        Successful calls without a 2xx response do not increase the limit
+        """
+        self.successResultOf(self.limiter.run(lambda: 'r'))
+        self.successResultOf(
+            self.limiter.run(lambda: (mock.Mock(code=404), 'content')))
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_other_failures_do_not_adapt(self):
+        """
+        Failures other than throttling do not change the limit
+        """
+        d = self.limiter.run(lambda: defer.fail(APIError(500, '')))
+        self.failureResultOf(d, APIError)
+        self.assertEqual(self.limiter.limit, 2)
+        self.assertEqual(self.limiter.active, 0)
+
+    def test_multiplicative_decrease(self):
+        """
+        Limit is halved when a call is throttled, not going below minimum.
+        Throttled calls started before the decrease do not decrease it
+        again.
+        """
+        self.limiter.limit = 4
+        ds = [self.limiter.run(self.call) for _ in range(4)]
+        self.calls[0].errback(APIError(429, ''))
+        self.failureResultOf(ds[0], APIError)
+        self.assertEqual(self.limiter.limit, 2)
+        self.calls[1].callback(mock.Mock(code=413))
+        self.successResultOf(ds[1])
+        self.assertEqual(self.limiter.limit, 2)
+
+        self.limiter.run(self.call)
+        self.calls[2].callback(mock.Mock(code=200))
+        self.calls[3].callback(mock.Mock(code=201))
+        self.calls[4].callback((mock.Mock(code=503), 'content'))
+        self.assertEqual(self.limiter.limit, 2.9 / 2)
+
+        d = self.limiter.run(lambda: defer.fail(APIError(429, '')))
+        self.failureResultOf(d, APIError)
+        self.assertEqual(self.limiter.limit, 1)
+
+
+class LimiterRegistryTests(SynchronousTestCase):
+    """
+    Tests for :class:`LimiterRegistry`
+    """
+
+    def setUp(self):
+        """
+        Registry with small limits
+        """
+        self.registry = LimiterRegistry(1, 3, max_limiters=2)
+
+    def test_limiter_per_service_and_tenant(self):
+        """
+        One limiter is created per service type and tenant with registry's
+        limits and least recently used ones are forgotten
+        """
+        servers = self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1')
+        self.assertEqual((servers.limit, servers.maximum), (1, 3))
+        self.assertIs(
+            servers,
+            self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1'))
+        self.assertIsNot(
+            servers,
+            self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't2'))
+        self.registry.get_limiter(ServiceType.CLOUD_LOAD_BALANCERS, 't1')
+        self.assertIsNot(
+            servers,
+            self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1'))
+
+    def test_limiters_with_calls_not_forgotten(self):
+        """
+        Limiters with calls in progress or queued are not forgotten even if
+        they are least recently used, keeping their decreased limit
+        """
+        self.registry = LimiterRegistry(2, 3, max_limiters=2)
+        servers = self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1')
+        d = servers.run(defer.fail, APIError(429, ''))
+        self.failureResultOf(d, APIError)
+        servers.run(defer.Deferred)
+        servers.run(defer.Deferred)
+        self.assertEqual((servers.active, servers.queued), (1, 1))
+        self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't2')
+        self.registry.get_limiter(ServiceType.CLOUD_LOAD_BALANCERS, 't1')
+        limiter = self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1')
+        self.assertIs(limiter, servers)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_initial_is_maximum(self):
+        """
+        Limiters start at the maximum if no initial limit is given
+        """
+        limiter = LimiterRegistry(maximum=7).get_limiter(
+            ServiceType.CLOUD_SERVERS, 't1')
+        self.assertEqual((limiter.limit, limiter.maximum), (7, 7))
+
+    def test_health_check(self):
+        """
+        Health check is healthy with total active and queued calls and the
+        limiters with queued calls
+        """
+        limiter = self.registry.get_limiter(ServiceType.CLOUD_SERVERS, 't1')
+        for _ in range(3):
+            limiter.run(defer.Deferred)
+        self.registry.get_limiter(ServiceType.CLOUD_LOAD_BALANCERS,
+                                  't1').run(defer.Deferred)
+        self.assertEqual(
+            self.registry.health_check(),
+            (True, {'active': 2, 'queued': 2, 'queued_limiters': {
+                'CLOUD_SERVERS:t1': {'limit': 1, 'active': 1,
+                                     'queued': 2}}}))
+
+    def test_get_limiter(self):
+        """
+        :func:`get_limiter` returns limiter from registry set with
+        :func:`set_limiter_registry`
+        """
+        set_limiter_registry(self.registry)
+        self.addCleanup(lambda: set_limiter_registry(LimiterRegistry()))
+        self.assertIs(get_limiter(ServiceType.CLOUD_SERVERS, 't1'),
+                      self.registry.get_limiter(ServiceType.CLOUD_SERVERS,
+                                                't1'))
@@ -14,10 +14,10 @@ from toolz.dicttoolz import merge
 
 from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.task import Clock
-from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import headers
+from otter.constants import ServiceType
 from otter.test.utils import (
     CheckFailure,
     DummyException,
@@ -25,7 +25,6 @@ from otter.test.utils import (
     StubResponse,
     StubTreq,
     StubTreq2,
-    defaults_by_name,
     iMock,
     matches,
     mock_log,
@@ -36,6 +35,8 @@ from otter.undo import IUndoStack
 from otter.util.config import set_config_data
 from otter.util.deferredutils import TimedOutError, unwrap_first_error
 from otter.util.http import APIError, RequestError, wrap_request_error
+from otter.util.throttle import (
+    LimiterRegistry, get_limiter, set_limiter_registry)
 from otter.worker import launch_server_v1
 from otter.worker.launch_server_v1 import (
     CLBOrNodeDeleted,
@@ -43,6 +44,7 @@ from otter.worker.launch_server_v1 import (
     LB_RETRY_INTERVAL_RANGE,
     ServerCreationRetryError,
     ServerDeleted,
+    ServerStatusWatcher,
     UnexpectedServerStatus,
     _as_new_style_instance_details,
     _definitely_lb_config,
@@ -62,7 +64,7 @@ from otter.worker.launch_server_v1 import (
     scrub_otter_metadata,
     server_details,
     verified_delete,
-    wait_for_active
+    watch_server
 )
 
 
@@ -867,6 +869,8 @@ class ServerTests(SynchronousTestCase):
 
         self.treq = patch(self, 'otter.worker.launch_server_v1.treq')
         patch(self, 'otter.util.http.treq', new=self.treq)
+        set_limiter_registry(LimiterRegistry(2))
+        self.addCleanup(lambda: set_limiter_registry(LimiterRegistry()))
 
         self.generate_server_name = patch(
             self,
@@ -1109,7 +1113,8 @@ class ServerTests(SynchronousTestCase):
 
     def test_create_server_limits(self):
         """
-        create_server when called many times will post only 2 requests at a time
+        create_server when called many times will post only as many requests
+        at a time for a tenant as its limiter allows, 2 to begin with here
         """
         deferreds = [Deferred() for i in range(3)]
         post_ds = deferreds[:]
@@ -1126,11 +1131,11 @@ class ServerTests(SynchronousTestCase):
 
         # no result in any of them and only first 2 treq.post is called
         [self.assertNoResult(d) for d in ret_ds]
-        self.assertTrue(self.treq.post.call_count, 2)
+        self.assertEqual(self.treq.post.call_count, 2)
 
         # fire one deferred and notice that 3rd treq.post is called
         post_ds[0].callback(mock.Mock(code=202))
-        self.assertTrue(self.treq.post.call_count, 3)
+        self.assertEqual(self.treq.post.call_count, 3)
         self.successResultOf(ret_ds[0])
 
         # fire others
@@ -1290,215 +1295,6 @@ class ServerTests(SynchronousTestCase):
         self.assertEqual(real_failure.value.code, 400)
         self.assertFalse(fs.called)
 
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active(self, server_details):
-        """
-        wait_for_active will poll server_details until the status transitions
-        to our expected status at which point it will return the complete
-        server_details.
-        """
-        clock = Clock()
-
-        server_status = ['BUILD']
-
-        def _server_status(*args, **kwargs):
-            return succeed({'server': {'status': server_status[0]}})
-
-        server_details.side_effect = _server_status
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        self.log.msg.assert_called_once_with(
-            "Checking instance status every {interval} seconds", interval=5)
-
-        server_details.assert_called_with('http://url/', 'my-auth-token',
-                                          'serverId', log=mock.ANY)
-        self.assertEqual(server_details.call_count, 1)
-
-        server_status[0] = 'ACTIVE'
-
-        clock.advance(5)
-
-        server_details.assert_called_with('http://url/', 'my-auth-token',
-                                          'serverId', log=mock.ANY)
-        self.assertEqual(server_details.call_count, 2)
-
-        self.log.msg.assert_called_with(
-            "Server changed from 'BUILD' to 'ACTIVE' within {time_building} seconds",
-            time_building=5.0)
-
-        result = self.successResultOf(d)
-
-        self.assertEqual(result['server']['status'], server_status[0])
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_errors(self, server_details):
-        """
-        wait_for_active will errback it's Deferred if it encounters a non-active
-        state transition.
-        """
-        clock = Clock()
-
-        server_status = ['BUILD', 'ERROR']
-
-        def _server_status(*args, **kwargs):
-            return succeed({'server': {'status': server_status.pop(0)}})
-
-        server_details.side_effect = _server_status
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        clock.advance(5)
-
-        failure = self.failureResultOf(d)
-        self.assertTrue(failure.check(UnexpectedServerStatus))
-
-        self.log.msg.assert_called_with(
-            "Server changed to '{status}' in {time_building} seconds",
-            time_building=5.0, status='ERROR')
-
-        self.assertEqual(failure.value.server_id, 'serverId')
-        self.assertEqual(failure.value.status, 'ERROR')
-        self.assertEqual(failure.value.expected_status, 'ACTIVE')
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_continues_looping_on_500(self, server_details):
-        """
-        wait_for_active will keep looping if ``server_details`` raises other
-        exceptions, for instance RequestErrors.
-        """
-        clock = Clock()
-
-        server_details.return_value = fail(
-            RequestError(Failure(APIError(500, '', {})), 'url'))
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        self.assertNoResult(d)
-        server_details.return_value = succeed({'server': {'status': 'ACTIVE'}})
-
-        clock.advance(5)
-
-        result = self.successResultOf(d)
-        self.assertEqual(result['server']['status'], 'ACTIVE')
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_stops_looping_on_server_deletion(self, server_details):
-        """
-        wait_for_active will errback it's Deferred if ``server_details`` raises
-        a ``ServerDeletion`` error
-        """
-        clock = Clock()
-
-        server_details.return_value = fail(ServerDeleted('1234'))
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        failure = self.failureResultOf(d)
-        self.assertTrue(failure.check(ServerDeleted))
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_stops_looping_on_error(self, server_details):
-        """
-        wait_for_active stops looping when it encounters an error.
-        """
-        clock = Clock()
-        server_status = ['BUILD', 'ERROR']
-
-        def _server_status(*args, **kwargs):
-            return succeed({'server': {'status': server_status.pop(0)}})
-
-        server_details.side_effect = _server_status
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        # This gets called once immediately then every 5 seconds.
-        self.assertEqual(server_details.call_count, 1)
-
-        clock.advance(5)
-
-        self.assertEqual(server_details.call_count, 2)
-
-        clock.advance(5)
-
-        # This has not been called a 3rd time because we encountered an error,
-        # and the looping call stopped.
-        self.assertEqual(server_details.call_count, 2)
-
-        self.failureResultOf(d)
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_stops_looping_on_success(self, server_details):
-        """
-        wait_for_active stops looping when it encounters the active state.
-        """
-        clock = Clock()
-        server_status = ['BUILD', 'ACTIVE']
-
-        def _server_status(*args, **kwargs):
-            return succeed({'server': {'status': server_status.pop(0)}})
-
-        server_details.side_effect = _server_status
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, clock=clock)
-
-        # This gets called once immediately then every 5 seconds.
-        self.assertEqual(server_details.call_count, 1)
-
-        clock.advance(5)
-
-        self.assertEqual(server_details.call_count, 2)
-
-        clock.advance(5)
-
-        # This has not been called a 3rd time because we encountered the active
-        # state and the looping call stopped.
-        self.assertEqual(server_details.call_count, 2)
-
-        self.successResultOf(d)
-
-    @mock.patch('otter.worker.launch_server_v1.server_details')
-    def test_wait_for_active_stops_looping_on_timeout(self, server_details):
-        """
-        wait_for_active stops looping when the timeout passes
-        """
-        clock = Clock()
-        server_details.side_effect = lambda *args, **kwargs: succeed(
-            {'server': {'status': 'BUILD'}})
-
-        d = wait_for_active(self.log,
-                            'http://url/', 'my-auth-token', 'serverId',
-                            interval=5, timeout=6, clock=clock)
-
-        # This gets called once immediately then every 5 seconds.
-        self.assertEqual(server_details.call_count, 1)
-        clock.advance(5)
-        self.assertEqual(server_details.call_count, 2)
-        self.assertNoResult(d)
-
-        clock.advance(1)
-        self.failureResultOf(d, TimedOutError)
-
-        # the loop has stopped
-        clock.advance(5)
-        self.assertEqual(server_details.call_count, 2)
-
-    def test_wait_for_active_default_timeout(self):
-        """:func`wait_for_active` waits for 2 hours by default."""
-        self.assertEqual(defaults_by_name(wait_for_active)["timeout"],
-                         2 * 60 * 60)
-
     def _launch_server(self, launch_config, log=None, clock=None):
         """
         Helper method for calling :func:`launch_server`.
@@ -1507,6 +1303,7 @@ class ServerTests(SynchronousTestCase):
         request_func.region = request_func.lb_region = "DFW"
         request_func.service_catalog = fake_service_catalog
         request_func.auth_token = 'my-auth-token'
+        request_func.re_auth = mock.Mock()
 
         d = launch_server(log if log is not None else self.log,
                           request_func, self.scaling_group,
@@ -1515,8 +1312,8 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
-    def test_launch_server(self, wait_for_active, create_server,
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
+    def test_launch_server(self, watch_server, create_server,
                            add_to_load_balancers):
         """
         launch_server creates a server, waits until the server is active then
@@ -1557,7 +1354,7 @@ class ServerTests(SynchronousTestCase):
 
         create_server.return_value = succeed(server_details)
 
-        wait_for_active.return_value = succeed(server_details)
+        watch_server.return_value = succeed(server_details)
 
         add_to_load_balancers.return_value = succeed([
             (lb_config_1, ('10.0.0.1', 80)),
@@ -1576,12 +1373,11 @@ class ServerTests(SynchronousTestCase):
         create_server.assert_called_once_with('http://dfw.openstack/',
                                               'my-auth-token',
                                               expected_server_config,
-                                              log=mock.ANY)
+                                              log=mock.ANY, tenant_id='1234')
 
-        wait_for_active.assert_called_once_with(mock.ANY,
-                                                'http://dfw.openstack/',
-                                                'my-auth-token',
-                                                '1')
+        watch_server.assert_called_once_with(
+            mock.ANY, 'http://dfw.openstack/', '1234', 'my-auth-token', '1',
+            clock=None, re_auth=self.request_func.re_auth)
 
         log.bind.assert_called_once_with(server_name='as000000')
         log = log.bind.return_value
@@ -1594,9 +1390,9 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_server_doesnt_check_networks_if_no_load_balancers(
-            self, wait_for_active, create_server, add_to_load_balancers):
+            self, watch_server, create_server, add_to_load_balancers):
         """
         :func:`launch_server` will succeed at launching a server that has no
         servicenet configured, so long as it also does not require load
@@ -1611,7 +1407,7 @@ class ServerTests(SynchronousTestCase):
         }
 
         create_server.return_value = succeed(server_details)
-        wait_for_active.return_value = succeed(server_details)
+        watch_server.return_value = succeed(server_details)
 
         log = mock.Mock()
         result = self.successResultOf(self._launch_server(launch_config, log))
@@ -1622,9 +1418,9 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_server_logs_if_metadata_does_not_match(
-            self, wait_for_active, create_server, add_to_load_balancers):
+            self, watch_server, create_server, add_to_load_balancers):
         """
         :func:`launch_server` will succeed but log a message if a server's
             metadata has changed between server launch and server becoming
@@ -1644,7 +1440,7 @@ class ServerTests(SynchronousTestCase):
         }
 
         create_server.return_value = succeed(server_details)
-        wait_for_active.return_value = succeed(server_details)
+        watch_server.return_value = succeed(server_details)
 
         d = self._launch_server(launch_config)
         expected_metadata = generate_server_metadata(self.scaling_group.uuid,
@@ -1662,9 +1458,9 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_server_propagates_create_server_errors(
-            self, wait_for_active, create_server, add_to_load_balancers):
+            self, watch_server, create_server, add_to_load_balancers):
         """
         launch_server will propagate any errors from create_server.
         """
@@ -1682,11 +1478,11 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
-    def test_launch_server_propagates_wait_for_active_errors(
-            self, wait_for_active, create_server, add_to_load_balancers):
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
+    def test_launch_server_propagates_watch_server_errors(
+            self, watch_server, create_server, add_to_load_balancers):
         """
-        launch_server will propagate any errors from wait_for_active.
+        launch_server will propagate any errors from watch_server.
         """
         launch_config = {'server': {'imageRef': '1', 'flavorRef': '1'},
                          'loadBalancers': []}
@@ -1699,7 +1495,7 @@ class ServerTests(SynchronousTestCase):
 
         create_server.return_value = succeed(server_details)
 
-        wait_for_active.return_value = fail(
+        watch_server.return_value = fail(
             APIError(500, "Oh noes")).addErrback(wrap_request_error, 'url')
 
         d = self._launch_server(launch_config)
@@ -1713,9 +1509,9 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_server_propagates_add_to_load_balancers_errors(
-            self, wait_for_active, create_server, add_to_load_balancers):
+            self, watch_server, create_server, add_to_load_balancers):
         """
         launch_server will propagate any errors from add_to_load_balancers.
         """
@@ -1732,7 +1528,7 @@ class ServerTests(SynchronousTestCase):
 
         create_server.return_value = succeed(server_details)
 
-        wait_for_active.return_value = succeed(server_details)
+        watch_server.return_value = succeed(server_details)
 
         add_to_load_balancers.return_value = fail(
             APIError(500, "Oh noes")).addErrback(wrap_request_error, 'url')
@@ -1749,9 +1545,9 @@ class ServerTests(SynchronousTestCase):
     @mock.patch('otter.worker.launch_server_v1.verified_delete')
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_server_pushes_verified_delete_onto_undo(
-            self, wait_for_active, create_server, add_to_load_balancers,
+            self, watch_server, create_server, add_to_load_balancers,
             verified_delete):
         """
         launch_server will push verified_delete onto the undo stack
@@ -1768,7 +1564,7 @@ class ServerTests(SynchronousTestCase):
 
         create_server.return_value = Deferred()
 
-        wait_for_active.return_value = succeed(server_details)
+        watch_server.return_value = succeed(server_details)
 
         mock_server_response = {'server': {'id': '1',
                                            'addresses': {'private': [{'version': 4,
@@ -1812,7 +1608,7 @@ class ServerTests(SynchronousTestCase):
     @mock.patch('otter.worker.launch_server_v1.verified_delete')
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_retries_on_error(self, mock_wfa, mock_cs, mock_addlb, mock_vd):
         """
         If server goes into ERROR state, launch_server deletes it and creates a new
@@ -1837,13 +1633,13 @@ class ServerTests(SynchronousTestCase):
         wfa_returns = [fail(UnexpectedServerStatus('1', 'ERROR', 'ACTIVE')),
                        fail(UnexpectedServerStatus('1', 'ERROR', 'ACTIVE')),
                        succeed(server_details)]
-        mock_wfa.side_effect = lambda *a: wfa_returns.pop(0)
+        mock_wfa.side_effect = lambda *a, **kw: wfa_returns.pop(0)
         mock_vd.side_effect = lambda *a: Deferred()
 
         clock = Clock()
         d = self._launch_server(launch_config, clock=clock)
 
-        # No result, create_server and wait_for_active called once, server deletion
+        # No result, create_server and watch_server called once, server deletion
         # was started and it wasn't added to clb
         self.assertNoResult(d)
         self.assertEqual(mock_cs.call_count, 1)
@@ -1884,7 +1680,7 @@ class ServerTests(SynchronousTestCase):
 
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_no_retry_on_non_error(self, mock_wfa, mock_cs, mock_addlb):
         """
         launch_server does not retry to create server if server goes into any state
@@ -1906,7 +1702,7 @@ class ServerTests(SynchronousTestCase):
 
         wfa_returns = [fail(UnexpectedServerStatus('1', 'SOME', 'ACTIVE')),
                        succeed(server_details)]
-        mock_wfa.side_effect = lambda *a: wfa_returns.pop(0)
+        mock_wfa.side_effect = lambda *a, **kw: wfa_returns.pop(0)
 
         clock = Clock()
         d = self._launch_server(launch_config, clock=clock)
@@ -1919,7 +1715,7 @@ class ServerTests(SynchronousTestCase):
     @mock.patch('otter.worker.launch_server_v1.verified_delete')
     @mock.patch('otter.worker.launch_server_v1.add_to_load_balancers')
     @mock.patch('otter.worker.launch_server_v1.create_server')
-    @mock.patch('otter.worker.launch_server_v1.wait_for_active')
+    @mock.patch('otter.worker.launch_server_v1.watch_server')
     def test_launch_max_retries(self, mock_wfa, mock_cs, mock_addlb, mock_vd):
         """
         server is created again max 3 times if it goes into ERROR state
@@ -1942,7 +1738,7 @@ class ServerTests(SynchronousTestCase):
                        fail(UnexpectedServerStatus('1', 'ERROR', 'ACTIVE')),
                        fail(UnexpectedServerStatus('1', 'ERROR', 'ACTIVE')),
                        fail(UnexpectedServerStatus('1', 'ERROR', 'ACTIVE'))]
-        mock_wfa.side_effect = lambda *a: wfa_returns.pop(0)
+        mock_wfa.side_effect = lambda *a, **kw: wfa_returns.pop(0)
 
         clock = Clock()
         d = self._launch_server(launch_config, clock=clock)
@@ -1955,6 +1751,265 @@ class ServerTests(SynchronousTestCase):
         self.assertFalse(mock_addlb.called)
 
 
+class ServerStatusWatcherTests(SynchronousTestCase):
+    """
+    Tests for :class:`ServerStatusWatcher` and :func:`watch_server`
+    """
+
+    def setUp(self):
+        """
+        Watcher with stub listing of changed servers
+        """
+        self.treq = patch(self, 'otter.worker.launch_server_v1.treq')
+        patch(self, 'otter.util.http.treq', new=self.treq)
+        set_limiter_registry(LimiterRegistry())
+        self.addCleanup(lambda: set_limiter_registry(LimiterRegistry()))
+        self.lists = []
+
+        def get(url, headers, log, service_type):
+            self.lists.append((url, Deferred()))
+            return self.lists[-1][1]
+
+        self.treq.get.side_effect = get
+        self.treq.json_content.side_effect = lambda r: succeed(r.body)
+        self.treq.content.side_effect = lambda r: succeed('error')
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.log = mock_log()
+        self.on_idle = mock.Mock()
+        self.watcher = ServerStatusWatcher(
+            self.clock, 'http://url/', '1234', self.log, min_interval=5,
+            max_interval=20, build_time=60, on_idle=self.on_idle)
+
+    def _list_url(self, since, marker=None):
+        query = [('changes-since', since), ('limit', 1000)]
+        if marker is not None:
+            query.append(('marker', marker))
+        return 'http://url/servers/detail?' + urlencode(query)
+
+    def _respond(self, *servers):
+        self.lists[-1][1].callback(mock.Mock(
+            code=200, body={'servers': [{'id': server_id, 'status': status}
+                                        for server_id, status in servers]}))
+
+    def test_servers_resolved_from_changed_servers(self):
+        """
+        Servers watched are checked together by listing servers changed since
+        the previous check. Each watcher is resolved when its server is not
+        building anymore and the watcher goes idle when none are left.
+        """
+        d1 = self.watcher.watch(self.log, 'token', 'a')
+        d2 = self.watcher.watch(self.log, 'token2', 'b')
+        self.clock.advance(20)
+        self.assertEqual(len(self.lists), 1)
+        self.assertEqual(self.lists[0][0],
+                         self._list_url('1970-01-01T00:15:40Z'))
+        self.treq.get.assert_called_once_with(
+            mock.ANY, headers=headers('token2'), log=self.log,
+            service_type=ServiceType.CLOUD_SERVERS)
+
+        self._respond(('a', 'ACTIVE'), ('b', 'BUILD'), ('c', 'ERROR'))
+        self.assertEqual(self.successResultOf(d1),
+                         {'server': {'id': 'a', 'status': 'ACTIVE'}})
+        self.assertNoResult(d2)
+        self.assertEqual(len(self.watcher), 1)
+
+        self.clock.advance(20)
+        self.assertEqual(self.lists[1][0],
+                         self._list_url('1970-01-01T00:16:00Z'))
+        self._respond(('b', 'ERROR'))
+        f = self.failureResultOf(d2, UnexpectedServerStatus)
+        self.assertEqual((f.value.server_id, f.value.status), ('b', 'ERROR'))
+        self.on_idle.assert_called_once_with()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_deleted_server(self):
+        """
+        Watcher errbacks with :class:`ServerDeleted` if server is deleted
+        """
+        d = self.watcher.watch(self.log, 'token', 'a')
+        self.clock.advance(20)
+        self._respond(('a', 'DELETED'))
+        self.failureResultOf(d, ServerDeleted)
+
+    def test_pages(self):
+        """
+        Changed servers are listed a page at a time, each page after the last
+        server of the previous one, until a page is shorter than the page
+        size.
+        """
+        patch(self, 'otter.worker.launch_server_v1.SERVERS_PAGE_SIZE', new=2)
+        d = self.watcher.watch(self.log, 'token', 'e')
+        self.clock.advance(20)
+        self._respond(('a', 'BUILD'), ('b', 'BUILD'))
+        self._respond(('c', 'BUILD'), ('d', 'BUILD'))
+        self.assertNoResult(d)
+        self._respond(('e', 'ACTIVE'))
+        self.successResultOf(d)
+        self.assertEqual(
+            [url for url, _ in self.lists],
+            [self._list_url('1970-01-01T00:15:40Z', marker).replace(
+                'limit=1000', 'limit=2')
+             for marker in [None, 'b', 'd']])
+
+    def test_configured_page_size(self):
+        """
+        Pages are of ``converger.osapi_max_limit`` servers when it is set
+        """
+        set_config_data({'converger': {'osapi_max_limit': 1}})
+        self.addCleanup(set_config_data, {})
+        d = self.watcher.watch(self.log, 'token', 'b')
+        self.clock.advance(20)
+        self._respond(('a', 'BUILD'))
+        self._respond(('b', 'ACTIVE'))
+        self.assertNoResult(d)
+        self._respond()
+        self.successResultOf(d)
+        self.assertEqual(
+            [url for url, _ in self.lists],
+            [self._list_url('1970-01-01T00:15:40Z', marker).replace(
+                'limit=1000', 'limit=1')
+             for marker in [None, 'a', 'b']])
+
+    def test_limited(self):
+        """
+        Changed servers are listed through the tenant's cloud servers limiter
+        """
+        set_limiter_registry(LimiterRegistry(1))
+        limiter = get_limiter(ServiceType.CLOUD_SERVERS, '1234')
+        busy = Deferred()
+        limiter.run(lambda: busy)
+        d = self.watcher.watch(self.log, 'token', 'a')
+        self.clock.advance(20)
+        self.assertEqual(self.lists, [])
+        busy.callback(None)
+        self.assertEqual(len(self.lists), 1)
+        self._respond(('a', 'ACTIVE'))
+        self.successResultOf(d)
+
+    def test_re_auth_on_401(self):
+        """
+        When the token is rejected, a new one is got with `re_auth` given to
+        the latest watch and the listing is retried with it. The new token is
+        used by the following checks.
+        """
+        re_auth = mock.Mock(return_value=succeed('new-token'))
+        d1 = self.watcher.watch(self.log, 'token', 'a', re_auth=re_auth)
+        d2 = self.watcher.watch(self.log, 'token', 'b')
+        self.clock.advance(20)
+        self.lists[0][1].callback(mock.Mock(code=401))
+        re_auth.assert_called_once_with()
+        self.assertEqual(self.lists[1][0],
+                         self._list_url('1970-01-01T00:15:40Z'))
+        self.assertEqual(self.treq.get.call_args[1]['headers'],
+                         headers('new-token'))
+        self._respond(('a', 'ACTIVE'))
+        self.successResultOf(d1)
+        self.clock.advance(20)
+        self.assertEqual(self.treq.get.call_args[1]['headers'],
+                         headers('new-token'))
+        self._respond(('b', 'ACTIVE'))
+        self.successResultOf(d2)
+        self.assertFalse(self.log.err.called)
+
+    def test_no_re_auth_on_other_errors(self):
+        """
+        Listing errors other than a rejected token are logged without getting
+        a new token
+        """
+        re_auth = mock.Mock(return_value=succeed('new-token'))
+        self.watcher.watch(self.log, 'token', 'a', re_auth=re_auth)
+        self.clock.advance(20)
+        self.lists[0][1].callback(mock.Mock(code=500))
+        self.assertFalse(re_auth.called)
+        self.assertEqual(len(self.lists), 1)
+        self.log.err.assert_called_once_with(
+            CheckFailure(APIError), 'Could not list changed servers')
+
+    def test_re_auth_failure_logged(self):
+        """
+        If listing with the new token is also rejected, it is logged and
+        listed again later
+        """
+        re_auth = mock.Mock(return_value=succeed('new-token'))
+        self.watcher.watch(self.log, 'token', 'a', re_auth=re_auth)
+        self.clock.advance(20)
+        self.lists[0][1].callback(mock.Mock(code=401))
+        self.lists[1][1].callback(mock.Mock(code=401))
+        self.assertEqual(re_auth.call_count, 1)
+        self.log.err.assert_called_once_with(
+            CheckFailure(APIError), 'Could not list changed servers')
+        self.clock.advance(20)
+        self.assertEqual(len(self.lists), 3)
+
+    def test_interval_tightens_around_build_time(self):
+        """
+        Servers are checked every `min_interval` seconds from `max_interval`
+        before `build_time` until twice `build_time` and every `max_interval`
+        seconds otherwise
+        """
+        self.watcher.watch(self.log, 'token', 'a')
+        times = []
+        while self.clock.seconds() < 1160:
+            self.clock.advance(1)
+            if len(self.lists) > len(times):
+                times.append(self.clock.seconds() - 1000)
+                self._respond()
+        self.assertEqual(times, [20, 40] + range(45, 125, 5) + [140, 160])
+
+    def test_list_failure_logged(self):
+        """
+        Failure to list changed servers is logged and they are listed again
+        later since the previous successful listing
+        """
+        d = self.watcher.watch(self.log, 'token', 'a')
+        self.clock.advance(20)
+        self.lists[0][1].errback(DummyException('bad'))
+        self.log.err.assert_called_once_with(
+            CheckFailure(DummyException), 'Could not list changed servers')
+        self.clock.advance(20)
+        self.assertEqual(self.lists[1][0],
+                         self._list_url('1970-01-01T00:15:40Z'))
+        self._respond(('a', 'ACTIVE'))
+        self.successResultOf(d)
+
+    def test_timeout(self):
+        """
+        Watching a server times out after `timeout` seconds and it is not
+        watched anymore
+        """
+        d = self.watcher.watch(self.log, 'token', 'a', timeout=10)
+        self.clock.advance(10)
+        self.failureResultOf(d, TimedOutError)
+        self.assertEqual(len(self.watcher), 0)
+        self.clock.advance(10)
+        self._respond(('a', 'ACTIVE'))
+        self.on_idle.assert_called_once_with()
+
+    def test_watch_server_shares_watcher_by_endpoint(self):
+        """
+        :func:`watch_server` watches servers of the same endpoint with one
+        watcher that is forgotten when it goes idle
+        """
+        watchers = patch(
+            self, 'otter.worker.launch_server_v1._server_watchers', new={})
+        re_auth = mock.Mock()
+        d1 = watch_server(self.log, 'http://url/', '1234', 'token', 'a',
+                          clock=self.clock)
+        d2 = watch_server(self.log, 'http://url/', '1234', 'token', 'b',
+                          clock=self.clock, re_auth=re_auth)
+        watcher = watchers['http://url/']
+        self.assertEqual(len(watcher), 2)
+        self.assertEqual(watcher.tenant_id, '1234')
+        self.assertIs(watcher.re_auth, re_auth)
+        self.clock.advance(20)
+        self.assertEqual(len(self.lists), 1)
+        self._respond(('a', 'ACTIVE'), ('b', 'ACTIVE'))
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertEqual(watchers, {})
+
+
 class ConfigPreparationTests(SynchronousTestCase):
     """
     Test config preparation.
@@ -0,0 +1,197 @@
+"""
+Caching utilities
+"""
+
+from collections import OrderedDict
+
+from twisted.internet import defer
+
+
+class _Fetch(object):
+    """
+    An outstanding fetch of a key in :class:`TTLCache`
+    """
+
+    def __init__(self):
+        self.waiters = []
+        self.valid = True
+
+
+class TTLCache(object):
+    """
+    Cache of results of ``Deferred`` returning fetches keyed by any hashable
+    key. Concurrent gets of a key that is being fetched wait on the same fetch
+    instead of fetching again. Fetched values are evicted `ttl` seconds after
+    being fetched. Failures are not cached.
+
+    :param clock: `IReactorTime` provider
+    :param float ttl: Number of seconds a fetched value is kept
+    """
+
+    def __init__(self, clock, ttl):
+        self._clock = clock
+        self.ttl = ttl
+        self._values = {}
+        self._fetches = {}
+
+    def get(self, key, fetch):
+        """
+        Get value of the key, fetching it if not already cached
+
+        :param key: Hashable key
+        :param callable fetch: No-argument function that is called to fetch
+            the value if it is not cached. Can return a ``Deferred``
+
+        :return: ``Deferred`` that fires with the value
+        """
+        if key in self._values:
+            return defer.succeed(self._values[key][0])
+        d = defer.Deferred()
+        if key in self._fetches:
+            self._fetches[key].waiters.append(d)
+            return d
+        _fetch = self._fetches[key] = _Fetch()
+        _fetch.waiters.append(d)
+        fd = defer.maybeDeferred(fetch)
+        fd.addCallback(self._fetched, key, _fetch)
+        fd.addBoth(self._notify, key, _fetch)
+        return d
+
+    def _fetched(self, value, key, _fetch):
+        """
+        Cache the fetched value unless key was invalidated while fetching
+        """
+        if _fetch.valid:
+            self._values[key] = (
+                value, self._clock.callLater(self.ttl, self._evict, key))
+        return value
+
+    def _notify(self, result, key, _fetch):
+        """
+        Fire all the waiters of the fetch with the result
+        """
+        if self._fetches.get(key) is _fetch:
+            del self._fetches[key]
+        for waiter in _fetch.waiters:
+            waiter.callback(result)
+
+    def _evict(self, key):
+        del self._values[key]
+
+    def invalidate(self, key):
+        """
+        Remove the key from the cache. If the key is being fetched, the result
+        of that fetch is given to its waiters but not cached and the next get
+        starts a new fetch.
+        """
+        if key in self._values:
+            _, call = self._values.pop(key)
+            call.cancel()
+        _fetch = self._fetches.pop(key, None)
+        if _fetch is not None:
+            _fetch.valid = False
+
+    def keys(self):
+        """
+        Return ``list`` of keys that are cached or being fetched
+        """
+        return list(set(self._values) | set(self._fetches))
+
+    def __contains__(self, key):
+        """
+        Is the key's value cached?
+        """
+        return key in self._values
+
+
+class LRUCache(object):
+    """
+    Mapping that keeps at most `max_size` keys by evicting the least recently
+    used key when a new one is added. Keys can also expire some seconds after
+    they are set, in which case they are treated as not there.
+
+    :param int max_size: Maximum number of keys kept
+    :param clock: `IReactorTime` provider. Only needed if keys expire
+    :param float ttl: Number of seconds after which keys expire unless
+        given when setting them. Keys do not expire if it is None
+    :param evictable: Callable taking a value and returning whether its key
+        can be evicted. Only the least recently used key that can be evicted
+        is evicted, so there can be more than `max_size` keys while the
+        others cannot. All keys can be evicted if it is None.
+    """
+
+    def __init__(self, max_size, clock=None, ttl=None, evictable=None):
+        self.max_size = max_size
+        self.clock = clock
+        self.ttl = ttl
+        self.evictable = evictable
+        self._values = OrderedDict()
+
+    def _expired(self, key):
+        expires = self._values[key][1]
+        return expires is not None and self.clock.seconds() >= expires
+
+    def get(self, key, default=None):
+        """
+        Return value of the key, marking it as most recently used, or
+        `default` if it is not there
+        """
+        if key not in self:
+            return default
+        item = self._values.pop(key)
+        self._values[key] = item
+        return item[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Add or update the key's value, evicting the least recently used key
+        if there are more than `max_size` keys
+
+        :param float ttl: Seconds after which the key expires. Defaults to
+            the cache's ``ttl``
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else self.clock.seconds() + ttl
+        self._values.pop(key, None)
+        self._values[key] = (value, expires)
+        if len(self._values) <= self.max_size:
+            return
+        if self.evictable is None:
+            self._values.popitem(last=False)
+            return
+        for old_key, (old_value, _) in self._values.items():
+            if old_key != key and self.evictable(old_value):
+                del self._values[old_key]
+                return
+
+    def pop(self, key, default=None):
+        """
+        Remove the key returning its value or `default` if it is not there
+        """
+        if key not in self:
+            self._values.pop(key, None)
+            return default
+        return self._values.pop(key)[0]
+
+    def __contains__(self, key):
+        """
+        Is the key there and not expired? Expired key is removed.
+        """
+        if key not in self._values:
+            return False
+        if self._expired(key):
+            del self._values[key]
+            return False
+        return True
+
+    def items(self):
+        """
+        Return list of (key, value) of keys that are not expired, least
+        recently used first. This does not mark them as used.
+        """
+        return [(key, item[0]) for key, item in self._values.items()
+                if not self._expired(key)]
+
+    def __len__(self):
+        return len(self._values)
@@ -1,7 +1,22 @@
 """ CQL Batch wrapper"""
 
-from silverberg.client import ConsistencyLevel
+import calendar
+import re
+from datetime import datetime
+from uuid import UUID
 
+from cql.cqltypes import (
+    DateType, LongType, ReversedType, TimeUUIDType, UUIDType, lookup_casstype)
+from cql.query import prepare_query, replace_param_substitutions
+
+from silverberg.cassandra import ttypes
+from silverberg.client import CQLClient, ConsistencyLevel
+from silverberg.cluster import RoundRobinCassandraCluster
+from silverberg.marshal import prepare, unmarshallers
+
+from twisted.internet.defer import Deferred, succeed
+
+from otter.util.cache import LRUCache
 from otter.util.deferredutils import timeout_deferred
 
 
@@ -69,3 +84,302 @@ class TimingOutCQLClient(object):
         See :py:func:`silverberg.client.CQLClient.disconnect`
         """
         return self._client.disconnect()
+
+
+class _Statement(object):
+    """
+    A statement prepared in Cassandra
+
+    :param int item_id: Id of the statement given by Cassandra
+    :param list names: Names of bound variables in the order they appear in
+        the query
+    :param list types: Cassandra types of the bound variables in same order
+    """
+
+    def __init__(self, item_id, names, types):
+        self.item_id = item_id
+        self.names = names
+        self.types = map(lookup_casstype, types)
+        if len(self.names) != len(self.types):
+            raise ValueError('Cassandra returned {} types for {} variables'
+                             .format(len(self.types), len(self.names)))
+
+    def bind(self, params):
+        """
+        Return ``list`` of binary serialized values of the variables from
+        the params
+        """
+        return [_serialize(_type, params[name])
+                for name, _type in zip(self.names, self.types)]
+
+
+def _serialize(casstype, value):
+    """
+    Serialize value to binary as per the Cassandra type. Values are taken
+    as :func:`silverberg.marshal.marshal` would take them, i.e. naive
+    ``datetime`` is UTC time and UUIDs can be strings.
+    """
+    if issubclass(casstype, ReversedType):
+        casstype = casstype.subtypes[0]
+    if issubclass(casstype, (UUIDType, TimeUUIDType)):
+        if isinstance(value, basestring):
+            value = UUID(value)
+        return value.bytes
+    if issubclass(casstype, DateType):
+        if isinstance(value, datetime):
+            value = (calendar.timegm(value.utctimetuple()) * 1000 +
+                     value.microsecond // 1000)
+        return LongType.serialize(int(value))
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return casstype.to_binary(value)
+
+
+_UNPREPARABLE = object()
+
+_dynamic_re = re.compile(r'^\s*BEGIN\b|\bIN\s*\(', re.IGNORECASE)
+
+
+def _bind_nulls(query, params):
+    """
+    Return query with params whose value is None replaced by null literal
+    and the remaining params. Thrift cannot send a null bound value and an
+    empty value is not null for most types.
+    """
+    nulls = set(name for name, value in params.items() if value is None)
+    if not nulls:
+        return query, params
+
+    def replace(match):
+        prefix, name = match.group(1), match.group(2)
+        return prefix + ('null' if name in nulls else ':' + name)
+
+    return (replace_param_substitutions(query, replace),
+            {name: value for name, value in params.items()
+             if name not in nulls})
+
+
+def _preparable(query):
+    """
+    Return whether the query is worth preparing. Batches and IN lists are
+    generated with as many statements or variables as the data they are
+    about and would evict the statements that are executed repeatedly.
+    """
+    return _dynamic_re.search(query) is None
+
+
+class _SilverbergInternals(object):
+    """
+    Parts of silverberg's :class:`CQLClient` and
+    :class:`RoundRobinCassandraCluster` that are not public but are needed by
+    :class:`PreparingCQLClient` and :class:`PreparingCassandraCluster`. They
+    are as of silverberg 0.1.9 and only this class should need changing when
+    silverberg changes them.
+
+    :param client: :class:`CQLClient` whose internals are used
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def connection(self):
+        """
+        Return ``Deferred`` that fires with the thrift client of the
+        connection, connecting if not already connected
+        """
+        return self._client._connection()
+
+    @property
+    def keyspace(self):
+        """
+        Keyspace the client is connected to
+        """
+        return self._client._keyspace
+
+    @property
+    def disconnect_on_cancel(self):
+        """
+        Should the client disconnect when a query is cancelled?
+        """
+        return self._client._disconnect_on_cancel
+
+    def unmarshal_rows(self, schema, rows):
+        """
+        Return rows of a result as ``list`` of ``dict``
+        """
+        return self._client._unmarshal_result(schema, rows, unmarshallers)
+
+    @staticmethod
+    def set_cluster_clients(cluster, clients):
+        """
+        Make the :class:`RoundRobinCassandraCluster` execute queries with
+        the given clients
+        """
+        cluster._seed_clients = clients
+        cluster._client_idx = 0
+
+
+class PreparingCQLClient(CQLClient):
+    """
+    A :class:`CQLClient` that prepares each distinct query once per
+    connection and then executes it by binding values serialized as per the
+    types of the variables. This saves Cassandra from parsing the query on
+    every execution. Queries that Cassandra cannot prepare, like the ones
+    with bind variables in places not supported by it, are executed as text
+    after substituting the values like :class:`CQLClient` does.
+
+    Prepared statements are remembered per connection since their ids are
+    valid only in the node that prepared them. A statement that the node
+    has since forgotten is prepared again. Batches and queries with IN lists
+    are executed as text without preparing them and params that are None are
+    sent as null literals.
+
+    :param int max_statements: Maximum number of prepared statements
+        remembered. Least recently used ones are forgotten beyond that.
+        Other params are same as :class:`CQLClient`
+    """
+
+    def __init__(self, cass_endpoint, keyspace, user=None, password=None,
+                 disconnect_on_cancel=False, max_statements=1000):
+        super(PreparingCQLClient, self).__init__(
+            cass_endpoint, keyspace, user, password, disconnect_on_cancel)
+        self._max_statements = max_statements
+        self._statements = LRUCache(max_statements)
+        self._statements_client = None
+        self._internals = _SilverbergInternals(self)
+
+    def _prepared(self, client, query):
+        """
+        Return ``Deferred`` that fires with :class:`_Statement` of the query
+        prepared on the client or `_UNPREPARABLE` if it cannot be prepared
+        """
+        if client is not self._statements_client:
+            self._statements = LRUCache(self._max_statements)
+            self._statements_client = client
+        statement = self._statements.get(query)
+        if statement is not None:
+            return succeed(statement)
+
+        prepared_query, names = prepare_query(query)
+
+        def _remember(result):
+            try:
+                statement = _Statement(result.itemId, names,
+                                       result.variable_types or [])
+            except ValueError:
+                statement = _UNPREPARABLE
+            self._statements.set(query, statement)
+            return statement
+
+        def _unpreparable(failure):
+            failure.trap(ttypes.InvalidRequestException)
+            self._statements.set(query, _UNPREPARABLE)
+            return _UNPREPARABLE
+
+        d = client.prepare_cql3_query(prepared_query, ttypes.Compression.NONE)
+        return d.addCallbacks(_remember, _unpreparable)
+
+    def _execute_prepared(self, client, query, args, consistency,
+                          retry=True):
+        """
+        Execute the query on the client by preparing it if not already
+        prepared. If the node has forgotten the statement, it is prepared
+        again and executed if `retry` is True.
+        """
+        def _execute_statement(statement):
+            if statement is _UNPREPARABLE:
+                return client.execute_cql3_query(
+                    prepare(query, args), ttypes.Compression.NONE,
+                    consistency)
+            d = client.execute_prepared_cql3_query(
+                statement.item_id, statement.bind(args), consistency)
+            if retry:
+                d.addErrback(_reprepare)
+            return d
+
+        def _reprepare(failure):
+            # The node may forget prepared statements when it is restarted
+            # or its statements cache is full
+            failure.trap(ttypes.InvalidRequestException)
+            if 'not found' not in (failure.value.why or ''):
+                return failure
+            self._statements.pop(query)
+            return self._execute_prepared(client, query, args, consistency,
+                                          retry=False)
+
+        return self._prepared(client, query).addCallback(_execute_statement)
+
+    def describe_ring(self):
+        """
+        Return ``Deferred`` that fires with ``list`` of
+        :class:`silverberg.cassandra.ttypes.TokenRange` of the keyspace
+        """
+        d = self._internals.connection()
+        return d.addCallback(
+            lambda client: client.describe_ring(self._internals.keyspace))
+
+    def describe_partitioner(self):
+        """
+        Return ``Deferred`` that fires with class name of the partitioner used
+        by the cluster
+        """
+        d = self._internals.connection()
+        return d.addCallback(lambda client: client.describe_partitioner())
+
+    def _process_result(self, result):
+        """
+        Return rows, number or None from the result like
+        :meth:`CQLClient.execute` does
+        """
+        if result.type == ttypes.CqlResultType.ROWS:
+            return self._internals.unmarshal_rows(result.schema, result.rows)
+        elif result.type == ttypes.CqlResultType.INT:
+            return result.num
+        else:
+            return None
+
+    def execute(self, query, args, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        query_text, params = _bind_nulls(query, args)
+
+        def _execute(client):
+            if _preparable(query_text):
+                d = self._execute_prepared(client, query_text, params,
+                                           consistency)
+            else:
+                d = client.execute_cql3_query(
+                    prepare(query_text, params), ttypes.Compression.NONE,
+                    consistency)
+            if self._internals.disconnect_on_cancel:
+                cancellable_d = Deferred(lambda d: self.disconnect())
+                d.chainDeferred(cancellable_d)
+                return cancellable_d
+            return d
+
+        d = self._internals.connection()
+        d.addCallback(_execute)
+        d.addCallback(self._process_result)
+        return d
+
+
+class PreparingCassandraCluster(RoundRobinCassandraCluster):
+    """
+    :class:`RoundRobinCassandraCluster` that executes queries with
+    :class:`PreparingCQLClient` instances
+
+    :param int max_statements: Maximum number of prepared statements
+        remembered per client. Other params are same as
+        :class:`RoundRobinCassandraCluster`
+    """
+
+    def __init__(self, seed_endpoints, keyspace, user=None, password=None,
+                 disconnect_on_cancel=False, max_statements=1000):
+        super(PreparingCassandraCluster, self).__init__(
+            [], keyspace, user, password, disconnect_on_cancel)
+        _SilverbergInternals.set_cluster_clients(self, [
+            PreparingCQLClient(endpoint, keyspace, user, password,
+                               disconnect_on_cancel, max_statements)
+            for endpoint in seed_endpoints
+        ])
@@ -0,0 +1,456 @@
+"""
+Cassandra cluster client that sends each query to a replica of the partition
+it is about
+"""
+
+import re
+import struct
+from bisect import bisect_left
+from hashlib import md5
+
+from silverberg.cassandra.ttypes import TimedOutException
+
+from twisted.internet.defer import DeferredList, succeed
+from twisted.internet.endpoints import clientFromString
+from twisted.internet.error import ConnectError
+
+from otter.util.cqlbatch import PreparingCQLClient
+from otter.util.deferredutils import TimedOutError
+
+
+_M64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _rotl64(x, r):
+    return ((x << r) | (x >> (64 - r))) & _M64
+
+
+def _fmix64(k):
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & _M64
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & _M64
+    return k ^ (k >> 33)
+
+
+def murmur3_token(key):
+    """
+    Return token of the partition key bytes as per Cassandra's
+    Murmur3Partitioner, i.e. first 64 bits of MurmurHash3 x64 128 hash
+    computed the way Cassandra does it (sign extending the tail bytes)
+    """
+    c1, c2 = 0x87c37b91114253d5, 0x4cf5ad432745937f
+    length = len(key)
+    nblocks = length // 16
+    h1 = h2 = 0
+    for i in range(nblocks):
+        k1, k2 = struct.unpack_from('<QQ', key, i * 16)
+        k1 = (_rotl64((k1 * c1) & _M64, 31) * c2) & _M64
+        h1 = (_rotl64(h1 ^ k1, 27) + h2) & _M64
+        h1 = (h1 * 5 + 0x52dce729) & _M64
+        k2 = (_rotl64((k2 * c2) & _M64, 33) * c1) & _M64
+        h2 = (_rotl64(h2 ^ k2, 31) + h1) & _M64
+        h2 = (h2 * 5 + 0x38495ab5) & _M64
+
+    tail = [b - 256 if b > 127 else b
+            for b in bytearray(key[nblocks * 16:])]
+    if len(tail) > 8:
+        k2 = 0
+        for i in range(8, len(tail)):
+            k2 ^= (tail[i] << ((i - 8) * 8)) & _M64
+        h2 ^= (_rotl64((k2 * c2) & _M64, 33) * c1) & _M64
+    if tail:
+        k1 = 0
+        for i in range(min(len(tail), 8)):
+            k1 ^= (tail[i] << (i * 8)) & _M64
+        h1 ^= (_rotl64((k1 * c1) & _M64, 31) * c2) & _M64
+
+    h1 ^= length
+    h2 ^= length
+    h1 = (h1 + h2) & _M64
+    h2 = (h2 + h1) & _M64
+    h1 = (_fmix64(h1) + _fmix64(h2)) & _M64
+    token = h1 - (1 << 64) if h1 >> 63 else h1
+    # Cassandra does not use minimum long as a token
+    return token if token != -(1 << 63) else (1 << 63) - 1
+
+
+def md5_token(key):
+    """
+    Return token of the partition key bytes as per Cassandra's
+    RandomPartitioner
+    """
+    token = int(md5(key).hexdigest(), 16)
+    if token >> 127:
+        token -= 1 << 128
+    return abs(token)
+
+
+PARTITIONERS = {
+    'org.apache.cassandra.dht.Murmur3Partitioner': murmur3_token,
+    'org.apache.cassandra.dht.RandomPartitioner': md5_token
+}
+
+
+_counter_re = re.compile(
+    r'\bCOUNTER\s+BATCH\b|"?\b(\w+)\b"?\s*=\s*"?\b\1\b"?\s*[-+]',
+    re.IGNORECASE)
+_conditional_re = re.compile(r'\bIF\b', re.IGNORECASE)
+
+
+def idempotent(query):
+    """
+    Return whether executing the query again after it timed out leaves the
+    same data as executing it once. Counter and collection updates relative
+    to the current value add the change again and conditional updates may
+    not apply again while reporting that they did not apply.
+    """
+    return (_counter_re.search(query) is None and
+            _conditional_re.search(query) is None)
+
+
+_table_re = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)"?', re.IGNORECASE)
+_insert_re = re.compile(
+    r'^\s*\(([^)]*)\)\s*VALUES\s*\(([^)]*)\)', re.IGNORECASE)
+
+
+def _segment_param(table, segment, partition_keys):
+    """
+    Return name of the param whose value is the partition key of the table
+    in the statement segment following the table name, or None if it is
+    not found
+    """
+    if table not in partition_keys:
+        return None
+    key = partition_keys[table]
+    insert = _insert_re.match(segment)
+    if insert is not None:
+        columns = [c.strip().strip('"') for c in insert.group(1).split(',')]
+        values = [v.strip() for v in insert.group(2).split(',')]
+        value = dict(zip(columns, values)).get(key, '')
+        return value[1:] if value.startswith(':') else None
+    match = re.search(r'"?\b{}\b"?\s*=\s*:(\w+)'.format(key), segment)
+    return match and match.group(1)
+
+
+def routing_key(query, params, partition_keys):
+    """
+    Return serialized partition key of the query if all its statements are
+    about the same partition. Otherwise return None.
+
+    :param str query: CQL query or batch
+    :param dict params: Params of the query
+    :param dict partition_keys: Table name -> partition key column name
+
+    :return: ``str`` or None
+    """
+    tables = list(_table_re.finditer(query))
+    if not tables:
+        return None
+    values = set()
+    for i, match in enumerate(tables):
+        end = tables[i + 1].start() if i + 1 < len(tables) else len(query)
+        param = _segment_param(match.group(1), query[match.end():end],
+                               partition_keys)
+        if param is None or param not in params:
+            return None
+        values.add(params[param])
+    if len(values) != 1:
+        return None
+    value = values.pop()
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long)):
+        # partition keys that are numbers in our tables are int columns
+        return struct.pack('>i', value)
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+
+class _Ring(object):
+    """
+    Replicas of token ranges of the keyspace
+
+    :param callable token: Function that returns token of a key
+    :param token_ranges: ``list`` of
+        :class:`silverberg.cassandra.ttypes.TokenRange`
+    """
+
+    def __init__(self, token, token_ranges):
+        self.token = token
+        ranges = sorted((int(r.end_token), _range_hosts(r))
+                        for r in token_ranges)
+        self._ends = [end for end, _ in ranges]
+        self._hosts = [hosts for _, hosts in ranges]
+
+    def hosts(self):
+        """
+        Return ``set`` of all the hosts in the ring
+        """
+        return set(host for hosts in self._hosts for host in hosts)
+
+    def replicas(self, key):
+        """
+        Return ``list`` of hosts that are replicas of the key
+        """
+        if not self._ends:
+            return []
+        index = bisect_left(self._ends, self.token(key))
+        return self._hosts[index % len(self._ends)]
+
+
+def _range_hosts(token_range):
+    """
+    Return addresses of the token range's endpoints that clients can connect
+    to
+    """
+    rpc_endpoints = token_range.rpc_endpoints or token_range.endpoints
+    return [rpc if rpc != '0.0.0.0' else listen
+            for rpc, listen in zip(rpc_endpoints, token_range.endpoints)]
+
+
+class _Node(object):
+    """
+    Connections to a Cassandra node and its measured latency
+
+    :param list clients: Clients connected to the node that are used round
+        robin
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.latency = None
+        self._next = 0
+
+    def client(self):
+        """
+        Return next client to use
+        """
+        client = self.clients[self._next]
+        self._next = (self._next + 1) % len(self.clients)
+        return client
+
+    def record(self, latency, alpha):
+        """
+        Update exponentially weighted moving average of latency with a new
+        measurement
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = alpha * latency + (1 - alpha) * self.latency
+
+
+class TokenAwareCassandraCluster(object):
+    """
+    Cassandra cluster client that sends each query to a replica of the
+    partition it is about, saving the coordinator the hop to a replica. The
+    partition is found from the query's param that is bound to the partition
+    key of its table. Among the replicas, the one with least measured latency
+    is tried first and others are tried if it cannot be connected to or, for
+    :func:`idempotent` queries, if it times out. Failed attempts count as the
+    time they took plus `failure_penalty` seconds towards the node's
+    latency. Queries whose partition is not known, like the ones spanning
+    partitions, are sent to the seeds round robin like
+    :class:`silverberg.cluster.RoundRobinCassandraCluster`.
+
+    The ring is fetched from a seed when the first query is executed and
+    every `ring_refresh_interval` seconds after that. Queries go to the
+    seeds until it is fetched.
+
+    :param clock: `IReactorTime` provider
+    :param list seed_endpoints: `IStreamClientEndpoint` providers of seeds
+    :param str keyspace: Keyspace to use
+    :param callable endpoint_factory: Function that takes node's address and
+        returns its `IStreamClientEndpoint` provider
+    :param dict partition_keys: Table name -> partition key column name
+    :param log: Bound log used to log failures to fetch the ring
+    :param int connections_per_node: Number of connections kept to each node
+    :param float ring_refresh_interval: Seconds after which ring is fetched
+        again
+    :param float latency_alpha: Weight of latest latency measurement in
+        node's average latency
+    :param float failure_penalty: Seconds added to the latency of a failed
+        attempt
+    :param callable client_factory: Function that takes endpoint, keyspace
+        and `client_kwargs` and returns a client with the interface of
+        :class:`PreparingCQLClient`
+    :param client_kwargs: Extra keyword arguments passed to `client_factory`
+    """
+
+    def __init__(self, clock, seed_endpoints, keyspace, endpoint_factory,
+                 partition_keys, log, connections_per_node=2,
+                 ring_refresh_interval=300, latency_alpha=0.2,
+                 failure_penalty=1.0, client_factory=PreparingCQLClient,
+                 **client_kwargs):
+        self.clock = clock
+        self.keyspace = keyspace
+        self.endpoint_factory = endpoint_factory
+        self.partition_keys = partition_keys
+        self.log = log
+        self.connections_per_node = connections_per_node
+        self.ring_refresh_interval = ring_refresh_interval
+        self.latency_alpha = latency_alpha
+        self.failure_penalty = failure_penalty
+        self.client_factory = client_factory
+        self.client_kwargs = client_kwargs
+
+        self._seeds = [self._make_client(endpoint)
+                       for endpoint in seed_endpoints]
+        self._seed_idx = 0
+        self._nodes = {}
+        self._ring = None
+        self._ring_fetched_at = None
+        self._fetching_ring = False
+
+    def _make_client(self, endpoint):
+        return self.client_factory(endpoint, self.keyspace,
+                                   **self.client_kwargs)
+
+    def _next_seed(self):
+        self._seed_idx = (self._seed_idx + 1) % len(self._seeds)
+        return self._seeds[self._seed_idx]
+
+    def _maybe_fetch_ring(self):
+        """
+        Start fetching the ring if it is time to
+        """
+        now = self.clock.seconds()
+        if (self._fetching_ring or
+                (self._ring_fetched_at is not None and
+                 now - self._ring_fetched_at < self.ring_refresh_interval)):
+            return
+        self._fetching_ring = True
+        self._ring_fetched_at = now
+        seed = self._next_seed()
+
+        def got_partitioner(partitioner):
+            if partitioner not in PARTITIONERS:
+                self.log.msg('Cannot route queries of partitioner',
+                             partitioner=partitioner)
+                return None
+            d = seed.describe_ring()
+            return d.addCallback(
+                lambda ranges: _Ring(PARTITIONERS[partitioner], ranges))
+
+        def done(result):
+            self._fetching_ring = False
+            return result
+
+        d = seed.describe_partitioner()
+        d.addCallback(got_partitioner)
+        d.addCallback(self._set_ring)
+        d.addErrback(self.log.err, 'Could not fetch Cassandra ring')
+        d.addBoth(done)
+
+    def _set_ring(self, ring):
+        """
+        Use the ring to route queries and connect to its hosts, disconnecting
+        from hosts that are not in it anymore
+        """
+        self._ring = ring
+        hosts = ring.hosts() if ring is not None else set()
+        for host in set(self._nodes) - hosts:
+            node = self._nodes.pop(host)
+            for client in node.clients:
+                client.disconnect()
+        for host in hosts - set(self._nodes):
+            self._nodes[host] = _Node(
+                [self._make_client(self.endpoint_factory(host))
+                 for _ in range(self.connections_per_node)])
+
+    def _candidates(self, query, params):
+        """
+        Return ``list`` of clients to try in order to execute the query
+        """
+        if self._ring is not None:
+            key = routing_key(query, params, self.partition_keys)
+            if key is not None:
+                nodes = sorted(
+                    (self._nodes[host] for host in self._ring.replicas(key)
+                     if host in self._nodes),
+                    key=lambda node: node.latency or 0)
+                if nodes:
+                    return [(node, node.client()) for node in nodes]
+        self._next_seed()
+        index = self._seed_idx
+        return [(None, seed)
+                for seed in self._seeds[index:] + self._seeds[:index]]
+
+    def execute(self, query, params, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        self._maybe_fetch_ring()
+        candidates = self._candidates(query, params)
+        retriable = [ConnectError]
+        if idempotent(query):
+            retriable.extend([TimedOutException, TimedOutError])
+
+        def try_execute(index):
+            node, client = candidates[index]
+            start = self.clock.seconds()
+            d = client.execute(query, params, consistency)
+            if node is not None:
+                d.addCallbacks(record, record_failure,
+                               callbackArgs=(node, start),
+                               errbackArgs=(node, start))
+            return d.addErrback(failed, index)
+
+        def record(result, node, start):
+            node.record(self.clock.seconds() - start, self.latency_alpha)
+            return result
+
+        def record_failure(failure, node, start):
+            node.record(self.clock.seconds() - start + self.failure_penalty,
+                        self.latency_alpha)
+            return failure
+
+        def failed(failure, index):
+            failure.trap(*retriable)
+            if index + 1 == len(candidates):
+                return failure
+            return try_execute(index + 1)
+
+        return try_execute(0)
+
+    def disconnect(self):
+        """
+        Disconnect all the connections
+
+        :return: ``Deferred`` that fires when all are disconnected
+        """
+        clients = self._seeds + [client for node in self._nodes.values()
+                                 for client in node.clients]
+        if not clients:
+            return succeed([])
+        return DeferredList([client.disconnect() for client in clients])
+
+
+def cluster_from_config(reactor, config, partition_keys, log, **kwargs):
+    """
+    Return :class:`TokenAwareCassandraCluster` connected to the cluster
+    described in the config
+
+    :param reactor: Twisted reactor
+    :param dict config: Cassandra config with "seed_hosts" endpoint strings,
+        "keyspace" and optional "rpc_port" of nodes found from ring
+        (defaults to 9160) and "connections_per_node" (defaults to 2)
+    :param dict partition_keys: Table name -> partition key column name
+    :param log: Bound log
+    :param kwargs: Other keyword arguments of
+        :class:`TokenAwareCassandraCluster`
+    """
+    seed_endpoints = [clientFromString(reactor, str(host))
+                      for host in config['seed_hosts']]
+    port = config.get('rpc_port') or 9160
+
+    def endpoint_factory(host):
+        return clientFromString(reactor, 'tcp:{}:{}'.format(host, port))
+
+    return TokenAwareCassandraCluster(
+        reactor, seed_endpoints, config['keyspace'], endpoint_factory,
+        partition_keys, log,
+        connections_per_node=config.get('connections_per_node') or 2,
+        **kwargs)
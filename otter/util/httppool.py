@@ -0,0 +1,118 @@
+"""
+Persistent HTTP connection pools shared by all the outgoing requests, one per
+service that the requests go to.
+"""
+
+from twisted.internet import defer
+from twisted.web.client import HTTPConnectionPool
+
+
+class ServicePool(HTTPConnectionPool):
+    """
+    Persistent HTTP connection pool that keeps stats of the connections it
+    gives out.
+
+    :param clock: `IReactorTime` and `IReactorTCP` provider
+    :param int max_per_host: Maximum number of idle connections kept open to
+        a host
+    :param float idle_timeout: Seconds after which an idle connection is
+        closed
+
+    :ivar dict stats: Number of connections given out as ``requests``, number
+        of them newly created as ``created`` and total seconds spent getting
+        them as ``wait_time``
+    """
+
+    def __init__(self, clock, max_per_host, idle_timeout):
+        HTTPConnectionPool.__init__(self, clock, persistent=True)
+        self.maxPersistentPerHost = max_per_host
+        self.cachedConnectionTimeout = idle_timeout
+        self.stats = {'requests': 0, 'created': 0, 'wait_time': 0}
+
+    def getConnection(self, key, endpoint):
+        """
+        See :meth:`HTTPConnectionPool.getConnection`
+        """
+        self.stats['requests'] += 1
+        start = self._reactor.seconds()
+
+        def got_connection(connection):
+            self.stats['wait_time'] += self._reactor.seconds() - start
+            return connection
+
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        return d.addCallback(got_connection)
+
+    def _newConnection(self, key, endpoint):
+        self.stats['created'] += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+
+class HTTPPoolRegistry(object):
+    """
+    A :class:`ServicePool` per :obj:`otter.constants.ServiceType`, created
+    when first asked for. Requests that are not for a particular service share
+    the pool of service type None.
+
+    :param clock: `IReactorTime` and `IReactorTCP` provider
+    :param int max_per_host: See :class:`ServicePool`
+    :param float idle_timeout: See :class:`ServicePool`
+    """
+
+    def __init__(self, clock, max_per_host=10, idle_timeout=240):
+        self.clock = clock
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._pools = {}
+
+    def get_pool(self, service_type=None):
+        """
+        Return pool of the service type
+        """
+        pool = self._pools.get(service_type)
+        if pool is None:
+            pool = ServicePool(self.clock, self.max_per_host,
+                               self.idle_timeout)
+            self._pools[service_type] = pool
+        return pool
+
+    def health_check(self):
+        """
+        Return stats of all the pools keyed by their service type's name as
+        health check details. It is always healthy.
+        """
+        return True, dict(
+            (getattr(service_type, 'name', 'default'), pool.stats)
+            for service_type, pool in self._pools.iteritems())
+
+    def close(self):
+        """
+        Close idle connections of all the pools
+
+        :return: ``Deferred`` that fires with None when they are closed
+        """
+        d = defer.gatherResults([pool.closeCachedConnections()
+                                 for pool in self._pools.values()])
+        return d.addCallback(lambda _: None)
+
+
+_registry = None
+
+
+def set_pool_registry(registry):
+    """
+    Set the :class:`HTTPPoolRegistry` from which requests get their pool. No
+    pool is used if it is None.
+    """
+    global _registry
+    _registry = registry
+
+
+def get_pool(service_type=None):
+    """
+    Return pool of the service type from the set registry or None if there
+    is no registry
+    """
+    if _registry is None:
+        return None
+    return _registry.get_pool(service_type)
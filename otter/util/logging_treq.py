@@ -10,6 +10,7 @@ from twisted.internet import reactor
 
 from otter.log import log as default_log
 from otter.util.deferredutils import timeout_deferred
+from otter.util.httppool import get_pool
 
 
 def _log_request(treq_call, url, **kwargs):
@@ -21,11 +22,19 @@ def _log_request(treq_call, url, **kwargs):
     :param log: If provided, an instance of BoundLog.
         Defaults to ``otter.log.default_log`` if not provided.
     :type log: BoundLog or None.
+    :param service_type: :obj:`otter.constants.ServiceType` of the service
+        the request is for. The request uses its pool from the registry set
+        in :mod:`otter.util.httppool` unless `pool` is given.
     """
     clock = kwargs.pop('clock', reactor)
     log = kwargs.pop('log', None)
     if not log:
         log = default_log
+    service_type = kwargs.pop('service_type', None)
+    if kwargs.get('pool') is None:
+        pool = get_pool(service_type)
+        if pool is not None:
+            kwargs['pool'] = pool
     method = kwargs.get('method', treq_call.__name__)
 
     treq_transaction = str(uuid4())
@@ -18,16 +18,23 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 
 from otter.util import logging_treq
 from otter.util.http import APIError
+from otter.util.throttle import get_limiter
 
 
-@attributes(['method', 'url', 'headers', 'data', 'params', 'log'],
+@attributes(['method', 'url', 'headers', 'data', 'params', 'log',
+             'service_type', 'tenant_id'],
             defaults={'headers': None, 'data': None, 'params': None,
-                      'log': None})
+                      'log': None, 'service_type': None, 'tenant_id': None})
 class Request(object):
     """
     An effect request for performing HTTP requests.
 
     The effect results in a two-tuple of (response, content).
+
+    `service_type` is the :obj:`otter.constants.ServiceType` whose connection
+    pool is used to perform the request. If it is given, the request is also
+    performed within the concurrency limit of the service and `tenant_id`
+    from :mod:`otter.util.throttle`.
     """
 
     treq = logging_treq
@@ -39,23 +46,31 @@ class Request(object):
                 and isinstance(result[1], str))
 
 
-@deferred_performer
 @inlineCallbacks
-def perform_request(dispatcher, intent):
-    """
-    Perform the request with treq.
-
-    :return: A two-tuple of (HTTP Response, content as bytes)
-    """
+def _treq_request(intent):
     response = yield intent.treq.request(intent.method.upper(), intent.url,
                                          headers=intent.headers,
                                          data=intent.data,
                                          params=intent.params,
-                                         log=intent.log)
+                                         log=intent.log,
+                                         service_type=intent.service_type)
     content = yield intent.treq.content(response)
     returnValue((response, content))
 
 
+@deferred_performer
+def perform_request(dispatcher, intent):
+    """
+    Perform the request with treq.
+
+    :return: A two-tuple of (HTTP Response, content as bytes)
+    """
+    if intent.service_type is None:
+        return _treq_request(intent)
+    limiter = get_limiter(intent.service_type, intent.tenant_id)
+    return limiter.run(_treq_request, intent)
+
+
 def request(method, url, **kwargs):
     """Return a Request wrapped in an Effect."""
     return Effect(Request(method=method, url=url, **kwargs))
@@ -0,0 +1,177 @@
+"""
+Adaptive limits on concurrent requests to a service on behalf of a tenant.
+"""
+
+from collections import deque
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from otter.util.cache import LRUCache
+
+
+# Response codes by which services tell that they are getting too many
+# requests
+THROTTLE_CODES = (413, 429, 503)
+
+
+def _response_code(result):
+    """
+    Return HTTP code of response or :class:`otter.util.http.APIError`
+    failure, which can also be ``(response, content)`` tuple. Return None
+    for anything else.
+    """
+    if isinstance(result, Failure):
+        result = result.value
+    elif isinstance(result, tuple):
+        result = result[0]
+    return getattr(result, 'code', None)
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits number of concurrent calls, queueing the rest. The limit adapts
+    with additive increase and multiplicative decrease (AIMD): it grows by
+    ``1 / limit`` on every call that gets a 2xx response, i.e. by about one
+    per limit worth of calls, and is multiplied by `decrease` when a call is
+    throttled with one of ``THROTTLE_CODES``. Only calls started after the
+    last decrease can decrease it again so that a burst of throttled calls
+    decreases it once. Queued calls can be cancelled.
+
+    :param float initial: Initial limit
+    :param float minimum: Lowest limit
+    :param float maximum: Highest limit
+    :param float decrease: Factor by which limit is decreased
+
+    :ivar int active: Number of calls in progress
+    """
+
+    def __init__(self, initial, minimum=1, maximum=20, decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.active = 0
+        self._waiting = deque()
+        self._decreases = 0
+
+    @property
+    def queued(self):
+        """
+        Number of calls waiting for their turn
+        """
+        return len(self._waiting)
+
+    def _start_waiting(self):
+        while self._waiting and self.active < max(int(self.limit), 1):
+            d = self._waiting.popleft()
+            if d.called:
+                continue
+            self.active += 1
+            d.callback(None)
+
+    def _cancel_waiting(self, d):
+        try:
+            self._waiting.remove(d)
+        except ValueError:
+            pass
+
+    def _adapt(self, result, decreases):
+        code = _response_code(result)
+        if code in THROTTLE_CODES:
+            if decreases == self._decreases:
+                self.limit = max(self.limit * self.decrease, self.minimum)
+                self._decreases += 1
+        elif (not isinstance(result, Failure) and code is not None and
+                200 <= code < 300):
+            self.limit = min(self.limit + 1 / self.limit, self.maximum)
+        self.active -= 1
+        self._start_waiting()
+        return result
+
+    def run(self, f, *args, **kwargs):
+        """
+        Call `f` with given arguments when there are fewer calls in
+        progress than the limit
+
+        :return: ``Deferred`` that fires with result of `f`
+        """
+        def call(_):
+            d = defer.maybeDeferred(f, *args, **kwargs)
+            return d.addBoth(self._adapt, self._decreases)
+
+        d = defer.Deferred(self._cancel_waiting)
+        self._waiting.append(d)
+        self._start_waiting()
+        return d.addCallback(call)
+
+
+class LimiterRegistry(object):
+    """
+    An :class:`AdaptiveLimiter` per service type and tenant, created when
+    first asked for. The least recently used limiters without calls in
+    progress or queued are forgotten when there are more than
+    `max_limiters`. Limiters with calls are kept so that their decreased
+    limit is not lost while they are being throttled.
+
+    :param float initial: Initial limit of each limiter. It is `maximum` if
+        None so that calls are only limited below `maximum` after they are
+        throttled.
+    :param float maximum: Highest limit of each limiter
+    :param int max_limiters: Maximum number of limiters kept
+    """
+
+    def __init__(self, initial=None, maximum=20, max_limiters=10000):
+        self.initial = maximum if initial is None else initial
+        self.maximum = maximum
+        self._limiters = LRUCache(
+            max_limiters,
+            evictable=lambda limiter: not (limiter.active or limiter.queued))
+
+    def get_limiter(self, service_type, tenant_id):
+        """
+        Return limiter of requests to the service on behalf of the tenant
+        """
+        key = (service_type, tenant_id)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter(self.initial, maximum=self.maximum)
+            self._limiters.set(key, limiter)
+        return limiter
+
+    def health_check(self):
+        """
+        Return number of calls in progress and queued over all the limiters
+        and limits of those that have queued calls as health check details.
+        It is always healthy.
+        """
+        limiters = self._limiters.items()
+        queued = dict(
+            ('{0}:{1}'.format(getattr(service_type, 'name', service_type),
+                              tenant_id),
+             {'limit': limiter.limit, 'active': limiter.active,
+              'queued': limiter.queued})
+            for (service_type, tenant_id), limiter in limiters
+            if limiter.queued)
+        return True, {
+            'active': sum(limiter.active for _, limiter in limiters),
+            'queued': sum(limiter.queued for _, limiter in limiters),
+            'queued_limiters': queued}
+
+
+_registry = LimiterRegistry()
+
+
+def set_limiter_registry(registry):
+    """
+    Set the :class:`LimiterRegistry` from which requests get their limiter
+    """
+    global _registry
+    _registry = registry
+
+
+def get_limiter(service_type, tenant_id):
+    """
+    Return limiter of the service and tenant from the set registry
+    """
+    return _registry.get_limiter(service_type, tenant_id)
@@ -22,6 +22,17 @@ def now():
     return "{0}Z".format(datetime.utcnow().isoformat())
 
 
+def epoch_to_timestamp(seconds):
+    """
+    Convert EPOCH seconds to UTC timestamp string like the one from
+    :func:`now`
+
+    :param float seconds: EPOCH seconds
+    :return: ISO8601 zulu timestamp string
+    """
+    return "{0}Z".format(datetime.utcfromtimestamp(seconds).isoformat())
+
+
 def from_timestamp(timestamp):
     """
     :param str timestamp: a timestamp string which is a ISO8601 formatted
@@ -26,25 +26,28 @@ from pyrsistent import freeze, thaw
 from toolz import comp
 
 from twisted.internet.defer import (
-    DeferredLock, DeferredSemaphore, gatherResults, inlineCallbacks,
-    returnValue)
+    Deferred, DeferredLock, gatherResults, inlineCallbacks, returnValue)
 from twisted.internet.task import deferLater
 from twisted.python.failure import Failure
 
 from otter.auth import public_endpoint_url
+from otter.constants import ServiceType
 from otter.convergence.gathering import _servicenet_address
 from otter.convergence.steps import set_server_name
+from otter.log import log as default_log
 from otter.util import logging_treq as treq
 from otter.util.config import config_value
-from otter.util.deferredutils import log_with_time, retry_and_timeout
+from otter.util.deferredutils import log_with_time, timeout_deferred
 from otter.util.hashkey import generate_server_name
 from otter.util.http import (
     APIError, RequestError, append_segments, check_success, headers,
     raise_error_on_code, wrap_request_error)
 from otter.util.retry import (
-    TransientRetryError, compose_retries, exponential_backoff_interval,
-    random_interval, repeating_interval, retry, retry_times,
-    terminal_errors_except, transient_errors_except)
+    compose_retries, exponential_backoff_interval, random_interval,
+    repeating_interval, retry, retry_times, terminal_errors_except,
+    transient_errors_except)
+from otter.util.throttle import get_limiter
+from otter.util.timestamp import epoch_to_timestamp
 from otter.worker._rcv3 import add_to_rcv3, remove_from_rcv3
 
 # Number of times to retry when adding/removing nodes from LB
@@ -53,6 +56,15 @@ LB_MAX_RETRIES = 10
 # Range from which random retry interval is got
 LB_RETRY_INTERVAL_RANGE = [10, 15]
 
+# Seconds subtracted from the time of the previous listing of changed servers
+# to allow for clock skew between otter and nova
+CHANGES_SINCE_SKEW = 60
+
+# Number of servers asked for in one page of changed servers unless
+# ``converger.osapi_max_limit`` is set. Listing stops at a page shorter than
+# that, so it must not be more than Nova's ``osapi_max_limit``.
+SERVERS_PAGE_SIZE = 1000
+
 
 class UnexpectedServerStatus(Exception):
     """
@@ -101,75 +113,231 @@ def server_details(server_endpoint, auth_token, server_id, log=None):
     return d.addCallback(treq.json_content)
 
 
-def wait_for_active(log,
-                    server_endpoint,
-                    auth_token,
-                    server_id,
-                    interval=20,
-                    timeout=7200,
-                    clock=None):
+class ServerStatusWatcher(object):
     """
-    Wait until the server specified by server_id's status is 'ACTIVE'
-
-    :param log: A bound logger.
-    :param str server_endpoint: Server endpoint URI.
-    :param str auth_token: Keystone Auth token.
-    :param str server_id: Opaque nova server id.
-    :param int interval: Polling interval in seconds.  Default: 20.
-    :param int timeout: timeout to poll for the server status in seconds.
-        Default 7200 (2 hours).
-
-    :return: Deferred that fires when the expected status has been seen.
+    Waits for servers of a tenant to leave the 'BUILD' state. Instead of
+    polling every server, each check lists the tenant's servers that changed
+    since the previous check a page at a time with
+    ``servers/detail?changes-since=`` and resolves the waiters of the ones
+    found. Pages are listed until one shorter than the page size comes back.
+    Listing goes through the tenant's cloud servers limiter and is retried
+    once with a new token if the token is rejected. Checks are `max_interval`
+    seconds apart except around the expected build time of a watched server,
+    i.e. from `max_interval` seconds before `build_time` until twice
+    `build_time` since it was watched, when they are `min_interval` seconds
+    apart. Checking stops when no server is watched.
+
+    :param clock: `IReactorTime` provider
+    :param str server_endpoint: Server endpoint URI
+    :param str tenant_id: Tenant whose servers are watched
+    :param log: A bound logger
+    :param float min_interval: Seconds between checks around build time
+    :param float max_interval: Seconds between checks otherwise
+    :param float build_time: Expected seconds taken to build a server
+    :param callable on_idle: Called with no arguments when checking stops
     """
-    log.msg("Checking instance status every {interval} seconds",
-            interval=interval)
 
-    if clock is None:  # pragma: no cover
-        from twisted.internet import reactor
-        clock = reactor
+    def __init__(self, clock, server_endpoint, tenant_id, log, min_interval=5,
+                 max_interval=20, build_time=120, on_idle=None):
+        self.clock = clock
+        self.server_endpoint = server_endpoint
+        self.tenant_id = tenant_id
+        self.log = log
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.build_time = build_time
+        self.on_idle = on_idle
+        self.auth_token = None
+        self.re_auth = None
+        self._waiters = {}
+        self._since = None
+        self._call = None
+        self._checking = False
+
+    def __len__(self):
+        """
+        Number of servers watched
+        """
+        return len(self._waiters)
 
-    start_time = clock.seconds()
+    def watch(self, log, auth_token, server_id, timeout=7200, re_auth=None):
+        """
+        Wait until the server's status is 'ACTIVE'
+
+        :param log: A bound logger
+        :param str auth_token: Keystone Auth token. It is used for all the
+            following checks
+        :param str server_id: Opaque nova server id
+        :param int timeout: Seconds to wait for. Default 7200 (2 hours)
+        :param callable re_auth: Called with no arguments when the token is
+            rejected. Returns Deferred that fires with a new token
+
+        :return: Deferred that fires with the server's details like
+            :func:`server_details` when it is 'ACTIVE'. It errbacks with
+            :class:`ServerDeleted` if the server is deleted and with
+            :class:`UnexpectedServerStatus` if it has any other status
+        """
+        self.auth_token = auth_token
+        if re_auth is not None:
+            self.re_auth = re_auth
+        now = self.clock.seconds()
+        if self._since is None:
+            self._since = now
+        waiter = []
+        d = Deferred(lambda _: self._forget(server_id, waiter))
+        waiter.extend([d, log, now])
+        self._waiters.setdefault(server_id, []).append(waiter)
+        timeout_deferred(
+            d, timeout, self.clock,
+            ("Waiting for server <{0}> to change from BUILD state to ACTIVE "
+             "state").format(server_id))
+        self._schedule()
+        return d
 
-    def poll():
-        def check_status(server):
-            status = server['server']['status']
-            time_building = clock.seconds() - start_time
+    def _forget(self, server_id, waiter):
+        waiters = self._waiters.get(server_id, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[server_id]
+
+    def _next_interval(self):
+        now = self.clock.seconds()
+        for waiters in self._waiters.itervalues():
+            for _, _, started in waiters:
+                elapsed = now - started
+                if (self.build_time - self.max_interval <= elapsed <
+                        2 * self.build_time):
+                    return self.min_interval
+        return self.max_interval
+
+    def _schedule(self):
+        if self._call is None and not self._checking:
+            self._call = self.clock.callLater(self._next_interval(),
+                                              self.check)
+
+    def check(self):
+        """
+        List servers changed since the previous check and resolve waiters of
+        the ones that are not building anymore. Failure to list is logged and
+        the servers are checked again later.
 
+        :return: Deferred that fires with None after the check
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._checking = True
+        start = self.clock.seconds()
+        d = self._list_authenticated(
+            epoch_to_timestamp(self._since - CHANGES_SINCE_SKEW))
+
+        def listed(servers):
+            self._since = start
+            for server in servers:
+                self._resolve(server)
+
+        def checked(_):
+            self._checking = False
+            if self._waiters:
+                self._schedule()
+            else:
+                self._since = None
+                if self.on_idle is not None:
+                    self.on_idle()
+
+        d.addCallbacks(listed, self.log.err,
+                       errbackArgs=('Could not list changed servers',))
+        return d.addCallback(checked)
+
+    def _list_authenticated(self, changes_since):
+        d = self._list_changed(changes_since)
+
+        def rejected(failure):
+            failure.trap(APIError)
+            if failure.value.code != 401 or self.re_auth is None:
+                return failure
+            self.log.msg('Token rejected when listing changed servers. '
+                         'Re-authenticating')
+
+            def authenticated(auth_token):
+                self.auth_token = auth_token
+                return self._list_changed(changes_since)
+
+            return self.re_auth().addCallback(authenticated)
+
+        return d.addErrback(rejected)
+
+    def _list_changed(self, changes_since, marker=None):
+        limit = config_value('converger.osapi_max_limit') or SERVERS_PAGE_SIZE
+        query = [('changes-since', changes_since), ('limit', limit)]
+        if marker is not None:
+            query.append(('marker', marker))
+        path = '{0}?{1}'.format(
+            append_segments(self.server_endpoint, 'servers', 'detail'),
+            urlencode(query))
+        d = get_limiter(ServiceType.CLOUD_SERVERS, self.tenant_id).run(
+            treq.get, path, headers=headers(self.auth_token), log=self.log,
+            service_type=ServiceType.CLOUD_SERVERS)
+        d.addCallback(check_success, [200, 203])
+        d.addCallback(treq.json_content)
+
+        def got_page(body):
+            servers = body['servers']
+            if len(servers) < limit:
+                return servers
+            more = self._list_changed(changes_since, servers[-1]['id'])
+            return more.addCallback(lambda rest: servers + rest)
+
+        return d.addCallback(got_page)
+
+    def _resolve(self, server):
+        server_id = server['id']
+        status = server['status']
+        if status == 'BUILD' or server_id not in self._waiters:
+            return
+        for d, log, started in self._waiters.pop(server_id):
+            time_building = self.clock.seconds() - started
             if status == 'ACTIVE':
                 log.msg(("Server changed from 'BUILD' to 'ACTIVE' within "
                          "{time_building} seconds"),
                         time_building=time_building)
-                return server
-
-            elif status != 'BUILD':
-                log.msg("Server changed to '{status}' in {time_building} seconds",
-                        time_building=time_building, status=status)
-                raise UnexpectedServerStatus(
-                    server_id,
-                    status,
-                    'ACTIVE')
-
+                d.callback({'server': server})
             else:
-                raise TransientRetryError()  # just poll again
+                log.msg("Server changed to '{status}' in {time_building} "
+                        "seconds", time_building=time_building, status=status)
+                if status == 'DELETED':
+                    d.errback(ServerDeleted(server_id))
+                else:
+                    d.errback(UnexpectedServerStatus(server_id, status,
+                                                     'ACTIVE'))
 
-        sd = server_details(server_endpoint, auth_token, server_id, log=log)
-        sd.addCallback(check_status)
-        return sd
 
-    timeout_description = ("Waiting for server <{0}> to change from BUILD "
-                           "state to ACTIVE state").format(server_id)
+# Server status watchers by server endpoint
+_server_watchers = {}
 
-    return retry_and_timeout(
-        poll, timeout,
-        can_retry=transient_errors_except(UnexpectedServerStatus, ServerDeleted),
-        next_interval=repeating_interval(interval),
-        clock=clock,
-        deferred_description=timeout_description)
 
-
-# limit on 2 servers to be created simultaneously
-MAX_CREATE_SERVER = 2
-create_server_sem = DeferredSemaphore(MAX_CREATE_SERVER)
+def watch_server(log, server_endpoint, tenant_id, auth_token, server_id,
+                 timeout=7200, clock=None, re_auth=None):
+    """
+    Wait until the server's status is 'ACTIVE' with the
+    :class:`ServerStatusWatcher` of its endpoint, which is shared by all the
+    servers being built on that endpoint. Arguments and result are like
+    :meth:`ServerStatusWatcher.watch`.
+    """
+    watcher = _server_watchers.get(server_endpoint)
+    if watcher is None:
+        if clock is None:  # pragma: no cover
+            from twisted.internet import reactor
+            clock = reactor
+        watcher = ServerStatusWatcher(
+            clock, server_endpoint, tenant_id,
+            default_log.bind(system='server_watcher',
+                             server_endpoint=server_endpoint),
+            on_idle=partial(_server_watchers.pop, server_endpoint, None))
+        _server_watchers[server_endpoint] = watcher
+    return watcher.watch(log, auth_token, server_id, timeout=timeout,
+                         re_auth=re_auth)
 
 
 class ServerCreationRetryError(Exception):
@@ -252,7 +420,8 @@ class _NoCreatedServerFound(Exception):
 
 
 def create_server(server_endpoint, auth_token, server_config, log=None,
-                  clock=None, retries=3, create_failure_delay=5, _treq=None):
+                  clock=None, retries=3, create_failure_delay=5, _treq=None,
+                  tenant_id=None):
     """
     Create a new server.  If there is an error from Nova from this call,
     checks to see if the server was created anyway.  If not, will retry the
@@ -278,6 +447,10 @@ def create_server(server_endpoint, auth_token, server_config, log=None,
     :param _treq: To be used for testing - what treq object to use
     :type treq: something with the same api as :obj:`treq`
 
+    :param tenant_id: Tenant on whose behalf the server is created. Creates
+        are limited by the tenant's adaptive Nova concurrency limit from
+        :mod:`otter.util.throttle`
+
     :return: Deferred that fires with the CreateServer response as a dict.
     """
     path = append_segments(server_endpoint, 'servers')
@@ -333,9 +506,9 @@ def create_server(server_endpoint, auth_token, server_config, log=None,
 
         If not, and if no further errors occur, server creation can be retried.
         """
-        d = create_server_sem.run(_treq.post, path, headers=headers(auth_token),
-                                  data=json.dumps({'server': server_config}),
-                                  log=log)
+        limiter = get_limiter(ServiceType.CLOUD_SERVERS, tenant_id)
+        d = limiter.run(_treq.post, path, headers=headers(auth_token),
+                        data=json.dumps({'server': server_config}), log=log)
         d.addCallback(check_success, [202], _treq=_treq)
         d.addCallback(_treq.json_content)
         d.addErrback(_check_server_created)
@@ -701,11 +874,14 @@ def launch_server(log, request_func, scaling_group, launch_config, undo, clock=N
             verified_delete, log, server_endpoint, auth_token, server_id)
 
         ilog[0] = log.bind(server_id=server_id)
-        return wait_for_active(
+        return watch_server(
             ilog[0],
             server_endpoint,
+            scaling_group.tenant_id,
             auth_token,
-            server_id).addCallback(check_metadata)
+            server_id,
+            clock=clock,
+            re_auth=request_func.re_auth).addCallback(check_metadata)
 
     def add_lb(server):
         if lb_config:
@@ -717,7 +893,8 @@ def launch_server(log, request_func, scaling_group, launch_config, undo, clock=N
         return (server, [])
 
     def _create_server():
-        d = create_server(server_endpoint, auth_token, server_config, log=log)
+        d = create_server(server_endpoint, auth_token, server_config, log=log,
+                          tenant_id=scaling_group.tenant_id)
         d.addCallback(wait_for_server)
         d.addCallback(add_lb)
         return d
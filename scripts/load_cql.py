@@ -16,11 +16,15 @@ from effect.twisted import perform
 
 from silverberg.client import CQLClient
 
-from twisted.internet import task
+from toolz.dicttoolz import merge_with
+
+from twisted.internet import defer, task
 from twisted.internet.endpoints import clientFromString
 
 from otter.effect_dispatcher import get_cql_dispatcher
-from otter.models.cass import CassScalingGroupCollection
+from otter.log import log as otter_log
+from otter.metrics import scan_scaling_groups
+from otter.models.cass import CassScalingGroupCollection, all_scope
 from otter.test.resources import CQLGenerator
 
 
@@ -35,6 +39,10 @@ the_parser.add_argument(
     '--webhook-migrate', action='store_true',
     help='Migrate webhook indexes to table')
 
+the_parser.add_argument(
+    '--reconcile-counts', action='store_true',
+    help='Fix drift in counts of groups, policies and webhooks')
+
 the_parser.add_argument(
     '--keyspace', type=str, default='otter',
     help='The name of the keyspace.  Default: otter')
@@ -163,15 +171,62 @@ def webhook_migrate(reactor, args):
     Migrate webhook indexes to table
     """
     store = CassScalingGroupCollection(None, None)
-    eff = store.get_webhook_index_only().on(store.add_webhook_keys)
+
+    def migrate(webhook_keys):
+        print('Migrating {} webhooks to webhook_keys table'.format(
+            len(webhook_keys)))
+        if not webhook_keys:
+            print('All webhooks are migrated. Lookups in the webhook index '
+                  'can be turned off by setting cassandra '
+                  'webhook_index_fallback config to false')
+            return None
+        return store.add_webhook_keys(webhook_keys)
+
+    eff = store.get_webhook_index_only().on(migrate)
     conn = setup_connection(reactor, args)
     return perform(get_cql_dispatcher(reactor, conn), eff).addCallback(
         lambda _: conn.disconnect())
 
 
+def reconcile_counts(reactor, args):
+    """
+    Fix drift in counts of every tenant having groups or counts and in total
+    counts. This also backfills counts of groups created before they were
+    maintained. Tenants having groups are reconciled as their groups are
+    scanned, so only their IDs are kept in memory.
+    """
+    conn = setup_connection(reactor, args)
+    store = CassScalingGroupCollection(conn, reactor)
+    log = otter_log.bind(system='reconcile_counts')
+    reconciled = set()
+    totals = {}
+
+    @defer.inlineCallbacks
+    def reconcile_tenants(tenant_ids):
+        for tenant_id in sorted(set(tenant_ids) - reconciled):
+            reconciled.add(tenant_id)
+            counts = yield store.reconcile_counts(log, tenant_id)
+            scope = all_scope(tenant_id)
+            totals[scope] = merge_with(sum, totals.get(scope, {}), counts)
+
+    def visit(groups):
+        return reconcile_tenants(group['tenantId'] for group in groups)
+
+    @defer.inlineCallbacks
+    def reconcile():
+        yield scan_scaling_groups(conn, visit)
+        counted = yield store.list_counted_tenants()
+        yield reconcile_tenants(counted)
+        yield store.reconcile_total_counts(log, totals)
+
+    return reconcile().addCallback(lambda _: conn.disconnect())
+
+
 def run(args):
     if args.webhook_migrate:
         task.react(webhook_migrate, (args,))
+    elif args.reconcile_counts:
+        task.react(reconcile_counts, (args,))
     else:
         generate(args)
 